@@ -0,0 +1,272 @@
+import sys
+import zlib
+import struct
+from array import array
+from bisect import bisect_right
+from parallel_gzip import ParallelGzipWriter
+from fastq_reader import find_fastq_record_offset
+
+#====================================================================#
+
+# BGZF is gzip made of members of at most 64 KiB, each with its compressed size
+# in a 'BC' extra field, so a reader can jump from one block to the next (as
+# used by bgzip, samtools and htslib):
+
+BGZF_BLOCK_SIZE = 0xff00 # the most uncompressed data to put in one block, as in htslib
+
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+
+BGZF_EOF = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+# the record index is written next to the BGZF file, eg. reads_1.fastq.gz.fqi:
+
+INDEX_SUFFIX = ".fqi"
+
+INDEX_MAGIC = b"BGZFFQI\x01"
+
+#====================================================================#
+
+# define a function to compress one block of data as a BGZF block:
+
+def compress_bgzf_block(data, compresslevel=9):
+    """compress up to BGZF_BLOCK_SIZE bytes of data as one BGZF block
+    >>> import gzip
+    >>> gzip.decompress(compress_bgzf_block(b'@r1\\nACGT\\n+\\nFFFF\\n') + BGZF_EOF)
+    b'@r1\\nACGT\\n+\\nFFFF\\n'
+    """
+
+    compressobj = zlib.compressobj(compresslevel, zlib.DEFLATED, -15) # raw deflate, we write the gzip header ourselves
+    cdata = compressobj.compress(data) + compressobj.flush()
+    block_size = BGZF_HEADER.size + len(cdata) + 8
+    header = BGZF_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, block_size - 1) # 66, 67 is 'BC'
+
+    return header + cdata + struct.pack("<II", zlib.crc32(data), len(data))
+
+#====================================================================#
+
+# define a function to read one BGZF block from a file:
+
+def read_bgzf_block(fileObj, offset):
+    """read and decompress the BGZF block at 'offset'; returns (data, offset of the next block)"""
+
+    fileObj.seek(offset)
+    header = fileObj.read(BGZF_HEADER.size)
+    fields = BGZF_HEADER.unpack(header)
+    if fields[:4] != (0x1f, 0x8b, 8, 4) or fields[8:10] != (66, 67):
+        raise ValueError("there is no BGZF block at offset %d of %s" % (offset, fileObj.name))
+    block_size = fields[11] + 1
+    cdata = fileObj.read(block_size - BGZF_HEADER.size - 8)
+    fileObj.read(8) # the crc32 and uncompressed size
+    data = zlib.decompress(cdata, -15)
+
+    return data, offset + block_size
+
+#====================================================================#
+
+# a file object that writes fastq records as BGZF, with a record index:
+
+class BgzfFastqWriter(ParallelGzipWriter):
+    """write whole fastq records to a BGZF file, plus an index of where each block's first record is
+
+    Blocks are cut at record boundaries (a record longer than a block starts a
+    new block and runs on into the blocks after it), so each entry of the index
+    says that record number N starts at the beginning of the block at compressed
+    offset X. The blocks are compressed on a thread pool, as for ParallelGzipWriter.
+    """
+
+    def __init__(self, output_file, threads, compresslevel=9):
+        ParallelGzipWriter.__init__(self, output_file, threads, BGZF_BLOCK_SIZE, compresslevel)
+        self.index_file = output_file + INDEX_SUFFIX
+        self.index_records = array("Q")
+        self.index_offsets = array("Q")
+        self.record_num = 0 # the number of the next record to be written, counting from 0
+
+    def write(self, data):
+        """write out some data, which must be made up of whole fastq records"""
+        data = bytes(data)
+        start = 0
+        size = len(data)
+        while start < size:
+            end = min(start + self.block_size, size)
+            num_lines = data.count(b"\n", start, end)
+            num_records = num_lines // 4
+            if num_records == 0:
+                # a record longer than a block starts a new block and runs on into the blocks after it:
+                end = find_fastq_record_offset(data, start, 1)
+                self.submit(data[start:start + self.block_size], self.record_num)
+                for block_start in range(start + self.block_size, end, self.block_size):
+                    self.submit(data[block_start:min(block_start + self.block_size, end)])
+                num_records = 1
+            else:
+                if end < size:
+                    # step back to the end of the last complete record in the block:
+                    for _ in range(num_lines - num_records * 4 + 1):
+                        end = data.rfind(b"\n", start, end)
+                    end += 1
+                self.submit(data[start:end], self.record_num)
+            self.record_num += num_records
+            start = end
+
+    def compress_block(self, block):
+        return compress_bgzf_block(block, self.compresslevel)
+
+    def member_written(self, offset, tag):
+        self.index_records.append(tag)
+        self.index_offsets.append(offset)
+
+    def close(self):
+        if self.pool is None:
+            return
+        while self.pending:
+            self.write_next_member()
+        # the index ends with the total number of records and the offset of the EOF block:
+        self.member_written(self.bytes_written, self.record_num)
+        self.outputfileObj.write(BGZF_EOF)
+        self.bytes_written += len(BGZF_EOF)
+        write_record_index(self.index_file, self.index_records, self.index_offsets)
+        ParallelGzipWriter.close(self)
+
+#====================================================================#
+
+# define a function to write out a record index:
+
+def write_record_index(index_file, index_records, index_offsets):
+    """write out the record numbers and block offsets of a BGZF fastq file, as little-endian uint64s"""
+
+    if sys.byteorder != "little":
+        index_records = array("Q", index_records)
+        index_offsets = array("Q", index_offsets)
+        index_records.byteswap()
+        index_offsets.byteswap()
+    with open(index_file, "wb") as outputfileObj:
+        outputfileObj.write(INDEX_MAGIC)
+        outputfileObj.write(struct.pack("<Q", len(index_records)))
+        index_records.tofile(outputfileObj)
+        index_offsets.tofile(outputfileObj)
+
+    return
+
+#====================================================================#
+
+# define a function to read in a record index:
+
+def read_record_index(index_file):
+    """read in the record numbers and block offsets of a BGZF fastq file"""
+
+    with open(index_file, "rb") as fileObj:
+        if fileObj.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError("%s is not a BGZF fastq record index" % index_file)
+        (num_entries,) = struct.unpack("<Q", fileObj.read(8))
+        index_records = array("Q")
+        index_offsets = array("Q")
+        index_records.fromfile(fileObj, num_entries)
+        index_offsets.fromfile(fileObj, num_entries)
+    if sys.byteorder != "little":
+        index_records.byteswap()
+        index_offsets.byteswap()
+
+    return index_records, index_offsets
+
+#====================================================================#
+
+# define a function to copy a range of records out of an indexed BGZF fastq file:
+
+def extract_bgzf_fastq_records(input_file, index, first_record, last_record, output_file, compresslevel=9):
+    """write records first_record to last_record-1 (counting from 0) of a BGZF fastq file to a new BGZF file
+
+    Whole compressed blocks are copied across as they are; only the blocks at the
+    two ends of the range, where it starts or ends part way through a block, are
+    decompressed and compressed again. A record index is written for the new file.
+    """
+
+    index_records, index_offsets = index
+    output_records = array("Q")
+    output_offsets = array("Q")
+    fileObj = open(input_file, "rb")
+    outputfileObj = open(output_file, "wb")
+
+    # find the blocks that the first record and the end of the range are in:
+    i = bisect_right(index_records, first_record) - 1
+    j = bisect_right(index_records, last_record) - 1
+
+    if index_records[i] == first_record:
+        copy_start = index_offsets[i]
+    else:
+        data, copy_start = read_bgzf_block(fileObj, index_offsets[i])
+        start = find_fastq_record_offset(data, 0, first_record - index_records[i])
+        if i == j: # the whole range is in this one block
+            end = find_fastq_record_offset(data, start, last_record - first_record)
+        else:
+            end = len(data)
+        if end > start:
+            output_records.append(0)
+            output_offsets.append(outputfileObj.tell())
+            outputfileObj.write(compress_bgzf_block(data[start:end], compresslevel))
+
+    if i != j or index_records[i] == first_record:
+        # copy the whole blocks in the middle of the range across as they are:
+        copy_end = index_offsets[j]
+        for k in range(bisect_right(index_offsets, copy_start) - 1, j):
+            if index_offsets[k] >= copy_start:
+                output_records.append(index_records[k] - first_record)
+                output_offsets.append(index_offsets[k] - copy_start + outputfileObj.tell())
+        fileObj.seek(copy_start)
+        remaining = copy_end - copy_start
+        while remaining > 0:
+            block = fileObj.read(min(remaining, 16 * 1024 * 1024))
+            outputfileObj.write(block)
+            remaining -= len(block)
+
+        # the range may end part way through a block:
+        if index_records[j] != last_record:
+            data, _ = read_bgzf_block(fileObj, index_offsets[j])
+            end = find_fastq_record_offset(data, 0, last_record - index_records[j])
+            output_records.append(index_records[j] - first_record)
+            output_offsets.append(outputfileObj.tell())
+            outputfileObj.write(compress_bgzf_block(data[:end], compresslevel))
+
+    output_records.append(last_record - first_record)
+    output_offsets.append(outputfileObj.tell())
+    outputfileObj.write(BGZF_EOF)
+    outputfileObj.close()
+    fileObj.close()
+    write_record_index(output_file + INDEX_SUFFIX, output_records, output_offsets)
+
+    return
+
+#====================================================================#
+
+# define a function to cut an indexed BGZF fastq file into new shards:
+
+def resplit_bgzf_fastq(input_file, output_file_prefix, num_output_files=None, seqs_per_output_file=None, record_range=None):
+    """cut an indexed BGZF fastq file into output_file_prefix_1.fastq.gz, output_file_prefix_2.fastq.gz, ...
+
+    Give one of num_output_files (to cut it into that many files of nearly equal
+    numbers of records), seqs_per_output_file, or record_range (a (first, last)
+    tuple of record numbers counting from 1, inclusive, written to one file).
+    """
+
+    index = read_record_index(input_file + INDEX_SUFFIX)
+    total_records = index[0][-1]
+
+    # work out the records that go into each output file:
+    if record_range is not None:
+        first, last = record_range
+        if first < 1 or last > total_records or first > last:
+            raise ValueError("records %d-%d are not in %s, which has %d records" % (first, last, input_file, total_records))
+        ranges = [(first - 1, last)]
+    elif num_output_files is not None:
+        ranges = [(total_records * k // num_output_files, total_records * (k + 1) // num_output_files) for k in range(num_output_files)]
+    else:
+        ranges = [(first, min(first + seqs_per_output_file, total_records)) for first in range(0, total_records, seqs_per_output_file)]
+
+    output_file_cnt = 0
+    for first_record, last_record in ranges:
+        output_file_cnt += 1
+        output_file = "%s_%d.fastq.gz" % (output_file_prefix, output_file_cnt)
+        print("Writing",output_file,"...")
+        extract_bgzf_fastq_records(input_file, index, first_record, last_record, output_file)
+
+    return
+
+#====================================================================#
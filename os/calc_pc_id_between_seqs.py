@@ -0,0 +1,722 @@
+# Script to calculate the percent identity between each pair of sequences in a fasta file,
+# like calc_pc_id_between_seqs.pl, but without running ggsearch (and writing temporary files)
+# for every pair: the global (Needleman-Wunsch) alignments are made here, with the scores and
+# gap penalties that ggsearch uses by default, and each row of the alignment matrix is filled
+# in for a batch of pairs at once with numpy, keeping only a band of diagonals around the
+# main one. Pairs that share few k-mers can be skipped without aligning them, and the pairs
+# are shared out between a pool of processes, with the results written out as they come back.
+
+import sys
+import os
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse
+from twobit_store import read_fasta_records
+
+#====================================================================#
+
+# the BLOSUM50 matrix, which ggsearch uses for proteins by default:
+
+BLOSUM50 = """
+   A  R  N  D  C  Q  E  G  H  I  L  K  M  F  P  S  T  W  Y  V  B  Z  X  *
+A  5 -2 -1 -2 -1 -1 -1  0 -2 -1 -2 -1 -1 -3 -1  1  0 -3 -2  0 -2 -1 -1 -5
+R -2  7 -1 -2 -4  1  0 -3  0 -4 -3  3 -2 -3 -3 -1 -1 -3 -1 -3 -1  0 -1 -5
+N -1 -1  7  2 -2  0  0  0  1 -3 -4  0 -2 -4 -2  1  0 -4 -2 -3  4  0 -1 -5
+D -2 -2  2  8 -4  0  2 -1 -1 -4 -4 -1 -4 -5 -1  0 -1 -5 -3 -4  5  1 -1 -5
+C -1 -4 -2 -4 13 -3 -3 -3 -3 -2 -2 -3 -2 -2 -4 -1 -1 -5 -3 -1 -3 -3 -2 -5
+Q -1  1  0  0 -3  7  2 -2  1 -3 -2  2  0 -4 -1  0 -1 -1 -1 -3  0  4 -1 -5
+E -1  0  0  2 -3  2  6 -3  0 -4 -3  1 -2 -3 -1 -1 -1 -3 -2 -3  1  5 -1 -5
+G  0 -3  0 -1 -3 -2 -3  8 -2 -4 -4 -2 -3 -4 -2  0 -2 -3 -3 -4 -1 -2 -2 -5
+H -2  0  1 -1 -3  1  0 -2 10 -4 -3  0 -1 -1 -2 -1 -2 -3  2 -4  0  0 -1 -5
+I -1 -4 -3 -4 -2 -3 -4 -4 -4  5  2 -3  2  0 -3 -3 -1 -3 -1  4 -4 -3 -1 -5
+L -2 -3 -4 -4 -2 -2 -3 -4 -3  2  5 -3  3  1 -4 -3 -1 -2 -1  1 -4 -3 -1 -5
+K -1  3  0 -1 -3  2  1 -2  0 -3 -3  6 -2 -4 -1  0 -1 -3 -2 -3  0  1 -1 -5
+M -1 -2 -2 -4 -2  0 -2 -3 -1  2  3 -2  7  0 -3 -2 -1 -1  0  1 -3 -1 -1 -5
+F -3 -3 -4 -5 -2 -4 -3 -4 -1  0  1 -4  0  8 -4 -3 -2  1  4 -1 -4 -4 -2 -5
+P -1 -3 -2 -1 -4 -1 -1 -2 -2 -3 -4 -1 -3 -4 10 -1 -1 -4 -3 -3 -2 -1 -2 -5
+S  1 -1  1  0 -1  0 -1  0 -1 -3 -3  0 -2 -3 -1  5  2 -4 -2 -2  0  0 -1 -5
+T  0 -1  0 -1 -1 -1 -1 -2 -2 -1 -1 -1 -1 -2 -1  2  5 -3 -2  0  0 -1  0 -5
+W -3 -3 -4 -5 -5 -1 -3 -3 -3 -3 -2 -3 -1  1 -4 -4 -3 15  2 -3 -5 -2 -3 -5
+Y -2 -1 -2 -3 -3 -1 -2 -3  2 -1 -1 -2  0  4 -3 -2 -2  2  8 -1 -3 -2 -1 -5
+V  0 -3 -3 -4 -1 -3 -3 -4 -4  4  1 -3  1 -1 -3 -2  0 -3 -1  5 -4 -3 -1 -5
+B -2 -1  4  5 -3  0  1 -1  0 -4 -4  0 -3 -4 -2  0  0 -5 -3 -4  5  2 -1 -5
+Z -1  0  0  1 -3  4  5 -2  0 -3 -3  1 -1 -4 -1  0 -1 -2 -2 -3  2  5 -1 -5
+X -1 -1 -1 -1 -2 -1 -1 -2 -1 -1 -1 -1 -1 -2 -2 -1  0 -3 -1 -1 -1 -1 -1 -5
+* -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5 -5  1
+"""
+
+# the scores ggsearch uses for DNA by default (+5/-4), with N scoring -1 against anything:
+
+DNA_LETTERS = "ACGTN"
+DNA_MATCH = 5
+DNA_MISMATCH = -4
+DNA_N_SCORE = -1
+
+# the gap penalties ggsearch uses by default, as (open, extend): a gap of k residues costs open + k * extend,
+# so the first residue of a gap costs -12 for proteins and -16 for DNA:
+
+GAP_PENALTIES = {"protein": (10, 2), "dna": (12, 4)}
+
+# the half-width of the band of diagonals that is aligned at first; a pair whose best alignment
+# could leave the band is aligned again with a band wide enough to be sure of it:
+
+DEFAULT_BAND = 32
+
+# the score of a cell outside the matrix, and of aligning a residue with the padding after
+# the end of a sequence; they are far below any real score, but cannot overflow int32:
+
+NEG_SCORE = -2**28
+PAD_SCORE = -2**20
+
+# the most traceback cells (one byte each) to keep for one batch of pairs, and the most pairs in a batch:
+
+MAX_BATCH_CELLS = 2**25
+MAX_BATCH_PAIRS = 64
+
+# the number of pairs given to a worker process at a time:
+
+TASK_PAIRS = 2048
+
+# the default k-mer length for the prefilter:
+
+DEFAULT_KMER_SIZE = {"protein": 3, "dna": 8}
+
+#====================================================================#
+
+# define a function to make the table of residue codes and the matrix of scores for proteins or DNA:
+
+def make_scoring(seqtype):
+    """returns (codes, scores): codes maps each byte to a residue code (upper and lower case
+    letters alike, with unknown letters as X or N), and scores[code1, code2] is the score
+    of aligning two residues. The last code is for padding after the end of a sequence.
+
+    >>> codes, scores = make_scoring('protein')
+    >>> int(scores[codes[ord('W')], codes[ord('w')]]), int(scores[codes[ord('A')], codes[ord('J')]])
+    (15, -1)
+    >>> codes, scores = make_scoring('dna')
+    >>> scores[codes[np.frombuffer(b'ACgn', dtype=np.uint8)]][:, codes[ord('G')]].tolist()
+    [-4, -4, 5, -1]
+    """
+
+    if seqtype == "protein":
+        lines = BLOSUM50.strip().split("\n")
+        letters = "".join(lines[0].split())
+        matrix = np.array([[int(score) for score in line.split()[1:]] for line in lines[1:]], dtype=np.int32)
+        unknown = letters.index("X")
+    elif seqtype == "dna":
+        letters = DNA_LETTERS
+        matrix = np.where(np.eye(4, dtype=bool), DNA_MATCH, DNA_MISMATCH).astype(np.int32)
+        matrix = np.pad(matrix, (0, 1), constant_values=DNA_N_SCORE)
+        unknown = letters.index("N")
+    else:
+        raise ValueError("unknown sequence type %s (should be protein or dna)" % seqtype)
+
+    codes = np.full(256, unknown, dtype=np.uint8)
+    for code, letter in enumerate(letters):
+        codes[ord(letter)] = code
+        codes[ord(letter.lower())] = code
+    if seqtype == "dna":
+        codes[ord("U")] = codes[ord("u")] = letters.index("T")
+    scores = np.full((len(letters) + 1, len(letters) + 1), PAD_SCORE, dtype=np.int32)
+    scores[:-1, :-1] = matrix
+
+    return codes, scores
+
+#====================================================================#
+
+# define a function to guess whether some sequences are DNA or protein:
+
+def guess_seqtype(seqs):
+    """'dna' if at least 85% of the letters are A, C, G, T, U or N (like the fasta programs), else 'protein'
+
+    >>> guess_seqtype([b'ACGTNNACGT', b'acgu']), guess_seqtype([b'MKVLAT'])
+    ('dna', 'protein')
+    """
+
+    total = sum(len(seq) for seq in seqs)
+    nucleotides = sum(len(seq) - len(seq.translate(None, b"ACGTUNacgtun")) for seq in seqs)
+
+    return "dna" if total > 0 and nucleotides >= 0.85 * total else "protein"
+
+#====================================================================#
+
+# define a function to make the global alignments of a batch of pairs of sequences, a row at a time:
+
+def align_batch(queries, targets, scores, gap_open, gap_extend, bands):
+    """returns arrays of (score, identities, alignment length, band needed) for the best global
+    alignment of each query with its target that stays within bands[pair] diagonals either side
+    of the diagonals that run from the start of the matrix to its end (the identities and
+    length are left as 0 for pairs that need a wider band)
+
+    The cells are kept by diagonal: cell k of row i of a pair is column j = i + lows[pair] + k,
+    so cell k of row i-1 is the diagonal step into it and cell k+1 the vertical step (when the
+    bands cover the whole matrix, the cells are kept by column instead, so cell k is column k).
+    The horizontal gaps along a row come from a running maximum (np.maximum.accumulate) of
+    H[i, j'] + extend * j', since a gap from j' to j costs open + extend * (j - j').
+
+    To tell whether the band was wide enough, each aligned pair of residues a, b is counted
+    as losing (best(a) + best(b)) / 2 - score(a, b) from the most the alignment could score,
+    and each residue in a gap as losing best(residue) / 2 plus the gap penalties. An alignment
+    that leaves the band must first leave it from a cell on its edge, and then needs gaps to
+    get back to the end of the matrix, so it cannot score more than the best score in that
+    cell, plus the most the rest of both sequences could score, less the loss from those
+    gaps. If the alignment found inside the band scores more than that, it is the best
+    alignment of the whole matrix (and is the same one aligning the whole matrix would give);
+    if not, the band needed is a width at which even the fewest gaps needed to leave the
+    band would lose more than the alignment found.
+
+    >>> codes, scores = make_scoring('protein')
+    >>> encode = lambda seq: codes[np.frombuffer(seq, dtype=np.uint8)]
+    >>> result = align_batch([encode(b'HEAGAWGHEE'), encode(b'MKV')], [encode(b'PAWHEAE'), encode(b'MKV')], scores, 10, 2, np.array([2, 2]))
+    >>> [array.tolist() for array in result]
+    [[5, 18], [0, 3], [0, 3], [3, 0]]
+    """
+
+    num_pairs = len(queries)
+    query_lengths = np.array([len(seq) for seq in queries], dtype=np.int64)
+    target_lengths = np.array([len(seq) for seq in targets], dtype=np.int64)
+    max_query_length = int(query_lengths.max())
+    max_target_length = int(target_lengths.max())
+    differences = target_lengths - query_lengths # the last diagonal, j - i, of each pair
+    pad = scores.shape[0] - 1
+    open_extend = gap_open + gap_extend
+
+    # the band runs from diagonal lows[pair] to lows[pair] + width - 1, or is the whole matrix:
+    whole_matrix = bool(np.all((bands >= query_lengths) & (bands >= target_lengths)))
+    if whole_matrix:
+        step = 0 # each row starts at column 0
+        lows = np.zeros(num_pairs, dtype=np.int64)
+        width = max_target_length + 1
+    else:
+        step = 1 # each row starts one column on from the row above
+        lows = np.maximum(np.minimum(0, differences) - bands, -query_lengths)
+        width = int(min((np.abs(differences) + 2 * bands + 1).max(), (target_lengths + query_lengths).max() + 1))
+    highs = lows + width - 1
+    cells = np.arange(width, dtype=np.int64)
+    extend_costs = (gap_extend * cells).astype(np.int32)
+    open_costs = extend_costs[:-1] + open_extend
+
+    # the queries, padded to the same length, and the targets shifted so that row i of a pair
+    # uses target residues shifted_targets[pair, i * step:i * step + width] (column j uses residue j - 1):
+    padded_queries = np.full((num_pairs, max_query_length), pad, dtype=np.uint8)
+    padded_targets = np.full((num_pairs, max_target_length + 1), pad, dtype=np.uint8)
+    for pair_num in range(num_pairs):
+        padded_queries[pair_num, :query_lengths[pair_num]] = queries[pair_num]
+        padded_targets[pair_num, :target_lengths[pair_num]] = targets[pair_num]
+    positions = lows[:, None] - 1 + np.arange(max_query_length * step + width)
+    inside = (positions >= 0) & (positions < target_lengths[:, None])
+    positions = np.where(inside, positions, target_lengths[:, None]) # the padding at the end of each target
+    shifted_targets = np.take_along_axis(padded_targets, positions, axis=1).astype(np.int32)
+    query_offsets = padded_queries.astype(np.int32) * scores.shape[1]
+    flat_scores = scores.ravel()
+
+    # the most each residue could score, the sums of these over the residues after each position,
+    # and the least a residue in a gap would lose (doubled, to keep to whole numbers):
+    best_scores = np.append(scores[:-1, :-1].max(axis=1), 0).astype(np.int64)
+    query_rest = np.zeros((num_pairs, max_query_length + 1), dtype=np.int64)
+    query_rest[:, :-1] = np.cumsum(best_scores[padded_queries][:, ::-1], axis=1)[:, ::-1]
+    target_rest = np.zeros((num_pairs, max_target_length + 2), dtype=np.int64)
+    target_rest[:, :-1] = np.cumsum(best_scores[padded_targets][:, ::-1], axis=1)[:, ::-1]
+    least_best = np.minimum(np.where(padded_queries != pad, best_scores[padded_queries], best_scores.max()).min(axis=1, initial=best_scores.max()),
+                            np.where(padded_targets != pad, best_scores[padded_targets], best_scores.max()).min(axis=1, initial=best_scores.max()))
+    gap_losses = 2 * gap_extend + least_best
+    # the least that leaving from the top edge of the band (with a horizontal step) or its bottom edge
+    # (with a vertical step) and getting back to the last diagonal could lose:
+    top_losses = 2 * gap_open + (highs + 2 - differences) * gap_losses
+    bottom_losses = 2 * gap_open + (differences - lows + 2) * gap_losses
+    top_edges = np.full((max_query_length + 1, num_pairs), NEG_SCORE, dtype=np.int64)
+    bottom_edges = np.full((max_query_length + 1, num_pairs), NEG_SCORE, dtype=np.int64)
+
+    # row 0 is a gap in the query, and there is nothing above it:
+    columns = lows[:, None] + cells
+    prev_h = np.where(columns == 0, 0, np.where(columns > 0, -(gap_open + gap_extend * columns), NEG_SCORE)).astype(np.int32)
+    prev_f = np.full((num_pairs, width), NEG_SCORE, dtype=np.int32)
+    # each traceback cell has whether the best score came from a horizontal gap in bit 0, or else from
+    # a vertical gap in bit 1 (or else from the diagonal), whether the horizontal gap extends one to
+    # its left in bit 2, and whether the vertical gap extends one above in bit 3:
+    pointers = np.zeros((num_pairs, max_query_length + 1, width), dtype=np.uint8)
+    pointers[:, 0] = np.where(columns > 0, 1, 0) | np.where(columns > 1, 4, 0)
+
+    final_scores = np.zeros(num_pairs, dtype=np.int64)
+    final_cells = differences - lows + query_lengths * (1 - step)
+    ending = np.argsort(query_lengths, kind="stable")
+    ending_bounds = np.searchsorted(query_lengths[ending], np.arange(max_query_length + 2))
+    ended = ending[:ending_bounds[1]]
+    final_scores[ended] = prev_h[ended, final_cells[ended]]
+    top_edges[0] = prev_h[:, -1]
+    bottom_edges[0] = prev_h[:, 0]
+
+    # the cells of the row above that the vertical and diagonal steps come from:
+    if whole_matrix:
+        (up_from, up_to, diagonal_from, diagonal_to) = (slice(None), slice(None), slice(None, -1), slice(1, None))
+    else:
+        (up_from, up_to, diagonal_from, diagonal_to) = (slice(1, None), slice(None, -1), slice(None), slice(None))
+    diagonal = np.full((num_pairs, width), NEG_SCORE, dtype=np.int32)
+    f = np.full((num_pairs, width), NEG_SCORE, dtype=np.int32)
+    e = np.full((num_pairs, width), NEG_SCORE, dtype=np.int32)
+    for i in range(1, max_query_length + 1):
+        row_scores = np.take(flat_scores, shifted_targets[:, i * step:i * step + width] + query_offsets[:, i - 1:i])
+        np.add(prev_h[:, diagonal_from], row_scores[:, diagonal_to], out=diagonal[:, diagonal_to])
+        # vertical gaps, from the row above:
+        up_open = prev_h[:, up_from] - open_extend
+        up_extend = prev_f[:, up_from] - gap_extend
+        np.maximum(up_open, up_extend, out=f[:, up_to])
+        h = np.maximum(diagonal, f)
+        # horizontal gaps, from the left along this row:
+        best_left = np.maximum.accumulate(h + extend_costs, axis=1)
+        np.subtract(best_left[:, :-1], open_costs, out=e[:, 1:])
+        row_pointers = pointers[:, i]
+        np.greater(e, h, out=row_pointers, casting="unsafe")
+        row_pointers |= np.greater(f, diagonal).view(np.uint8) << 1
+        row_pointers[:, 1:] |= np.greater(e[:, 1:], h[:, :-1] - open_extend).view(np.uint8) << 2
+        row_pointers[:, up_to] |= np.greater(up_extend, up_open).view(np.uint8) << 3
+        np.maximum(h, e, out=h)
+        ended = ending[ending_bounds[i]:ending_bounds[i + 1]]
+        final_scores[ended] = h[ended, final_cells[ended]]
+        top_edges[i] = h[:, -1]
+        bottom_edges[i] = h[:, 0]
+        prev_h = h
+        prev_f, f = f, prev_f
+
+    # the band needed for the pairs whose alignment could have been beaten from outside the band:
+    if whole_matrix:
+        needed = np.zeros(num_pairs, dtype=np.int64)
+    else:
+        outside_bound = find_outside_bound(top_edges, bottom_edges, query_lengths, target_lengths, lows, highs, query_rest, target_rest, top_losses, bottom_losses)
+        losses = query_rest[:, 0] + target_rest[:, 0] - 2 * final_scores
+        needed = np.where(gap_losses > 0, ((losses - 4 * gap_open) // np.maximum(gap_losses, 1) - np.abs(differences)) // 2, np.maximum(query_lengths, target_lengths))
+        needed = np.where(outside_bound >= 2 * final_scores, np.maximum(needed, bands + 1), 0)
+
+    # follow the pointers back from the end of each alignment (that will not be aligned again):
+    identities = np.zeros(num_pairs, dtype=np.int64)
+    lengths = np.zeros(num_pairs, dtype=np.int64)
+    for pair_num in np.flatnonzero(needed == 0).tolist():
+        identities[pair_num], lengths[pair_num] = trace_alignment(pointers[pair_num, :query_lengths[pair_num] + 1].tobytes(), width, int(lows[pair_num]), step, queries[pair_num].tobytes(), targets[pair_num].tobytes())
+
+    return final_scores, identities, lengths, needed
+
+#====================================================================#
+
+# define a function to find the most (doubled) that alignments leaving the band could score, from the cells on the edges of the band:
+
+def find_outside_bound(top_edges, bottom_edges, query_lengths, target_lengths, lows, highs, query_rest, target_rest, top_losses, bottom_losses):
+
+    # leaving from the top edge needs a column to step right into, and from the bottom edge a row to step down into:
+    rows = np.arange(top_edges.shape[0])[:, None]
+    pair_nums = np.arange(top_edges.shape[1])
+    top_columns = rows + highs
+    bottom_columns = rows + lows
+    top = (top_columns < target_lengths) & (rows <= query_lengths)
+    bottom = (bottom_columns >= 0) & (rows < query_lengths)
+    rest = query_rest.T[:len(rows)]
+    top_bounds = 2 * top_edges + rest + target_rest[pair_nums, np.clip(top_columns, 0, target_rest.shape[1] - 1)] - top_losses
+    bottom_bounds = 2 * bottom_edges + rest + target_rest[pair_nums, np.clip(bottom_columns, 0, target_rest.shape[1] - 1)] - bottom_losses
+
+    return np.maximum(np.where(top, top_bounds, 2 * NEG_SCORE).max(axis=0), np.where(bottom, bottom_bounds, 2 * NEG_SCORE).max(axis=0))
+
+#====================================================================#
+
+# define a function to follow the traceback pointers of one pair back from the end of its alignment:
+
+def trace_alignment(pointers, width, low, step, query, target):
+    """returns (identities, alignment length)"""
+
+    i = len(query)
+    j = len(target)
+    state = 0 # 0 in the best-score matrix, 1 in a horizontal gap, 2 in a vertical gap
+    identities = 0
+    length = 0
+    while i > 0 or j > 0:
+        pointer = pointers[i * width + j - low - i * step]
+        if state == 0:
+            state = 1 if pointer & 1 else pointer & 2
+        if state == 0:
+            if query[i - 1] == target[j - 1]:
+                identities += 1
+            i -= 1
+            j -= 1
+        elif state == 1:
+            j -= 1
+            if pointer & 4 == 0:
+                state = 0
+        else:
+            i -= 1
+            if pointer & 8 == 0:
+                state = 0
+        length += 1
+
+    return identities, length
+
+#====================================================================#
+
+# define a function to make the global alignments of many pairs, in batches of similar pairs:
+
+def align_pairs(queries, targets, scores, gap_open, gap_extend, band=DEFAULT_BAND):
+    """returns arrays of (score, identities, alignment length) for each query with its target
+
+    The pairs are put in batches by query length and by how wide their bands are, and pairs
+    whose best alignment might leave the band are aligned again with the band that
+    align_batch() says is needed (or the whole matrix, if that is as quick), so the results are the same as aligning the whole matrix
+    of each pair. A band of 0 aligns the whole matrix straight away.
+    """
+
+    num_pairs = len(queries)
+    all_scores = np.zeros(num_pairs, dtype=np.int64)
+    identities = np.zeros(num_pairs, dtype=np.int64)
+    lengths = np.zeros(num_pairs, dtype=np.int64)
+    query_lengths = np.array([len(seq) for seq in queries], dtype=np.int64)
+    target_lengths = np.array([len(seq) for seq in targets], dtype=np.int64)
+    differences = np.abs(target_lengths - query_lengths)
+    longer_lengths = np.maximum(query_lengths, target_lengths) # a band this wide covers the whole matrix
+    bands = longer_lengths.copy() if band <= 0 else np.minimum(band, longer_lengths)
+    todo = np.arange(num_pairs)
+    while len(todo) > 0:
+        # a band at least as wide as a row of the matrix is no quicker than the whole matrix:
+        bands[todo] = np.where(differences[todo] + 2 * bands[todo] >= target_lengths[todo], longer_lengths[todo], bands[todo])
+        whole_matrix = bands[todo] >= longer_lengths[todo]
+        widths = np.where(whole_matrix, target_lengths[todo] + 1, np.minimum(differences[todo] + 2 * bands[todo] + 1, query_lengths[todo] + target_lengths[todo] + 1))
+        order = np.lexsort((widths, query_lengths[todo], whole_matrix))
+        (todo, whole_matrix, widths) = (todo[order], whole_matrix[order].tolist(), widths[order].tolist())
+        rows = (query_lengths[todo] + 1).tolist()
+        retry = []
+        batch_start = 0
+        while batch_start < len(todo):
+            # add pairs to the batch until its traceback would be too big:
+            batch_end = batch_start + 1
+            (batch_rows, batch_width) = (rows[batch_start], widths[batch_start])
+            while batch_end < len(todo) and batch_end - batch_start < MAX_BATCH_PAIRS and whole_matrix[batch_end] == whole_matrix[batch_start]:
+                batch_rows = max(batch_rows, rows[batch_end])
+                batch_width = max(batch_width, widths[batch_end])
+                if batch_rows * batch_width * (batch_end - batch_start + 1) > MAX_BATCH_CELLS:
+                    break
+                batch_end += 1
+            batch = todo[batch_start:batch_end]
+            batch_scores, batch_identities, batch_lengths, needed = align_batch([queries[pair_num] for pair_num in batch], [targets[pair_num] for pair_num in batch], scores, gap_open, gap_extend, bands[batch])
+            all_scores[batch] = batch_scores
+            identities[batch] = batch_identities
+            lengths[batch] = batch_lengths
+            retry.append(batch[needed > 0])
+            bands[batch] = np.where(needed > 0, np.minimum(needed, longer_lengths[batch]), bands[batch])
+            batch_start = batch_end
+        todo = np.concatenate(retry)
+
+    return all_scores, identities, lengths
+
+#====================================================================#
+
+# define a function to calculate the percent identity from the number of identities and the alignment length:
+
+def format_pc_id(identities, length):
+    """the percent identity as ggsearch prints it, to one decimal place
+
+    >>> format_pc_id(99, 100), format_pc_id(0, 0)
+    ('99.0', '0.0')
+    """
+
+    return "%.1f" % (100.0 * identities / length if length > 0 else 0.0)
+
+#====================================================================#
+
+# define a function to calculate the percent identity between two sequences:
+
+def calc_pc_id_between_two_seqs(seq1, seq2, seqtype=None, band=DEFAULT_BAND):
+    """the percent identity of the best global alignment of two sequences, as a string like '99.0'
+
+    >>> seq1 = b'AAAAGAAAAATTTTTCTTTTCACACACACACGGGGTGGGGACCACCACCACCCCCACCCCGAGAGAGAGACCCCGGCCCCAAAACCAAAATTTTCTCTTT'
+    >>> seq2 = b'AAAAGAACAATTTTTCTTTTCACACACACACGGGGTTGGGACCACCACCACCGCCACCCCGAGAGAGAGACCCCGGCCCCAAAACCAAAATTATCTCTCT'
+    >>> calc_pc_id_between_two_seqs(seq1, seq1), calc_pc_id_between_two_seqs(seq1, seq2)
+    ('100.0', '95.0')
+    >>> calc_pc_id_between_two_seqs(b'MKVLAAGIVGLLLA', b'MKVLAGIVGLLWLA')
+    '86.7'
+    """
+
+    if seqtype is None:
+        seqtype = guess_seqtype([seq1, seq2])
+    codes, scores = make_scoring(seqtype)
+    (gap_open, gap_extend) = GAP_PENALTIES[seqtype]
+    query = codes[np.frombuffer(seq1, dtype=np.uint8)]
+    target = codes[np.frombuffer(seq2, dtype=np.uint8)]
+    _, identities, lengths = align_pairs([query], [target], scores, gap_open, gap_extend, band)
+
+    return format_pc_id(int(identities[0]), int(lengths[0]))
+
+#====================================================================#
+
+# define a function to make a sparse matrix of which k-mers are in each sequence:
+
+def make_kmer_matrix(seq_codes, kmer_size, alphabet_size):
+    """returns a scipy CSR matrix with a 1 at [seq, kmer] for each distinct k-mer in each sequence
+
+    >>> kmers = make_kmer_matrix([np.array([0, 1, 0, 1, 0], dtype=np.uint8), np.array([1, 1], dtype=np.uint8)], 2, 4)
+    >>> kmers.indices.tolist(), kmers.indptr.tolist()
+    ([1, 4, 5], [0, 2, 3])
+    """
+
+    powers = alphabet_size ** np.arange(kmer_size - 1, -1, -1, dtype=np.int64)
+    kmer_lists = []
+    for codes in seq_codes:
+        if len(codes) < kmer_size:
+            kmer_lists.append(np.zeros(0, dtype=np.int64))
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(codes.astype(np.int64), kmer_size)
+        kmer_lists.append(np.unique(windows @ powers))
+    indptr = np.zeros(len(seq_codes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(kmers) for kmers in kmer_lists])
+    indices = np.concatenate(kmer_lists) if kmer_lists else np.zeros(0, dtype=np.int64)
+
+    return scipy.sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr), shape=(len(seq_codes), alphabet_size ** kmer_size))
+
+#====================================================================#
+
+# define a function to find the later sequences that share enough k-mers with each of a block of sequences:
+
+def find_similar_seqs(kmers, first, last, min_similarity):
+    """yields (seq, array of later seqs) for seqs first..last-1, keeping the later seqs that share at least
+    min_similarity of the distinct k-mers of whichever of the two sequences has fewer (a pair is kept if
+    either sequence is too short to have any k-mers)
+
+    >>> kmers = make_kmer_matrix([np.array(codes, dtype=np.uint8) for codes in ([0, 1, 2, 3], [0, 1, 2, 0], [3, 3, 3, 3], [1])], 2, 4)
+    >>> [(seq, later.tolist()) for seq, later in find_similar_seqs(kmers, 0, 4, 0.5)]
+    [(0, [1, 3]), (1, [3]), (2, [3]), (3, [])]
+    """
+
+    counts = np.diff(kmers.indptr)
+    shared = (kmers[first:last] @ kmers.T).toarray()
+    for seq in range(first, last):
+        later_shared = shared[seq - first, seq + 1:]
+        fewest = np.minimum(counts[seq], counts[seq + 1:])
+        keep = (fewest == 0) | (later_shared >= min_similarity * fewest)
+        yield seq, seq + 1 + np.flatnonzero(keep)
+
+    return
+
+#====================================================================#
+
+# define a function to list the pairs of sequences to align, in chunks:
+
+def generate_pair_chunks(num_seqs, kmers=None, min_similarity=0.0, chunk_size=TASK_PAIRS):
+    """yields (first seqs, second seqs, number of pairs skipped) for chunks of the pairs (i, j) with i < j,
+    in order, leaving out pairs that share too few k-mers if kmers is given
+
+    >>> [(first.tolist(), second.tolist(), skipped) for first, second, skipped in generate_pair_chunks(4, chunk_size=4)]
+    [([0, 0, 0, 1], [1, 2, 3, 2], 0), ([1, 2], [3, 3], 0)]
+    """
+
+    first_seqs = []
+    second_seqs = []
+    num_pairs = 0
+    skipped = 0
+    block_size = max(1, 2**22 // max(1, num_seqs)) # seqs to compare the k-mers of at once
+    for block_start in range(0, num_seqs, block_size):
+        block_end = min(num_seqs, block_start + block_size)
+        if kmers is None:
+            similar = ((seq, np.arange(seq + 1, num_seqs)) for seq in range(block_start, block_end))
+        else:
+            similar = find_similar_seqs(kmers, block_start, block_end, min_similarity)
+        for seq, later_seqs in similar:
+            skipped += num_seqs - seq - 1 - len(later_seqs)
+            while len(later_seqs) > 0:
+                take = min(len(later_seqs), chunk_size - num_pairs)
+                first_seqs.append(np.full(take, seq, dtype=np.int64))
+                second_seqs.append(later_seqs[:take])
+                later_seqs = later_seqs[take:]
+                num_pairs += take
+                if num_pairs == chunk_size:
+                    yield np.concatenate(first_seqs), np.concatenate(second_seqs), skipped
+                    first_seqs = []
+                    second_seqs = []
+                    num_pairs = 0
+                    skipped = 0
+    if num_pairs > 0 or skipped > 0:
+        yield np.concatenate(first_seqs) if first_seqs else np.zeros(0, dtype=np.int64), np.concatenate(second_seqs) if second_seqs else np.zeros(0, dtype=np.int64), skipped
+
+    return
+
+#====================================================================#
+
+# the encoded sequences and the scores used by each worker process, set once when the worker starts:
+
+worker_alignment = None
+
+# define a function to give a worker process the sequences and scores:
+
+def set_worker_alignment(seq_codes, scores, gap_open, gap_extend, band):
+
+    global worker_alignment
+    worker_alignment = (seq_codes, scores, gap_open, gap_extend, band)
+
+# define a function to align a chunk of pairs, in a worker process:
+
+def align_pairs_in_worker(first_seqs, second_seqs):
+
+    (seq_codes, scores, gap_open, gap_extend, band) = worker_alignment
+    _, identities, lengths = align_pairs([seq_codes[seq] for seq in first_seqs.tolist()], [seq_codes[seq] for seq in second_seqs.tolist()], scores, gap_open, gap_extend, band)
+
+    return identities, lengths
+
+#====================================================================#
+
+# define a function to calculate the percent identity between each pair of sequences, and write them out:
+
+def calc_pc_id_between_seqs(seqs, outputfileObj, seqtype=None, band=DEFAULT_BAND, min_kmer_similarity=None, kmer_size=None, num_processes=1):
+    """writes 'name1<TAB>name2<TAB>percent identity' for each pair of sequences, with the names in
+    sorted order (like calc_pc_id_between_seqs.pl), and returns (pairs written, pairs skipped)
+
+    If min_kmer_similarity is given, pairs that share fewer than that fraction of their distinct
+    k-mers are skipped (left out of the output) without aligning them. The chunks of pairs
+    are aligned by a pool of processes, a few chunks ahead of the one being written out.
+
+    >>> import io
+    >>> seqs = {'seq3': b'AAAAGAAAAATTTTTCTTTTCACACACACACGGGGTTGGGACCACCACCACCCCCACCCCGAGAGAGAGACCCCGGCCCCAAAACCAAAATTTTCTCTTT',
+    ...         'seq1': b'AAAAGAAAAATTTTTCTTTTCACACACACACGGGGTGGGGACCACCACCACCCCCACCCCGAGAGAGAGACCCCGGCCCCAAAACCAAAATTTTCTCTTT',
+    ...         'seq2': b'AAAAGAAAAATTTTTCTTTTCACACACACACGGGGTGGGGACCACCACCACCCCCACCCCGAGAGAGAGACCCCGGCCCCAAAACCAAAATTTTCTCTTT'}
+    >>> outputfileObj = io.StringIO()
+    >>> calc_pc_id_between_seqs(seqs, outputfileObj)
+    (3, 0)
+    >>> outputfileObj.getvalue().splitlines()
+    ['seq1\\tseq2\\t100.0', 'seq1\\tseq3\\t99.0', 'seq2\\tseq3\\t99.0']
+    """
+
+    names = sorted(seqs)
+    if seqtype is None:
+        seqtype = guess_seqtype([seqs[name] for name in names])
+    codes, scores = make_scoring(seqtype)
+    (gap_open, gap_extend) = GAP_PENALTIES[seqtype]
+    seq_codes = [codes[np.frombuffer(seqs[name], dtype=np.uint8)] for name in names]
+
+    kmers = None
+    if min_kmer_similarity is not None:
+        kmers = make_kmer_matrix(seq_codes, kmer_size or DEFAULT_KMER_SIZE[seqtype], scores.shape[0] - 1)
+    chunks = generate_pair_chunks(len(names), kmers, min_kmer_similarity or 0.0)
+
+    # align the chunks (on a pool of processes, keeping a few chunks in hand for each one):
+    if num_processes > 1:
+        pool = ProcessPoolExecutor(max_workers=num_processes, initializer=set_worker_alignment, initargs=(seq_codes, scores, gap_open, gap_extend, band))
+        pending = deque()
+        def aligned_chunks():
+            for first_seqs, second_seqs, skipped in chunks:
+                pending.append((first_seqs, second_seqs, skipped, pool.submit(align_pairs_in_worker, first_seqs, second_seqs)))
+                if len(pending) >= 4 * num_processes:
+                    first_seqs, second_seqs, skipped, future = pending.popleft()
+                    yield (first_seqs, second_seqs, skipped) + future.result()
+            while pending:
+                first_seqs, second_seqs, skipped, future = pending.popleft()
+                yield (first_seqs, second_seqs, skipped) + future.result()
+        results = aligned_chunks()
+    else:
+        set_worker_alignment(seq_codes, scores, gap_open, gap_extend, band)
+        results = ((first_seqs, second_seqs, skipped) + align_pairs_in_worker(first_seqs, second_seqs) for first_seqs, second_seqs, skipped in chunks)
+
+    # write out the percent identities, in order:
+    num_written = 0
+    num_skipped = 0
+    for first_seqs, second_seqs, skipped, identities, lengths in results:
+        outputfileObj.write("".join("%s\t%s\t%s\n" % (names[seq1], names[seq2], format_pc_id(pair_identities, length)) for seq1, seq2, pair_identities, length in zip(first_seqs.tolist(), second_seqs.tolist(), identities.tolist(), lengths.tolist())))
+        num_written += len(first_seqs)
+        num_skipped += skipped
+    if num_processes > 1:
+        pool.shutdown()
+
+    return num_written, num_skipped
+
+#====================================================================#
+
+# define a function to read the sequences from a fasta file:
+
+def read_seqs(input_fasta):
+    """returns a dictionary of {name: sequence}, with the name being the first word of the header line"""
+
+    seqs = {}
+    fileObj = open(input_fasta, "rb")
+    for name, seq in read_fasta_records(fileObj):
+        if name in seqs:
+            raise ValueError("%s has more than one sequence called %s" % (input_fasta, name))
+        seqs[name] = seq
+    fileObj.close()
+
+    return seqs
+
+#====================================================================#
+
+# compare the percent identities calculated here with those in an earlier output file (eg. from ggsearch):
+
+def compare_main(argv):
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(prog="%s compare" % sys.argv[0], description="calculate the percent identities for the pairs in an output file of calc_pc_id_between_seqs.pl (from ggsearch), and compare them")
+    parser.add_argument("input_fasta", help="input fasta file of the sequences")
+    parser.add_argument("reference_output", help="file with lines 'name1 name2 percent_identity' (separated by spaces or tabs)")
+    parser.add_argument("--seqtype", choices=["auto", "protein", "dna"], default="auto", help="whether the sequences are protein or DNA (default: guess from the letters)")
+    parser.add_argument("--band", type=int, default=DEFAULT_BAND, help="half-width of the band of diagonals to align first, or 0 for the whole matrix (default: %d)" % DEFAULT_BAND)
+    parser.add_argument("--tolerance", type=float, default=1.0, help="report pairs whose percent identities differ by more than this (default: 1.0)")
+    args = parser.parse_args(argv)
+    if os.path.exists(args.input_fasta) == False or os.path.exists(args.reference_output) == False:
+        parser.print_usage()
+        sys.exit(1)
+
+    seqs = read_seqs(args.input_fasta)
+    seqtype = guess_seqtype(list(seqs.values())) if args.seqtype == "auto" else args.seqtype
+    codes, scores = make_scoring(seqtype)
+    (gap_open, gap_extend) = GAP_PENALTIES[seqtype]
+    pairs = []
+    fileObj = open(args.reference_output, "r")
+    for line in fileObj:
+        temp = line.split()
+        if len(temp) == 3:
+            pairs.append((temp[0], temp[1], float(temp[2])))
+    fileObj.close()
+
+    start_time = time.perf_counter()
+    queries = [codes[np.frombuffer(seqs[name1], dtype=np.uint8)] for name1, name2, pc_id in pairs]
+    targets = [codes[np.frombuffer(seqs[name2], dtype=np.uint8)] for name1, name2, pc_id in pairs]
+    _, identities, lengths = align_pairs(queries, targets, scores, gap_open, gap_extend, args.band)
+    seconds = time.perf_counter() - start_time
+    differences = np.array([round(float(format_pc_id(pair_identities, length)) - pc_id, 1) for (name1, name2, pc_id), pair_identities, length in zip(pairs, identities.tolist(), lengths.tolist())])
+    # calc_pc_id_between_seqs.pl gives 0.0 for pairs that ggsearch found no alignment for (with E() < 10):
+    unaligned = np.array([pc_id == 0 for name1, name2, pc_id in pairs], dtype=bool)
+    differences[unaligned] = 0
+    print("%d pairs aligned in %.1f seconds (%.2f milliseconds per pair)" % (len(pairs), seconds, 1000 * seconds / max(1, len(pairs))))
+    print("%d pairs have the same percent identity, %d differ by up to %.1f, and %d by more (%d pairs with no ggsearch alignment are not compared)" % (np.sum((differences == 0) & ~unaligned), np.sum((differences != 0) & (np.abs(differences) <= args.tolerance)), args.tolerance, np.sum(np.abs(differences) > args.tolerance), np.sum(unaligned)))
+    for pair_num in np.flatnonzero(np.abs(differences) > args.tolerance).tolist():
+        (name1, name2, pc_id) = pairs[pair_num]
+        print("%s %s %.1f (here %s)" % (name1, name2, pc_id, format_pc_id(int(identities[pair_num]), int(lengths[pair_num]))))
+
+#====================================================================#
+
+def main():
+
+    # 'calc_pc_id_between_seqs.py compare ...' checks the percent identities against an earlier output file:
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        compare_main(sys.argv[2:])
+        return
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(description="calculate the percent identity between each pair of sequences in a fasta file, from their best global alignment", epilog="Run '%(prog)s compare -h' for checking the percent identities against an output file of calc_pc_id_between_seqs.pl.")
+    parser.add_argument("input_fasta", help="input fasta file of protein (or DNA) sequences")
+    parser.add_argument("output", help="output file, with lines 'name1<TAB>name2<TAB>percent_identity'")
+    parser.add_argument("--seqtype", choices=["auto", "protein", "dna"], default="auto", help="whether the sequences are protein or DNA (default: guess from the letters)")
+    parser.add_argument("--band", type=int, default=DEFAULT_BAND, help="half-width of the band of diagonals to align first, or 0 for the whole matrix (default: %d)" % DEFAULT_BAND)
+    parser.add_argument("--kmer-filter", type=float, help="skip (leave out) pairs that share less than this fraction of their distinct k-mers, eg. 0.05")
+    parser.add_argument("--kmer-size", type=int, help="k-mer length for --kmer-filter (default: %d for protein, %d for DNA)" % (DEFAULT_KMER_SIZE["protein"], DEFAULT_KMER_SIZE["dna"]))
+    parser.add_argument("--processes", type=int, default=1, help="number of processes to align the pairs with (default: 1)")
+    args = parser.parse_args()
+    if os.path.exists(args.input_fasta) == False:
+        parser.print_usage()
+        sys.exit(1)
+
+    seqs = read_seqs(args.input_fasta)
+    seqtype = None if args.seqtype == "auto" else args.seqtype
+    outputfileObj = open(args.output, "w")
+    num_written, num_skipped = calc_pc_id_between_seqs(seqs, outputfileObj, seqtype, args.band, args.kmer_filter, args.kmer_size, args.processes)
+    outputfileObj.close()
+    print("Wrote the percent identities of %d pairs of sequences to %s (%d pairs skipped by the k-mer filter)" % (num_written, args.output, num_skipped))
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,370 @@
+# Script to find the best-scoring paths through a directed acyclic graph, eg. of
+# exons or gene models where chaining them together scores the edges. Unlike
+# Dijkstra's algorithm (see dijkstra_example2.py), this is right for negative
+# scores too: the nodes are put in topological order, and the best score of each
+# node is worked out from its predecessors' in O(V+E).
+
+import sys
+import os
+import argparse
+import numpy as np
+from scipy.sparse import csr_matrix
+from sparse_graph import SparseGraph, reconstruct_paths
+
+#====================================================================#
+
+# the most bytes of (score, predecessor) rows to hold at once when finding paths from many sources:
+
+SCORES_MEMORY = 512 * 1024 * 1024
+
+# levels with fewer edges (times sources) than this are done in a plain loop, which is quicker than
+# NumPy for a few edges; long chain-like graphs (eg. genes in order along a contig) are mostly small levels:
+
+SMALL_LEVEL_EDGES = 64
+
+#====================================================================#
+
+# define a function to put the nodes of a DAG into topological levels:
+
+def find_topological_levels(matrix):
+    """returns the level of each node of a DAG (a CSR matrix of edges), where each node's
+    level is after the levels of all of its predecessors; raises ValueError if there is a cycle
+
+    This is Kahn's algorithm, taking all the nodes with no edges left coming into them
+    at once for each level.
+
+    >>> matrix = csr_matrix((np.ones(4), ([0, 0, 1, 3], [1, 2, 2, 0])), shape=(4, 4))
+    >>> find_topological_levels(matrix).tolist()
+    [1, 2, 3, 0]
+    >>> find_topological_levels(csr_matrix((np.ones(2), ([0, 1], [1, 0])), shape=(2, 2)))
+    Traceback (most recent call last):
+    ...
+    ValueError: the graph has a cycle, through 2 of its nodes
+    """
+
+    matrix = csr_matrix(matrix)
+    num_nodes = matrix.shape[0]
+    indptr = matrix.indptr.astype(np.int64)
+    in_degrees = np.bincount(matrix.indices, minlength=num_nodes)
+    levels = np.full(num_nodes, -1, dtype=np.int64)
+    frontier = np.flatnonzero(in_degrees == 0)
+    level = 0
+    num_done = 0
+    while len(frontier) > 0:
+        levels[frontier] = level
+        num_done += len(frontier)
+        # take away the edges out of the frontier, and find the nodes with none left coming in:
+        starts = indptr[frontier]
+        counts = indptr[frontier + 1] - starts
+        if counts.sum() < SMALL_LEVEL_EDGES:
+            next_frontier = []
+            for start, end in zip(starts.tolist(), (starts + counts).tolist()):
+                for target in matrix.indices[start:end].tolist():
+                    in_degrees[target] -= 1
+                    if in_degrees[target] == 0:
+                        next_frontier.append(target)
+            frontier = np.array(next_frontier, dtype=np.int64)
+        else:
+            which = np.repeat(np.arange(len(frontier)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            targets, num_edges = np.unique(matrix.indices[starts[which] + offsets], return_counts=True)
+            in_degrees[targets] -= num_edges
+            frontier = targets[in_degrees[targets] == 0]
+        level += 1
+    if num_done < num_nodes:
+        raise ValueError("the graph has a cycle, through %d of its nodes" % (num_nodes - num_done))
+
+    return levels
+
+#====================================================================#
+
+# the edges of a DAG, in an order for dynamic programming:
+
+class DagPaths:
+    """find best-scoring paths through a DAG given as a CSR matrix of edge scores
+
+    The edges are sorted by the level of their source node, then by their target, so
+    the edges out of each level are a block, and the edges into each target within it
+    are a run. Going through the levels in order, every node has its final score before
+    the edges out of it are used.
+
+    >>> graph = SparseGraph.from_edges([('a', 'b', 2), ('b', 'd', 2), ('a', 'c', -1), ('c', 'd', 6), ('a', 'd', 3)])
+    >>> dag = DagPaths(graph.matrix)
+    >>> a, d = graph.get_node_ids(['a', 'd'])
+    >>> [(score, graph.get_node_names(path)) for score, path in dag.best_paths([a], [d])]
+    [(5.0, ['a', 'c', 'd'])]
+    >>> [(score, graph.get_node_names(path)) for score, path in dag.best_paths([a], [d], maximize=False)]
+    [(3.0, ['a', 'd'])]
+    >>> [(score, graph.get_node_names(path)) for score, path in dag.k_best_paths(a, d, 5)]
+    [(5.0, ['a', 'c', 'd']), (4.0, ['a', 'b', 'd']), (3.0, ['a', 'd'])]
+    """
+
+    def __init__(self, matrix):
+        matrix = csr_matrix(matrix)
+        self.num_nodes = matrix.shape[0]
+        self.levels = find_topological_levels(matrix)
+        sources = np.repeat(np.arange(self.num_nodes, dtype=np.int64), np.diff(matrix.indptr))
+        targets = matrix.indices.astype(np.int64)
+        order = np.lexsort((targets, self.levels[sources]))
+        self.sources = sources[order]
+        self.targets = targets[order]
+        self.scores = matrix.data[order].astype(np.float64)
+        edge_levels = self.levels[self.sources]
+        num_levels = int(self.levels.max()) + 1 if self.num_nodes > 0 else 0
+        self.level_bounds = np.searchsorted(edge_levels, np.arange(num_levels + 1))
+        # where each run of edges into one target (within one level) starts:
+        if len(order) > 0:
+            self.run_starts = np.flatnonzero(np.concatenate(([True], (self.targets[1:] != self.targets[:-1]) | (edge_levels[1:] != edge_levels[:-1]))))
+        else:
+            self.run_starts = np.zeros(0, dtype=np.int64)
+
+    def iter_levels(self):
+        """yield (first edge, end edge, starts of the target runs relative to the first edge) for each level with edges out of it"""
+        for level in range(len(self.level_bounds) - 1):
+            start = self.level_bounds[level]
+            end = self.level_bounds[level + 1]
+            if start < end:
+                runs = self.run_starts[np.searchsorted(self.run_starts, start):np.searchsorted(self.run_starts, end)] - start
+                yield start, end, runs
+
+    def best_scores(self, source_ids, maximize=True):
+        """returns (scores, predecessors), each (number of sources, number of nodes), with the best
+        score of a path from each source to each node (-inf, or inf if minimizing, if there is none),
+        and the node before it on that path (-9999 for none, like scipy's dijkstra())"""
+        source_ids = np.asarray(source_ids, dtype=np.int64)
+        num_sources = len(source_ids)
+        edge_scores = self.scores if maximize else -self.scores
+        scores = np.full((num_sources, self.num_nodes), -np.inf)
+        scores[np.arange(num_sources), source_ids] = 0.0
+        predecessors = np.full((num_sources, self.num_nodes), -9999, dtype=np.int32)
+        for start, end, runs in self.iter_levels():
+            if (end - start) * num_sources < SMALL_LEVEL_EDGES:
+                # a few edges, so just go through them:
+                for row in range(num_sources):
+                    row_scores = scores[row]
+                    row_predecessors = predecessors[row]
+                    for source, target, edge_score in zip(self.sources[start:end].tolist(), self.targets[start:end].tolist(), edge_scores[start:end].tolist()):
+                        new_score = row_scores[source] + edge_score
+                        if new_score > row_scores[target]:
+                            row_scores[target] = new_score
+                            row_predecessors[target] = source
+                continue
+            new_scores = scores[:, self.sources[start:end]] + edge_scores[start:end]
+            # the best new score for each target, and the first edge that gives it:
+            best = np.maximum.reduceat(new_scores, runs, axis=1)
+            run_lengths = np.diff(np.append(runs, end - start))
+            is_best = new_scores == np.repeat(best, run_lengths, axis=1)
+            best_edges = np.minimum.reduceat(np.where(is_best, np.arange(end - start), end - start), runs, axis=1)
+            targets = self.targets[start + runs]
+            improved = best > scores[:, targets]
+            scores[:, targets] = np.where(improved, best, scores[:, targets])
+            predecessors[:, targets] = np.where(improved, self.sources[start + best_edges], predecessors[:, targets])
+        if not maximize:
+            scores = -scores
+        return scores, predecessors
+
+    def best_paths(self, source_ids, sink_ids, maximize=True):
+        """returns a list of (score, path) for each pair of source_ids[i], sink_ids[i], with the path
+        a list of node ids (empty if the sink can't be reached), doing one pass for each batch of sources"""
+        source_ids = np.asarray(source_ids, dtype=np.int64)
+        sink_ids = np.asarray(sink_ids, dtype=np.int64)
+        results = [None] * len(source_ids)
+        unique_sources, pair_sources = np.unique(source_ids, return_inverse=True)
+        pair_sources = pair_sources.ravel()
+        batch_size = max(1, SCORES_MEMORY // (12 * max(self.num_nodes, 1)))
+        for batch_start in range(0, len(unique_sources), batch_size):
+            batch = unique_sources[batch_start:batch_start + batch_size]
+            scores, predecessors = self.best_scores(batch, maximize)
+            pairs = np.flatnonzero((pair_sources >= batch_start) & (pair_sources < batch_start + len(batch)))
+            rows = pair_sources[pairs] - batch_start
+            pair_scores = scores[rows, sink_ids[pairs]].tolist()
+            indptr, nodes = reconstruct_paths(predecessors, batch, rows, sink_ids[pairs])
+            nodes = nodes.tolist()
+            for i, score, start, end in zip(pairs.tolist(), pair_scores, indptr[:-1].tolist(), indptr[1:].tolist()):
+                results[i] = (score, nodes[start:end])
+        return results
+
+    def k_best_scores(self, source_id, k, maximize=True):
+        """returns (scores, predecessors, predecessor ranks), each (number of nodes, k): the k best
+        scores of paths from the source to each node, best first, and for each the node before it and
+        which of that node's paths it goes on from
+
+        Each node keeps its k best (score, predecessor, rank) entries. For each level, the
+        new entries from the edges out of it are pooled with the entries their targets
+        already have, sorted by target and score, and the first k of each target kept.
+        """
+        edge_scores = self.scores if maximize else -self.scores
+        scores = np.full((self.num_nodes, k), -np.inf)
+        scores[source_id, 0] = 0.0
+        predecessors = np.full((self.num_nodes, k), -9999, dtype=np.int64)
+        predecessor_ranks = np.full((self.num_nodes, k), -1, dtype=np.int64)
+        for start, end, runs in self.iter_levels():
+            sources = self.sources[start:end]
+            targets = self.targets[start + runs]
+            # the new entries, and the old ones of the same targets:
+            pool_targets = np.concatenate((np.repeat(self.targets[start:end], k), np.repeat(targets, k)))
+            pool_scores = np.concatenate(((scores[sources] + edge_scores[start:end, None]).ravel(), scores[targets].ravel()))
+            pool_predecessors = np.concatenate((np.repeat(sources, k), predecessors[targets].ravel()))
+            pool_ranks = np.concatenate((np.tile(np.arange(k), end - start), predecessor_ranks[targets].ravel()))
+            keep = pool_scores > -np.inf
+            pool_targets = pool_targets[keep]
+            pool_scores = pool_scores[keep]
+            pool_predecessors = pool_predecessors[keep]
+            pool_ranks = pool_ranks[keep]
+            # keep the k best of each target:
+            order = np.lexsort((pool_ranks, pool_predecessors, -pool_scores, pool_targets))
+            pool_targets = pool_targets[order]
+            group_starts = np.flatnonzero(np.concatenate(([True], pool_targets[1:] != pool_targets[:-1]))) if len(order) > 0 else np.zeros(0, dtype=np.int64)
+            ranks = np.arange(len(order)) - np.repeat(group_starts, np.diff(np.append(group_starts, len(order))))
+            best = order[ranks < k]
+            scores[targets] = -np.inf
+            predecessors[targets] = -9999
+            predecessor_ranks[targets] = -1
+            scores[pool_targets[ranks < k], ranks[ranks < k]] = pool_scores[best]
+            predecessors[pool_targets[ranks < k], ranks[ranks < k]] = pool_predecessors[best]
+            predecessor_ranks[pool_targets[ranks < k], ranks[ranks < k]] = pool_ranks[best]
+        if not maximize:
+            scores = -scores
+        return scores, predecessors, predecessor_ranks
+
+    def k_best_paths(self, source_id, sink_id, k, maximize=True):
+        """returns up to k (score, path) tuples for the best paths from the source to the sink, best first"""
+        scores, predecessors, predecessor_ranks = self.k_best_scores(source_id, k, maximize)
+        found = np.flatnonzero(np.isfinite(scores[sink_id]))
+        paths = [[sink_id] for _ in found]
+        nodes = np.full(len(found), sink_id, dtype=np.int64)
+        ranks = found
+        active = np.arange(len(found))
+        while len(active) > 0:
+            previous = predecessors[nodes, ranks]
+            previous_ranks = predecessor_ranks[nodes, ranks]
+            keep = previous >= 0
+            active = active[keep]
+            nodes = previous[keep]
+            ranks = previous_ranks[keep]
+            for i, node in zip(active.tolist(), nodes.tolist()):
+                paths[i].append(node)
+        return [(float(scores[sink_id, rank]), path[::-1]) for rank, path in zip(found.tolist(), paths)]
+
+#====================================================================#
+
+# define a function to list every path between two nodes of a small DAG, to check the answers against:
+
+def brute_force_paths(matrix, source_id, sink_id):
+    """returns (score, path) for every path from the source to the sink, best first
+
+    >>> rng = np.random.default_rng(3)
+    >>> all_agree = True
+    >>> for trial in range(200):
+    ...     num_nodes = int(rng.integers(2, 9))
+    ...     pairs = [(i, j) for i in range(num_nodes) for j in range(i + 1, num_nodes) if rng.random() < 0.5]
+    ...     rows = [i for i, j in pairs]
+    ...     columns = [j for i, j in pairs]
+    ...     matrix = csr_matrix((rng.integers(-10, 10, len(pairs)).astype(float), (rows, columns)), shape=(num_nodes, num_nodes))
+    ...     matrix.data[matrix.data == 0] = 0.5
+    ...     dag = DagPaths(matrix)
+    ...     expected = brute_force_paths(matrix, 0, num_nodes - 1)
+    ...     best = dag.best_paths([0], [num_nodes - 1])[0]
+    ...     k_best = dag.k_best_paths(0, num_nodes - 1, 4)
+    ...     if expected:
+    ...         all_agree &= best[0] == expected[0][0] and best[1] in [path for score, path in expected if score == best[0]]
+    ...     else:
+    ...         all_agree &= best == (-np.inf, [])
+    ...     all_agree &= [score for score, path in k_best] == [score for score, path in expected[:4]]
+    ...     all_agree &= all((score, path) in expected for score, path in k_best)
+    >>> all_agree
+    True
+
+    Layers of 9 nodes with every edge between neighbouring layers have levels of 81 edges,
+    more than SMALL_LEVEL_EDGES, so these go through the NumPy code for each level:
+
+    >>> all_agree = True
+    >>> for trial in range(5):
+    ...     layers = [[0]] + [list(range(1 + 9 * layer, 10 + 9 * layer)) for layer in range(3)] + [[28]]
+    ...     pairs = [(i, j) for layer in range(4) for i in layers[layer] for j in layers[layer + 1]]
+    ...     order = rng.permutation(29)
+    ...     rows = [order[i] for i, j in pairs]
+    ...     columns = [order[j] for i, j in pairs]
+    ...     matrix = csr_matrix((rng.integers(-50, 50, len(pairs)) + 0.5, (rows, columns)), shape=(29, 29))
+    ...     dag = DagPaths(matrix)
+    ...     expected = brute_force_paths(matrix, order[0], order[28])
+    ...     best = dag.best_paths([order[0]], [order[28]])[0]
+    ...     all_agree &= best[0] == expected[0][0] and best[1] in [path for score, path in expected if score == best[0]]
+    ...     k_best = dag.k_best_paths(order[0], order[28], 4)
+    ...     all_agree &= [score for score, path in k_best] == [score for score, path in expected[:4]]
+    ...     all_agree &= all((score, path) in expected for score, path in k_best)
+    >>> len(expected), int(dag.level_bounds[2] - dag.level_bounds[1]) > SMALL_LEVEL_EDGES, all_agree
+    (729, True, True)
+    """
+
+    matrix = csr_matrix(matrix)
+    paths = []
+    stack = [(source_id, 0.0, [source_id])]
+    while stack:
+        node, score, path = stack.pop()
+        if node == sink_id:
+            paths.append((score, path))
+            continue
+        for i in range(matrix.indptr[node], matrix.indptr[node + 1]):
+            stack.append((int(matrix.indices[i]), score + float(matrix.data[i]), path + [int(matrix.indices[i])]))
+    paths.sort(key=lambda pair: -pair[0])
+
+    return paths
+
+#====================================================================#
+
+def main():
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(description="find the best-scoring paths between pairs of nodes of a directed acyclic graph")
+    parser.add_argument("edge_file", help="tab-separated 'node1 node2 score' lines, or an .npy array of (node1, node2, score) rows of node numbers")
+    parser.add_argument("pairs_file", help="tab-separated 'source sink' lines")
+    parser.add_argument("output_file", help="output file of tab-separated 'source sink rank score path' lines (none for pairs with no path)")
+    parser.add_argument("--k", type=int, default=1, help="number of best paths to find for each pair (default: 1)")
+    parser.add_argument("--minimize", action="store_true", help="find the lowest-scoring paths instead of the highest")
+    args = parser.parse_args()
+    if os.path.exists(args.edge_file) == False or os.path.exists(args.pairs_file) == False or args.k < 1:
+        parser.print_usage()
+        sys.exit(1)
+
+    # read in the graph:
+    if args.edge_file.endswith(".npy"):
+        graph = SparseGraph.from_npy(args.edge_file, directed=True, keep_max=not args.minimize)
+    else:
+        graph = SparseGraph.from_tsv(args.edge_file, directed=True, keep_max=not args.minimize)
+    dag = DagPaths(graph.matrix)
+    print("Read a DAG of",graph.num_nodes,"nodes and",graph.matrix.nnz,"edges in",len(dag.level_bounds) - 1,"levels from",args.edge_file)
+
+    # read in the pairs of nodes:
+    sources = []
+    sinks = []
+    fileObj = open(args.pairs_file, "r")
+    for line in fileObj:
+        temp = line.split()
+        if len(temp) >= 2:
+            sources.append(temp[0])
+            sinks.append(temp[1])
+    fileObj.close()
+    source_ids = graph.get_node_ids(sources)
+    sink_ids = graph.get_node_ids(sinks)
+
+    # find the best paths, and write them out:
+    outputfileObj = open(args.output_file, "w")
+    if args.k == 1:
+        results = [[result] if result[1] else [] for result in dag.best_paths(source_ids, sink_ids, not args.minimize)]
+    else:
+        results = [dag.k_best_paths(source_id, sink_id, args.k, not args.minimize) for source_id, sink_id in zip(source_ids.tolist(), sink_ids.tolist())]
+    for source, sink, pair_results in zip(sources, sinks, results):
+        for rank, (score, path) in enumerate(pair_results):
+            outputfileObj.write("%s\t%s\t%d\t%s\t%s\n" % (source, sink, rank + 1, score, ",".join(graph.get_node_names(path))))
+    outputfileObj.close()
+    print("Wrote the best paths for",len(sources),"pairs to",args.output_file)
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
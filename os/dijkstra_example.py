@@ -1,48 +1,22 @@
-# define function 'xrange'
+from sparse_graph import SparseGraph, reconstruct_paths
 
-def xrange(x):
+# the edges between the genes, as (gene1, gene2, weight):
+edges = [('g1', 'g4', 12), ('g1', 'g3', 23), ('g2', 'g3', 5), ('g2', 'g7', 16), ('g3', 'g5', 17),
+         ('g3', 'g4', 9), ('g4', 'g5', 18), ('g4', 'g6', 25), ('g5', 'g6', 7), ('g5', 'g7', 22)]
 
-    return iter(range(x))
+# make a sparse matrix straight from the edges (each edge goes both ways)
+graph = SparseGraph.from_edges(edges, directed=False)
 
-genes = ['g1', 'g2', 'g3', 'g4', 'g5', 'g6', 'g7']
-Matrix = [[0 for x in xrange(7)] for x in xrange(7)]
-Matrix[1-1][4-1] = 12
-Matrix[4-1][1-1] = 12
-Matrix[1-1][3-1] = 23
-Matrix[3-1][1-1] = 23
-Matrix[2-1][3-1] = 5
-Matrix[3-1][2-1] = 5
-Matrix[2-1][7-1] = 16
-Matrix[7-1][2-1] = 16
-Matrix[3-1][5-1] = 17
-Matrix[5-1][3-1] = 17
-Matrix[3-1][4-1] = 9
-Matrix[4-1][3-1] = 9
-Matrix[4-1][5-1] = 18
-Matrix[5-1][4-1] = 18
-Matrix[4-1][6-1] = 25
-Matrix[6-1][4-1] = 25
-Matrix[5-1][6-1] = 7
-Matrix[6-1][5-1] = 7
-Matrix[5-1][7-1] = 22
-Matrix[7-1][5-1] = 22
-
-# make a sparse matrix
-from scipy.sparse import csr_matrix
-Matrix_sparse = csr_matrix(Matrix)
-
-# run Dijkstra's algorithm, starting at index 0
+# run Dijkstra's algorithm, starting at g1
 from scipy.sparse.csgraph import dijkstra
-distances, predecessors = dijkstra(Matrix_sparse, indices=0, return_predecessors=True)
+start = graph.node_ids['g1']
+distances, predecessors = dijkstra(graph.matrix, indices=start, return_predecessors=True)
 
 # print out the distance to g7
-print("distance to g7=",distances[6])
+end = graph.node_ids['g7']
+print("distance to g7=",distances[end])
 
 # print out the path
-path = []
-i = 6
-while i != 0:
-    path.append(genes[i])
-    i = predecessors[i]
-path.append(genes[0])
-print("path=",path[::-1])
+indptr, nodes = reconstruct_paths(predecessors, [start], [0], [end])
+path = graph.get_node_names(nodes.tolist())
+print("path=",path)
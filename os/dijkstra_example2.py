@@ -1,51 +1,28 @@
-# define function 'xrange'
+from sparse_graph import SparseGraph
+from dag_paths import DagPaths
 
-def xrange(x):
-   
-    return iter(range(x))
+# the edges between the genes, as (gene1, gene2, score); the graph is directed and acyclic:
+edges = [('g0', 'g1', 105), ('g0', 'g2', 110), ('g1', 'g3', 132), ('g1', 'g4', 126), ('g3', 'g5', 150),
+         ('g4', 'g6', 128), ('g4', 'g7', 166), ('g4', 'g8', 132), ('g4', 'g9', 118), ('g5', 'g6', 128),
+         ('g5', 'g7', 166), ('g5', 'g8', 132), ('g5', 'g9', 118), ('g6', 'g10', 196), ('g7', 'g8', 132),
+         ('g8', 'g9', 118), ('g9', 'g10', 196), ('g2', 'g4', 126), ('g2', 'g5', 150), ('g10', 'g11', 100)]
 
-genes = ['g0', 'g1', 'g2', 'g3', 'g4', 'g5', 'g6', 'g7', 'g8', 'g9', 'g10', 'g11']
+# make a sparse matrix straight from the edges
+graph = SparseGraph.from_edges(edges, directed=True, keep_max=True)
 
-# create a list containing 12 lists initialised to 0
-Matrix = [[0 for x in xrange(12)] for x in xrange(12)]
-Matrix[0][1] = -105
-Matrix[0][2] = -110
-Matrix[1][3] = -132
-Matrix[1][4] = -126
-Matrix[3][5] = -150
-Matrix[4][6] = -128
-Matrix[4][7] = -166
-Matrix[4][8] = -132
-Matrix[4][9] = -118
-Matrix[5][6] = -128
-Matrix[5][7] = -166
-Matrix[5][8] = -132
-Matrix[5][9] = -118
-Matrix[6][10] = -196
-Matrix[7][8] = -132
-Matrix[8][9] = -118
-Matrix[9][10] = -196
-Matrix[2][4] = -126
-Matrix[2][5] = -150
-Matrix[10][11] = -100
+# find the highest-scoring path from g0 to g11, going through the genes in topological order
+# (Dijkstra's algorithm isn't right for this in general, as the scores would have to be used as negative weights)
+dag = DagPaths(graph.matrix)
+start = graph.node_ids['g0']
+end = graph.node_ids['g11']
+[(score, path)] = dag.best_paths([start], [end])
 
-# make a sparse matrix
-from scipy.sparse import csr_matrix
-Matrix_sparse = csr_matrix(Matrix)
-
-# run Dijkstra's algorithm, starting at index 0
-from scipy.sparse.csgraph import dijkstra
-distances, predecessors = dijkstra(Matrix_sparse, indices=0, return_predecessors=True, directed=True)
-
-# print out the distance to g11
-print("distance to g11=",distances[11])
+# print out the score of the path to g11
+print("best score to g11=",score)
 
 # print out the path
-path = []
-i = 11
-while i != 0:
-    path.append(genes[i])
-    i = predecessors[i]
-path.append(genes[0])
-print("path=",path[::-1])
+print("path=",graph.get_node_names(path))
 
+# print out the next best paths, eg. for alternative gene models
+for score, path in dag.k_best_paths(start, end, 3)[1:]:
+    print("alternative path=",graph.get_node_names(path),"score=",score)
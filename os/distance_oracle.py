@@ -0,0 +1,361 @@
+# Script to answer many shortest-path queries on a big graph quickly. Distances from
+# a few landmark nodes are worked out once, and give lower bounds on the distance
+# between any two nodes (by the triangle inequality), which guide an A* search
+# ("ALT") for exact point-to-point queries. Sources that come up again and again get
+# a full Dijkstra run, kept in a least-recently-used cache.
+
+import sys
+import os
+import time
+import heapq
+import argparse
+from collections import OrderedDict
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from sparse_graph import SparseGraph, build_csr_graph
+
+#====================================================================#
+
+DEFAULT_NUM_LANDMARKS = 16
+
+DEFAULT_CACHE_SIZE = 32
+
+# a source is given a full Dijkstra run (and cached) once it has been asked for this many times:
+
+FULL_SEARCH_AFTER = 2
+
+# A* runs in Python, so once it has settled more than the number of nodes divided by this (or
+# MIN_ASTAR_SETTLED, if more) it gives way to scipy's Dijkstra, limited by the landmark upper bound:
+
+ASTAR_SETTLED_DIVISOR = 100
+
+MIN_ASTAR_SETTLED = 2000
+
+# the A* bounds are worked out for blocks of 2**BOUND_BLOCK_BITS node numbers at a time:
+
+BOUND_BLOCK_BITS = 10
+
+#====================================================================#
+
+# define a function to choose landmarks and find the distances to and from them:
+
+def find_landmark_distances(matrix, num_landmarks, directed, seed=1):
+    """returns (landmarks, distances from the landmarks, distances to the landmarks), with the
+    distances as (number of nodes, number of landmarks) arrays; for an undirected graph the
+    distances to the landmarks are the same array as the distances from them
+
+    The landmarks are spread out by picking each one as the node furthest from the
+    landmarks so far (among the nodes they can reach), starting at a random node.
+    Each new landmark then also starts in any part of the graph not reached yet.
+    """
+
+    num_nodes = matrix.shape[0]
+    transposed = matrix.T.tocsr() if directed else None
+    rng = np.random.default_rng(seed)
+    landmarks = []
+    from_columns = []
+    to_columns = []
+    nearest = np.full(num_nodes, np.inf) # the distance from each node to its nearest landmark so far
+    for _ in range(min(num_landmarks, num_nodes)):
+        if not landmarks:
+            landmark = int(rng.integers(num_nodes))
+        elif np.isinf(nearest).any():
+            landmark = int(rng.choice(np.flatnonzero(np.isinf(nearest)))) # a part of the graph with no landmark yet
+        else:
+            landmark = int(np.argmax(nearest))
+        landmarks.append(landmark)
+        from_distances = dijkstra(matrix, indices=landmark)
+        from_columns.append(from_distances)
+        if directed:
+            to_columns.append(dijkstra(transposed, indices=landmark))
+        nearest = np.minimum(nearest, from_distances)
+        nearest[landmarks] = 0.0
+    from_landmarks = np.ascontiguousarray(np.column_stack(from_columns))
+    to_landmarks = np.ascontiguousarray(np.column_stack(to_columns)) if directed else from_landmarks
+
+    return np.array(landmarks, dtype=np.int64), from_landmarks, to_landmarks
+
+#====================================================================#
+
+# define a function to follow one path back through a row of Dijkstra predecessors:
+
+def follow_path(predecessors, source_id, target_id):
+    """returns the node ids on the path from the source to the target (empty if there isn't one)
+
+    For a single path, stepping back one node at a time is quicker than sparse_graph's
+    reconstruct_paths(), which is made for following many paths together.
+
+    >>> follow_path(np.array([-9999, 0, 1, 2, -9999]), 0, 3), follow_path(np.array([-9999, 0, 1, 2, -9999]), 0, 4)
+    ([0, 1, 2, 3], [])
+    """
+
+    path = [target_id]
+    while path[-1] != source_id:
+        previous = int(predecessors[path[-1]])
+        if previous < 0:
+            return []
+        path.append(previous)
+    return path[::-1]
+
+#====================================================================#
+
+# answers shortest-path queries with landmarks, A* and a cache of full Dijkstra runs:
+
+class DistanceOracle:
+    """exact shortest paths between pairs of nodes of a SparseGraph (with non-negative weights)
+
+    >>> graph = SparseGraph.from_edges([('a', 'b', 1), ('b', 'c', 2), ('a', 'c', 4), ('c', 'd', 1), ('e', 'f', 1)], directed=False)
+    >>> oracle = DistanceOracle(graph, num_landmarks=2, cache_size=1)
+    >>> oracle.shortest_path('a', 'd'), oracle.shortest_path('d', 'e')
+    ((4.0, ['a', 'b', 'c', 'd']), (inf, []))
+    >>> oracle.shortest_path('a', 'c'), oracle.shortest_path('a', 'b')
+    ((3.0, ['a', 'b', 'c']), (1.0, ['a', 'b']))
+    >>> oracle.stats['astar_queries'], oracle.stats['full_searches'], oracle.stats['cache_hits']
+    (2, 1, 1)
+    """
+
+    def __init__(self, graph, num_landmarks=DEFAULT_NUM_LANDMARKS, cache_size=DEFAULT_CACHE_SIZE, directed=None):
+        self.graph = graph
+        self.matrix = graph.matrix
+        if directed is None:
+            directed = (self.matrix != self.matrix.T).nnz > 0
+        self.directed = directed
+        self.landmarks, self.from_landmarks, self.to_landmarks = find_landmark_distances(self.matrix, num_landmarks, directed)
+        self.cache_size = cache_size
+        self.cache = OrderedDict() # source id -> (distances, predecessors), least recently used first
+        self.source_counts = {}
+        self.stats = {"queries": 0, "cache_hits": 0, "full_searches": 0, "astar_queries": 0, "limited_searches": 0, "nodes_settled": 0}
+
+    def memory_bytes(self):
+        """the bytes used by the landmark distances and the cached Dijkstra results"""
+        landmark_bytes = self.from_landmarks.nbytes + (self.to_landmarks.nbytes if self.directed else 0)
+        cache_bytes = sum(distances.nbytes + predecessors.nbytes for distances, predecessors in self.cache.values())
+        return landmark_bytes, cache_bytes
+
+    def lower_bounds(self, node_ids, target_id):
+        """lower bounds on the distances from some nodes to the target (inf if the target can't be reached from them)"""
+        with np.errstate(invalid="ignore"):
+            bounds = self.from_landmarks[target_id] - self.from_landmarks[node_ids] # d(L,t) - d(L,v) <= d(v,t)
+            if self.directed:
+                bounds = np.concatenate((bounds, self.to_landmarks[node_ids] - self.to_landmarks[target_id]), axis=1) # d(v,L) - d(t,L) <= d(v,t)
+            else:
+                bounds = np.abs(bounds)
+            bounds = np.fmax.reduce(bounds, axis=1) # nan where both distances are inf, which tells us nothing
+        bounds[np.isnan(bounds)] = 0.0
+        return np.maximum(bounds, 0.0)
+
+    def full_search(self, source_id):
+        """the (distances, predecessors) of a full Dijkstra run from the source, from the cache if it's there"""
+        if source_id in self.cache:
+            self.cache.move_to_end(source_id)
+            self.stats["cache_hits"] += 1
+            return self.cache[source_id]
+        distances, predecessors = dijkstra(self.matrix, indices=source_id, return_predecessors=True)
+        self.stats["full_searches"] += 1
+        if self.cache_size > 0:
+            self.cache[source_id] = (distances, predecessors)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return distances, predecessors
+
+    def upper_bound(self, source_id, target_id):
+        """an upper bound on the distance from the source to the target, through the best landmark (inf if none is on the way)"""
+        return float(np.min(self.to_landmarks[source_id] + self.from_landmarks[target_id])) # d(s,L) + d(L,t) >= d(s,t)
+
+    def astar(self, source_id, target_id, max_settled=None):
+        """returns (distance, path of node ids) from an A* search guided by the landmark bounds,
+        or None if it has to settle more than max_settled nodes"""
+        indptr = self.matrix.indptr
+        indices = self.matrix.indices
+        data = self.matrix.data
+        if max_settled is None:
+            max_settled = self.matrix.shape[0]
+
+        # the bounds are worked out for a block of node numbers at a time, as the search reaches them:
+        bounds = np.empty(self.matrix.shape[0])
+        done_blocks = bytearray((self.matrix.shape[0] >> BOUND_BLOCK_BITS) + 1)
+        block = source_id >> BOUND_BLOCK_BITS
+        bounds[block << BOUND_BLOCK_BITS:(block + 1) << BOUND_BLOCK_BITS] = self.lower_bounds(slice(block << BOUND_BLOCK_BITS, (block + 1) << BOUND_BLOCK_BITS), target_id)
+        done_blocks[block] = 1
+
+        best = {source_id: 0.0}
+        parents = {source_id: -1}
+        settled = set()
+        heap = [(float(bounds[source_id]), 0.0, source_id)]
+        found = False
+        while heap:
+            estimate, distance, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            if node == target_id:
+                found = True
+                break
+            settled.add(node)
+            if len(settled) > max_settled:
+                self.stats["nodes_settled"] += len(settled)
+                return None
+            start = indptr[node]
+            end = indptr[node + 1]
+            for neighbour, weight in zip(indices[start:end].tolist(), data[start:end].tolist()):
+                new_distance = distance + weight
+                if new_distance < best.get(neighbour, np.inf):
+                    block = neighbour >> BOUND_BLOCK_BITS
+                    if not done_blocks[block]:
+                        bounds[block << BOUND_BLOCK_BITS:(block + 1) << BOUND_BLOCK_BITS] = self.lower_bounds(slice(block << BOUND_BLOCK_BITS, (block + 1) << BOUND_BLOCK_BITS), target_id)
+                        done_blocks[block] = 1
+                    bound = bounds[neighbour]
+                    if bound < np.inf:
+                        best[neighbour] = new_distance
+                        parents[neighbour] = node
+                        heapq.heappush(heap, (new_distance + bound, new_distance, neighbour))
+        self.stats["nodes_settled"] += len(settled)
+        if not found:
+            return np.inf, []
+        path = [target_id]
+        while parents[path[-1]] >= 0:
+            path.append(parents[path[-1]])
+        return best[target_id], path[::-1]
+
+    def shortest_path_ids(self, source_id, target_id):
+        """returns (distance, path of node ids) between two nodes, from the cache, a full search or A*"""
+        self.stats["queries"] += 1
+        count = self.source_counts.get(source_id, 0) + 1
+        self.source_counts[source_id] = count
+        if source_id in self.cache or (count >= FULL_SEARCH_AFTER and self.cache_size > 0):
+            distances, predecessors = self.full_search(source_id)
+            return float(distances[target_id]), follow_path(predecessors, source_id, target_id)
+        self.stats["astar_queries"] += 1
+        result = self.astar(source_id, target_id, max(MIN_ASTAR_SETTLED, self.matrix.shape[0] // ASTAR_SETTLED_DIVISOR))
+        if result is not None:
+            return result
+
+        # a long way to go: scipy's Dijkstra is quicker, and needn't go beyond the landmark upper bound:
+        self.stats["limited_searches"] += 1
+        limit = self.upper_bound(source_id, target_id) # inf if no landmark is on the way, which doesn't mean there's no way
+        distances, predecessors = dijkstra(self.matrix, indices=source_id, return_predecessors=True, limit=limit * (1 + 1e-9) + 1e-12)
+        return float(distances[target_id]), follow_path(predecessors, source_id, target_id)
+
+    def shortest_path(self, source, target):
+        """returns (distance, path) between two nodes, given by name"""
+        source_id, target_id = self.graph.get_node_ids([source, target]).tolist()
+        distance, path = self.shortest_path_ids(source_id, target_id)
+        return distance, self.graph.get_node_names(path)
+
+#====================================================================#
+
+# define a function to answer a log of queries, timing each one:
+
+def replay_queries(oracle, queries, outputfileObj=None, compare=False):
+    """answer (source, target) queries in order, and print the latency, cache hit rate and memory used;
+    if compare, also answer each one with a plain scipy dijkstra() run and check the distances agree"""
+
+    latencies = []
+    plain_seconds = 0.0
+    for source, target in queries:
+        start_time = time.perf_counter()
+        distance, path = oracle.shortest_path(source, target)
+        latencies.append(time.perf_counter() - start_time)
+        if outputfileObj is not None:
+            outputfileObj.write("%s\t%s\t%s\t%s\n" % (source, target, distance, ",".join(path)))
+        if compare:
+            source_id, target_id = oracle.graph.get_node_ids([source, target]).tolist()
+            start_time = time.perf_counter()
+            plain_distance = dijkstra(oracle.matrix, indices=source_id)[target_id]
+            plain_seconds += time.perf_counter() - start_time
+            assert plain_distance == distance or abs(plain_distance - distance) <= 1e-9 * max(1.0, abs(distance)), (source, target, distance, plain_distance)
+
+    latencies = np.array(latencies) * 1000
+    stats = oracle.stats
+    landmark_bytes, cache_bytes = oracle.memory_bytes()
+    print("%d queries: mean %.2f ms, median %.2f ms, 95th percentile %.2f ms, max %.2f ms" % (len(latencies), latencies.mean(), np.median(latencies), np.percentile(latencies, 95), latencies.max()))
+    print("cache hits %d (%.1f%%), full Dijkstra runs %d, A* queries %d settling %.0f nodes on average, %d of them finished by a limited Dijkstra" % (stats["cache_hits"], 100.0 * stats["cache_hits"] / max(1, stats["queries"]), stats["full_searches"], stats["astar_queries"], stats["nodes_settled"] / max(1, stats["astar_queries"]), stats["limited_searches"]))
+    print("memory: landmark distances %.1f MB, cache %.1f MB" % (landmark_bytes / 2**20, cache_bytes / 2**20))
+    if compare:
+        print("plain Dijkstra for every query: %.1f ms on average, %.1f s in total (against %.1f s)" % (1000 * plain_seconds / max(1, len(latencies)), plain_seconds, latencies.sum() / 1000))
+
+    return latencies
+
+#====================================================================#
+
+# time a random graph with a skewed log of queries (some sources come up much more often than others):
+
+def benchmark_main(argv):
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(prog="%s benchmark" % sys.argv[0], description="time the oracle on a random graph with a skewed query log")
+    parser.add_argument("--nodes", type=int, default=200000, help="number of nodes (default: 200000)")
+    parser.add_argument("--edges", type=int, default=1000000, help="number of edges (default: 1000000)")
+    parser.add_argument("--queries", type=int, default=500, help="number of queries (default: 500)")
+    parser.add_argument("--landmarks", type=int, default=DEFAULT_NUM_LANDMARKS, help="number of landmarks (default: %d)" % DEFAULT_NUM_LANDMARKS)
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="number of full Dijkstra results to cache (default: %d)" % DEFAULT_CACHE_SIZE)
+    args = parser.parse_args(argv)
+
+    # a graph of nodes along a line, each joined to a few nearby nodes, like genes along chromosomes:
+    rng = np.random.default_rng(1)
+    sources = rng.integers(0, args.nodes, args.edges)
+    targets = np.clip(sources + rng.integers(-50, 50, args.edges), 0, args.nodes - 1)
+    weights = rng.random(args.edges) * 10
+    graph = SparseGraph(build_csr_graph(sources, targets, weights, args.nodes, directed=False))
+    start_time = time.time()
+    oracle = DistanceOracle(graph, args.landmarks, args.cache_size, directed=False)
+    print("Found the distances from %d landmarks in %.1f s" % (args.landmarks, time.time() - start_time))
+
+    # the sources follow a Zipf distribution, so a few come up again and again:
+    query_sources = (rng.zipf(1.3, args.queries) * 7919) % args.nodes
+    query_targets = rng.integers(0, args.nodes, args.queries)
+    replay_queries(oracle, [(str(source), str(target)) for source, target in zip(query_sources.tolist(), query_targets.tolist())], compare=True)
+
+#====================================================================#
+
+def main():
+
+    # 'distance_oracle.py benchmark ...' times a random graph:
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark_main(sys.argv[2:])
+        return
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(description="answer a log of shortest-path queries on a graph, using landmarks, A* and a cache", epilog="Run '%(prog)s benchmark -h' for timing a random graph.")
+    parser.add_argument("edge_file", help="tab-separated 'node1 node2 [weight]' lines, or an .npy array of (node1, node2[, weight]) rows of node numbers")
+    parser.add_argument("query_log", help="tab-separated 'source target' lines, in the order they were asked")
+    parser.add_argument("output_file", help="output file of tab-separated 'source target distance path' lines")
+    parser.add_argument("--directed", action="store_true", help="the edges only go from node1 to node2")
+    parser.add_argument("--landmarks", type=int, default=DEFAULT_NUM_LANDMARKS, help="number of landmarks (default: %d)" % DEFAULT_NUM_LANDMARKS)
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="number of full Dijkstra results to cache (default: %d)" % DEFAULT_CACHE_SIZE)
+    parser.add_argument("--compare", action="store_true", help="also run a plain Dijkstra for each query, and check the distances agree")
+    args = parser.parse_args()
+    if os.path.exists(args.edge_file) == False or os.path.exists(args.query_log) == False or args.landmarks < 1 or args.cache_size < 0:
+        parser.print_usage()
+        sys.exit(1)
+
+    # read in the graph, and find the distances from the landmarks:
+    if args.edge_file.endswith(".npy"):
+        graph = SparseGraph.from_npy(args.edge_file, args.directed)
+    else:
+        graph = SparseGraph.from_tsv(args.edge_file, args.directed)
+    start_time = time.time()
+    oracle = DistanceOracle(graph, args.landmarks, args.cache_size, args.directed)
+    print("Found the distances from %d landmarks in %.1f s" % (len(oracle.landmarks), time.time() - start_time))
+
+    # read in the query log:
+    queries = []
+    fileObj = open(args.query_log, "r")
+    for line in fileObj:
+        temp = line.split()
+        if len(temp) >= 2:
+            queries.append((temp[0], temp[1]))
+    fileObj.close()
+
+    # answer the queries in order, and write out the answers:
+    outputfileObj = open(args.output_file, "w")
+    replay_queries(oracle, queries, outputfileObj, args.compare)
+    outputfileObj.close()
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
@@ -0,0 +1,460 @@
+import sys
+import os
+import mmap
+import heapq
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+#====================================================================#
+
+# the index is written next to the fasta file, eg. genome.fa.fai, in the samtools faidx format:
+# one line per sequence of 'name length offset line_bases line_width', where offset is the
+# byte offset of its first base and every line but the last has line_bases bases (line_width
+# bytes, with the newline)
+
+INDEX_SUFFIX = ".fai"
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# newlines are counted in pieces of this size, so a whole chromosome isn't copied at once:
+
+COUNT_CHUNK_SIZE = 16 * 1024 * 1024
+
+# the most bytes to copy in one go when splitting up a fasta file:
+
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# line length for sequences printed out by fetching regions:
+
+OUTPUT_LINE_BASES = 60
+
+#====================================================================#
+
+# define a function to count the newlines in part of a memory-mapped file:
+
+def count_newlines(data, start, end):
+    """count the b'\\n' bytes in data[start:end], a piece at a time
+    >>> count_newlines(b'AC\\nGT\\nA\\n', 1, 6)
+    2
+    """
+
+    count = 0
+    for chunk_start in range(start, end, COUNT_CHUNK_SIZE):
+        count += data[chunk_start:min(chunk_start + COUNT_CHUNK_SIZE, end)].count(b"\n")
+
+    return count
+
+#====================================================================#
+
+# define a function to find the length and line layout of one sequence:
+
+def index_sequence(data, name, start, end):
+    """returns (length, offset, line_bases, line_width) for the sequence in data[start:end], which
+    has no newlines at its end; raises ValueError if its lines (apart from the last) aren't all the
+    same length, as samtools needs them to be
+
+    The newline count and the check that every line_width-th byte is a newline are
+    both done by bytes methods, so a chromosome is indexed without a loop over its lines.
+
+    >>> index_sequence(b'ACGTA\\nACGTA\\nAC', 'chr1', 0, 14)
+    (12, 0, 5, 6)
+    >>> index_sequence(b'ACGTA\\r\\nACG', 'chr1', 0, 10)
+    (8, 0, 5, 7)
+    >>> index_sequence(b'ACGTA\\nACG\\nACGTA', 'chr1', 0, 15)
+    Traceback (most recent call last):
+    ...
+    ValueError: sequence chr1 has lines of different lengths
+    """
+
+    if end <= start:
+        return 0, start, 0, 0
+    first_newline = data.find(b"\n", start, end)
+    if first_newline == -1:
+        line_bases = end - start
+        line_width = line_bases + (2 if data[end:end + 1] == b"\r" else 1)
+        return line_bases, start, line_bases, line_width
+    line_width = first_newline + 1 - start
+    line_bases = line_width - (2 if data[first_newline - 1:first_newline] == b"\r" else 1)
+
+    # the newlines must all come at the ends of full-width lines:
+    num_lines = count_newlines(data, start, end)
+    last_line_bases = (end - start) - num_lines * line_width
+    if last_line_bases < 1 or last_line_bases > line_bases or data[start + line_width - 1:start + num_lines * line_width:line_width] != b"\n" * num_lines:
+        raise ValueError("sequence %s has lines of different lengths" % name)
+    if line_width - line_bases == 2 and data[start + line_width - 2:start + num_lines * line_width:line_width] != b"\r" * num_lines:
+        raise ValueError("sequence %s has lines of different lengths" % name)
+
+    return num_lines * line_bases + last_line_bases, start, line_bases, line_width
+
+#====================================================================#
+
+# define a function to index a fasta file:
+
+def build_fasta_index(fasta_file):
+    """returns a list of (name, length, offset, line_bases, line_width) for the sequences in a
+    fasta file, as in a samtools .fai index; the file is memory-mapped rather than read in"""
+
+    entries = []
+    fileObj = open(fasta_file, "rb")
+    size = os.fstat(fileObj.fileno()).st_size
+    if size == 0:
+        fileObj.close()
+        return entries
+    data = mmap.mmap(fileObj.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[:2] == GZIP_MAGIC:
+        raise ValueError("%s is gzipped, please gunzip it first" % fasta_file)
+    if data[:1] != b">":
+        raise ValueError("%s does not start with a '>' header line" % fasta_file)
+
+    names = set()
+    header_start = 0
+    while header_start < size:
+        header_end = data.find(b"\n", header_start)
+        if header_end == -1:
+            header_end = size
+        temp = data[header_start + 1:header_end].split() # eg. >chr1 some description
+        if len(temp) == 0:
+            raise ValueError("there is a header line with no sequence name at byte %d of %s" % (header_start, fasta_file))
+        name = temp[0].decode()
+        if name in names:
+            raise ValueError("sequence name %s is in %s more than once" % (name, fasta_file))
+        names.add(name)
+
+        # the sequence runs up to the next header line, leaving out any newlines at its end:
+        seq_start = min(header_end + 1, size)
+        next_header = data.find(b"\n>", header_end)
+        next_start = size if next_header == -1 else next_header + 1
+        end = next_start
+        while end > seq_start and data[end - 1] in (10, 13): # \n or \r
+            end -= 1
+        length, offset, line_bases, line_width = index_sequence(data, name, seq_start, end)
+        entries.append((name, length, offset, line_bases, line_width))
+        header_start = next_start
+    data.close()
+    fileObj.close()
+
+    return entries
+
+#====================================================================#
+
+# define a function to write out a .fai index:
+
+def write_fasta_index(fai_file, entries):
+
+    # write to a temporary file first, so a reader never sees half an index:
+    temp_file = "%s.tmp%d" % (fai_file, os.getpid())
+    outputfileObj = open(temp_file, "w")
+    for name, length, offset, line_bases, line_width in entries:
+        outputfileObj.write("%s\t%d\t%d\t%d\t%d\n" % (name, length, offset, line_bases, line_width))
+    outputfileObj.close()
+    os.replace(temp_file, fai_file)
+
+    return
+
+#====================================================================#
+
+# define a function to read in a .fai index:
+
+def read_fasta_index(fai_file):
+    """returns a list of (name, length, offset, line_bases, line_width) from a .fai index"""
+
+    entries = []
+    fileObj = open(fai_file, "r")
+    for line in fileObj:
+        temp = line.rstrip("\n").split("\t")
+        if len(temp) >= 5:
+            entries.append((temp[0], int(temp[1]), int(temp[2]), int(temp[3]), int(temp[4])))
+    fileObj.close()
+
+    return entries
+
+#====================================================================#
+
+# define a function to get the index of a fasta file, making it if it's missing or out of date:
+
+def load_fasta_index(fasta_file):
+
+    fai_file = fasta_file + INDEX_SUFFIX
+    if os.path.exists(fai_file) and os.path.getmtime(fai_file) >= os.path.getmtime(fasta_file):
+        return read_fasta_index(fai_file)
+    entries = build_fasta_index(fasta_file)
+    try:
+        write_fasta_index(fai_file, entries)
+    except OSError as error: # eg. the fasta file is in a read-only directory, so we just keep the index in memory
+        print("Could not write the index %s (%s)" % (fai_file, error))
+
+    return entries
+
+#====================================================================#
+
+# define a function to parse a samtools-style region:
+
+def parse_region(region):
+    """returns (name, start, end) for a region like 'chr1:1,001-2,000' (counting from 1, including
+    both ends), with start and end as 0-based Python slice positions; end is None for the end of
+    the sequence
+    >>> parse_region('chr1:1,001-2,000'), parse_region('chr1:5'), parse_region('chr1')
+    (('chr1', 1000, 2000), ('chr1', 4, None), ('chr1', 0, None))
+    """
+
+    name, colon, positions = region.rpartition(":")
+    if not colon:
+        return region, 0, None
+    temp = positions.replace(",", "").split("-")
+    start = int(temp[0]) - 1
+    end = int(temp[1]) if len(temp) > 1 and temp[1] != "" else None
+
+    return name, max(start, 0), end
+
+#====================================================================#
+
+# reads regions of sequences from an indexed fasta file, without reading in the sequences:
+
+class IndexedFasta:
+    """random access to the sequences in a fasta file, through its .fai index and a memory map
+
+    >>> import tempfile
+    >>> temp_dir = tempfile.TemporaryDirectory()
+    >>> fasta_file = os.path.join(temp_dir.name, 'test.fa')
+    >>> fileObj = open(fasta_file, 'w')
+    >>> _ = fileObj.write('>chr1 first\\nACGTA\\nCCGGT\\nTT\\n>chr2\\nGGGG\\n')
+    >>> fileObj.close()
+    >>> fasta = IndexedFasta(fasta_file)
+    >>> fasta.fetch('chr1', 3, 12), fasta.fetch_region('chr2:2-3'), fasta.fetch('chr1', 10)
+    (b'TACCGGTTT', b'GG', b'TT')
+    >>> open(fasta_file + '.fai').read()
+    'chr1\\t12\\t12\\t5\\t6\\nchr2\\t4\\t33\\t4\\t5\\n'
+    >>> fasta.close()
+    >>> temp_dir.cleanup()
+    """
+
+    def __init__(self, fasta_file):
+        self.fasta_file = fasta_file
+        self.entries = load_fasta_index(fasta_file)
+        self.names = [entry[0] for entry in self.entries]
+        self.index = dict((entry[0], entry) for entry in self.entries)
+        self.fileObj = open(fasta_file, "rb")
+        self.data = b""
+        if os.fstat(self.fileObj.fileno()).st_size > 0:
+            self.data = mmap.mmap(self.fileObj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def get_length(self, name):
+        return self.index[name][1]
+
+    def fetch(self, name, start=0, end=None):
+        """returns the bases in sequence[start:end] (0-based, as for a Python slice) as bytes"""
+        if name not in self.index:
+            raise KeyError("%s is not a sequence in %s" % (name, self.fasta_file))
+        name, length, offset, line_bases, line_width = self.index[name]
+        if end is None or end > length:
+            end = length
+        if start >= end:
+            return b""
+        first_byte = offset + (start // line_bases) * line_width + start % line_bases
+        last_byte = offset + ((end - 1) // line_bases) * line_width + (end - 1) % line_bases
+        return self.data[first_byte:last_byte + 1].translate(None, b"\r\n")
+
+    def fetch_region(self, region):
+        """returns the bases in a samtools-style region, eg. 'chr1:1,001-2,000'"""
+        name, start, end = parse_region(region)
+        return self.fetch(name, start, end)
+
+    def close(self):
+        if not isinstance(self.data, bytes):
+            self.data.close()
+        self.fileObj.close()
+
+#====================================================================#
+
+# define a function to share out sequences between shards, so each gets about the same number of bases:
+
+def assign_records_to_shards(lengths, num_shards):
+    """returns a list of shards, each a list of record numbers in file order; the longest records
+    are given out first, each to the shard with the fewest bases so far
+    >>> assign_records_to_shards([100, 10, 60, 50, 5], 2)
+    [[0, 1, 4], [2, 3]]
+    """
+
+    num_shards = min(num_shards, len(lengths))
+    shards = [[] for i in range(num_shards)]
+    heap = [(0, i) for i in range(num_shards)] # (bases so far, shard number)
+    for record_num in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        bases, shard_num = heapq.heappop(heap)
+        shards[shard_num].append(record_num)
+        heapq.heappush(heap, (bases + lengths[record_num], shard_num))
+
+    return [sorted(shard) for shard in shards]
+
+#====================================================================#
+
+# define a function to find where each record (header line and sequence) starts and ends in the file:
+
+def find_record_ranges(data, entries, size):
+    """returns a list of (start, end) byte ranges, one per index entry"""
+
+    starts = []
+    for name, length, offset, line_bases, line_width in entries:
+        starts.append(data.rfind(b"\n", 0, offset - 1) + 1) # the start of the header line just before the sequence
+    ends = starts[1:] + [size]
+
+    return list(zip(starts, ends))
+
+#====================================================================#
+
+# define a function to copy some byte ranges of the input into one output file, with its own .fai index:
+
+def write_shard(fasta_file, ranges, shard_entries, output_file):
+
+    fileObj = open(fasta_file, "rb")
+    outputfileObj = open(output_file, "wb")
+    output_entries = []
+    output_pos = 0
+    for (start, end), (name, length, offset, line_bases, line_width) in zip(ranges, shard_entries):
+        output_entries.append((name, length, offset - start + output_pos, line_bases, line_width))
+        output_pos += end - start
+    copy_byte_ranges(fileObj, outputfileObj, merge_byte_ranges(ranges))
+    outputfileObj.close()
+    fileObj.close()
+    write_fasta_index(output_file + INDEX_SUFFIX, output_entries)
+
+    return
+
+#====================================================================#
+
+# define a function to join up byte ranges that follow on from each other:
+
+def merge_byte_ranges(ranges):
+    """
+    >>> merge_byte_ranges([(0, 10), (10, 25), (40, 50)])
+    [(0, 25), (40, 50)]
+    """
+
+    merged = []
+    for start, end in ranges:
+        if merged and merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    return merged
+
+#====================================================================#
+
+# define a function to copy byte ranges from one file to another:
+
+def copy_byte_ranges(fileObj, outputfileObj, ranges):
+
+    # os.sendfile() copies inside the kernel, with no trip through Python (on Linux):
+    outputfileObj.flush()
+    use_sendfile = hasattr(os, "sendfile") and sys.platform.startswith("linux")
+    for start, end in ranges:
+        while start < end:
+            if use_sendfile:
+                num_copied = os.sendfile(outputfileObj.fileno(), fileObj.fileno(), start, min(end - start, COPY_CHUNK_SIZE))
+                if num_copied == 0:
+                    raise ValueError("%s ended before byte %d" % (fileObj.name, end))
+            else:
+                fileObj.seek(start)
+                data = fileObj.read(min(end - start, COPY_CHUNK_SIZE))
+                if len(data) == 0:
+                    raise ValueError("%s ended before byte %d" % (fileObj.name, end))
+                outputfileObj.write(data)
+                num_copied = len(data)
+            start += num_copied
+
+    return
+
+#====================================================================#
+
+# define a function to split up a fasta file into shards with about the same number of bases each:
+
+def split_fasta_file(fasta_file, num_output_files, output_file_prefix, threads=1):
+    """write the sequences to output_file_prefix_1.fa, output_file_prefix_2.fa, etc. (each with a
+    .fai index); the records are copied byte for byte, and the shards are written in parallel"""
+
+    entries = load_fasta_index(fasta_file)
+    fileObj = open(fasta_file, "rb")
+    size = os.fstat(fileObj.fileno()).st_size
+    if size == 0:
+        fileObj.close()
+        return []
+    data = mmap.mmap(fileObj.fileno(), 0, access=mmap.ACCESS_READ)
+    ranges = find_record_ranges(data, entries, size)
+    data.close()
+    fileObj.close()
+
+    shards = assign_records_to_shards([entry[1] for entry in entries], num_output_files)
+    output_files = []
+    pool = ThreadPoolExecutor(max_workers=threads) # the copying is done by the kernel, outside the GIL
+    futures = []
+    for shard_num, shard in enumerate(shards):
+        output_file = "%s_%d.fa" % (output_file_prefix, shard_num + 1)
+        print("Writing %s (%d sequences, %d bases) ..." % (output_file, len(shard), sum(entries[i][1] for i in shard)))
+        futures.append(pool.submit(write_shard, fasta_file, [ranges[i] for i in shard], [entries[i] for i in shard], output_file))
+        output_files.append(output_file)
+    for future in futures:
+        future.result()
+    pool.shutdown()
+
+    return output_files
+
+#====================================================================#
+
+# split up a fasta file into shards with about the same number of bases each:
+
+def split_main(argv):
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(prog="%s split" % sys.argv[0], description="split up a fasta file into output files with about the same number of bases each")
+    parser.add_argument("input_fasta", help="input fasta file (not gzipped)")
+    parser.add_argument("num_output_files", type=int, help="number of output files to split the input into")
+    parser.add_argument("output_file_prefix", help="prefix to use for the output file names (output_file_prefix_1.fa, etc.)")
+    parser.add_argument("--threads", type=int, default=1, help="number of output files to write at once (default: 1)")
+    args = parser.parse_args(argv)
+    if os.path.exists(args.input_fasta) == False or args.num_output_files < 1 or args.threads < 1:
+        parser.print_usage()
+        sys.exit(1)
+
+    split_fasta_file(args.input_fasta, args.num_output_files, args.output_file_prefix, args.threads)
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+def main():
+
+    # 'fasta_index.py split ...' splits up a fasta file:
+    if len(sys.argv) > 1 and sys.argv[1] == "split":
+        split_main(sys.argv[2:])
+        return
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(description="index a fasta file (as samtools faidx does), and print out regions of its sequences", epilog="Run '%(prog)s split -h' for splitting up a fasta file into shards with about the same number of bases each.")
+    parser.add_argument("input_fasta", help="input fasta file (not gzipped); its index is written to input_fasta.fai")
+    parser.add_argument("regions", nargs="*", help="regions to print out, eg. chr1 or chr1:1,001-2,000 (counting from 1)")
+    args = parser.parse_args()
+    if os.path.exists(args.input_fasta) == False:
+        parser.print_usage()
+        sys.exit(1)
+
+    # make the index if it's missing or out of date, and print out the regions in fasta format:
+    fasta = IndexedFasta(args.input_fasta)
+    for region in args.regions:
+        seq = fasta.fetch_region(region).decode()
+        sys.stdout.write(">%s\n" % region)
+        for i in range(0, len(seq), OUTPUT_LINE_BASES):
+            sys.stdout.write(seq[i:i + OUTPUT_LINE_BASES] + "\n")
+    fasta.close()
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
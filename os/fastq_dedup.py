@@ -0,0 +1,458 @@
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+#====================================================================#
+
+# how much memory the read fingerprints can use by default:
+
+DEFAULT_MAX_MEMORY = 1024 * 1024 * 1024
+
+# the sequence line of each fastq record:
+
+FASTQ_SEQUENCES = re.compile(rb"@[^\n]*\n([^\n]*)\n[^\n]*\n[^\n]*\n")
+
+NEWLINE = 10
+
+# the smallest number of fingerprints to write to a run on disk, or to read from one at a time:
+
+MIN_RUN_ENTRIES = 256
+
+# the most runs to merge at once; when there are this many, they are merged into one:
+
+MAX_MERGE_RUNS = 64
+
+#====================================================================#
+
+# define a function to make a regular expression for the start of the sequence of each fastq record:
+
+def make_sequence_pattern(prefix_length=0):
+    """make a regular expression that finds the first prefix_length bases (0 for all) of each read
+
+    >>> make_sequence_pattern(3).findall(b'@r1\\nACGT\\n+\\nFFFF\\n@r2\\nAC\\n+\\nFF\\n')
+    [b'ACG', b'AC']
+    """
+
+    if prefix_length == 0:
+        return FASTQ_SEQUENCES
+    return re.compile(rb"@[^\n]*\n([^\n]{0,%d})[^\n]*\n[^\n]*\n[^\n]*\n" % prefix_length)
+
+#====================================================================#
+
+# define a function to make 64-bit fingerprints of the reads in blocks of fastq records:
+
+def fingerprint_reads(datas, pattern=FASTQ_SEQUENCES):
+    """make a 64-bit fingerprint (BLAKE2b) of the sequence of each read in blocks of records
+
+    'datas' holds one block of records per input file; for paired-end reads the
+    R1 and R2 sequences of each pair go into one fingerprint. A fingerprint of 0
+    is changed to 1, as 0 marks an empty slot in a FingerprintSet.
+
+    >>> a = fingerprint_reads([b'@r1\\nACGT\\n+\\nFFFF\\n@r2\\nACGT\\n+\\nF#FF\\n@r3\\nACG\\n+\\nFFF\\n'])
+    >>> bool(a[0] == a[1]), bool(a[0] == a[2])
+    (True, False)
+    >>> b = fingerprint_reads([b'@r1\\nAC\\n+\\nFF\\n@r2\\nAC\\n+\\nFF\\n', b'@r1\\nGT\\n+\\nFF\\n@r2\\nGA\\n+\\nFF\\n'])
+    >>> bool(b[0] == b[1])
+    False
+    """
+
+    seqs = [pattern.findall(data) for data in datas]
+    if len(seqs) == 1:
+        keys = seqs[0]
+    else:
+        keys = [b"\n".join(pair) for pair in zip(*seqs)]
+    blake2b = hashlib.blake2b
+    fingerprints = np.frombuffer(b"".join([blake2b(key, digest_size=8).digest() for key in keys]), dtype="<u8").astype(np.uint64)
+    fingerprints[fingerprints == 0] = 1
+
+    return fingerprints
+
+#====================================================================#
+
+# define a function to take the records we want out of a block of fastq records:
+
+def select_records(data, keep):
+    """return the records in a block of fastq records (bytes) for which 'keep' is True
+
+    Runs of kept records are copied out as slices, so no Python code runs per
+    record unless every other record is dropped.
+
+    >>> select_records(b'@r1\\nA\\n+\\nF\\n@r2\\nC\\n+\\nF\\n@r3\\nG\\n+\\nF\\n', np.array([True, False, True]))
+    b'@r1\\nA\\n+\\nF\\n@r3\\nG\\n+\\nF\\n'
+    """
+
+    if keep.all():
+        return data
+    ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == NEWLINE)[3::4] + 1 # the end of each record
+    starts = np.concatenate(([0], ends[:-1]))
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], keep.view(np.int8), [0])))) # where runs of kept records start and stop
+    run_starts = starts[edges[0::2]].tolist()
+    run_ends = ends[edges[1::2] - 1].tolist()
+    view = memoryview(data)
+
+    return b"".join([view[start:end] for start, end in zip(run_starts, run_ends)])
+
+#====================================================================#
+
+# an open-addressing hash set of 64-bit fingerprints, held in one NumPy array:
+
+class FingerprintSet:
+    """a hash set of non-zero 64-bit fingerprints, with linear probing, in a uint64 array
+
+    A whole batch of fingerprints is added at once, a probe step at a time, so
+    no Python code runs per fingerprint. The table is kept at most half full, and
+    is doubled in size as it fills, up to what fits in max_memory bytes.
+
+    >>> seen = FingerprintSet(1024 * 1024)
+    >>> seen.add(np.array([5, 7, 5, 9], dtype=np.uint64)).tolist()
+    [True, True, False, True]
+    >>> seen.add(np.array([9, 11], dtype=np.uint64)).tolist()
+    [False, True]
+    >>> len(seen), sorted(seen.fingerprints().tolist())
+    (4, [5, 7, 9, 11])
+    """
+
+    def __init__(self, max_memory=DEFAULT_MAX_MEMORY, capacity=1024):
+        # the largest table whose old and new arrays both fit in max_memory while it is doubled in size:
+        self.max_capacity = 1
+        while self.max_capacity * 3 * 8 <= max_memory:
+            self.max_capacity *= 2
+        self.slots = np.zeros(min(capacity, self.max_capacity), dtype=np.uint64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def has_room(self, num_fingerprints):
+        """can num_fingerprints more fingerprints be added without going over max_memory?"""
+        return (self.size + num_fingerprints) * 2 <= self.max_capacity
+
+    def fingerprints(self):
+        """the fingerprints in the set, in no particular order"""
+        return self.slots[self.slots != 0]
+
+    def grow(self, capacity):
+        old_fingerprints = self.fingerprints()
+        self.slots = np.zeros(capacity, dtype=np.uint64)
+        self.size = 0
+        self.add(old_fingerprints)
+
+    def add(self, fingerprints):
+        """add a batch of fingerprints, returning True for each one that was not already in the set
+
+        Only the first copy of a fingerprint that comes up more than once in the
+        batch counts as new.
+        """
+        capacity = len(self.slots)
+        while (self.size + len(fingerprints)) * 2 > capacity:
+            capacity *= 2
+        if capacity > len(self.slots):
+            self.grow(capacity)
+        mask = np.uint64(capacity - 1)
+
+        is_new = np.zeros(len(fingerprints), dtype=bool)
+        pending = np.arange(len(fingerprints)) # the fingerprints still being placed
+        positions = (fingerprints & mask).astype(np.int64)
+        while len(pending):
+            current = self.slots[positions]
+            wanted = fingerprints[pending]
+            empty = current == 0
+            # the first fingerprint to probe each empty slot goes into it; copies of the
+            # same fingerprint always probe the same slots, so the first copy wins:
+            empty_indexes = np.flatnonzero(empty)
+            unused, first = np.unique(positions[empty_indexes], return_index=True)
+            winners = empty_indexes[first]
+            self.slots[positions[winners]] = wanted[winners]
+            is_new[pending[winners]] = True
+            self.size += len(winners)
+            # the others probe the same slot again if they lost it, or move on if it holds something else:
+            placed = current == wanted
+            placed[winners] = True
+            move_on = ~empty & ~placed
+            positions[move_on] = (positions[move_on] + 1) & (capacity - 1)
+            pending = pending[~placed]
+            positions = positions[~placed]
+
+        return is_new
+
+#====================================================================#
+
+# a sorted run of (fingerprint, read number) pairs on disk:
+
+class SortedRun:
+    """a file of unique fingerprints in order, each with the number of the first read it came from
+
+    The pairs are stored as uint64 [fingerprint, read number] rows; read numbers
+    count from 1, and 0 means the fingerprint was seen before the fingerprints
+    overflowed memory.
+    """
+
+    def __init__(self, filename, length):
+        self.filename = filename
+        self.length = length
+
+    def read(self, start, count):
+        count = min(count, self.length - start)
+        if count <= 0:
+            return np.zeros((0, 2), dtype=np.uint64)
+        return np.fromfile(self.filename, dtype=np.uint64, count=count * 2, offset=start * 16).reshape(-1, 2)
+
+    def delete(self):
+        os.remove(self.filename)
+
+#====================================================================#
+
+# define a function to merge sorted runs in blocks:
+
+def merge_sorted_runs(runs, block_size):
+    """merge SortedRuns, yielding sorted blocks of [fingerprint, read number] rows
+
+    Up to block_size rows are read from each run at a time. Each block holds
+    every row with a fingerprint up to the smallest last fingerprint read from any
+    of the runs, so all the copies of a fingerprint end up in the same block.
+    """
+
+    positions = [0] * len(runs)
+    blocks = [run.read(0, block_size) for run in runs]
+    while True:
+        live = [i for i, block in enumerate(blocks) if len(block)]
+        if not live:
+            break
+        threshold = min(blocks[i][-1, 0] for i in live)
+        pieces = []
+        for i in live:
+            num_rows = int(np.searchsorted(blocks[i][:, 0], threshold, side="right"))
+            pieces.append(blocks[i][:num_rows])
+            blocks[i] = blocks[i][num_rows:]
+            if len(blocks[i]) == 0:
+                positions[i] += block_size
+                blocks[i] = runs[i].read(positions[i], block_size)
+        merged = np.concatenate(pieces)
+        yield merged[np.lexsort((merged[:, 1], merged[:, 0]))]
+
+#====================================================================#
+
+# define a function to find the first copy of each fingerprint in sorted [fingerprint, read number] rows:
+
+def split_first_copies(rows):
+    """split sorted [fingerprint, read number] rows into the first copy of each fingerprint and the read numbers of the other copies
+
+    >>> rows = np.array([[3, 0], [3, 5], [4, 2], [4, 6], [4, 7]], dtype=np.uint64)
+    >>> first, copies = split_first_copies(rows)
+    >>> first.tolist(), copies.tolist()
+    ([[3, 0], [4, 2]], [5, 6, 7])
+    """
+
+    is_copy = np.zeros(len(rows), dtype=bool)
+    is_copy[1:] = rows[1:, 0] == rows[:-1, 0]
+
+    return rows[~is_copy], rows[is_copy, 1]
+
+#====================================================================#
+
+# the numbers of the duplicate reads found after the fingerprints overflowed memory, kept on disk:
+
+class DuplicateReadNumbers:
+    """lists of duplicate read numbers on disk, one file per bucket of bucket_size reads
+
+    The read numbers are appended to the bucket files in any order; each bucket
+    is turned into an array of flags, one per read, when it is looked up.
+    """
+
+    def __init__(self, work_dir, first_read, bucket_size):
+        self.work_dir = work_dir
+        self.first_read = first_read
+        self.bucket_size = bucket_size
+        self.loaded_bucket = None
+        self.flags = None
+
+    def bucket_file(self, bucket):
+        return os.path.join(self.work_dir, "duplicates_%d" % bucket)
+
+    def add(self, read_numbers):
+        buckets = (read_numbers - self.first_read) // self.bucket_size
+        for bucket in np.unique(buckets).tolist():
+            fileObj = open(self.bucket_file(bucket), "ab")
+            read_numbers[buckets == bucket].tofile(fileObj)
+            fileObj.close()
+
+    def load(self, bucket):
+        self.flags = np.zeros(self.bucket_size, dtype=bool)
+        if os.path.exists(self.bucket_file(bucket)):
+            read_numbers = np.fromfile(self.bucket_file(bucket), dtype=np.uint64)
+            self.flags[(read_numbers - self.first_read - bucket * self.bucket_size).astype(np.int64)] = True
+            os.remove(self.bucket_file(bucket))
+        self.loaded_bucket = bucket
+
+    def is_duplicate(self, first, last):
+        """flags for reads first to last - 1, all of them from first_read on"""
+        is_duplicate = np.zeros(last - first, dtype=bool)
+        read_num = first
+        while read_num < last:
+            bucket = (read_num - self.first_read) // self.bucket_size
+            if bucket != self.loaded_bucket:
+                self.load(bucket)
+            bucket_start = self.first_read + bucket * self.bucket_size
+            end = min(last, bucket_start + self.bucket_size)
+            is_duplicate[read_num - first:end - first] = self.flags[read_num - bucket_start:end - bucket_start]
+            read_num = end
+        return is_duplicate
+
+#====================================================================#
+
+# take duplicate reads out of a stream of blocks of fastq records:
+
+class ReadDeduplicator:
+    """remove reads whose sequence (or first prefix_length bases) has been seen before, keeping the first copy
+
+    Reads are compared by 64-bit fingerprints of their sequences, held in a
+    FingerprintSet. If the fingerprints outgrow max_memory bytes, the set is
+    written to disk as a sorted run, the rest of the input is fingerprinted into
+    more sorted runs of up to max_memory bytes (merged into one whenever there
+    are MAX_MERGE_RUNS of them), and the runs are merged to find the duplicates.
+    The input is then read a second time to write out the rest of the reads, so
+    memory use stays bounded however large the input is.
+
+    >>> def read_chunks():
+    ...     return iter([(b'@r1\\nAC\\n+\\nFF\\n@r2\\nAG\\n+\\nFF\\n', 2), (b'@r3\\nAC\\n+\\nFF\\n@r4\\nAGT\\n+\\nFFF\\n', 2)])
+    >>> dedup = ReadDeduplicator()
+    >>> [chunk[0] for chunk in dedup.filter_chunks(read_chunks)]
+    [b'@r1\\nAC\\n+\\nFF\\n@r2\\nAG\\n+\\nFF\\n', b'@r4\\nAGT\\n+\\nFFF\\n']
+    >>> dedup.num_reads, dedup.num_duplicates
+    (4, 1)
+    >>> dedup = ReadDeduplicator(max_memory=0, prefix_length=2) # the fingerprints go straight to disk
+    >>> [chunk[0] for chunk in dedup.filter_chunks(read_chunks)]
+    [b'@r1\\nAC\\n+\\nFF\\n@r2\\nAG\\n+\\nFF\\n']
+    >>> dedup.num_reads, dedup.num_duplicates, dedup.spilled
+    (4, 2, True)
+    """
+
+    def __init__(self, max_memory=DEFAULT_MAX_MEMORY, prefix_length=0, temp_dir=None):
+        self.max_memory = max_memory
+        self.pattern = make_sequence_pattern(prefix_length)
+        self.temp_dir = temp_dir
+        self.num_reads = 0
+        self.num_duplicates = 0
+        self.spilled = False
+        self.num_run_files = 0
+
+    def select_records(self, chunk, keep):
+        return tuple(select_records(data, keep) for data in chunk[:-1]) + (int(np.count_nonzero(keep)),)
+
+    def filter_chunks(self, read_chunks):
+        """yield the chunks from read_chunks() with the duplicate reads taken out
+
+        'read_chunks' is a function returning an iterator of (data..., num_records)
+        tuples, as made by read_fastq_chunks() or read_paired_fastq_chunks(); it
+        is called a second time if the fingerprints do not fit in memory.
+        """
+
+        seen = FingerprintSet(self.max_memory)
+        chunks = read_chunks()
+        for chunk in chunks:
+            fingerprints = fingerprint_reads(chunk[:-1], self.pattern)
+            if not seen.has_room(len(fingerprints)):
+                break
+            keep = seen.add(fingerprints)
+            self.num_reads += len(keep)
+            self.num_duplicates += len(keep) - int(np.count_nonzero(keep))
+            if keep.any():
+                yield self.select_records(chunk, keep)
+        else:
+            return
+
+        # the fingerprints do not fit in memory, so go on with sorted runs on disk:
+        self.spilled = True
+        work_dir = tempfile.mkdtemp(prefix="fastq_dedup.", dir=self.temp_dir)
+        try:
+            first_spilled_read = self.num_reads
+            duplicates = DuplicateReadNumbers(work_dir, first_spilled_read, max(self.max_memory // 2, MIN_RUN_ENTRIES))
+            runs = []
+            seen_before = np.sort(seen.fingerprints())
+            seen = None
+            if len(seen_before):
+                runs.append(self.write_run_file(np.column_stack((seen_before, np.zeros(len(seen_before), dtype=np.uint64))), runs, work_dir))
+            seen_before = None
+            self.spill_fingerprints(self.fingerprint_chunks(fingerprints, chunks), runs, duplicates, work_dir)
+
+            # merge the runs, to find which reads are copies of earlier reads:
+            for rows in merge_sorted_runs(runs, self.merge_block_size(len(runs))):
+                duplicates.add(split_first_copies(rows)[1] - np.uint64(1))
+            for run in runs:
+                run.delete()
+
+            # then read the input again, writing out the reads from first_spilled_read on that are not duplicates:
+            read_num = 0
+            for chunk in read_chunks():
+                first, last = read_num, read_num + chunk[-1]
+                read_num = last
+                if last <= first_spilled_read:
+                    continue
+                keep = np.zeros(last - first, dtype=bool)
+                first_new = max(first, first_spilled_read)
+                keep[first_new - first:] = ~duplicates.is_duplicate(first_new, last)
+                self.num_duplicates += int(np.count_nonzero(~keep[first_new - first:]))
+                if keep.any():
+                    yield self.select_records(chunk, keep)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def fingerprint_chunks(self, fingerprints, chunks):
+        """yield the fingerprints of a chunk that has already been read, then of the rest of the chunks"""
+        yield fingerprints
+        for chunk in chunks:
+            yield fingerprint_reads(chunk[:-1], self.pattern)
+
+    def merge_block_size(self, num_runs):
+        """how many rows to read from each of num_runs runs at a time when merging them"""
+        return max(self.max_memory // (64 * max(num_runs, 1)), MIN_RUN_ENTRIES)
+
+    def spill_fingerprints(self, fingerprint_batches, runs, duplicates, work_dir):
+        """write batches of fingerprints out as sorted runs of the first copy of each fingerprint"""
+        max_entries = max(self.max_memory // 48, MIN_RUN_ENTRIES) # the fingerprints, read numbers, sort order and sorted rows
+        buffered = []
+        num_buffered = 0
+        for fingerprints in fingerprint_batches:
+            self.num_reads += len(fingerprints)
+            buffered.append(fingerprints)
+            num_buffered += len(fingerprints)
+            if num_buffered >= max_entries:
+                self.write_run(buffered, num_buffered, runs, duplicates, work_dir)
+                buffered = []
+                num_buffered = 0
+        if num_buffered:
+            self.write_run(buffered, num_buffered, runs, duplicates, work_dir)
+
+    def write_run(self, buffered, num_buffered, runs, duplicates, work_dir):
+        fingerprints = np.concatenate(buffered)
+        first_read = self.num_reads - num_buffered + 1 # read numbers in the runs start at 1
+        order = np.argsort(fingerprints, kind="stable") # the reads stay in order within each fingerprint
+        rows = np.column_stack((fingerprints[order], order.astype(np.uint64) + np.uint64(first_read)))
+        order = None
+        first_copies, copies = split_first_copies(rows)
+        duplicates.add(copies - np.uint64(1))
+        runs.append(self.write_run_file(first_copies, runs, work_dir))
+
+        # merge the runs into one when there are too many of them to merge at once:
+        if len(runs) >= MAX_MERGE_RUNS:
+            merged_file = os.path.join(work_dir, "merged_%d" % self.num_reads)
+            fileObj = open(merged_file, "wb")
+            length = 0
+            for rows in merge_sorted_runs(runs, self.merge_block_size(len(runs))):
+                first_copies, copies = split_first_copies(rows)
+                duplicates.add(copies - np.uint64(1))
+                first_copies.tofile(fileObj)
+                length += len(first_copies)
+            fileObj.close()
+            for run in runs:
+                run.delete()
+            runs[:] = [SortedRun(merged_file, length)]
+
+    def write_run_file(self, rows, runs, work_dir):
+        self.num_run_files += 1
+        run_file = os.path.join(work_dir, "run_%d" % self.num_run_files)
+        rows.tofile(run_file)
+        return SortedRun(run_file, len(rows))
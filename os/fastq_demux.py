@@ -0,0 +1,265 @@
+import re
+from collections import OrderedDict, deque
+from itertools import combinations, product
+from concurrent.futures import ThreadPoolExecutor
+from parallel_gzip import compress_gzip_member
+
+#====================================================================#
+
+# reads whose barcode doesn't match any sample go to this 'sample':
+
+UNDETERMINED = "Undetermined"
+
+# each fastq record, and the index sequence at the end of its header,
+# eg. 2:N:0:NTTGTA in @M03558:259:000000000-BH588:1:1101:15455:1333 2:N:0:NTTGTA
+
+FASTQ_RECORDS_AND_BARCODES = re.compile(rb"(@(?:[^\n]*:)?([^:\n]*)\n[^\n]*\n[^\n]*\n[^\n]*\n)")
+
+# how much of a sample's records to build up before compressing them as one gzip member:
+
+SAMPLE_BUFFER_SIZE = 256 * 1024
+
+#====================================================================#
+
+# read in the barcode sheet:
+
+def read_barcode_sheet(barcode_sheet):
+    """read in a tab-separated file of sample names and barcodes (eg. 'sample1  TTGTAC', or 'ACGTAC+TTGTAC' for dual indexes)"""
+
+    barcodes = OrderedDict()
+    fileObj = open(barcode_sheet, "r")
+    for line in fileObj:
+        line = line.rstrip()
+        if line == "" or line.startswith('#'):
+            continue
+        temp = line.split()
+        sample = temp[0] # eg. sample1
+        barcode = temp[1].upper() # eg. TTGTAC
+        assert(sample not in barcodes)
+        assert(sample != UNDETERMINED)
+        barcodes[sample] = barcode
+    fileObj.close()
+
+    return barcodes
+
+#====================================================================#
+
+# define a function to make a lookup table of barcodes with mismatches:
+
+def make_barcode_lookup(barcodes, max_mismatches):
+    """make a dictionary from every sequence within max_mismatches of a barcode to its sample
+
+    Sequences that are within max_mismatches of more than one sample's barcode
+    map to UNDETERMINED, so a read is never given to the wrong sample.
+
+    >>> lookup = make_barcode_lookup({'s1': 'AAAA', 's2': 'AATT'}, 1)
+    >>> lookup[b'AAAA'], lookup[b'NAAA'], lookup[b'AATA'], lookup[b'AATT']
+    ('s1', 's1', 'Undetermined', 's2')
+    >>> len(make_barcode_lookup({'s1': 'ACGT+TTGA'}, 2)) == 1 + 8 * 4 + 28 * 16
+    True
+    """
+
+    lookup = {}
+    for sample, barcode in barcodes.items():
+        barcode = barcode.encode()
+        positions = [i for i, base in enumerate(barcode) if base != ord('+')] # the '+' between dual indexes stays as it is
+        variants = set([barcode])
+        for num_mismatches in range(1, max_mismatches + 1):
+            for mismatch_positions in combinations(positions, num_mismatches):
+                choices = [[base for base in b"ACGTN" if base != barcode[i]] for i in mismatch_positions]
+                for new_bases in product(*choices):
+                    variant = bytearray(barcode)
+                    for i, base in zip(mismatch_positions, new_bases):
+                        variant[i] = base
+                    variants.add(bytes(variant))
+        for variant in variants:
+            if lookup.get(variant, sample) != sample:
+                lookup[variant] = UNDETERMINED # close to two samples' barcodes
+            else:
+                lookup[variant] = sample
+
+    return lookup
+
+#====================================================================#
+
+# a pool of open output files, so we never have too many open at once:
+
+class FileHandlePool:
+    """keep at most max_open output files open, closing the least recently used one when we need another
+
+    A file is created ("wb") the first time it is asked for; if it has been
+    closed to make room, it is opened again for appending ("ab").
+    """
+
+    def __init__(self, max_open):
+        self.max_open = max_open
+        self.open_files = OrderedDict()
+        self.seen_files = set()
+
+    def get(self, filename):
+        fileObj = self.open_files.get(filename)
+        if fileObj is not None:
+            self.open_files.move_to_end(filename)
+            return fileObj
+        if len(self.open_files) >= self.max_open:
+            _, oldest = self.open_files.popitem(last=False)
+            oldest.close()
+        mode = "ab" if filename in self.seen_files else "wb"
+        self.seen_files.add(filename)
+        fileObj = open(filename, mode)
+        self.open_files[filename] = fileObj
+        return fileObj
+
+    def close(self, filename):
+        fileObj = self.open_files.pop(filename, None)
+        if fileObj is not None:
+            fileObj.close()
+
+    def close_all(self):
+        for fileObj in self.open_files.values():
+            fileObj.close()
+        self.open_files.clear()
+
+#====================================================================#
+
+# write each sample's records to its own series of gzipped output files:
+
+class DemuxWriter:
+    """write records to per-sample output files of seqs_per_output_file records each
+
+    Each sample's records are built up in a buffer and compressed as a gzip member
+    on a thread pool; the members are appended to the output files in the order
+    they were submitted, through a FileHandlePool. The R1 and R2 writers of
+    paired-end reads can share one thread pool ('compress_pool'), which is then
+    left for the caller to shut down.
+    """
+
+    def __init__(self, output_file_prefix, seqs_per_output_file, threads=1, max_open_files=256, read_label="", compress_pool=None):
+        self.output_file_prefix = output_file_prefix
+        self.seqs_per_output_file = seqs_per_output_file if seqs_per_output_file > 0 else float("inf")
+        self.read_label = read_label # eg. '_R1' for the R1 files of paired-end reads
+        self.file_pool = FileHandlePool(max_open_files)
+        self.own_compress_pool = compress_pool is None
+        self.compress_pool = ThreadPoolExecutor(max_workers=threads) if compress_pool is None else compress_pool
+        self.max_pending = threads * 2
+        self.pending = deque()
+        self.buffers = {} # sample -> list of records not yet compressed
+        self.buffer_sizes = {}
+        self.seqcnts = {} # sample -> number of records in its current output file
+        self.output_file_cnts = {} # sample -> number of its current output file
+        self.num_reads = {} # sample -> total number of records
+
+    def output_file(self, sample):
+        return "%s_%s%s_%d.fastq.gz" % (self.output_file_prefix, sample, self.read_label, self.output_file_cnts[sample])
+
+    def write_records(self, sample, records):
+        """add a list of records (bytes) for a sample"""
+        if sample not in self.seqcnts:
+            self.seqcnts[sample] = 0
+            self.output_file_cnts[sample] = 1
+            self.num_reads[sample] = 0
+            self.buffers[sample] = []
+            self.buffer_sizes[sample] = 0
+            print("Opening",self.output_file(sample),"...")
+        self.num_reads[sample] += len(records)
+        while records:
+            if self.seqcnts[sample] == self.seqs_per_output_file:
+                self.flush(sample, end_of_file=True)
+                self.output_file_cnts[sample] += 1
+                self.seqcnts[sample] = 0
+                print("Opening",self.output_file(sample),"...")
+            num_to_write = min(len(records), self.seqs_per_output_file - self.seqcnts[sample])
+            for record in records[:num_to_write]:
+                self.buffers[sample].append(record)
+                self.buffer_sizes[sample] += len(record)
+            self.seqcnts[sample] += num_to_write
+            records = records[num_to_write:]
+            if self.buffer_sizes[sample] >= SAMPLE_BUFFER_SIZE:
+                self.flush(sample)
+
+    def flush(self, sample, end_of_file=False):
+        """compress the buffered records of a sample, and write them out in order"""
+        if self.buffer_sizes[sample] > 0:
+            block = b"".join(self.buffers[sample])
+            self.buffers[sample] = []
+            self.buffer_sizes[sample] = 0
+            self.pending.append((self.compress_pool.submit(compress_gzip_member, block, 9), self.output_file(sample), end_of_file))
+        elif end_of_file:
+            self.pending.append((None, self.output_file(sample), end_of_file))
+        while len(self.pending) > self.max_pending:
+            self.write_next_member()
+
+    def write_next_member(self):
+        future, output_file, end_of_file = self.pending.popleft()
+        if future is not None:
+            self.file_pool.get(output_file).write(future.result())
+        if end_of_file:
+            self.file_pool.close(output_file)
+
+    def close(self):
+        for sample in self.buffers:
+            self.flush(sample, end_of_file=True)
+        while self.pending:
+            self.write_next_member()
+        if self.own_compress_pool:
+            self.compress_pool.shutdown()
+        self.file_pool.close_all()
+
+#====================================================================#
+
+# define a function to split a block of records up by sample:
+
+def group_records_by_sample(data, barcode_lookup):
+    """group the records in a block by the sample their barcode belongs to
+    >>> group_records_by_sample(b'@r1 1:N:0:AAAT\\nAC\\n+\\nFF\\n@r2 1:N:0:GGGG\\nAC\\n+\\nFF\\n', {b'AAAT': 's1'})
+    {'s1': [b'@r1 1:N:0:AAAT\\nAC\\n+\\nFF\\n'], 'Undetermined': [b'@r2 1:N:0:GGGG\\nAC\\n+\\nFF\\n']}
+    """
+
+    samples = {}
+    get_sample = barcode_lookup.get
+    for record, barcode in FASTQ_RECORDS_AND_BARCODES.findall(data):
+        sample = get_sample(barcode, UNDETERMINED)
+        records = samples.get(sample)
+        if records is None:
+            samples[sample] = [record]
+        else:
+            records.append(record)
+
+    return samples
+
+#====================================================================#
+
+# define a function to group the records of paired-end reads by sample, using the R1 barcodes:
+
+def group_paired_records_by_sample(data1, data2, barcode_lookup):
+    """group read pairs by the sample that the barcode in their R1 header belongs to"""
+
+    samples = {}
+    get_sample = barcode_lookup.get
+    records2 = FASTQ_RECORDS_AND_BARCODES.findall(data2)
+    for (record1, barcode), (record2, _) in zip(FASTQ_RECORDS_AND_BARCODES.findall(data1), records2):
+        sample = get_sample(barcode, UNDETERMINED)
+        records = samples.get(sample)
+        if records is None:
+            samples[sample] = ([record1], [record2])
+        else:
+            records[0].append(record1)
+            records[1].append(record2)
+
+    return samples
+
+#====================================================================#
+
+# write out the number of reads for each sample:
+
+def write_demux_summary(summary_file, barcodes, num_reads):
+
+    outputfileObj = open(summary_file, "w")
+    outputfileObj.write("sample\tbarcode\tnum_reads\n")
+    for sample in list(barcodes) + [UNDETERMINED]:
+        outputfileObj.write("%s\t%s\t%d\n" % (sample, barcodes.get(sample, "-"), num_reads.get(sample, 0)))
+    outputfileObj.close()
+
+    return
+
+#====================================================================#
@@ -0,0 +1,186 @@
+import json
+import numpy as np
+
+#====================================================================#
+
+# the bases we count at each position; anything else counts as N:
+
+BASES = "ACGTN"
+
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate("ACGT"):
+    BASE_CODES[ord(base)] = code
+    BASE_CODES[ord(base.lower())] = code
+
+NEWLINE = 10
+
+#====================================================================#
+
+# read QC statistics, built up from blocks of fastq records:
+
+class FastqQcStats:
+    """per-position quality and base composition, and read length, GC and N histograms
+
+    Whole blocks of records are decoded at once into uint8 NumPy arrays with a row
+    per read, so no Python code runs per read or per base. Reads are put in rows with
+    others of about the same length (padded to the longest of them), so a few long
+    reads don't make every row long, and the column is the position in the read.
+
+    >>> stats = FastqQcStats()
+    >>> stats.add_records(b'@r1\\nACGN\\n+\\nIII#\\n@r2\\nGG\\n+\\n55\\n')
+    >>> stats.num_reads, stats.num_bases
+    (2, 6)
+    >>> stats.mean_quality().tolist()
+    [30.0, 30.0, 40.0, 2.0]
+    >>> stats.base_counts[0].tolist()
+    [1, 0, 1, 0, 0]
+    >>> int(stats.gc_histogram[67]), int(stats.gc_histogram[100])
+    (1, 1)
+    """
+
+    def __init__(self, quality_offset=33):
+        self.quality_offset = quality_offset
+        self.num_reads = 0
+        self.num_bases = 0
+        self.quality_sums = np.zeros(0, dtype=np.float64) # sum of the qualities at each position
+        self.base_counts = np.zeros((0, len(BASES)), dtype=np.int64) # A, C, G, T and N counts at each position
+        self.length_histogram = np.zeros(0, dtype=np.int64)
+        self.gc_histogram = np.zeros(101, dtype=np.int64) # number of reads with each GC percent (of A/C/G/T bases)
+        self.n_content_histogram = np.zeros(101, dtype=np.int64) # number of reads with each percent of Ns
+
+    def grow(self, max_len):
+        """make room for reads up to max_len long"""
+        extra = max_len - len(self.quality_sums)
+        if extra > 0:
+            self.quality_sums = np.concatenate([self.quality_sums, np.zeros(extra)])
+            self.base_counts = np.concatenate([self.base_counts, np.zeros((extra, len(BASES)), dtype=np.int64)])
+        extra = max_len + 1 - len(self.length_histogram)
+        if extra > 0:
+            self.length_histogram = np.concatenate([self.length_histogram, np.zeros(extra, dtype=np.int64)])
+
+    def add_records(self, data):
+        """add a block of whole fastq records (bytes) to the statistics"""
+        chars = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(chars == NEWLINE).reshape(-1, 4) # the ends of the 4 lines of each record
+        if len(newlines) == 0:
+            return
+        seq_starts = newlines[:, 0] + 1
+        lengths = newlines[:, 1] - seq_starts
+        qual_starts = newlines[:, 2] + 1
+        if np.any(newlines[:, 3] - qual_starts != lengths):
+            raise ValueError("a fastq record has a quality string that is not the same length as its sequence")
+        self.grow(int(lengths.max()))
+        self.length_histogram += np.bincount(lengths, minlength=len(self.length_histogram))
+
+        # count the bases in reads of about the same length together, as uint8 rows
+        # padded to the longest of them, so the padding is at most a quarter:
+        gc_counts = np.zeros(len(lengths), dtype=np.int64)
+        n_counts = np.zeros(len(lengths), dtype=np.int64)
+        order = np.argsort(lengths, kind="stable")
+        sorted_lengths = lengths[order]
+        first = int(np.searchsorted(sorted_lengths, 1)) # reads with no bases have nothing to count
+        while first < len(order):
+            last = int(np.searchsorted(sorted_lengths, sorted_lengths[first] * 5 // 4, side="right"))
+            reads = order[first:last]
+            gc_counts[reads], n_counts[reads] = self.add_rows(chars, seq_starts[reads], qual_starts[reads], lengths[reads])
+            first = last
+
+        # GC and N content of each read:
+        acgt_counts = lengths - n_counts
+        has_acgt = acgt_counts > 0
+        gc_percents = np.rint(100.0 * gc_counts[has_acgt] / acgt_counts[has_acgt]).astype(np.int64)
+        self.gc_histogram += np.bincount(gc_percents, minlength=101)
+        n_percents = np.rint(100.0 * n_counts / np.maximum(lengths, 1)).astype(np.int64)
+        self.n_content_histogram += np.bincount(n_percents, minlength=101)
+
+        self.num_reads += len(lengths)
+        self.num_bases += int(lengths.sum())
+
+    def add_rows(self, chars, seq_starts, qual_starts, lengths):
+        """add reads of about the same length to the per-position statistics, and return their GC and N counts"""
+        num_rows = len(lengths)
+        row_len = int(lengths.max())
+        padded = int(lengths.min()) < row_len
+        seq_steps = np.diff(seq_starts)
+        qual_steps = np.diff(qual_starts)
+        if not padded and num_rows > 1 and (seq_steps == seq_steps[0]).all() and (qual_steps == qual_steps[0]).all():
+            # the records are all the same size, so the rows are views of the data:
+            seqs = np.lib.stride_tricks.as_strided(chars[seq_starts[0]:], (num_rows, row_len), (int(seq_steps[0]), 1), writeable=False)
+            quals = np.lib.stride_tricks.as_strided(chars[qual_starts[0]:], (num_rows, row_len), (int(qual_steps[0]), 1), writeable=False)
+        else:
+            # gather the rows through an int32 index of each base, reading the padding from
+            # whatever follows each read (kept inside the data) and masking it out below:
+            index_type = np.int32 if len(chars) < 2**31 - row_len else np.int64
+            index = seq_starts.astype(index_type)[:, None] + np.arange(row_len, dtype=index_type)
+            np.minimum(index, len(chars) - 1, out=index)
+            seqs = np.take(chars, index)
+            index += (qual_starts - seq_starts).astype(index_type)[:, None]
+            np.minimum(index, len(chars) - 1, out=index)
+            quals = np.take(chars, index)
+            del index
+
+        # upper case letters, with the padding as 0, which isn't a base:
+        upper = seqs & 0xDF
+        if padded:
+            padding = np.arange(row_len) >= lengths[:, None]
+            upper[padding] = 0
+            quals[padding] = self.quality_offset # adds nothing to the quality sums
+        self.quality_sums[:row_len] += quals.sum(axis=0, dtype=np.int32) - self.quality_offset * num_rows
+
+        is_gc = None
+        is_acgt = None
+        acgt_per_column = 0
+        for code, base in enumerate("ACGT"):
+            is_base = (upper == ord(base)).view(np.uint8)
+            base_per_column = is_base.sum(axis=0, dtype=np.int32)
+            self.base_counts[:row_len, code] += base_per_column
+            acgt_per_column = acgt_per_column + base_per_column
+            if base in "GC":
+                is_gc = is_base.copy() if is_gc is None else np.bitwise_or(is_gc, is_base, out=is_gc)
+            is_acgt = is_base if is_acgt is None else np.bitwise_or(is_acgt, is_base, out=is_acgt)
+        reads_per_column = num_rows - padding.sum(axis=0, dtype=np.int32) if padded else num_rows
+        self.base_counts[:row_len, 4] += reads_per_column - acgt_per_column # everything else is an N
+
+        return is_gc.sum(axis=1, dtype=np.int32), lengths - is_acgt.sum(axis=1, dtype=np.int32)
+
+    def merge(self, other):
+        """add the statistics from another FastqQcStats to these ones"""
+        self.grow(max(len(other.quality_sums), len(other.length_histogram) - 1))
+        self.quality_sums[:len(other.quality_sums)] += other.quality_sums
+        self.base_counts[:len(other.base_counts)] += other.base_counts
+        self.length_histogram[:len(other.length_histogram)] += other.length_histogram
+        self.gc_histogram += other.gc_histogram
+        self.n_content_histogram += other.n_content_histogram
+        self.num_reads += other.num_reads
+        self.num_bases += other.num_bases
+
+    def mean_quality(self):
+        """the mean quality at each position"""
+        return self.quality_sums / np.maximum(self.base_counts.sum(axis=1), 1)
+
+    def write(self, output_prefix):
+        """write the statistics to output_prefix.json (summary and histograms) and output_prefix.tsv (per position)"""
+        summary = {
+            "num_reads": self.num_reads,
+            "num_bases": self.num_bases,
+            "mean_read_length": self.num_bases / self.num_reads if self.num_reads else 0.0,
+            "mean_quality": float(self.quality_sums.sum() / self.num_bases) if self.num_bases else 0.0,
+            "gc_percent": float(100.0 * self.base_counts[:, 1:3].sum() / max(self.base_counts[:, :4].sum(), 1)),
+            "n_percent": float(100.0 * self.base_counts[:, 4].sum() / max(self.num_bases, 1)),
+            "read_length_histogram": {str(length): int(count) for length, count in enumerate(self.length_histogram) if count},
+            "gc_percent_histogram": self.gc_histogram.tolist(),
+            "n_percent_histogram": self.n_content_histogram.tolist(),
+        }
+        with open("%s.json" % output_prefix, "w") as outputfileObj:
+            json.dump(summary, outputfileObj, indent=1)
+            outputfileObj.write("\n")
+
+        mean_quality = self.mean_quality()
+        with open("%s.tsv" % output_prefix, "w") as outputfileObj:
+            outputfileObj.write("position\tmean_quality\t%s\n" % "\t".join(BASES))
+            for position, counts in enumerate(self.base_counts):
+                outputfileObj.write("%d\t%.2f\t%s\n" % (position + 1, mean_quality[position], "\t".join(str(count) for count in counts)))
+
+        return
+
+#====================================================================#
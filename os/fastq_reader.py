@@ -0,0 +1,275 @@
+import re
+import gzip
+import queue
+import threading
+
+#====================================================================#
+
+# size of each block of (uncompressed) data that we read from the input:
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# a run of complete fastq records, each with '@' and '+' at the start of its first and third lines:
+
+FASTQ_RECORDS = re.compile(rb"(?:@[^\n]*\n[^\n]*\n\+[^\n]*\n[^\n]*\n)*")
+
+# the read name from the header of each fastq record, without any /1 or /2 at the end:
+
+FASTQ_READ_NAMES = re.compile(rb"@(\S*?)(?:/[12])?(?:[ \t][^\n]*)?\n[^\n]*\n[^\n]*\n[^\n]*\n")
+
+#====================================================================#
+
+# define a function to open a fastq file in binary mode, whether it is gzipped or not:
+
+def open_fastq_input(input_fastq_file):
+    """open a fastq file for reading bytes, gunzipping it if it is gzipped"""
+
+    fileObj = open(input_fastq_file, "rb")
+    magic = fileObj.read(2)
+    fileObj.seek(0)
+    if magic == GZIP_MAGIC:
+        fileObj.close()
+        fileObj = gzip.open(input_fastq_file, "rb") # this opens a gzipped file in binary mode
+    return fileObj
+
+#====================================================================#
+
+# define a function to find the complete fastq records at the start of a block of bytes:
+
+def find_complete_fastq_records(data, first_record_num=1, validate=True):
+    """find the complete 4-line fastq records at the start of a block of bytes
+
+    Returns (end, num_records), where data[:end] holds the num_records complete
+    records and anything after 'end' is a partial record. If 'validate' is True,
+    check that each record's first line starts with '@' and its third line starts
+    with '+'; 'first_record_num' is only used in the error message. The work is
+    done by a compiled regular expression and bytes.count(), so no Python code runs
+    per line or per record.
+
+    >>> find_complete_fastq_records(b'@r1\\nACGT\\n+\\nFFFF\\n@r2\\nAC')
+    (16, 1)
+    >>> find_complete_fastq_records(b'@r1\\nACGT\\n+\\nFFFF\\n@r2\\nAC', validate=False)
+    (16, 1)
+    >>> find_complete_fastq_records(b'@r1\\nACGT\\n+\\nFFFF\\n@r2\\nACGT\\nFFFF\\n+\\n')
+    Traceback (most recent call last):
+    ...
+    ValueError: fastq record 2 does not have '@' and '+' at the start of its first and third lines
+    """
+
+    if validate:
+        end = FASTQ_RECORDS.match(data).end()
+        num_records = data.count(b"\n", 0, end) // 4
+        if data.count(b"\n", end) >= 4 and not data[end:].isspace(): # the next record is complete (not just blank lines at the end of the file), so it must be malformed
+            raise ValueError("fastq record %d does not have '@' and '+' at the start of its first and third lines" % (first_record_num + num_records))
+    else:
+        num_lines = data.count(b"\n")
+        num_records = num_lines // 4
+        # step back over the lines of the partial record at the end:
+        end = len(data)
+        for _ in range(num_lines - num_records * 4 + 1):
+            end = data.rfind(b"\n", 0, end)
+        end += 1
+
+    return end, num_records
+
+#====================================================================#
+
+# define a function to find the offset just after a number of fastq records:
+
+def find_fastq_record_offset(data, start, num_records):
+    """find the offset in 'data' just after 'num_records' complete records from 'start'
+
+    The first record's length is used to guess the offset, bytes.count() says how
+    many lines the guess is out by, and only those few lines are stepped over one
+    at a time. For reads of a fixed length the guess is exact.
+
+    >>> find_fastq_record_offset(b'@r1\\nACGT\\n+\\nFFFF\\n@r2\\nAC\\n+\\nFF\\n', 0, 1)
+    16
+    >>> find_fastq_record_offset(b'@r1\\nACGT\\n+\\nFFFF\\n@r2\\nAC\\n+\\nFF\\n@r3\\nA\\n+\\nF\\n', 0, 2)
+    28
+    """
+
+    if num_records == 0:
+        return start
+    target = num_records * 4 # the number of lines to step over
+
+    # guess the offset from the length of the first record:
+    first_record_len = start
+    for _ in range(4):
+        first_record_len = data.find(b"\n", first_record_len) + 1
+    first_record_len -= start
+    pos = min(start + num_records * first_record_len, len(data))
+
+    # then correct the guess:
+    num_lines = data.count(b"\n", start, pos)
+    if num_lines < target:
+        for _ in range(target - num_lines):
+            pos = data.find(b"\n", pos) + 1
+    else:
+        for _ in range(num_lines - target + 1):
+            pos = data.rfind(b"\n", start, pos)
+        pos += 1
+
+    return pos
+
+#====================================================================#
+
+# define a function to read a fastq file in large blocks of whole records:
+
+def read_fastq_chunks(fileObj, chunk_size=DEFAULT_CHUNK_SIZE, validate=True):
+    """read a fastq file (opened in binary mode) in blocks of whole records
+
+    Yields (data, num_records) tuples, where 'data' is a bytes object holding
+    num_records complete records. A record cut across the edge of a block is
+    carried over to the next block, and the data is never decoded into strings.
+
+    >>> import io
+    >>> fastq = io.BytesIO(b'@r1\\nACGT\\n+\\nFFFF\\n@r2\\nAC\\n+\\nFF')
+    >>> list(read_fastq_chunks(fastq, chunk_size=20))
+    [(b'@r1\\nACGT\\n+\\nFFFF\\n', 1), (b'@r2\\nAC\\n+\\nFF\\n', 1)]
+    >>> list(read_fastq_chunks(io.BytesIO(b'@r1\\nACGT\\n+\\nFFFF\\n\\n\\n\\n\\n\\n'), chunk_size=6))
+    [(b'@r1\\nACGT\\n+\\nFFFF\\n', 1)]
+    """
+
+    pieces = [] # a partial record carried over from the blocks before, in the pieces it was read in
+    num_lines = 0 # the number of newlines in 'pieces'
+    record_num = 1
+    while True:
+        chunk = fileObj.read(chunk_size)
+        if not chunk:
+            break
+        pieces.append(chunk)
+        num_lines += chunk.count(b"\n")
+        if num_lines < 4:
+            continue # no record can be complete yet, so don't join up the pieces of a long record every time
+        data = b"".join(pieces) if len(pieces) > 1 else chunk
+        end, num_records = find_complete_fastq_records(data, record_num, validate)
+        leftover = data[end:] # a partial record, or a record longer than the chunk size
+        pieces = [leftover] if leftover else []
+        num_lines = leftover.count(b"\n")
+        if num_records:
+            record_num += num_records
+            yield data[:end] if end < len(data) else data, num_records
+
+    # the last record may be missing the newline at the end of the file, and there may be blank lines after it:
+    leftover = b"".join(pieces)
+    if leftover and not leftover.endswith(b"\n"):
+        leftover += b"\n"
+    end, num_records = find_complete_fastq_records(leftover, record_num, validate)
+    if end < len(leftover) and not leftover[end:].isspace():
+        raise ValueError("fastq record %d is truncated at the end of the file" % (record_num + num_records))
+    if num_records:
+        yield leftover[:end] if end < len(leftover) else leftover, num_records
+
+#====================================================================#
+
+# define a function to run an iterator in a background thread:
+
+def read_in_background(iterator, depth=4):
+    """run an iterator in a background thread, keeping up to 'depth' items ready
+
+    zlib releases the GIL while it decompresses, so reading a gzipped file this
+    way lets the decompression run at the same time as whatever the main thread
+    does with the data. Exceptions are passed on to the main thread.
+
+    >>> list(read_in_background(iter([1, 2, 3])))
+    [1, 2, 3]
+    """
+
+    items = queue.Queue(maxsize=depth)
+    finished = object()
+
+    def run():
+        try:
+            for item in iterator:
+                items.put((item, None))
+            items.put((finished, None))
+        except Exception as error: # pylint: disable=broad-except
+            items.put((finished, error))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    while True:
+        item, error = items.get()
+        if item is finished:
+            break
+        yield item
+    thread.join()
+    if error is not None:
+        raise error
+
+#====================================================================#
+
+# define a function to read the R1 and R2 fastq files of paired-end reads together:
+
+def read_paired_fastq_chunks(fileObj1, fileObj2, chunk_size=DEFAULT_CHUNK_SIZE, check_names=True):
+    """read the R1 and R2 fastq files of paired-end reads in step with each other
+
+    Yields (data1, data2, num_records) tuples, where the bytes objects data1 and
+    data2 hold the same num_records read pairs from the two files. Both files are read (and
+    decompressed) in their own background threads. If 'check_names' is True,
+    check that the read names agree record by record, ignoring any /1 or /2 at the
+    end of the names.
+
+    >>> import io
+    >>> r1 = io.BytesIO(b'@r1/1\\nACGT\\n+\\nFFFF\\n@r2/1\\nAC\\n+\\nFF\\n')
+    >>> r2 = io.BytesIO(b'@r1/2\\nTT\\n+\\nFF\\n@r2/2\\nGGG\\n+\\nFFF\\n')
+    >>> list(read_paired_fastq_chunks(r1, r2, chunk_size=25))
+    [(b'@r1/1\\nACGT\\n+\\nFFFF\\n', b'@r1/2\\nTT\\n+\\nFF\\n', 1), (b'@r2/1\\nAC\\n+\\nFF\\n', b'@r2/2\\nGGG\\n+\\nFFF\\n', 1)]
+    >>> r1 = io.BytesIO(b'@r1 1:N:0:ACGT\\nACGT\\n+\\nFFFF\\n')
+    >>> r2 = io.BytesIO(b'@r9 2:N:0:ACGT\\nACGT\\n+\\nFFFF\\n')
+    >>> list(read_paired_fastq_chunks(r1, r2))
+    Traceback (most recent call last):
+    ...
+    ValueError: read names differ between R1 and R2 at read pair 1: r1 and r9
+    >>> r1 = io.BytesIO(b'@r1\\r\\nACGT\\n+\\nFFFF\\n')
+    >>> r2 = io.BytesIO(b'@r1\\nACGT\\n+\\nFFFF\\n')
+    >>> list(read_paired_fastq_chunks(r1, r2))
+    Traceback (most recent call last):
+    ...
+    ValueError: could not read the names of all the reads in R1 and R2 in read pairs 1 to 1 (found 0 and 1 names)
+    """
+
+    chunks1 = read_in_background(read_fastq_chunks(fileObj1, chunk_size))
+    chunks2 = read_in_background(read_fastq_chunks(fileObj2, chunk_size))
+    data1, remaining1, start1 = None, 0, 0
+    data2, remaining2, start2 = None, 0, 0
+    record_num = 1
+    while True:
+        if remaining1 == 0:
+            data1, remaining1 = next(chunks1, (None, 0))
+            start1 = 0
+        if remaining2 == 0:
+            data2, remaining2 = next(chunks2, (None, 0))
+            start2 = 0
+        if remaining1 == 0 or remaining2 == 0:
+            break
+
+        # take the same number of records from each file:
+        num_records = min(remaining1, remaining2)
+        end1 = len(data1) if num_records == remaining1 else find_fastq_record_offset(data1, start1, num_records)
+        end2 = len(data2) if num_records == remaining2 else find_fastq_record_offset(data2, start2, num_records)
+        piece1 = data1[start1:end1] if end1 - start1 < len(data1) else data1
+        piece2 = data2[start2:end2] if end2 - start2 < len(data2) else data2
+        if check_names:
+            names1 = FASTQ_READ_NAMES.findall(piece1)
+            names2 = FASTQ_READ_NAMES.findall(piece2)
+            if names1 != names2:
+                for i, (name1, name2) in enumerate(zip(names1, names2)):
+                    if name1 != name2:
+                        raise ValueError("read names differ between R1 and R2 at read pair %d: %s and %s" % (record_num + i, name1.decode(), name2.decode()))
+                # the names that were found agree, so some headers couldn't be read in one of the files:
+                raise ValueError("could not read the names of all the reads in R1 and R2 in read pairs %d to %d (found %d and %d names)" % (record_num, record_num + num_records - 1, len(names1), len(names2)))
+        yield piece1, piece2, num_records
+        record_num += num_records
+        remaining1 -= num_records
+        remaining2 -= num_records
+        start1 = end1
+        start2 = end2
+
+    if remaining1 != 0 or remaining2 != 0:
+        raise ValueError("R1 and R2 have different numbers of reads; the shorter one ends after read pair %d" % (record_num - 1))
+
+#====================================================================#
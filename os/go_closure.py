@@ -0,0 +1,297 @@
+# Script to build an index of all the ancestors of every term of the Gene Ontology
+# (the transitive closure of the DAG), with their distances, so that questions like
+# "is A an ancestor of B?" or "what are the lowest common ancestors of A and B?" are
+# answered by looking things up rather than traversing the DAG each time (like
+# BFS_dist_from_node() in tree_traversal.py does)
+
+import sys
+import os
+import json
+import time
+import shutil
+import random
+import numpy as np
+from go_dag import GODag, DEFAULT_RELATIONSHIPS, find_ancestor_distances
+from tree_traversal import BFS_dist_from_node
+
+#====================================================================#
+
+# the index is a directory written next to the OBO file, eg. go-basic.obo.closure, of
+# .npy files that are memory-mapped when read, so that worker processes share one copy:
+
+INDEX_SUFFIX = ".closure"
+
+INDEX_VERSION = 1
+
+#====================================================================#
+
+# define a function to get the file details that tell us if the index is out of date:
+
+def get_obo_file_stamp(obo_file, relationships):
+
+    stat = os.stat(obo_file)
+    stamp = "%d %d %d %s" % (INDEX_VERSION, stat.st_size, stat.st_mtime_ns, ",".join(relationships))
+
+    return stamp
+
+#====================================================================#
+
+# define a function to find the closure of a DAG:
+
+def build_closure_arrays(dag):
+    """returns (indptr, keys, distances, depths) arrays for a GODag
+
+    The ancestors of term t (including t itself) are encoded as keys t * n + ancestor,
+    in keys[indptr[t]:indptr[t+1]], sorted, with the minimum distances from t to them
+    in the same places of 'distances'. Since the keys of term t are all smaller than
+    those of term t+1, the whole keys array is sorted, so any number of (term,
+    ancestor) pairs can be looked up in it at once with a binary search. depths[t] is
+    the minimum distance from t to a root of the DAG.
+
+    >>> dag = GODag({'B': ['A'], 'C': ['A'], 'D': ['B', 'C'], 'E': ['D']})
+    >>> indptr, keys, distances, depths = build_closure_arrays(dag)
+    >>> indptr.tolist(), (keys % 5).tolist(), distances.tolist(), depths.tolist()
+    ([0, 1, 3, 5, 9, 14], [0, 0, 1, 0, 2, 0, 1, 2, 3, 0, 1, 2, 3, 4], [0, 1, 0, 1, 0, 2, 1, 1, 0, 3, 2, 2, 1, 0], [0, 1, 1, 2, 3])
+    """
+
+    num_terms = len(dag)
+    queries, ancestors, distances = find_ancestor_distances(dag.indptr, dag.indices, num_terms, np.arange(num_terms))
+    keys = queries * num_terms + ancestors
+    order = np.argsort(keys)
+    keys = keys[order]
+    distances = distances[order]
+    indptr = np.zeros(num_terms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(queries, minlength=num_terms), out=indptr[1:])
+
+    # the depth of a term is its smallest distance to a root (there is always one, maybe the term itself):
+    is_root = np.diff(dag.indptr) == 0
+    root_distances = np.where(is_root[keys % num_terms], distances, np.iinfo(np.int32).max)
+    depths = np.minimum.reduceat(root_distances, indptr[:-1]).astype(np.int32)
+
+    return indptr, keys, distances, depths
+
+#====================================================================#
+
+# define a function to write the index:
+
+def write_go_closure(dag, index_dir, stamp):
+    """build the closure of the DAG, and write it to index_dir (in a temporary directory that is then renamed)"""
+
+    indptr, keys, distances, depths = build_closure_arrays(dag)
+    temp_dir = "%s.%d.tmp" % (index_dir, os.getpid())
+    if os.path.exists(temp_dir):
+        shutil.rmtree(temp_dir)
+    os.mkdir(temp_dir)
+    np.save(os.path.join(temp_dir, "indptr.npy"), indptr)
+    np.save(os.path.join(temp_dir, "keys.npy"), keys)
+    np.save(os.path.join(temp_dir, "distances.npy"), distances)
+    np.save(os.path.join(temp_dir, "depths.npy"), depths)
+    with open(os.path.join(temp_dir, "terms.json"), "w") as outputfileObj:
+        json.dump({"stamp": stamp, "terms": dag.terms, "term_ids": dag.term_ids}, outputfileObj)
+    if os.path.exists(index_dir):
+        old_dir = "%s.%d.old" % (index_dir, os.getpid())
+        os.replace(index_dir, old_dir)
+        os.replace(temp_dir, index_dir)
+        shutil.rmtree(old_dir)
+    else:
+        os.replace(temp_dir, index_dir)
+
+    return
+
+#====================================================================#
+
+# the ancestors of every term of the DAG:
+
+class GOClosure:
+    """answer ancestry, distance and lowest common ancestor questions from the arrays of build_closure_arrays()
+
+    >>> closure = GOClosure(GODag({'B': ['A'], 'C': ['A'], 'D': ['B', 'C'], 'E': ['D'], 'F': ['C']}))
+    >>> closure.is_ancestor('B', 'E'), closure.is_ancestor('E', 'B'), closure.is_ancestor('F', 'E')
+    (True, False, False)
+    >>> closure.distance('A', 'E'), closure.distance('F', 'E'), closure.depth('E')
+    (3, None, 3)
+    >>> closure.lowest_common_ancestors('E', 'F'), closure.lowest_common_ancestors('D', 'B')
+    (['C'], ['B'])
+    >>> closure.ancestor_distances('D') == BFS_dist_from_node('D', {'B': ['A'], 'C': ['A'], 'D': ['B', 'C']})
+    True
+    """
+
+    def __init__(self, dag=None, arrays=None, terms=None, term_ids=None):
+        if dag is not None:
+            arrays = build_closure_arrays(dag)
+            terms = dag.terms
+            term_ids = dag.term_ids
+        (self.indptr, self.keys, self.distances, self.depths) = arrays
+        self.terms = terms
+        self.term_ids = term_ids
+        self.num_terms = len(terms)
+
+    @classmethod
+    def load(cls, index_dir):
+        """read an index written by write_go_closure(), memory-mapping the arrays"""
+        arrays = tuple(np.load(os.path.join(index_dir, name + ".npy"), mmap_mode="r") for name in ("indptr", "keys", "distances", "depths"))
+        with open(os.path.join(index_dir, "terms.json"), "r") as fileObj:
+            details = json.load(fileObj)
+        return cls(arrays=arrays, terms=details["terms"], term_ids=details["term_ids"])
+
+    def get_term_ids(self, terms):
+        """the ids of some terms (or of their main ids, for alternative ids)"""
+        try:
+            return np.array([self.term_ids[term] for term in terms], dtype=np.int64)
+        except KeyError as error:
+            raise KeyError("%s is not a term in the DAG" % error.args[0]) from None
+
+    def find_pairs(self, ancestor_ids, term_ids):
+        """returns (found, positions): whether each ancestor is an ancestor of (or the same as) each term, and where that pair is in keys"""
+        wanted = np.asarray(term_ids, dtype=np.int64) * self.num_terms + np.asarray(ancestor_ids, dtype=np.int64)
+        positions = np.searchsorted(self.keys, wanted)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == wanted[found]
+        return found, positions
+
+    def is_ancestor_batch(self, ancestor_ids, term_ids):
+        """a boolean array of whether each ancestor_ids[i] is an ancestor of (or the same as) term_ids[i]"""
+        return self.find_pairs(ancestor_ids, term_ids)[0]
+
+    def distance_batch(self, ancestor_ids, term_ids):
+        """the minimum distances from each term_ids[i] up to ancestor_ids[i], or -1 where it isn't an ancestor"""
+        found, positions = self.find_pairs(ancestor_ids, term_ids)
+        distances = np.full(len(found), -1, dtype=np.int32)
+        distances[found] = self.distances[positions[found]]
+        return distances
+
+    def find_pair(self, ancestor, term):
+        """where the pair is in keys, or -1 if 'ancestor' is not an ancestor of (or the same as) 'term'"""
+        term_id = self.term_ids[term]
+        key = term_id * self.num_terms + self.term_ids[ancestor]
+        start = int(self.indptr[term_id])
+        end = int(self.indptr[term_id + 1])
+        position = start + int(self.keys[start:end].searchsorted(key)) # the ancestors of one term, so a short search
+        if position < end and self.keys[position] == key:
+            return position
+        return -1
+
+    def is_ancestor(self, ancestor, term):
+        return self.find_pair(ancestor, term) >= 0
+
+    def distance(self, ancestor, term):
+        position = self.find_pair(ancestor, term)
+        return None if position < 0 else int(self.distances[position])
+
+    def depth(self, term):
+        return int(self.depths[self.term_ids[term]])
+
+    def ancestor_ids(self, term_id):
+        """the sorted ids of the ancestors of a term (including itself)"""
+        return self.keys[self.indptr[term_id]:self.indptr[term_id + 1]] - term_id * self.num_terms
+
+    def ancestor_distances(self, term):
+        """a dictionary of {ancestor: minimum distance}, like BFS_dist_from_node() in tree_traversal.py"""
+        term_id = self.term_ids[term]
+        distances = self.distances[self.indptr[term_id]:self.indptr[term_id + 1]]
+        return {self.terms[ancestor_id]: distance for ancestor_id, distance in zip(self.ancestor_ids(term_id).tolist(), distances.tolist())}
+
+    def lowest_common_ancestors(self, term1, term2):
+        """the common ancestors of two terms that are not ancestors of any other common ancestor, deepest first"""
+        common = np.intersect1d(self.ancestor_ids(self.term_ids[term1]), self.ancestor_ids(self.term_ids[term2]), assume_unique=True)
+        # take away the ancestors of the common ancestors, apart from themselves:
+        above = []
+        for common_id in common.tolist():
+            ancestor_ids = self.ancestor_ids(common_id)
+            above.append(ancestor_ids[ancestor_ids != common_id])
+        if above:
+            common = np.setdiff1d(common, np.concatenate(above), assume_unique=True)
+        lowest = sorted(common.tolist(), key=lambda term_id: (-self.depths[term_id], self.terms[term_id]))
+        return [self.terms[term_id] for term_id in lowest]
+
+#====================================================================#
+
+# define a function to read in the index of an OBO file, building it if need be:
+
+def load_go_closure(obo_file, relationships=DEFAULT_RELATIONSHIPS):
+    """read in the closure index of an OBO file, (re)building it if it is missing or the file has changed since
+
+    If the index can't be written (eg. the OBO file is in a read-only directory),
+    the closure is built in memory instead.
+    """
+
+    index_dir = obo_file + INDEX_SUFFIX
+    if len(relationships) != 1 or relationships[0] != "is_a":
+        index_dir = "%s.%s%s" % (obo_file, "_".join(relationships), INDEX_SUFFIX)
+    stamp = get_obo_file_stamp(obo_file, relationships)
+    current = False
+    if os.path.exists(os.path.join(index_dir, "terms.json")):
+        with open(os.path.join(index_dir, "terms.json"), "r") as fileObj:
+            try:
+                current = json.load(fileObj).get("stamp") == stamp
+            except ValueError:
+                current = False
+    if not current:
+        print("Building closure index",index_dir,"...")
+        dag = GODag.from_obo(obo_file, relationships)
+        try:
+            write_go_closure(dag, index_dir, stamp)
+        except OSError as error:
+            print("Could not write closure index",index_dir,"(%s), so keeping it in memory" % error)
+            return GOClosure(dag)
+
+    return GOClosure.load(index_dir)
+
+#====================================================================#
+
+# define a function to compare the closure index with traversing the DAG each time:
+
+def benchmark_go_closure(obo_file, num_queries):
+    """time is-ancestor queries for random pairs of terms with the index and with BFS_dist_from_node(), and check they agree"""
+
+    dag = GODag.from_obo(obo_file)
+    parents = {term: [dag.terms[parent_id] for parent_id in dag.indices[dag.indptr[i]:dag.indptr[i + 1]].tolist()] for i, term in enumerate(dag.terms)}
+    closure = load_go_closure(obo_file)
+    random.seed(1)
+    pairs = [(random.choice(dag.terms), random.choice(dag.terms)) for _ in range(num_queries)]
+    # make about half of the pairs true, by picking an ancestor of the term:
+    pairs = [(random.choice(list(closure.ancestor_distances(term))), term) if i % 2 == 0 else (ancestor, term) for i, (ancestor, term) in enumerate(pairs)]
+
+    start_time = time.time()
+    traversal_answers = [BFS_dist_from_node(term, parents).get(ancestor, -1) for ancestor, term in pairs]
+    traversal_seconds = time.time() - start_time
+
+    start_time = time.time()
+    closure_answers = [closure.distance(ancestor, term) for ancestor, term in pairs]
+    closure_answers = [-1 if distance is None else distance for distance in closure_answers]
+    single_seconds = time.time() - start_time
+
+    start_time = time.time()
+    batch_answers = closure.distance_batch(closure.get_term_ids([pair[0] for pair in pairs]), closure.get_term_ids([pair[1] for pair in pairs])).tolist()
+    batch_seconds = time.time() - start_time
+
+    assert traversal_answers == closure_answers == batch_answers
+    print("%d distance queries: BFS_dist_from_node %.3f s, index one at a time %.3f s, index in a batch %.4f s" % (num_queries, traversal_seconds, single_seconds, batch_seconds))
+
+    return
+
+#====================================================================#
+
+def main():
+
+    # check the command-line arguments:
+    if len(sys.argv) not in (2, 3) or os.path.exists(sys.argv[1]) == False:
+        print("Usage: %s obo_file [num_benchmark_queries]" % sys.argv[0])
+        sys.exit(1)
+    obo_file = sys.argv[1] # eg. go-basic.obo
+
+    # build the index (if it isn't there already or is out of date):
+    closure = load_go_closure(obo_file)
+    print("The index has",len(closure.keys),"(term, ancestor) pairs for",closure.num_terms,"terms")
+
+    if len(sys.argv) == 3:
+        benchmark_go_closure(obo_file, int(sys.argv[2]))
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
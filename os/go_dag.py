@@ -0,0 +1,281 @@
+# Script to find the ancestors of Gene Ontology terms, and their minimum distances
+# from the terms, for many terms at once. The GO DAG is read from an OBO file (eg.
+# go-basic.obo) into integer-indexed CSR arrays, so a traversal is a few NumPy
+# array operations per level of the DAG rather than Python work per edge (see
+# tree_traversal.py for the simple versions).
+
+import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+#====================================================================#
+
+# the relationships to follow up the DAG by default; 'part_of' is another common choice:
+
+DEFAULT_RELATIONSHIPS = ("is_a",)
+
+# the batch traversal keeps a 4-byte number for each (query, term) pair, so limit how many bytes of these are used at once:
+
+VISITED_BUDGET = 128 * 1024 * 1024
+
+#====================================================================#
+
+# define a function to read the parents of each term from an OBO file:
+
+def read_obo_parents(obo_file, relationships=DEFAULT_RELATIONSHIPS):
+    """read an OBO file, and return (parents, alt_ids): a dictionary from each term to its list
+    of parents, and a dictionary from each alternative id to its term
+
+    Obsolete terms are left out. 'relationships' are the relationship types to
+    follow, eg. ('is_a', 'part_of').
+    """
+
+    parents = {}
+    alt_ids = {}
+    term = None
+    term_parents = []
+    term_alt_ids = []
+    obsolete = False
+    in_term = False
+    fileObj = open(obo_file, "r")
+    for line in fileObj:
+        line = line.strip()
+        if line.startswith('['): # the start of a new stanza, eg. [Term] or [Typedef]
+            if term is not None and not obsolete:
+                parents[term] = term_parents
+                for alt_id in term_alt_ids:
+                    alt_ids[alt_id] = term
+            term = None
+            term_parents = []
+            term_alt_ids = []
+            obsolete = False
+            in_term = line == '[Term]'
+        elif not line or not in_term:
+            continue
+        elif line.startswith('id: '): # eg. id: GO:0000001
+            term = line[4:].strip()
+        elif line.startswith('alt_id: '): # eg. alt_id: GO:0019952
+            term_alt_ids.append(line[8:].strip())
+        elif line.startswith('is_a: '): # eg. is_a: GO:0048308 ! organelle inheritance
+            if 'is_a' in relationships:
+                term_parents.append(line[6:].split('!')[0].strip())
+        elif line.startswith('relationship: '): # eg. relationship: part_of GO:0005739 ! mitochondrion
+            temp = line[14:].split()
+            if temp[0] in relationships:
+                term_parents.append(temp[1])
+        elif line == 'is_obsolete: true':
+            obsolete = True
+    fileObj.close()
+    if term is not None and not obsolete:
+        parents[term] = term_parents
+        for alt_id in term_alt_ids:
+            alt_ids[alt_id] = term
+
+    return parents, alt_ids
+
+#====================================================================#
+
+# define a function to traverse the DAG upwards from many terms at once:
+
+def find_ancestor_distances(indptr, indices, num_terms, query_ids):
+    """returns (query numbers, ancestor ids, distances) arrays for the ancestors of each query
+    (including the query itself, at distance 0), sorted by query number
+
+    This is a level-synchronous breadth-first search from all the queries at once.
+    Each level takes the (query, term) pairs of the frontier, gathers the parents of
+    all their terms from the CSR arrays, and keeps the (query, parent) pairs that
+    have not been visited yet. Each pair is visited once, so it is O(V+E) for each
+    query, and the first level a pair is reached at is its minimum distance.
+
+    >>> indptr = np.array([0, 2, 2, 3])
+    >>> indices = np.array([1, 2, 1])
+    >>> [array.tolist() for array in find_ancestor_distances(indptr, indices, 3, np.array([0, 2]))]
+    [[0, 0, 0, 1, 1], [0, 1, 2, 2, 1], [0, 1, 1, 0, 1]]
+    """
+
+    query_ids = np.asarray(query_ids, dtype=np.int64)
+    all_queries = []
+    all_ancestors = []
+    all_distances = []
+    chunk_size = max(1, VISITED_BUDGET // (4 * max(num_terms, 1)))
+    for chunk_start in range(0, len(query_ids), chunk_size):
+        chunk = query_ids[chunk_start:chunk_start + chunk_size]
+        # -1 for the (query, term) pairs that haven't been reached yet:
+        pair_numbers = np.full(len(chunk) * num_terms, -1, dtype=np.int32)
+        keys = np.arange(len(chunk), dtype=np.int64) * num_terms + chunk
+        pair_numbers[keys] = 0
+        distance = 0
+        while len(keys) > 0:
+            queries = keys // num_terms
+            nodes = keys % num_terms
+            all_queries.append(queries + chunk_start)
+            all_ancestors.append(nodes)
+            all_distances.append(np.full(len(nodes), distance, dtype=np.int32))
+            # gather the parents of all the frontier terms:
+            starts = indptr[nodes]
+            counts = indptr[nodes + 1] - starts
+            total = counts.sum()
+            if total == 0:
+                break
+            which = np.repeat(np.arange(len(nodes)), counts)
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            keys = queries[which] * num_terms + indices[starts[which] + offsets]
+            # keep the (query, parent) pairs we haven't seen before, once each: number the new
+            # pairs, and keep each pair where its number is the one that stuck (without sorting them):
+            keys = keys[pair_numbers[keys] < 0]
+            numbers = np.arange(len(keys), dtype=np.int32)
+            pair_numbers[keys] = numbers
+            keys = keys[pair_numbers[keys] == numbers]
+            distance += 1
+    if not all_queries:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+    queries = np.concatenate(all_queries)
+    ancestors = np.concatenate(all_ancestors)
+    distances = np.concatenate(all_distances)
+    order = np.argsort(queries, kind="stable")
+
+    return queries[order], ancestors[order], distances[order]
+
+#====================================================================#
+
+# the CSR arrays of the DAG for each worker process, set once when the worker starts:
+
+worker_dag = None
+
+# define a function to give a worker process the DAG:
+
+def set_worker_dag(indptr, indices, num_terms):
+
+    global worker_dag
+    worker_dag = (indptr, indices, num_terms)
+
+# define a function to traverse the DAG from some queries, in a worker process:
+
+def find_ancestor_distances_in_worker(query_ids):
+
+    (indptr, indices, num_terms) = worker_dag
+
+    return find_ancestor_distances(indptr, indices, num_terms, query_ids)
+
+#====================================================================#
+
+# the GO DAG, with each term's parents stored as CSR arrays:
+
+class GODag:
+    """the terms of a DAG, numbered 0..n-1, with the parents of term i in indices[indptr[i]:indptr[i+1]]
+
+    >>> parents = {'N1': ['N2', 'N3', 'N4'], 'N3': ['N6', 'N7'], 'N4': ['N3'], 'N5': ['N4', 'N8'], 'N6': ['N13'],
+    ...            'N8': ['N9'], 'N9': ['N11'], 'N10': ['N7', 'N9'], 'N11': ['N14'], 'N12': ['N5']}
+    >>> dag = GODag(parents)
+    >>> sorted(dag.ancestor_distances('N1').items())
+    [('N1', 0), ('N13', 3), ('N2', 1), ('N3', 1), ('N4', 1), ('N6', 2), ('N7', 2)]
+    >>> [len(distances) for distances in dag.ancestor_distances_batch(['N12', 'N14'])]
+    [11, 1]
+    """
+
+    def __init__(self, parents, alt_ids=None):
+        terms = set(parents)
+        for term_parents in parents.values():
+            terms.update(term_parents)
+        self.terms = sorted(terms)
+        self.term_ids = {term: i for i, term in enumerate(self.terms)}
+        if alt_ids is not None:
+            for alt_id, term in alt_ids.items():
+                if alt_id not in self.term_ids and term in self.term_ids:
+                    self.term_ids[alt_id] = self.term_ids[term]
+        counts = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        indices = []
+        for term in self.terms:
+            term_parents = sorted(set(self.term_ids[parent] for parent in parents.get(term, [])))
+            counts[self.term_ids[term] + 1] = len(term_parents)
+            indices.extend(term_parents)
+        self.indptr = np.cumsum(counts)
+        self.indices = np.array(indices, dtype=np.int32)
+
+    @classmethod
+    def from_obo(cls, obo_file, relationships=DEFAULT_RELATIONSHIPS):
+        """read the DAG from an OBO file"""
+        parents, alt_ids = read_obo_parents(obo_file, relationships)
+        return cls(parents, alt_ids)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def get_term_ids(self, terms):
+        """the ids of some terms (or of their main ids, for alternative ids)"""
+        try:
+            return np.array([self.term_ids[term] for term in terms], dtype=np.int64)
+        except KeyError as error:
+            raise KeyError("%s is not a term in the DAG" % error.args[0]) from None
+
+    def ancestor_distance_arrays(self, query_ids, num_processes=1):
+        """like find_ancestor_distances(), optionally splitting the queries between a pool of processes"""
+        query_ids = np.asarray(query_ids, dtype=np.int64)
+        if num_processes <= 1 or len(query_ids) < 2 * num_processes:
+            return find_ancestor_distances(self.indptr, self.indices, len(self.terms), query_ids)
+        chunks = np.array_split(np.arange(len(query_ids)), num_processes * 4)
+        pool = ProcessPoolExecutor(max_workers=num_processes, initializer=set_worker_dag, initargs=(self.indptr, self.indices, len(self.terms)))
+        results = list(pool.map(find_ancestor_distances_in_worker, [query_ids[chunk] for chunk in chunks]))
+        pool.shutdown()
+        queries = np.concatenate([chunk[result[0]] for chunk, result in zip(chunks, results)])
+        ancestors = np.concatenate([result[1] for result in results])
+        distances = np.concatenate([result[2] for result in results])
+        return queries, ancestors, distances
+
+    def ancestor_distances_batch(self, query_terms, num_processes=1):
+        """return a list with a dictionary of {ancestor: minimum distance} for each query term"""
+        queries, ancestors, distances = self.ancestor_distance_arrays(self.get_term_ids(query_terms), num_processes)
+        bounds = np.searchsorted(queries, np.arange(len(query_terms) + 1))
+        ancestor_terms = [self.terms[i] for i in ancestors.tolist()]
+        distances = distances.tolist()
+        return [dict(zip(ancestor_terms[start:end], distances[start:end])) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def ancestor_distances(self, query_term):
+        """return a dictionary of {ancestor: minimum distance} for one term, like BFS_dist_from_node() in tree_traversal.py"""
+        return self.ancestor_distances_batch([query_term])[0]
+
+#====================================================================#
+
+def main():
+
+    # check the command-line arguments:
+    if len(sys.argv) not in (4, 5) or os.path.exists(sys.argv[1]) == False or os.path.exists(sys.argv[2]) == False:
+        print("Usage: %s obo_file query_terms_file output_file [num_processes]" % sys.argv[0])
+        sys.exit(1)
+    obo_file = sys.argv[1] # eg. go-basic.obo
+    query_terms_file = sys.argv[2] # a file with one GO term per line, eg. GO:0006915
+    output_file = sys.argv[3] # a tab-separated file with lines: query_term  ancestor  distance
+    num_processes = int(sys.argv[4]) if len(sys.argv) == 5 else 1
+
+    # read in the DAG:
+    dag = GODag.from_obo(obo_file)
+    print("Read",len(dag),"terms from",obo_file)
+
+    # read in the query terms:
+    query_terms = []
+    fileObj = open(query_terms_file, "r")
+    for line in fileObj:
+        line = line.strip()
+        if line != "":
+            query_terms.append(line)
+    fileObj.close()
+
+    # find the ancestors of all the query terms:
+    queries, ancestors, distances = dag.ancestor_distance_arrays(dag.get_term_ids(query_terms), num_processes)
+
+    # write out the distances:
+    outputfileObj = open(output_file, "w")
+    for query, ancestor, distance in zip(queries.tolist(), ancestors.tolist(), distances.tolist()):
+        outputfileObj.write("%s\t%s\t%d\n" % (query_terms[query], dag.terms[ancestor], distance))
+    outputfileObj.close()
+    print("Wrote",len(queries),"ancestor distances for",len(query_terms),"terms to",output_file)
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
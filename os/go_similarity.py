@@ -0,0 +1,316 @@
+# Script to calculate the GO semantic similarity between pairs of genes, from the GO
+# terms they are annotated with. For each pair of terms it calculates the Resnik
+# similarity (the information content of their most informative common ancestor),
+# the Lin similarity, and a shortest-path similarity (1 / (1 + the length of the
+# shortest path between them through a common ancestor)); and for each pair of genes
+# it takes the best-match average of these over their terms.
+
+import sys
+import os
+import numpy as np
+import scipy.sparse
+from go_closure import load_go_closure
+
+#====================================================================#
+
+# the most (gene pair, term pair) combinations to hold in memory at once:
+
+MAX_TERM_PAIRS = 1000000
+
+# the most distinct term pairs to compare at once (each one gathers the ancestors of both of its terms):
+
+MAX_DISTINCT_TERM_PAIRS = 100000
+
+MEASURES = ("resnik", "lin", "path")
+
+#====================================================================#
+
+# define a function to read the GO terms of each gene:
+
+def read_gene_annotations(annotation_file, closure):
+    """read a file of 'gene<tab>GO term' lines (several terms can be given separated by
+    commas or |), and return (genes, indptr, term ids) with the term ids of genes[g] in
+    term_ids[indptr[g]:indptr[g+1]]
+
+    Terms that are not in the DAG are left out, and so are genes with no terms left.
+    """
+
+    terms_of_gene = {}
+    unknown_terms = set()
+    fileObj = open(annotation_file, "r")
+    for line in fileObj:
+        line = line.rstrip()
+        if line == "" or line.startswith('#'):
+            continue
+        temp = line.split("\t")
+        gene = temp[0] # eg. HPLM_0000313201
+        for term in temp[1].replace('|', ',').split(','): # eg. GO:0006915
+            term = term.strip()
+            if term in closure.term_ids:
+                terms_of_gene.setdefault(gene, set()).add(closure.term_ids[term])
+            elif term != "":
+                unknown_terms.add(term)
+    fileObj.close()
+    if unknown_terms:
+        print("WARNING:",len(unknown_terms),"terms in",annotation_file,"are not in the GO DAG, eg.",sorted(unknown_terms)[0])
+
+    genes = sorted(terms_of_gene)
+    indptr = np.zeros(len(genes) + 1, dtype=np.int64)
+    np.cumsum([len(terms_of_gene[gene]) for gene in genes], out=indptr[1:])
+    term_ids = np.array([term_id for gene in genes for term_id in sorted(terms_of_gene[gene])], dtype=np.int64)
+
+    return genes, indptr, term_ids
+
+#====================================================================#
+
+# define a function to calculate the information content of each term:
+
+def calculate_information_content(closure, annotations):
+    """returns -log(the fraction of the genes annotated with the term or any of its descendants), for each term
+
+    'annotations' is a list of (genes, indptr, term ids) tuples from read_gene_annotations().
+    Terms no gene is annotated with (even through their descendants) get an information content of 0.
+    """
+
+    num_terms = closure.num_terms
+    gene_ancestor_keys = []
+    num_genes = 0
+    for genes, indptr, term_ids in annotations:
+        gene_of_term = np.repeat(np.arange(len(genes), dtype=np.int64) + num_genes, np.diff(indptr))
+        starts = closure.indptr[term_ids]
+        counts = closure.indptr[term_ids + 1] - starts
+        which = np.repeat(np.arange(len(term_ids)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        ancestors = closure.keys[starts[which] + offsets] - term_ids[which] * num_terms
+        gene_ancestor_keys.append(gene_of_term[which] * num_terms + ancestors)
+        num_genes += len(genes)
+    gene_ancestor_keys = np.unique(np.concatenate(gene_ancestor_keys)) # count each gene once for each term
+    counts = np.bincount(gene_ancestor_keys % num_terms, minlength=num_terms)
+    information_content = np.zeros(num_terms)
+    annotated = counts > 0
+    information_content[annotated] = -np.log(counts[annotated] / num_genes)
+
+    return information_content
+
+#====================================================================#
+
+# define a function to make the sparse (term x ancestor) matrix used to compare terms:
+
+def make_ancestor_matrix(closure):
+    """returns a CSR matrix with 2 ** distance for each (term, ancestor) pair
+
+    When the rows of two terms are multiplied elementwise, the product is only there
+    for their common ancestors, where it is 2 ** (the length of the path between the
+    terms through that ancestor), so one sparse product gives everything needed.
+    """
+
+    num_terms = closure.num_terms
+    indptr = np.asarray(closure.indptr)
+    ancestors = (closure.keys - np.repeat(np.arange(num_terms, dtype=np.int64), np.diff(indptr)) * num_terms).astype(np.int32)
+    ancestor_matrix = scipy.sparse.csr_matrix((np.exp2(np.asarray(closure.distances, dtype=float)), ancestors, indptr), shape=(num_terms, num_terms))
+
+    return ancestor_matrix
+
+#====================================================================#
+
+# define a function to compare pairs of terms:
+
+def calculate_term_similarities(ancestor_matrix, information_content, term_ids1, term_ids2):
+    """returns a (3, number of pairs) array of the Resnik, Lin and path similarities of each pair of terms
+
+    The ancestors of all the first terms and of all the second terms are gathered into
+    two sparse matrices with a row for each pair, and their elementwise product keeps
+    just the common ancestors of each pair, so each similarity is a maximum or minimum
+    over the rows of the product.
+
+    >>> from go_dag import GODag
+    >>> from go_closure import GOClosure
+    >>> closure = GOClosure(GODag({'B': ['A'], 'C': ['A'], 'D': ['B', 'C'], 'E': ['B'], 'F': []}))
+    >>> information_content = np.array([0.0, 0.5, 1.0, 2.0, 2.0, 3.0])
+    >>> ancestor_matrix = make_ancestor_matrix(closure)
+    >>> calculate_term_similarities(ancestor_matrix, information_content, np.array([3, 3, 4, 0]), np.array([4, 3, 5, 0])).round(3).tolist()
+    [[0.5, 2.0, 0.0, 0.0], [0.25, 1.0, 0.0, 1.0], [0.333, 1.0, 0.0, 1.0]]
+    """
+
+    similarities = np.zeros((3, len(term_ids1)))
+    for start in range(0, len(term_ids1), MAX_DISTINCT_TERM_PAIRS):
+        ids1 = term_ids1[start:start + MAX_DISTINCT_TERM_PAIRS]
+        ids2 = term_ids2[start:start + MAX_DISTINCT_TERM_PAIRS]
+        common = ancestor_matrix[ids1].multiply(ancestor_matrix[ids2]).tocsr()
+        has_common = np.diff(common.indptr) > 0
+        row_starts = common.indptr[:-1][has_common]
+        resnik = np.zeros(len(ids1))
+        path = np.zeros(len(ids1))
+        if len(row_starts) > 0:
+            # Resnik: the largest information content of a common ancestor:
+            resnik[has_common] = np.maximum.reduceat(information_content[common.indices], row_starts)
+            # path: the shortest path from one term to the other through a common ancestor:
+            path[has_common] = 1.0 / (1.0 + np.log2(np.minimum.reduceat(common.data, row_starts)))
+        # Lin: 2 * Resnik / (the sum of the information contents of the two terms):
+        total = information_content[ids1] + information_content[ids2]
+        lin = np.divide(2 * resnik, total, out=(ids1 == ids2).astype(float), where=total > 0)
+        similarities[0, start:start + len(ids1)] = resnik
+        similarities[1, start:start + len(ids1)] = lin
+        similarities[2, start:start + len(ids1)] = path
+
+    return similarities
+
+#====================================================================#
+
+# define a function to compare pairs of genes:
+
+def calculate_gene_similarities(ancestor_matrix, information_content, annotations1, annotations2, genes1, genes2):
+    """returns a (3, number of gene pairs) array of the best-match average Resnik, Lin and path similarities of each pair genes1[i], genes2[i]
+
+    The best-match average of two genes is the average of: the mean over the first
+    gene's terms of their best similarity to any of the second gene's terms; and the
+    mean over the second gene's terms of their best similarity to any of the first's.
+
+    >>> from go_dag import GODag
+    >>> from go_closure import GOClosure
+    >>> closure = GOClosure(GODag({'B': ['A'], 'C': ['A'], 'D': ['B', 'C'], 'E': ['B'], 'F': []}))
+    >>> information_content = np.array([0.0, 0.5, 1.0, 2.0, 2.0, 3.0])
+    >>> ancestor_matrix = make_ancestor_matrix(closure)
+    >>> annotations = (['g1', 'g2'], np.array([0, 2, 3]), np.array([3, 5, 4]))
+    >>> calculate_gene_similarities(ancestor_matrix, information_content, annotations, annotations, np.array([0, 0]), np.array([1, 0])).round(3).tolist()
+    [[0.375, 2.5], [0.188, 1.0], [0.25, 1.0]]
+    """
+
+    (names1, indptr1, term_ids1) = annotations1
+    (names2, indptr2, term_ids2) = annotations2
+    sizes1 = np.diff(indptr1)[genes1]
+    sizes2 = np.diff(indptr2)[genes2]
+
+    # all the term pairs of each gene pair, in order of the gene pair, then the first term, then the second term:
+    counts = sizes1 * sizes2
+    offsets = np.cumsum(counts) - counts
+    pair = np.repeat(np.arange(len(genes1)), counts)
+    local = np.arange(counts.sum()) - offsets[pair]
+    i = local // sizes2[pair]
+    j = local % sizes2[pair]
+    terms1 = term_ids1[indptr1[genes1[pair]] + i]
+    terms2 = term_ids2[indptr2[genes2[pair]] + j]
+
+    # compare each distinct term pair once:
+    num_terms = len(information_content)
+    term_pairs, inverse = np.unique(terms1 * num_terms + terms2, return_inverse=True)
+    similarities = calculate_term_similarities(ancestor_matrix, information_content, term_pairs // num_terms, term_pairs % num_terms)[:, inverse.ravel()]
+
+    # the best match of each term of the first gene, then their mean:
+    best1 = np.maximum.reduceat(similarities, np.flatnonzero(j == 0), axis=1)
+    mean1 = np.add.reduceat(best1, np.cumsum(sizes1) - sizes1, axis=1) / sizes1
+    # the same for the terms of the second gene, reordering the term pairs by the second term first:
+    reordered = np.empty_like(similarities)
+    reordered[:, offsets[pair] + j * sizes1[pair] + i] = similarities
+    starts2 = np.zeros(len(local), dtype=bool)
+    starts2[(offsets[pair] + j * sizes1[pair])[i == 0]] = True
+    best2 = np.maximum.reduceat(reordered, np.flatnonzero(starts2), axis=1)
+    mean2 = np.add.reduceat(best2, np.cumsum(sizes2) - sizes2, axis=1) / sizes2
+
+    return (mean1 + mean2) / 2
+
+#====================================================================#
+
+# define a function to list the pairs of genes to compare, a chunk at a time:
+
+def iter_gene_pair_chunks(num_genes1, num_genes2, same_genes, chunk_size):
+    """yield (first genes, second genes) arrays of at most chunk_size gene pairs; if same_genes, just the pairs i < j
+
+    >>> [(genes1.tolist(), genes2.tolist()) for genes1, genes2 in iter_gene_pair_chunks(3, 3, True, 2)]
+    [([0, 0], [1, 2]), ([1], [2])]
+    """
+
+    genes1 = []
+    genes2 = []
+    num_pairs = 0
+    for gene1 in range(num_genes1):
+        gene2 = gene1 + 1 if same_genes else 0
+        while gene2 < num_genes2:
+            take = min(num_genes2 - gene2, chunk_size - num_pairs)
+            genes1.append(np.full(take, gene1, dtype=np.int64))
+            genes2.append(np.arange(gene2, gene2 + take, dtype=np.int64))
+            num_pairs += take
+            gene2 += take
+            if num_pairs == chunk_size:
+                yield np.concatenate(genes1), np.concatenate(genes2)
+                genes1 = []
+                genes2 = []
+                num_pairs = 0
+    if num_pairs > 0:
+        yield np.concatenate(genes1), np.concatenate(genes2)
+
+#====================================================================#
+
+# define a function to compare all the pairs of genes, and write out the similarities as we go:
+
+def write_gene_similarities(closure, annotations1, annotations2, output_file):
+    """compare every gene of annotations1 with every gene of annotations2 (or each pair of genes
+    once, if they are the same), keeping at most MAX_TERM_PAIRS term pairs in memory at a time"""
+
+    same_genes = annotations2 is None
+    if same_genes:
+        annotations2 = annotations1
+        information_content = calculate_information_content(closure, [annotations1])
+    else:
+        information_content = calculate_information_content(closure, [annotations1, annotations2])
+    ancestor_matrix = make_ancestor_matrix(closure)
+    names1 = annotations1[0]
+    names2 = annotations2[0]
+    sizes1 = np.diff(annotations1[1])
+    sizes2 = np.diff(annotations2[1])
+
+    num_pairs = 0
+    outputfileObj = open(output_file, "w")
+    outputfileObj.write("gene1\tgene2\t%s\n" % "\t".join(MEASURES))
+    if len(sizes1) == 0 or len(sizes2) == 0:
+        outputfileObj.close() # no genes with GO terms, so no pairs to compare
+        return num_pairs
+    mean_term_pairs = max(1, int(sizes1.mean() * sizes2.mean()))
+    for genes1, genes2 in iter_gene_pair_chunks(len(names1), len(names2), same_genes, max(1, MAX_TERM_PAIRS // mean_term_pairs)):
+        # split the chunk further where genes with many terms would make too many term pairs:
+        cumulative = np.cumsum(sizes1[genes1] * sizes2[genes2])
+        bounds = np.searchsorted(cumulative, np.arange(MAX_TERM_PAIRS, cumulative[-1], MAX_TERM_PAIRS), side="right")
+        for part1, part2 in zip(np.split(genes1, bounds), np.split(genes2, bounds)):
+            if len(part1) == 0:
+                continue
+            similarities = calculate_gene_similarities(ancestor_matrix, information_content, annotations1, annotations2, part1, part2)
+            outputfileObj.write("".join("%s\t%s\t%.4f\t%.4f\t%.4f\n" % (names1[gene1], names2[gene2], resnik, lin, path) for gene1, gene2, resnik, lin, path in zip(part1.tolist(), part2.tolist(), *similarities.tolist())))
+            num_pairs += len(part1)
+    outputfileObj.close()
+
+    return num_pairs
+
+#====================================================================#
+
+def main():
+
+    # check the command-line arguments:
+    if len(sys.argv) not in (4, 5) or os.path.exists(sys.argv[1]) == False or os.path.exists(sys.argv[2]) == False:
+        print("Usage: %s obo_file annotation_file output_file [annotation_file2]" % sys.argv[0])
+        sys.exit(1)
+    obo_file = sys.argv[1] # eg. go-basic.obo
+    annotation_file = sys.argv[2] # tab-separated: gene  GO term (eg. HPLM_0000313201  GO:0006915)
+    output_file = sys.argv[3] # tab-separated: gene1  gene2  resnik  lin  path
+    annotation_file2 = sys.argv[4] if len(sys.argv) == 5 else None # eg. the GO terms of another species' genes
+
+    # read in the GO DAG's closure (building it if need be), and the GO terms of the genes:
+    closure = load_go_closure(obo_file)
+    annotations1 = read_gene_annotations(annotation_file, closure)
+    print("Read GO terms for",len(annotations1[0]),"genes from",annotation_file)
+    annotations2 = None
+    if annotation_file2 is not None:
+        annotations2 = read_gene_annotations(annotation_file2, closure)
+        print("Read GO terms for",len(annotations2[0]),"genes from",annotation_file2)
+
+    # compare the genes:
+    num_pairs = write_gene_similarities(closure, annotations1, annotations2, output_file)
+    print("Wrote similarities for",num_pairs,"pairs of genes to",output_file)
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
@@ -0,0 +1,568 @@
+# Script to count the k-mers in fastq files (eg. the shards written by split_up_fastq.py), for
+# genome size and contamination estimates. The reads are encoded as 2-bit NumPy arrays, and the
+# canonical k-mer (the smaller of the k-mer and its reverse complement) at each position is built
+# with shifts and ors over whole blocks of reads. The shards are shared out between a pool of
+# processes, each counting into its own partitioned hash table; the partitions are then merged
+# on the pool, and written out as a k-mer histogram (in the jellyfish 'histo' format, for
+# eg. GenomeScope) and, optionally, a binary table of the count of each k-mer.
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from fastq_reader import open_fastq_input, read_fastq_chunks
+from fastq_qc import BASE_CODES
+from fasta_index import assign_records_to_shards
+
+#====================================================================#
+
+# canonical k-mers are stored in 2 bits per base in a uint64, so k can be up to 31:
+
+MAX_K = 31
+
+DEFAULT_K = 21
+
+# the number of partitions of each hash table (a power of 2); k-mers go to a partition by their hash:
+
+DEFAULT_PARTITIONS = 64
+
+# the histogram's last bin counts the k-mers seen this many times or more (as in 'jellyfish histo'):
+
+DEFAULT_MAX_COUNT = 10000
+
+# how much memory (in MB) the hash table of each process can use before it is written out to disk:
+
+DEFAULT_MEMORY = 1024
+
+# a key that cannot be a k-mer, marking an empty slot in a hash table:
+
+EMPTY_KEY = np.uint64(2**64 - 1)
+
+# the multiplier for Fibonacci hashing; the top bits of kmer * HASH_MULTIPLIER pick the partition,
+# and the bits below them the slot in the partition's table:
+
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# the hash is a one-to-one map, undone by multiplying by this (the inverse of HASH_MULTIPLIER, mod 2**64):
+
+HASH_INVERSE = np.uint64(pow(0x9E3779B97F4A7C15, -1, 2**64))
+
+NEWLINE = 10
+
+N_CODE = 4
+
+# the first 8 bytes of a binary k-mer count table:
+
+TABLE_MAGIC = b"KMERCNT1"
+
+#====================================================================#
+
+# define a function to encode the sequences in a block of fastq records as 2-bit codes:
+
+def encode_reads(data):
+    """return the sequences of a block of fastq records (bytes) as one uint8 array of codes
+
+    A, C, G and T are 0, 1, 2 and 3, and anything else (including the newline
+    kept at the end of each read, so no k-mer spans two reads) is 4.
+
+    >>> encode_reads(b'@r1\\nACGTN\\n+\\nFFFFF\\n@r2\\nTTa\\n+\\nFFF\\n').tolist()
+    [0, 1, 2, 3, 4, 4, 3, 3, 0, 4]
+    """
+
+    chars = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(chars == NEWLINE).reshape(-1, 4) # the ends of the 4 lines of each record
+    # mark the sequence lines (with their newlines), and pick them out:
+    flags = np.zeros(len(chars) + 1, dtype=np.int8)
+    flags[newlines[:, 0] + 1] = 1
+    flags[newlines[:, 1] + 1] = -1
+    in_seq = np.cumsum(flags[:-1], dtype=np.int8).view(bool)
+
+    return BASE_CODES[chars[in_seq]]
+
+#====================================================================#
+
+# define a function to find the canonical k-mer at each position of an array of base codes:
+
+def canonical_kmers(codes, k):
+    """return the canonical k-mers (as 2-bit uint64s, first base in the highest bits) of the windows
+    of k codes that have no N in them, in order
+
+    The k-mers are built by doubling: the windows of 2m bases are made by shifting
+    the windows of m bases and or-ing them together, in uint8s up to 4 bases, then
+    uint16s and uint32s, so building each k-mer takes a few whole-array operations
+    rather than k. The reverse complements are built in the same way, as are flags
+    for the windows with an N.
+
+    >>> canonical_kmers(np.array([0, 1, 2, 3, 4, 2, 2], dtype=np.uint8), 3).tolist() # ACG and CGT both give ACG
+    [6, 6]
+    >>> codes = encode_reads(b'@r1\\nTTTCCCAAAAAAAAAAAAAAAAAAAAAGGGGTT\\n+\\nFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF\\n')
+    >>> [format_kmer(int(kmer), 31) for kmer in canonical_kmers(codes, 31)]
+    ['CCCCTTTTTTTTTTTTTTTTTTTTTGGGAAA', 'ACCCCTTTTTTTTTTTTTTTTTTTTTGGGAA', 'AACCCCTTTTTTTTTTTTTTTTTTTTTGGGA']
+    """
+
+    num_kmers = len(codes) - k + 1
+    if num_kmers <= 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    # the windows of 'width' bases, for width = 1, 2, 4, ... up to k or 16:
+    forward = codes & 3
+    reverse = 3 - forward # the complement of each base
+    has_n = codes == N_CODE
+    width = 1
+    while width * 2 <= min(k, 16):
+        dtype = np.uint8 if width < 4 else np.uint16 if width < 8 else np.uint32
+        forward = (forward[:-width].astype(dtype) << (2 * width)) | forward[width:]
+        reverse = reverse[:-width].astype(dtype) | (reverse[width:].astype(dtype) << (2 * width))
+        has_n = has_n[:-width] | has_n[width:]
+        width *= 2
+
+    # then each k-mer is the window of 'width' bases at its start, and the last k - width bases
+    # of the overlapping window that ends where it does:
+    extra = k - width
+    if extra == 0:
+        forward = forward[:num_kmers].astype(np.uint64)
+        reverse = reverse[:num_kmers].astype(np.uint64)
+        has_n = has_n[:num_kmers]
+    else:
+        last = slice(extra, extra + num_kmers)
+        forward = (forward[:num_kmers].astype(np.uint64) << np.uint64(2 * extra)) | (forward[last] & ((1 << (2 * extra)) - 1))
+        reverse = reverse[:num_kmers].astype(np.uint64) | ((reverse[last] >> (2 * (width - extra))).astype(np.uint64) << np.uint64(2 * width))
+        has_n = has_n[:num_kmers] | has_n[last]
+
+    return np.minimum(forward, reverse)[~has_n]
+
+#====================================================================#
+
+# define functions to convert k-mers between strings and 2-bit integers:
+
+def format_kmer(kmer, k):
+    """
+    >>> format_kmer(6, 3)
+    'ACG'
+    """
+    return "".join("ACGT"[(kmer >> (2 * (k - 1 - i))) & 3] for i in range(k))
+
+def parse_kmers(kmers):
+    """return the canonical 2-bit codes of k-mer strings (all of the same length), and whether each is
+    a valid k-mer (of A, C, G and T only)
+
+    >>> codes, valid = parse_kmers(['ACG', 'CGT', 'ANG'])
+    >>> codes.tolist(), valid.tolist()
+    ([6, 6, 0], [True, True, False])
+    """
+
+    k = len(kmers[0])
+    codes = BASE_CODES[np.frombuffer("".join(kmers).encode(), dtype=np.uint8)].reshape(-1, k)
+    valid = np.all(codes != N_CODE, axis=1)
+    # put an N between the k-mers, so there is exactly one window of k bases per k-mer:
+    separated = np.full((len(kmers), k + 1), N_CODE, dtype=np.uint8)
+    separated[:, :k] = np.where(valid[:, None], codes, 0)
+    canonical = canonical_kmers(separated.reshape(-1), k)
+
+    return np.where(valid, canonical, np.uint64(0)), valid
+
+#====================================================================#
+
+# define a function to find the partition of each k-mer:
+
+def hash_kmers(kmers, partition_bits):
+    """return the hash of each k-mer, and the partition (its top partition_bits bits) it goes to"""
+
+    hashes = kmers * HASH_MULTIPLIER
+    partitions = (hashes >> np.uint64(64 - partition_bits)).astype(np.uint16) if partition_bits else np.zeros(len(kmers), dtype=np.uint16)
+
+    return hashes, partitions
+
+#====================================================================#
+
+# an open-addressing hash table of k-mer counts, split into partitions, held in NumPy arrays:
+
+class KmerHashTable:
+    """a hash table of k-mers (uint64) and their counts (uint32), with linear probing, in partitions
+
+    The partitions are equal-sized blocks of one pair of arrays. A k-mer goes to the
+    partition given by the top bits of its hash, and to the slot in it given by the
+    bits just below them; probing wraps around within the partition. Whole batches
+    of distinct k-mers are added at once, a probe step at a time (quickest if they
+    are in the order of their hashes), and every partition is doubled in size
+    whenever the fullest one would be more than half full.
+
+    >>> table = KmerHashTable(2)
+    >>> table.add(np.array([5, 7], dtype=np.uint64), np.array([1, 2]))
+    >>> table.add(np.array([7, 0], dtype=np.uint64), np.array([3, 1]))
+    >>> len(table), sorted((int(kmer), int(count)) for partition in range(2) for kmer, count in zip(*table.items(partition)))
+    (3, [(0, 1), (5, 1), (7, 5)])
+    """
+
+    def __init__(self, num_partitions=DEFAULT_PARTITIONS, capacity=1024):
+        self.num_partitions = num_partitions
+        self.partition_bits = num_partitions.bit_length() - 1
+        self.capacity = capacity # the number of slots in each partition
+        self.keys = np.full(num_partitions * capacity, EMPTY_KEY, dtype=np.uint64)
+        self.counts = np.zeros(num_partitions * capacity, dtype=np.uint32)
+        self.sizes = np.zeros(num_partitions, dtype=np.int64) # the number of k-mers in each partition
+
+    def __len__(self):
+        return int(self.sizes.sum())
+
+    def memory(self):
+        return self.keys.nbytes + self.counts.nbytes
+
+    def items(self, partition):
+        """the k-mers in a partition in order, and their counts"""
+        keys = self.keys[partition * self.capacity:(partition + 1) * self.capacity]
+        used = keys != EMPTY_KEY
+        order = np.argsort(keys[used])
+        return keys[used][order], self.counts[partition * self.capacity:(partition + 1) * self.capacity][used][order]
+
+    def resize(self, capacity):
+        used = self.keys != EMPTY_KEY
+        old_keys, old_counts = self.keys[used], self.counts[used]
+        self.capacity = capacity
+        self.keys = np.full(self.num_partitions * capacity, EMPTY_KEY, dtype=np.uint64)
+        self.counts = np.zeros(self.num_partitions * capacity, dtype=np.uint32)
+        self.sizes[:] = 0
+        self.add(old_keys, old_counts)
+
+    def capacity_needed(self, partitions):
+        """the number of slots each partition would need, to add k-mers going to these partitions"""
+        capacity = self.capacity
+        while int((self.sizes + np.bincount(partitions, minlength=self.num_partitions)).max()) * 2 > capacity:
+            capacity *= 2
+        return capacity
+
+    def add(self, kmers, counts):
+        """add counts for a batch of distinct k-mers"""
+        hashes, partitions = hash_kmers(kmers, self.partition_bits)
+        capacity = self.capacity_needed(partitions)
+        if capacity > self.capacity:
+            self.resize(capacity)
+        mask = capacity - 1
+        table_bits = capacity.bit_length() - 1
+        positions = partitions.astype(np.int64) * capacity + ((hashes << np.uint64(self.partition_bits)) >> np.uint64(64 - table_bits)).astype(np.int64)
+
+        is_new = np.zeros(len(kmers), dtype=bool)
+        pending = np.arange(len(kmers)) # the k-mers still being placed
+        while len(pending):
+            current = self.keys[positions]
+            wanted = kmers[pending]
+            # k-mers already in the table have their counts added:
+            found = current == wanted
+            self.counts[positions[found]] += counts[pending[found]].astype(np.uint32)
+            # k-mers that reach an empty slot are put in it; if several reach the same
+            # slot, only one of them is left there, and the others try again:
+            empty_indexes = np.flatnonzero(current == EMPTY_KEY)
+            self.keys[positions[empty_indexes]] = wanted[empty_indexes]
+            winners = empty_indexes[self.keys[positions[empty_indexes]] == wanted[empty_indexes]]
+            self.counts[positions[winners]] = counts[pending[winners]]
+            is_new[pending[winners]] = True
+            # the others probe the same slot again if they lost it, or move on if it holds another k-mer:
+            found[winners] = True
+            move_on = (current != EMPTY_KEY) & ~found
+            positions[move_on] = (positions[move_on] & ~mask) | ((positions[move_on] + 1) & mask)
+            pending = pending[~found]
+            positions = positions[~found]
+        self.sizes += np.bincount(partitions[is_new], minlength=self.num_partitions)
+
+#====================================================================#
+
+# count the k-mers in fastq files into a partitioned hash table:
+
+class KmerCounter:
+    """count the canonical k-mers in blocks of fastq records, in a KmerHashTable
+
+    When the table uses more than max_memory bytes, each partition is written to
+    a file in work_dir (sorted, as .npz files of 'kmers' and 'counts') and the
+    table starts again, so a partition may end up in several files.
+
+    >>> counter = KmerCounter(3, num_partitions=4)
+    >>> counter.add_reads(b'@r1\\nACGT\\n+\\nFFFF\\n@r2\\nCGTA\\n+\\nFFFF\\n')
+    >>> sorted((format_kmer(int(kmer), 3), int(count)) for partition in range(4) for kmer, count in zip(*counter.table.items(partition)))
+    [('ACG', 3), ('GTA', 1)]
+    >>> counter.num_reads, counter.num_kmers
+    (2, 4)
+    """
+
+    def __init__(self, k, num_partitions=DEFAULT_PARTITIONS, max_memory=DEFAULT_MEMORY * 1024 * 1024, work_dir=None, name="kmers"):
+        self.k = k
+        self.num_partitions = num_partitions
+        self.table = KmerHashTable(num_partitions)
+        self.max_memory = max_memory
+        self.work_dir = work_dir
+        self.name = name
+        self.partition_files = [[] for partition in range(num_partitions)]
+        self.num_reads = 0
+        self.num_kmers = 0
+
+    def add_reads(self, data, num_records=None):
+        """count the k-mers in a block of fastq records (bytes)"""
+        kmers = canonical_kmers(encode_reads(data), self.k)
+        self.num_reads += data.count(b"\n") // 4 if num_records is None else num_records
+        self.num_kmers += len(kmers)
+        # find the distinct k-mers in the order of their hashes, so the table's slots are visited in order:
+        hashes, counts = np.unique(kmers * HASH_MULTIPLIER, return_counts=True)
+        kmers = hashes * HASH_INVERSE
+        # write the table out first if it would have to grow past max_memory:
+        if self.work_dir is not None and len(self.table) and self.table.capacity_needed(hash_kmers(kmers, self.table.partition_bits)[1]) * self.table.memory() > self.table.capacity * self.max_memory:
+            self.write_partitions()
+        self.table.add(kmers, counts)
+
+    def count_file(self, fastq_file):
+        """count the k-mers in a fastq file (which may be gzipped)"""
+        fileObj = open_fastq_input(fastq_file)
+        for data, num_records in read_fastq_chunks(fileObj):
+            self.add_reads(data, num_records)
+        fileObj.close()
+
+    def write_partitions(self):
+        """write each partition's k-mers and counts to a file, and empty the table"""
+        for partition in range(self.num_partitions):
+            kmers, counts = self.table.items(partition)
+            if len(kmers) == 0:
+                continue
+            partition_file = os.path.join(self.work_dir, "%s.%d.part_%d.npz" % (self.name, len(self.partition_files[partition]), partition))
+            np.savez(partition_file, kmers=kmers, counts=counts)
+            self.partition_files[partition].append(partition_file)
+        self.table = KmerHashTable(self.num_partitions)
+
+#====================================================================#
+
+# define a function to count the k-mers in a group of fastq files, in a worker process:
+
+def count_kmers_in_worker(fastq_files, k, num_partitions, max_memory, work_dir, worker_num):
+    """count the k-mers in fastq files, writing the partitions to work_dir; returns (the partition files, reads, k-mers)"""
+
+    counter = KmerCounter(k, num_partitions, max_memory, work_dir, "worker_%d" % worker_num)
+    for fastq_file in fastq_files:
+        counter.count_file(fastq_file)
+    counter.write_partitions()
+
+    return counter.partition_files, counter.num_reads, counter.num_kmers
+
+#====================================================================#
+
+# define a function to merge the counts for one partition, in a worker process:
+
+def merge_partition_in_worker(partition_files, max_count, min_count, table_file):
+    """add up the counts of each k-mer from the partition files, and return the histogram of the counts
+    and the number of distinct k-mers; if table_file is given, the k-mers seen at least min_count times
+    (and their counts) are written to it"""
+
+    kmers = np.concatenate([np.load(partition_file)["kmers"] for partition_file in partition_files] + [np.zeros(0, dtype=np.uint64)])
+    counts = np.concatenate([np.load(partition_file)["counts"].astype(np.uint64) for partition_file in partition_files] + [np.zeros(0, dtype=np.uint64)])
+    for partition_file in partition_files:
+        os.remove(partition_file)
+    if len(partition_files) > 1 and len(kmers):
+        # a k-mer may be in several of the files (from different workers), so add up its counts:
+        order = np.argsort(kmers)
+        kmers = kmers[order]
+        starts = np.flatnonzero(np.concatenate(([True], kmers[1:] != kmers[:-1])))
+        counts = np.add.reduceat(counts[order], starts)
+        kmers = kmers[starts]
+    histogram = np.bincount(np.minimum(counts, max_count).astype(np.int64), minlength=max_count + 1)
+    if table_file is not None:
+        kept = counts >= min_count
+        np.savez(table_file, kmers=kmers[kept], counts=np.minimum(counts[kept], 2**32 - 1).astype(np.uint32))
+
+    return histogram, len(kmers)
+
+#====================================================================#
+
+# define a function to count the k-mers in fastq files, and write out the histogram (and count table):
+
+def count_kmers(fastq_files, k, output_prefix, num_processes=1, num_partitions=DEFAULT_PARTITIONS, max_count=DEFAULT_MAX_COUNT, write_table=False, min_count=1, max_memory=DEFAULT_MEMORY * 1024 * 1024, temp_dir=None):
+    """count the canonical k-mers in fastq files, writing the histogram to output_prefix.histo and, if
+    write_table is True, the k-mers seen at least min_count times to output_prefix.kmers; returns
+    (reads, k-mers, distinct k-mers)
+
+    The files are shared out between num_processes processes, so each gets about
+    the same number of bytes to read, and the partitions are then merged on the same
+    pool of processes.
+    """
+
+    work_dir = tempfile.mkdtemp(prefix="kmer_count.", dir=temp_dir)
+    pool = ProcessPoolExecutor(max_workers=num_processes) if num_processes > 1 else None
+    try:
+        # count the k-mers in each group of files:
+        groups = assign_records_to_shards([os.path.getsize(fastq_file) for fastq_file in fastq_files], num_processes)
+        jobs = [([fastq_files[file_num] for file_num in group], k, num_partitions, max_memory, work_dir, worker_num) for worker_num, group in enumerate(groups)]
+        if pool is not None:
+            results = [future.result() for future in [pool.submit(count_kmers_in_worker, *job) for job in jobs]]
+        else:
+            results = [count_kmers_in_worker(*job) for job in jobs]
+        num_reads = sum(result[1] for result in results)
+        num_kmers = sum(result[2] for result in results)
+
+        # then add up the counts for each partition:
+        jobs = []
+        for partition in range(num_partitions):
+            partition_files = [partition_file for result in results for partition_file in result[0][partition]]
+            table_file = os.path.join(work_dir, "table.part_%d.npz" % partition) if write_table else None
+            jobs.append((partition_files, max_count, min_count, table_file))
+        if pool is not None:
+            merged = [future.result() for future in [pool.submit(merge_partition_in_worker, *job) for job in jobs]]
+        else:
+            merged = [merge_partition_in_worker(*job) for job in jobs]
+        histogram = sum(partition_histogram for partition_histogram, num_distinct in merged)
+        num_distinct = sum(num_distinct for partition_histogram, num_distinct in merged)
+
+        write_histogram(histogram, "%s.histo" % output_prefix)
+        if write_table:
+            write_count_table([job[3] for job in jobs], k, "%s.kmers" % output_prefix)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return num_reads, num_kmers, num_distinct
+
+#====================================================================#
+
+# define a function to write out a k-mer histogram:
+
+def write_histogram(histogram, output_file):
+    """write 'count number_of_kmers' lines for the counts that some k-mers have, as 'jellyfish histo' does;
+    the last bin of the histogram is for that count or more"""
+
+    outputfileObj = open(output_file, "w")
+    for count in np.flatnonzero(histogram).tolist():
+        if count > 0:
+            outputfileObj.write("%d %d\n" % (count, histogram[count]))
+    outputfileObj.close()
+
+    return
+
+#====================================================================#
+
+# define a function to write the k-mer counts of each partition out as one binary table:
+
+def write_count_table(table_files, k, output_file):
+    """write the k-mers and counts in the partitions' .npz files to one binary table
+
+    The table is TABLE_MAGIC, then k and the number of partitions (uint32s), the
+    offset of the start of each partition and the end of the last one (uint64s),
+    the k-mers (uint64s, sorted within each partition) and their counts (uint32s),
+    all little-endian.
+    """
+
+    lengths = [len(np.load(table_file)["kmers"]) for table_file in table_files]
+    outputfileObj = open(output_file, "wb")
+    outputfileObj.write(TABLE_MAGIC)
+    outputfileObj.write(np.array([k, len(table_files)], dtype="<u4").tobytes())
+    outputfileObj.write(np.concatenate(([0], np.cumsum(lengths))).astype("<u8").tobytes())
+    for table_file in table_files:
+        outputfileObj.write(np.load(table_file)["kmers"].astype("<u8").tobytes())
+    for table_file in table_files:
+        outputfileObj.write(np.load(table_file)["counts"].astype("<u4").tobytes())
+    outputfileObj.close()
+
+    return
+
+#====================================================================#
+
+# look up k-mers in a binary table written by count_kmers():
+
+class KmerCountTable:
+    """a k-mer count table written with --table, memory-mapped so only the parts looked at are read"""
+
+    def __init__(self, table_file):
+        fileObj = open(table_file, "rb")
+        header = fileObj.read(16)
+        fileObj.close()
+        if header[:8] != TABLE_MAGIC:
+            raise ValueError("%s is not a k-mer count table" % table_file)
+        (self.k, num_partitions) = np.frombuffer(header[8:], dtype="<u4").tolist()
+        self.partition_bits = num_partitions.bit_length() - 1
+        self.offsets = np.memmap(table_file, dtype="<u8", mode="r", offset=16, shape=(num_partitions + 1,))
+        num_kmers = int(self.offsets[-1])
+        kmers_offset = 16 + 8 * (num_partitions + 1)
+        self.kmers = np.memmap(table_file, dtype="<u8", mode="r", offset=kmers_offset, shape=(num_kmers,))
+        self.counts = np.memmap(table_file, dtype="<u4", mode="r", offset=kmers_offset + 8 * num_kmers, shape=(num_kmers,))
+
+    def __len__(self):
+        return len(self.kmers)
+
+    def lookup(self, kmers):
+        """return the count of each k-mer (a string of k bases) in the table, or 0 if it is not there"""
+        if any(len(kmer) != self.k for kmer in kmers):
+            raise ValueError("the k-mers to look up should all be %d bases long" % self.k)
+        codes, valid = parse_kmers(kmers)
+        hashes, partitions = hash_kmers(codes, self.partition_bits)
+        counts = np.zeros(len(kmers), dtype=np.int64)
+        for partition in np.unique(partitions[valid]).tolist():
+            selected = np.flatnonzero(valid & (partitions == partition))
+            start, end = int(self.offsets[partition]), int(self.offsets[partition + 1])
+            positions = start + np.searchsorted(self.kmers[start:end], codes[selected])
+            found = positions < end
+            found[found] = self.kmers[positions[found]] == codes[selected[found]]
+            counts[selected[found]] = self.counts[positions[found]]
+        return counts
+
+    def close(self):
+        del self.offsets, self.kmers, self.counts
+
+#====================================================================#
+
+# print out the counts of k-mers from a binary table:
+
+def query_main(argv):
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(prog="%s query" % sys.argv[0], description="print out the counts of k-mers in a table written with --table")
+    parser.add_argument("table_file", help="binary k-mer count table (eg. prefix.kmers)")
+    parser.add_argument("kmers", nargs="+", help="k-mers to look up; a k-mer and its reverse complement have the same count")
+    args = parser.parse_args(argv)
+    if os.path.exists(args.table_file) == False:
+        parser.print_usage()
+        sys.exit(1)
+
+    table = KmerCountTable(args.table_file)
+    for kmer, count in zip(args.kmers, table.lookup([kmer.upper() for kmer in args.kmers]).tolist()):
+        print("%s\t%d" % (kmer, count))
+    table.close()
+
+#====================================================================#
+
+def main():
+
+    # 'kmer_count.py query ...' looks up k-mers in a count table:
+    if len(sys.argv) > 1 and sys.argv[1] == "query":
+        query_main(sys.argv[2:])
+        return
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(description="count the canonical k-mers in fastq files (eg. the shards from split_up_fastq.py), and write out a k-mer histogram", epilog="Run '%(prog)s query -h' for looking up k-mers in a table written with --table.")
+    parser.add_argument("output_prefix", help="prefix for the output files: output_prefix.histo, and output_prefix.kmers with --table")
+    parser.add_argument("fastq_files", nargs="+", help="input fastq files (optionally gzipped)")
+    parser.add_argument("-k", type=int, default=DEFAULT_K, help="k-mer length, up to %d (default: %d)" % (MAX_K, DEFAULT_K))
+    parser.add_argument("--processes", type=int, default=1, help="number of processes to count the k-mers with; the files are shared out between them (default: 1)")
+    parser.add_argument("--partitions", type=int, default=DEFAULT_PARTITIONS, help="number of partitions of each hash table, a power of 2; more partitions use less memory when merging (default: %d)" % DEFAULT_PARTITIONS)
+    parser.add_argument("--memory", type=int, default=DEFAULT_MEMORY, metavar="MB", help="most memory in MB for the hash table of each process, before it is written out to disk (default: %d)" % DEFAULT_MEMORY)
+    parser.add_argument("--max-count", type=int, default=DEFAULT_MAX_COUNT, help="the histogram's last bin is for k-mers seen this many times or more (default: %d)" % DEFAULT_MAX_COUNT)
+    parser.add_argument("--table", action="store_true", help="also write a binary table of the count of each k-mer, to output_prefix.kmers")
+    parser.add_argument("--min-count", type=int, default=1, help="only put k-mers seen at least this many times in the --table (default: 1)")
+    parser.add_argument("--temp-dir", help="directory for the temporary files (default: the system temporary directory)")
+    args = parser.parse_args()
+    num_partitions = args.partitions
+    if any(os.path.exists(fastq_file) == False for fastq_file in args.fastq_files) or args.k < 1 or args.k > MAX_K or args.processes < 1 or num_partitions < 1 or num_partitions & (num_partitions - 1) or num_partitions > 2**16 or args.memory < 1 or args.max_count < 1 or (args.temp_dir and os.path.isdir(args.temp_dir) == False):
+        parser.print_usage()
+        sys.exit(1)
+
+    start_time = time.perf_counter()
+    num_reads, num_kmers, num_distinct = count_kmers(args.fastq_files, args.k, args.output_prefix, args.processes, num_partitions, args.max_count, args.table, args.min_count, args.memory * 1024 * 1024, args.temp_dir)
+    seconds = time.perf_counter() - start_time
+    print("Counted %d %d-mers (%d distinct) in %d reads in %.1f seconds" % (num_kmers, args.k, num_distinct, num_reads, seconds))
+    print("Wrote the k-mer histogram to %s.histo" % args.output_prefix)
+    if args.table:
+        print("Wrote the k-mer counts to %s.kmers" % args.output_prefix)
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
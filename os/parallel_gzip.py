@@ -0,0 +1,127 @@
+import gzip
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+#====================================================================#
+
+# size of the uncompressed data that goes into each gzip member:
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+#====================================================================#
+
+# define a function to compress one block of data into a complete gzip member:
+
+def compress_gzip_member(data, compresslevel):
+    """compress a block of data into a complete, independent gzip member
+    >>> gzip.decompress(compress_gzip_member(b'@read1\\nACGT\\n+\\nFFFF\\n', 9))
+    b'@read1\\nACGT\\n+\\nFFFF\\n'
+    """
+
+    # mtime=0 so that the same input always gives the same output bytes:
+    return gzip.compress(data, compresslevel, mtime=0)
+
+#====================================================================#
+
+# a file object that writes a gzip file as a series of gzip members,
+# compressed in parallel:
+
+class ParallelGzipWriter:
+    """write a gzip file as a series of independent gzip members, compressed on a thread pool
+
+    A file made of several gzip members one after another is still a valid gzip
+    file (RFC 1952), and gunzip, zcat and aligners read it as one stream. zlib
+    releases the GIL while it compresses, so a thread pool is enough to use all
+    the cores. The members are written out in the order the data came in.
+
+    >>> import io
+    >>> out = io.BytesIO()
+    >>> writer = ParallelGzipWriter(out, threads=2, block_size=4)
+    >>> for line in [b'@read1\\n', b'ACGT\\n', b'+\\n', b'FFFF\\n']:
+    ...     writer.write(line)
+    >>> writer.close()
+    >>> gzip.decompress(out.getvalue())
+    b'@read1\\nACGT\\n+\\nFFFF\\n'
+    """
+
+    def __init__(self, output_file, threads, block_size=DEFAULT_BLOCK_SIZE, compresslevel=9):
+        if hasattr(output_file, "write"):
+            self.outputfileObj = output_file
+            self.close_output_file = False
+        else:
+            self.outputfileObj = open(output_file, "wb")
+            self.close_output_file = True
+        self.block_size = block_size
+        self.compresslevel = compresslevel
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.max_pending = threads * 2 # keep every thread busy, without holding the whole file in memory
+        self.pending = deque()
+        self.buffer = []
+        self.buffer_size = 0
+        self.bytes_written = 0 # the compressed size of the members written out so far
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        """add some data to the output; it is compressed once a whole block has built up"""
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= self.block_size:
+            self.flush_block()
+
+    def flush_block(self):
+        """send the data buffered so far off to be compressed as one gzip member"""
+        if self.buffer_size == 0:
+            return
+        block = b"".join(self.buffer)
+        self.buffer = []
+        self.buffer_size = 0
+        self.submit(block)
+
+    def submit(self, block, tag=None):
+        """compress a block on the pool, writing out finished members in order"""
+        self.pending.append((self.pool.submit(self.compress_block, block), tag))
+        while len(self.pending) > self.max_pending:
+            self.write_next_member()
+
+    def compress_block(self, block):
+        return compress_gzip_member(block, self.compresslevel)
+
+    def write_next_member(self):
+        future, tag = self.pending.popleft()
+        member = future.result()
+        if tag is not None:
+            self.member_written(self.bytes_written, tag)
+        self.outputfileObj.write(member)
+        self.bytes_written += len(member)
+
+    def member_written(self, offset, tag):
+        """called with the file offset at which each member submitted with a tag starts"""
+
+    def close(self):
+        if self.pool is None:
+            return
+        self.flush_block()
+        while self.pending:
+            self.write_next_member()
+        self.pool.shutdown()
+        self.pool = None
+        if self.close_output_file:
+            self.outputfileObj.close()
+
+#====================================================================#
+
+# open an output file for gzipped output, in parallel if we have more than one thread:
+
+def open_gzip_output(output_file, threads):
+    """open a gzipped output file, compressed on 'threads' threads"""
+
+    if threads > 1:
+        return ParallelGzipWriter(output_file, threads)
+    return gzip.open(output_file, "wb") # write out the output file in gzipped format
+
+#====================================================================#
@@ -0,0 +1,371 @@
+# Script to build a sparse graph (eg. a gene neighbourhood or synteny graph) straight
+# from a list of edges, without ever making a dense matrix, and find shortest paths
+# in it with Dijkstra's algorithm (see dijkstra_example.py for a small example)
+
+import sys
+import os
+import time
+import argparse
+from array import array
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+#====================================================================#
+
+# the most bytes of (distance, predecessor) rows to hold at once when running Dijkstra from many sources:
+
+DIJKSTRA_MEMORY = 512 * 1024 * 1024
+
+# the number of lines of an edge list to read at a time:
+
+READ_BLOCK_LINES = 100000
+
+#====================================================================#
+
+# define a function to give node names integer ids, as they come in:
+
+def intern_edges(edges, node_ids, names):
+    """turn (node1, node2, weight) tuples into source, target and weight arrays, giving each
+    new node name the next id (adding it to the node_ids dictionary and names list)
+
+    >>> node_ids = {}
+    >>> names = []
+    >>> sources, targets, weights = intern_edges([('g1', 'g4', 12), ('g4', 'g2', 5)], node_ids, names)
+    >>> sources.tolist(), targets.tolist(), weights.tolist(), names
+    ([0, 1], [1, 2], [12.0, 5.0], ['g1', 'g4', 'g2'])
+    """
+
+    sources = array('i')
+    targets = array('i')
+    weights = array('d')
+    for node1, node2, weight in edges:
+        id1 = node_ids.get(node1)
+        if id1 is None:
+            id1 = node_ids[node1] = len(names)
+            names.append(node1)
+        id2 = node_ids.get(node2)
+        if id2 is None:
+            id2 = node_ids[node2] = len(names)
+            names.append(node2)
+        sources.append(id1)
+        targets.append(id2)
+        weights.append(weight)
+
+    return np.frombuffer(sources, dtype=np.int32), np.frombuffer(targets, dtype=np.int32), np.frombuffer(weights, dtype=np.float64)
+
+#====================================================================#
+
+# define a function to read the edges from a tab-separated edge list:
+
+def iter_edge_list_tsv(edge_file):
+    """yield a (node1, node2, weight) tuple for each 'node1<tab>node2[<tab>weight]' line (the weight is 1 if there isn't one)"""
+
+    fileObj = open(edge_file, "r")
+    while True:
+        lines = fileObj.readlines(READ_BLOCK_LINES * 32)
+        if not lines:
+            break
+        for line in lines:
+            temp = line.split()
+            if len(temp) < 2 or temp[0].startswith('#'):
+                continue
+            yield temp[0], temp[1], float(temp[2]) if len(temp) > 2 else 1.0
+    fileObj.close()
+
+#====================================================================#
+
+# define a function to build a CSR matrix from arrays of edges:
+
+def build_csr_graph(sources, targets, weights, num_nodes, directed=True, keep_max=False):
+    """make a (num_nodes x num_nodes) CSR matrix with the edges, in O(V+E) memory
+
+    For an undirected graph each edge is added in both directions. If there is more
+    than one edge between two nodes, the lightest is kept (or the heaviest, if
+    keep_max; csr_matrix() would add them up). Zero-weight edges are kept as edges.
+
+    >>> graph = build_csr_graph(np.array([0, 0, 2]), np.array([1, 1, 0]), np.array([5.0, 3.0, 0.0]), 3, directed=False)
+    >>> graph.toarray().tolist(), graph.nnz
+    ([[0.0, 3.0, 0.0], [3.0, 0.0, 0.0], [0.0, 0.0, 0.0]], 4)
+    """
+
+    sources = np.asarray(sources)
+    targets = np.asarray(targets)
+    weights = np.asarray(weights, dtype=np.float64)
+    if not directed:
+        sources, targets = np.concatenate((sources, targets)), np.concatenate((targets, sources))
+        weights = np.concatenate((weights, weights))
+
+    # sort the edges by source then target, and keep the lightest (or heaviest) of any duplicates:
+    keys = sources.astype(np.int64) * num_nodes + targets
+    order = np.argsort(keys)
+    keys = keys[order]
+    firsts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1]))) if len(keys) > 0 else np.zeros(0, dtype=np.int64)
+    keep = np.maximum if keep_max else np.minimum
+    weights = keep.reduceat(weights[order], firsts) if len(firsts) > 0 else weights
+    keys = keys[firsts]
+
+    index_dtype = np.int32 if len(keys) < 2**31 and num_nodes < 2**31 else np.int64
+    indptr = np.zeros(num_nodes + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(keys // num_nodes, minlength=num_nodes), out=indptr[1:])
+    graph = csr_matrix((weights, (keys % num_nodes).astype(index_dtype), indptr), shape=(num_nodes, num_nodes))
+
+    return graph
+
+#====================================================================#
+
+# define a function to follow the predecessors from Dijkstra back to the sources:
+
+def reconstruct_paths(predecessors, row_sources, rows, targets):
+    """returns (indptr, nodes) with the path from row_sources[rows[i]] (the source of row
+    rows[i] of predecessors) to targets[i] in nodes[indptr[i]:indptr[i+1]] (empty if the
+    target can't be reached)
+
+    All the paths are followed back one step at a time together, so there is one
+    loop iteration per step of the longest path rather than per node.
+
+    >>> predecessors = np.array([[-9999, 0, 1, 2, -9999], [1, -9999, 1, 2, -9999]])
+    >>> indptr, nodes = reconstruct_paths(predecessors, np.array([0, 1]), np.array([0, 0, 1, 1]), np.array([3, 0, 0, 4]))
+    >>> [nodes[start:end].tolist() for start, end in zip(indptr[:-1], indptr[1:])]
+    [[0, 1, 2, 3], [0], [1, 0], []]
+    """
+
+    predecessors = np.asarray(predecessors)
+    if predecessors.ndim == 1:
+        predecessors = predecessors.reshape(1, -1)
+    rows = np.asarray(rows, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    num_paths = len(targets)
+
+    # a target can be reached if it has a predecessor, or is the source itself:
+    reached = (predecessors[rows, targets] >= 0) | (targets == np.asarray(row_sources)[rows])
+    path_numbers = np.flatnonzero(reached)
+    current = targets[path_numbers]
+    all_path_numbers = []
+    all_nodes = []
+    all_steps = []
+    step = 0
+    while len(current) > 0:
+        all_path_numbers.append(path_numbers)
+        all_nodes.append(current)
+        all_steps.append(np.full(len(current), step, dtype=np.int64))
+        previous = predecessors[rows[path_numbers], current]
+        keep = previous >= 0
+        path_numbers = path_numbers[keep]
+        current = previous[keep]
+        step += 1
+    if not all_nodes:
+        return np.zeros(num_paths + 1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    all_path_numbers = np.concatenate(all_path_numbers)
+    all_nodes = np.concatenate(all_nodes)
+    all_steps = np.concatenate(all_steps)
+
+    # put each path in order from its source to its target:
+    order = np.lexsort((-all_steps, all_path_numbers))
+    indptr = np.zeros(num_paths + 1, dtype=np.int64)
+    np.cumsum(np.bincount(all_path_numbers, minlength=num_paths), out=indptr[1:])
+
+    return indptr, all_nodes[order]
+
+#====================================================================#
+
+# a graph, with names for its nodes:
+
+class SparseGraph:
+    """a CSR matrix of the edges between nodes 0..n-1, with names[i] the name of node i
+    (or, if there are no names, the nodes are called by their numbers)"""
+
+    def __init__(self, matrix, names=None, node_ids=None):
+        self.matrix = matrix
+        self.num_nodes = matrix.shape[0]
+        if names is not None and node_ids is None:
+            node_ids = {name: i for i, name in enumerate(names)}
+        self.names = names
+        self.node_ids = node_ids
+
+    @classmethod
+    def from_edges(cls, edges, directed=True, keep_max=False):
+        """make a graph from (node1, node2, weight) tuples (see build_csr_graph() for keep_max)
+
+        >>> graph = SparseGraph.from_edges([('g1', 'g2', 2), ('g2', 'g3', 2), ('g1', 'g3', 5)], directed=False)
+        >>> distances, paths = graph.shortest_paths(['g3'], ['g1'])
+        >>> distances.tolist(), paths
+        ([4.0], [['g3', 'g2', 'g1']])
+        """
+        node_ids = {}
+        names = []
+        sources, targets, weights = intern_edges(edges, node_ids, names)
+        return cls(build_csr_graph(sources, targets, weights, len(names), directed, keep_max), names, node_ids)
+
+    @classmethod
+    def from_tsv(cls, edge_file, directed=True, keep_max=False):
+        """read a graph from a 'node1<tab>node2[<tab>weight]' edge list, a block of lines at a time"""
+        return cls.from_edges(iter_edge_list_tsv(edge_file), directed, keep_max)
+
+    @classmethod
+    def from_npy(cls, edge_file, directed=True, keep_max=False):
+        """read a graph from an .npy file of an (E, 2) or (E, 3) array of (node1, node2[, weight]) rows, where the nodes are already numbered 0..n-1"""
+        edges = np.load(edge_file, mmap_mode="r")
+        sources = np.asarray(edges[:, 0], dtype=np.int64)
+        targets = np.asarray(edges[:, 1], dtype=np.int64)
+        weights = np.asarray(edges[:, 2], dtype=np.float64) if edges.shape[1] > 2 else np.ones(len(edges))
+        num_nodes = int(max(sources.max(), targets.max())) + 1 if len(edges) > 0 else 0
+        return cls(build_csr_graph(sources, targets, weights, num_nodes, directed, keep_max))
+
+    def get_node_ids(self, names):
+        if self.node_ids is None:
+            node_ids = np.array([int(name) for name in names], dtype=np.int64)
+            if len(node_ids) > 0 and (node_ids.min() < 0 or node_ids.max() >= self.num_nodes):
+                raise KeyError("node numbers must be from 0 to %d" % (self.num_nodes - 1))
+            return node_ids
+        try:
+            return np.array([self.node_ids[name] for name in names], dtype=np.int64)
+        except KeyError as error:
+            raise KeyError("%s is not a node in the graph" % error.args[0]) from None
+
+    def get_node_names(self, node_ids):
+        if self.names is None:
+            return [str(node_id) for node_id in node_ids]
+        return [self.names[node_id] for node_id in node_ids]
+
+    def iter_dijkstra(self, source_ids, batch_size=None, limit=np.inf):
+        """yield (batch of source ids, distances, predecessors) for batches of the sources, each
+        from one scipy dijkstra() call, keeping the rows held at once within DIJKSTRA_MEMORY"""
+        if batch_size is None:
+            batch_size = max(1, DIJKSTRA_MEMORY // (12 * max(self.num_nodes, 1)))
+        for start in range(0, len(source_ids), batch_size):
+            batch = np.asarray(source_ids[start:start + batch_size])
+            distances, predecessors = dijkstra(self.matrix, indices=batch, return_predecessors=True, limit=limit)
+            yield batch, distances, predecessors
+
+    def shortest_paths(self, sources, targets, limit=np.inf):
+        """returns (distances, paths) for each pair of sources[i], targets[i] (node names), running
+        Dijkstra once for each different source; paths are lists of node names (empty if there is no path)"""
+        source_ids = self.get_node_ids(sources)
+        target_ids = self.get_node_ids(targets)
+        distances = np.full(len(source_ids), np.inf)
+        paths = [None] * len(source_ids)
+        unique_sources, pair_sources = np.unique(source_ids, return_inverse=True)
+        pair_sources = pair_sources.ravel()
+        batch_start = 0
+        for batch, batch_distances, batch_predecessors in self.iter_dijkstra(unique_sources, limit=limit):
+            pairs = np.flatnonzero((pair_sources >= batch_start) & (pair_sources < batch_start + len(batch)))
+            rows = pair_sources[pairs] - batch_start
+            distances[pairs] = batch_distances[rows, target_ids[pairs]]
+            indptr, nodes = reconstruct_paths(batch_predecessors, batch, rows, target_ids[pairs])
+            names = self.get_node_names(nodes.tolist())
+            for i, start, end in zip(pairs.tolist(), indptr[:-1].tolist(), indptr[1:].tolist()):
+                paths[i] = names[start:end]
+            batch_start += len(batch)
+        return distances, paths
+
+#====================================================================#
+
+# define a function to time building a big random graph and finding paths in it:
+
+def run_benchmark(num_nodes, num_edges, num_sources, num_targets):
+
+    rng = np.random.default_rng(1)
+    sources = rng.integers(0, num_nodes, num_edges, dtype=np.int64)
+    targets = rng.integers(0, num_nodes, num_edges, dtype=np.int64)
+    weights = rng.random(num_edges) * 100
+
+    start_time = time.time()
+    graph = SparseGraph(build_csr_graph(sources, targets, weights, num_nodes, directed=False))
+    print("Built an undirected graph of %d nodes and %d edges in %.1f s (%d MB)" % (num_nodes, num_edges, time.time() - start_time, (graph.matrix.data.nbytes + graph.matrix.indices.nbytes + graph.matrix.indptr.nbytes) // 2**20))
+
+    start_time = time.time()
+    source_ids = rng.choice(num_nodes, num_sources, replace=False)
+    batch, distances, predecessors = next(graph.iter_dijkstra(source_ids))
+    print("Ran Dijkstra from %d sources in one batch in %.1f s" % (len(batch), time.time() - start_time))
+
+    rows = rng.integers(0, len(batch), num_targets)
+    target_ids = rng.integers(0, num_nodes, num_targets)
+    start_time = time.time()
+    indptr, nodes = reconstruct_paths(predecessors, batch, rows, target_ids)
+    vectorized_seconds = time.time() - start_time
+    start_time = time.time()
+    loop_paths = []
+    for row, i in zip(rows.tolist(), target_ids.tolist()):
+        path = []
+        if predecessors[row, i] >= 0 or i == batch[row]:
+            while i >= 0:
+                path.append(i)
+                i = predecessors[row, i]
+        loop_paths.append(path[::-1])
+    loop_seconds = time.time() - start_time
+    assert loop_paths == [nodes[start:end].tolist() for start, end in zip(indptr[:-1], indptr[1:])]
+    print("Reconstructed %d paths (%.1f nodes long on average) in %.2f s, against %.2f s for a Python loop" % (num_targets, len(nodes) / num_targets, vectorized_seconds, loop_seconds))
+
+    return
+
+#====================================================================#
+
+# time building a big random graph and finding paths in it:
+
+def benchmark_main(argv):
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(prog="%s benchmark" % sys.argv[0], description="time building a random graph and finding shortest paths in it")
+    parser.add_argument("--nodes", type=int, default=2000000, help="number of nodes (default: 2000000)")
+    parser.add_argument("--edges", type=int, default=10000000, help="number of edges (default: 10000000)")
+    parser.add_argument("--sources", type=int, default=4, help="number of sources to run Dijkstra from (default: 4)")
+    parser.add_argument("--paths", type=int, default=100000, help="number of paths to reconstruct (default: 100000)")
+    args = parser.parse_args(argv)
+
+    run_benchmark(args.nodes, args.edges, args.sources, args.paths)
+
+#====================================================================#
+
+def main():
+
+    # 'sparse_graph.py benchmark ...' times a big random graph:
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark_main(sys.argv[2:])
+        return
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(description="find shortest paths between pairs of nodes of a graph given as an edge list", epilog="Run '%(prog)s benchmark -h' for timing a big random graph.")
+    parser.add_argument("edge_file", help="tab-separated 'node1 node2 [weight]' lines, or an .npy array of (node1, node2[, weight]) rows of node numbers")
+    parser.add_argument("pairs_file", help="tab-separated 'source target' lines")
+    parser.add_argument("output_file", help="output file of tab-separated 'source target distance path' lines")
+    parser.add_argument("--directed", action="store_true", help="the edges only go from node1 to node2")
+    args = parser.parse_args()
+    if os.path.exists(args.edge_file) == False or os.path.exists(args.pairs_file) == False:
+        parser.print_usage()
+        sys.exit(1)
+
+    # read in the graph:
+    if args.edge_file.endswith(".npy"):
+        graph = SparseGraph.from_npy(args.edge_file, args.directed)
+    else:
+        graph = SparseGraph.from_tsv(args.edge_file, args.directed)
+    print("Read a graph of",graph.num_nodes,"nodes and",graph.matrix.nnz,"edges from",args.edge_file)
+
+    # read in the pairs of nodes:
+    sources = []
+    targets = []
+    fileObj = open(args.pairs_file, "r")
+    for line in fileObj:
+        temp = line.split()
+        if len(temp) >= 2:
+            sources.append(temp[0])
+            targets.append(temp[1])
+    fileObj.close()
+
+    # find the shortest paths, and write them out:
+    distances, paths = graph.shortest_paths(sources, targets)
+    outputfileObj = open(args.output_file, "w")
+    for source, target, distance, path in zip(sources, targets, distances.tolist(), paths):
+        outputfileObj.write("%s\t%s\t%s\t%s\n" % (source, target, distance, ",".join(path)))
+    outputfileObj.close()
+    print("Wrote",len(sources),"shortest paths to",args.output_file)
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
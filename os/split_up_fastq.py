@@ -1,66 +1,291 @@
 import sys
 import os
-import gzip
-from collections import defaultdict
+import argparse
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from parallel_gzip import open_gzip_output
+from bgzf import BgzfFastqWriter, resplit_bgzf_fastq
+from fastq_demux import read_barcode_sheet, make_barcode_lookup, group_records_by_sample, group_paired_records_by_sample, DemuxWriter, write_demux_summary
+from fastq_reader import open_fastq_input, read_fastq_chunks, find_fastq_record_offset, read_in_background, read_paired_fastq_chunks
 
 #====================================================================#
 
-# now read in the input fastq and split it up:     
+# define a function to write blocks of records out to numbered output files:
+
+def write_chunks_to_output_files(chunks, seqs_per_output_file, output_file_prefixes, threads=1, bgzf=False, qc=False):
+    """write blocks of records to output files of seqs_per_output_file records each
+
+    'chunks' yields tuples of one block of records per output file prefix plus
+    the number of records in each block, so paired files are cut at the same read.
+    If seqs_per_output_file is 0, all the records go into one output file. If 'qc'
+    is True, read QC statistics are written for each output file (eg.
+    prefix_1.qc.json and prefix_1.qc.tsv) and for the whole run (prefix.qc.json
+    and prefix.qc.tsv).
+    """
+
+    if seqs_per_output_file == 0:
+        seqs_per_output_file = float("inf")
 
-def read_fastq_file_and_split(input_fastq_file, seqs_per_output_file, output_file_prefix):
+    # set up the QC statistics for each output file, and for the whole run:
+    shard_stats = None
+    if qc:
+        from fastq_qc import FastqQcStats # this needs NumPy, so is only imported when we want QC statistics
+        shard_stats = [FastqQcStats() for output_file_prefix in output_file_prefixes]
+        run_stats = [FastqQcStats() for output_file_prefix in output_file_prefixes]
 
-    # open an output file:
+    # open the first output files:
     output_file_cnt = 1
-    output_file = "%s_%d.fastq.gz" % (output_file_prefix, output_file_cnt)
-    outputfileObj = gzip.open(output_file, "wb") # write out the output file in gzipped format
-    print("Opening",output_file,"...")
+    outputfileObjs = open_output_files(output_file_prefixes, output_file_cnt, threads, bgzf)
 
-    # read in the input file:
-    fileObj = gzip.open(input_fastq_file, "rt") # this opens a gzipped file in text mode
     seqcnt = 0
-    linecnt = 0
-    for line in fileObj:
-        line = line.rstrip()
-        if line.startswith('@') and (linecnt == 0 or linecnt == 4): 
-            linecnt = 0
-            seqcnt += 1
-            if seqcnt == (seqs_per_output_file + 1):
-                outputfileObj.close()
+    for chunk in chunks:
+        datas = chunk[:-1]
+        num_records = chunk[-1]
+        # write out slices of whole records, starting new output files
+        # every seqs_per_output_file records:
+        starts = [0] * len(datas)
+        while num_records > 0:
+            if seqcnt == seqs_per_output_file:
+                for outputfileObj in outputfileObjs:
+                    outputfileObj.close()
+                if qc:
+                    write_shard_stats(shard_stats, run_stats, output_file_prefixes, output_file_cnt)
+                    shard_stats = [FastqQcStats() for output_file_prefix in output_file_prefixes]
                 output_file_cnt += 1
-                output_file = "%s_%d.fastq.gz" % (output_file_prefix, output_file_cnt)
-                outputfileObj = gzip.open(output_file, "wb") # write out the output file in gzipped format
-                print("Opening",output_file,"...")
-                seqcnt = 1
-        outputline = "%s\n" % line
-        outputfileObj.write(outputline.encode()) # need to write bytes (not a string) to the output file, see https://stackoverflow.com/questions/49286135/write-strings-to-gzip-file
-        linecnt += 1 
-    fileObj.close()
-    outputfileObj.close()
+                outputfileObjs = open_output_files(output_file_prefixes, output_file_cnt, threads, bgzf)
+                seqcnt = 0
+            num_to_write = min(num_records, seqs_per_output_file - seqcnt)
+            for i, data in enumerate(datas):
+                if num_to_write == num_records:
+                    end = len(data)
+                else:
+                    end = find_fastq_record_offset(data, starts[i], num_to_write)
+                outputfileObjs[i].write(memoryview(data)[starts[i]:end]) # the records are already bytes, so are written out as they are
+                if qc:
+                    shard_stats[i].add_records(memoryview(data)[starts[i]:end])
+                starts[i] = end
+            seqcnt += num_to_write
+            num_records -= num_to_write
+    for outputfileObj in outputfileObjs:
+        outputfileObj.close()
+    if qc:
+        write_shard_stats(shard_stats, run_stats, output_file_prefixes, output_file_cnt)
+        for output_file_prefix, stats in zip(output_file_prefixes, run_stats):
+            stats.write("%s.qc" % output_file_prefix)
+
+    return
+
+#====================================================================#
+
+# write out the QC statistics for the output files with a particular number:
+
+def write_shard_stats(shard_stats, run_stats, output_file_prefixes, output_file_cnt):
+
+    for output_file_prefix, stats, totals in zip(output_file_prefixes, shard_stats, run_stats):
+        stats.write("%s_%d.qc" % (output_file_prefix, output_file_cnt))
+        totals.merge(stats) # add them to the statistics for the whole run
+
+    return
+
+#====================================================================#
+
+# open the output files with a particular number:
+
+def open_output_files(output_file_prefixes, output_file_cnt, threads, bgzf=False):
+
+    outputfileObjs = []
+    for output_file_prefix in output_file_prefixes:
+        output_file = "%s_%d.fastq.gz" % (output_file_prefix, output_file_cnt)
+        if bgzf:
+            outputfileObjs.append(BgzfFastqWriter(output_file, threads)) # BGZF, with a record index in output_file.fqi
+        else:
+            outputfileObjs.append(open_gzip_output(output_file, threads)) # write out the output file in gzipped format
+        print("Opening",output_file,"...")
+
+    return outputfileObjs
+
+#====================================================================#
+
+# read in the input fastq file, or the R1 and R2 files of paired-end reads, a block of whole records at a time:
+
+def read_input_chunks(input_fastq_files):
+    """yield (data, num_records) tuples from one fastq file, or (data1, data2, num_records) from R1 and R2 files"""
+
+    fileObjs = [open_fastq_input(input_fastq_file) for input_fastq_file in input_fastq_files] # this opens gzipped files in binary mode
+    if len(fileObjs) == 2:
+        chunks = read_paired_fastq_chunks(fileObjs[0], fileObjs[1]) # check the read names match
+    else:
+        chunks = read_in_background(read_fastq_chunks(fileObjs[0])) # decompress the input while the output is compressed
+    for chunk in chunks:
+        yield chunk
+    for fileObj in fileObjs:
+        fileObj.close()
+
+    return
+
+#====================================================================#
+
+# read in the input fastq file(s) and split them up, taking out duplicate reads first if 'dedup' is a ReadDeduplicator:
+
+def split_input_files(input_fastq_files, seqs_per_output_file, output_file_prefixes, threads=1, bgzf=False, qc=False, dedup=None):
+
+    if dedup is None:
+        chunks = read_input_chunks(input_fastq_files)
+    else:
+        # the input is read a second time if the read fingerprints do not fit in memory:
+        chunks = dedup.filter_chunks(partial(read_input_chunks, input_fastq_files))
+    write_chunks_to_output_files(chunks, seqs_per_output_file, output_file_prefixes, threads, bgzf, qc)
+    if dedup is not None:
+        print("Removed %d duplicate reads out of %d (%d left)" % (dedup.num_duplicates, dedup.num_reads, dedup.num_reads - dedup.num_duplicates))
+
+    return
+
+#====================================================================#
+
+# read in the R1 and R2 fastq files of paired-end reads, and split them up together:
+
+def read_paired_fastq_files_and_split(input_fastq_file1, input_fastq_file2, seqs_per_output_file, output_file_prefix, threads=1, bgzf=False, qc=False, dedup=None):
+
+    # the output files are called output_file_prefix_R1_1.fastq.gz and output_file_prefix_R2_1.fastq.gz, etc.
+    output_file_prefixes = ["%s_R1" % output_file_prefix, "%s_R2" % output_file_prefix]
+
+    # read in the two input files together, checking the read names match;
+    # with 'dedup', a pair is a duplicate if both its R1 and R2 sequences have been seen together before:
+    split_input_files([input_fastq_file1, input_fastq_file2], seqs_per_output_file, output_file_prefixes, threads, bgzf, qc, dedup)
+
+    return
+
+#====================================================================#
+
+# now read in the input fastq and split it up:     
+
+def read_fastq_file_and_split(input_fastq_file, seqs_per_output_file, output_file_prefix, threads=1, bgzf=False, qc=False, dedup=None):
+
+    # read in the input file, a block of whole records at a time:
+    split_input_files([input_fastq_file], seqs_per_output_file, [output_file_prefix], threads, bgzf, qc, dedup)
 
     # the fastq file looks like this:
     # @M03558:259:000000000-BH588:1:1101:15455:1333 2:N:0:NTTGTA
-    # NCAAGCATCTCATTTTGTGCATATACCTGGTCTTTCGTCTTCTGGCGTGAAGTCGCCGACTGAATGCCAGCAATCTCTTTTTGAGTCTCATTTTGCATCTCGGCAATCTCTTTCTGATTGTCCAGTTGCATTTTAGTAAGCTCTTTTTGATTCTCAAATCCGGCGTCAACCATACCAGCAGAGGAAGCATCAGCACCAGCACGCTCCCAAGCATTAAGCTCAGGAAATGCAGCAGCAAGA
-TAATCACGAGT
+    # NCAAGCATCTCATTTTGTGCATATACCTGGTCTTTCGTCTTCTGGCGTGAAGTCGCCGACTGAATGCCAGCAATCTCTTTTTGAGTCTCATTTTGCATCTCGGCAATCTCTTTCTGATTGTCCAGTTGCATTTTAGTAAGCTCTTTTTGATTCTCAAATCCGGCGTCAACCATACCAGCAGAGGAAGCATCAGCACCAGCACGCTCCCAAGCATTAAGCTCAGGAAATGCAGCAGCAAGATAATCACGAGT
     # +
-    # #>>ABBFFFFFFGGGGGGGGGGHHHHHHHHHHHGHHGH2FFHHHHHGGGGGHHHGGGGGGGGHHHGHHHHGHHHHHHHHHHHGGGHHHHHHHHHHHHHHHHGGGGGHGFHHHHHHHHHHHHHGHHHHGHFHHHHHEFFFHGFFHHHHHGGHHHHHFGHHHHGGGCGGGFHHGGHGHHHHHHHHAGFFHHHHHGGGAEFHHHFDGDDGGGGEEBFGGGGGFGGGGEFGFFFGGGGGGFFFF
-FFBBFFFDFAA
+    # #>>ABBFFFFFFGGGGGGGGGGHHHHHHHHHHHGHHGH2FFHHHHHGGGGGHHHGGGGGGGGHHHGHHHHGHHHHHHHHHHHGGGHHHHHHHHHHHHHHHHGGGGGHGFHHHHHHHHHHHHHGHHHHGHFHHHHHEFFFHGFFHHHHHGGHHHHHFGHHHHGGGCGGGFHHGGHGHHHHHHHHAGFFHHHHHGGGAEFHHHFDGDDGGGGEEBFGGGGGFGGGGEFGFFFGGGGGGFFFFFFBBFFFDFAA
 
     return 
 
 #====================================================================#
 
+# read in the input fastq, and split it up into per-sample output files using the barcodes in the read headers:
+
+def read_fastq_file_and_demux(input_fastq_file, input_fastq_file2, seqs_per_output_file, output_file_prefix, barcode_sheet, max_mismatches, threads=1, max_open_files=256):
+
+    # read in the barcodes, and make a lookup table with all the barcodes within max_mismatches of them:
+    barcodes = read_barcode_sheet(barcode_sheet)
+    barcode_lookup = make_barcode_lookup(barcodes, max_mismatches)
+
+    # the output files are called output_file_prefix_sample1_1.fastq.gz etc.,
+    # or output_file_prefix_sample1_R1_1.fastq.gz and output_file_prefix_sample1_R2_1.fastq.gz for paired-end reads:
+    fileObj = open_fastq_input(input_fastq_file)
+    if input_fastq_file2:
+        fileObj2 = open_fastq_input(input_fastq_file2)
+        compress_pool = ThreadPoolExecutor(max_workers=threads) # shared by the R1 and R2 files, so we use 'threads' threads in all
+        writers = [DemuxWriter(output_file_prefix, seqs_per_output_file, threads, max_open_files // 2, "_R1", compress_pool),
+                   DemuxWriter(output_file_prefix, seqs_per_output_file, threads, max_open_files // 2, "_R2", compress_pool)]
+        for data1, data2, num_records in read_paired_fastq_chunks(fileObj, fileObj2):
+            for sample, (records1, records2) in group_paired_records_by_sample(data1, data2, barcode_lookup).items():
+                writers[0].write_records(sample, records1)
+                writers[1].write_records(sample, records2)
+        fileObj2.close()
+    else:
+        writers = [DemuxWriter(output_file_prefix, seqs_per_output_file, threads, max_open_files)]
+        for data, num_records in read_in_background(read_fastq_chunks(fileObj)):
+            for sample, records in group_records_by_sample(data, barcode_lookup).items():
+                writers[0].write_records(sample, records)
+    fileObj.close()
+    for writer in writers:
+        writer.close()
+    if input_fastq_file2:
+        compress_pool.shutdown()
+
+    # write out the number of reads for each sample:
+    write_demux_summary("%s.demux.tsv" % output_file_prefix, barcodes, writers[0].num_reads)
+
+    return
+
+#====================================================================#
+
+# cut an indexed BGZF fastq file (written with --bgzf) into new output files:
+
+def resplit_main(argv):
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(prog="%s resplit" % sys.argv[0], description="cut a BGZF fastq file written with --bgzf into new output files, using its .fqi record index")
+    parser.add_argument("input_fastq_file", help="BGZF fastq file, with a .fqi record index next to it")
+    parser.add_argument("output_file_prefix", help="prefix to use for the output file names")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--num-output-files", type=int, help="number of output files to cut the input into")
+    group.add_argument("--seqs-per-output-file", type=int, help="number of sequences to put into each output file")
+    group.add_argument("--range", metavar="FIRST-LAST", help="write only reads FIRST to LAST (counting from 1) to one output file")
+    args = parser.parse_args(argv)
+    if os.path.exists(args.input_fastq_file) == False or os.path.exists(args.input_fastq_file + ".fqi") == False:
+        parser.print_usage()
+        sys.exit(1)
+    if (args.num_output_files is not None and args.num_output_files < 1) or (args.seqs_per_output_file is not None and args.seqs_per_output_file < 1):
+        parser.print_usage()
+        sys.exit(1)
+    record_range = None
+    if args.range:
+        temp = args.range.split('-') # eg. 1000001-2000000
+        record_range = (int(temp[0]), int(temp[1]))
+
+    resplit_bgzf_fastq(args.input_fastq_file, args.output_file_prefix, args.num_output_files, args.seqs_per_output_file, record_range)
+
+#====================================================================#
+
 def main():
     
+    # 'split_up_fastq.py resplit ...' re-cuts a BGZF file written with --bgzf:
+    if len(sys.argv) > 1 and sys.argv[1] == "resplit":
+        resplit_main(sys.argv[2:])
+        return
+
     # check the command-line arguments:
-    if len(sys.argv) != 4 or os.path.exists(sys.argv[1]) == False:
-        print("Usage: %s input_fastq_file seqs_per_output_file output_file_prefix" % sys.argv[0]) 
+    parser = argparse.ArgumentParser(description="split up a gzipped fastq file into smaller gzipped fastq files", epilog="Run '%(prog)s resplit -h' for cutting a BGZF output file into new shards using its index.")
+    parser.add_argument("input_fastq_file", help="input fastq file")
+    parser.add_argument("seqs_per_output_file", type=int, help="number of sequences to put into each output file (0 for one output file)")
+    parser.add_argument("output_file_prefix", help="prefix to use for the output file names")
+    parser.add_argument("--r2", metavar="INPUT_FASTQ_FILE_R2", help="R2 fastq file of paired-end reads; input_fastq_file is then the R1 file")
+    parser.add_argument("--threads", type=int, default=1, help="number of threads to use for compressing the output (default: 1)")
+    parser.add_argument("--bgzf", action="store_true", help="write the output files as BGZF, each with a .fqi record index for 'resplit'")
+    parser.add_argument("--barcodes", metavar="BARCODE_SHEET", help="tab-separated file of sample names and barcodes; split the reads up by sample using the index sequence at the end of each read header")
+    parser.add_argument("--mismatches", type=int, default=1, choices=[0, 1, 2], help="number of mismatches to allow in a barcode, with --barcodes (default: 1)")
+    parser.add_argument("--max-open-files", type=int, default=256, help="most output files to have open at once, with --barcodes (default: 256)")
+    parser.add_argument("--qc", action="store_true", help="also write read QC statistics (.qc.json and .qc.tsv) for each output file and for the whole run; needs NumPy")
+    parser.add_argument("--dedup", action="store_true", help="take out duplicate reads (read pairs, with --r2) before splitting, keeping the first copy of each; needs NumPy")
+    parser.add_argument("--dedup-memory", type=int, default=1024, metavar="MB", help="most memory in MB for the --dedup read fingerprints; past this they go to sorted runs on disk, and the input is read twice (default: 1024)")
+    parser.add_argument("--dedup-prefix", type=int, default=0, metavar="N", help="with --dedup, only compare the first N bases of each read, to also take out near-duplicates that differ further along (default: 0, the whole read)")
+    parser.add_argument("--temp-dir", help="directory for the sorted runs that --dedup writes when its fingerprints do not fit in --dedup-memory (default: the system temporary directory)")
+    args = parser.parse_args()
+    if os.path.exists(args.input_fastq_file) == False or (args.r2 and os.path.exists(args.r2) == False) or args.threads < 1 or args.seqs_per_output_file < 0:
+        parser.print_usage()
+        sys.exit(1)
+    if args.barcodes and (args.bgzf or args.qc or args.dedup or os.path.exists(args.barcodes) == False or args.max_open_files < 2):
+        print("--barcodes needs an existing barcode sheet and at least 2 --max-open-files, and cannot be used with --bgzf, --qc or --dedup")
+        sys.exit(1)
+    if args.dedup_memory < 1 or args.dedup_prefix < 0 or (args.temp_dir and os.path.isdir(args.temp_dir) == False):
+        parser.print_usage()
         sys.exit(1)
-    input_fastq_file = sys.argv[1] # input fastq file                  
-    seqs_per_output_file = int(sys.argv[2]) # number of sequences to put into each output file
-    output_file_prefix = sys.argv[3] # prefix to use for the output file names
+    dedup = None
+    if args.dedup:
+        from fastq_dedup import ReadDeduplicator # this needs NumPy, so is only imported when we take out duplicate reads
+        dedup = ReadDeduplicator(args.dedup_memory * 1024 * 1024, args.dedup_prefix, args.temp_dir)
 
     # now read in the input fastq and split it up:     
-    read_fastq_file_and_split(input_fastq_file, seqs_per_output_file, output_file_prefix)
+    if args.barcodes:
+        read_fastq_file_and_demux(args.input_fastq_file, args.r2, args.seqs_per_output_file, args.output_file_prefix, args.barcodes, args.mismatches, args.threads, args.max_open_files)
+    elif args.r2:
+        read_paired_fastq_files_and_split(args.input_fastq_file, args.r2, args.seqs_per_output_file, args.output_file_prefix, args.threads, args.bgzf, args.qc, dedup)
+    else:
+        read_fastq_file_and_split(args.input_fastq_file, args.seqs_per_output_file, args.output_file_prefix, args.threads, args.bgzf, args.qc, dedup)
     
     #====================================================================#
 
@@ -1,51 +1,61 @@
+from collections import deque
 
-def DFS_dist_from_node(query_node, parents):
-    """Return dictionary containing distances of parent GO nodes from the query"""
+def DFS_dist_from_node(query_node, parents, verbose=False):
+    """Return dictionary containing distances of parent GO nodes from the query
+    >>> DFS_dist_from_node('N1', {'N1': ['N2', 'N3'], 'N3': ['N2']})
+    {'N1': 0, 'N3': 1, 'N2': 1}
+    """
     result = {}
     stack = []
+    stack_members = set() # a node is never on the stack twice, so a set is enough
     stack.append( (query_node, 0) )
+    stack_members.add(query_node)
     while len(stack) > 0:
-        print("stack=", stack)
+        if verbose:
+            print("stack=", stack)
         node, dist = stack.pop()
+        stack_members.discard(node)
         result[node] = dist
         if node in parents:
             for parent in parents[node]:
-                # Get the first member of each tuple, see 
-                # http://stackoverflow.com/questions/12142133/how-to-get-first-element-in-a-list-of-tuples
-                stack_members = [x[0] for x in stack]
                 if parent not in stack_members:
                     stack.append( (parent, dist+1) )
+                    stack_members.add(parent)
     return result
-    
-def BFS_dist_from_node(query_node, parents):
-    """Return dictionary containing minimum distances of parent GO nodes from the query"""
+
+def BFS_dist_from_node(query_node, parents, verbose=False):
+    """Return dictionary containing minimum distances of parent GO nodes from the query
+    >>> BFS_dist_from_node('N1', {'N1': ['N2', 'N3'], 'N3': ['N2']})
+    {'N1': 0, 'N2': 1, 'N3': 1}
+    """
     result = {}
-    queue = []
+    queue = deque()
+    queue_members = set()
     queue.append( (query_node, 0) )
+    queue_members.add(query_node)
     while queue:
-        print("queue=", queue)
-        node, dist = queue.pop(0)
+        if verbose:
+            print("queue=", list(queue))
+        node, dist = queue.popleft()
+        queue_members.discard(node)
         result[node] = dist
         if node in parents: # If the node *has* parents
             for parent in parents[node]:
-                # Get the first member of each tuple, see 
-                # http://stackoverflow.com/questions/12142133/how-to-get-first-element-in-a-list-of-tuples
-                queue_members = [x[0] for x in queue]
                 if parent not in result and parent not in queue_members: # Don't visit a second time
                     queue.append( (parent, dist+1) )
+                    queue_members.add(parent)
     return result
-    
+
 if __name__ == "__main__":
-    
+
     parents = dict()
     parents = {'N1': ['N2', 'N3', 'N4'], 'N3': ['N6', 'N7'], 'N4': ['N3'], 'N5': ['N4', 'N8'], 'N6': ['N13'],
                'N8': ['N9'], 'N9': ['N11'], 'N10': ['N7', 'N9'], 'N11': ['N14'], 'N12': ['N5']}
 
     print("Depth-first search:")
-    dist = DFS_dist_from_node('N1', parents)
+    dist = DFS_dist_from_node('N1', parents, verbose=True)
     print(dist)
-    
+
     print("Breadth-first search:")
-    dist = BFS_dist_from_node('N1', parents)
+    dist = BFS_dist_from_node('N1', parents, verbose=True)
     print(dist)
-    
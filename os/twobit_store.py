@@ -0,0 +1,561 @@
+# Script to store the sequences of an assembly in the UCSC .2bit format, and read regions
+# of them back out. Each base takes 2 bits (so the file is about 4x smaller than text),
+# runs of Ns and of soft-masked (lower case) bases are kept as lists of blocks, and the file
+# is memory-mapped, so a region is read without reading the rest of the sequence, and
+# worker processes share one copy of it in the page cache. The files can be read by the
+# UCSC tools (eg. twoBitToFa), and .2bit files from UCSC can be read here.
+
+import sys
+import os
+import gzip
+import mmap
+import time
+import random
+import struct
+import shutil
+import argparse
+from array import array
+from bisect import bisect_left, bisect_right
+import numpy as np
+from fasta_index import parse_region, IndexedFasta
+
+#====================================================================#
+
+TWOBIT_SIGNATURE = 0x1A412743
+
+# how much of a fasta file to read at once when converting it:
+
+READ_BLOCK_SIZE = 16 * 1024 * 1024
+
+# version 1 files have 64-bit offsets in their index, for files of 4 GB or more:
+
+MAX_VERSION0_SIZE = 2**32
+
+# the 2-bit codes are T=0, C=1, A=2, G=3, packed 4 bases to a byte with the first base in the top
+# 2 bits; any other base is stored as T (code 0) and listed in an N block
+
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, bases in enumerate([b"Tt", b"Cc", b"Aa", b"Gg"]):
+    for base in bases:
+        BASE_CODES[base] = code
+
+# the code of each base as a byte (with other bases as T), for bytes.translate():
+
+PACK_CODES = bytes(np.where(BASE_CODES == 4, 0, BASE_CODES).astype(np.uint8))
+
+# the 4 bases in each possible byte of packed DNA:
+
+UNPACK_TABLE = np.frombuffer(b"".join(bytes(b"TCAG"[(byte >> shift) & 3] for shift in (6, 4, 2, 0)) for byte in range(256)), dtype=np.uint8).reshape(256, 4)
+
+UNPACK_WORDS = UNPACK_TABLE.view(np.uint32).reshape(-1) # the same, as one 4-byte word per packed byte, which is quicker to look up
+
+# a region overlapping up to this many N or mask blocks has them filled in one at a time:
+
+SMALL_BLOCK_COUNT = 8
+
+# the complement of each base (keeping upper or lower case), and of each code (N stays N):
+
+COMPLEMENT = bytes.maketrans(b"ACGTNacgtn", b"TGCANtgcan")
+
+COMPLEMENT_CODES = np.array([2, 3, 0, 1, 4], dtype=np.uint8)
+
+# a .2bit file keeps any base that isn't A, C, G or T as N (or n, if soft-masked):
+
+AS_N = bytes.maketrans(bytes(range(65, 91)) + bytes(range(97, 123)), b"".join(b"N" if chr(i) not in "ACGT" else bytes([i]) for i in range(65, 91)) + b"".join(b"n" if chr(i) not in "acgt" else bytes([i]) for i in range(97, 123)))
+
+# the base written for a position in an N block:
+
+N_BASE = ord("N")
+
+#====================================================================#
+
+# define a function to read the sequences from a fasta file:
+
+def read_fasta_records(fileObj, block_size=READ_BLOCK_SIZE):
+    """yields (name, sequence) for each sequence in a fasta file opened in binary mode
+
+    The file is read in big blocks, which are cut up where a line starts with '>', so
+    there is no loop over the lines of a sequence.
+
+    >>> import io
+    >>> list(read_fasta_records(io.BytesIO(b'>chr1 first\\nACG\\nTA\\n>chr2\\nGG\\n'), block_size=5))
+    [('chr1', b'ACGTA'), ('chr2', b'GG')]
+    """
+
+    pieces = [] # the text of the record we are in so far
+    line_start = True # whether the next block starts at the start of a line
+    while True:
+        block = fileObj.read(block_size)
+        if not block:
+            break
+        pos = 0
+        while pos < len(block):
+            if line_start and block[pos:pos + 1] == b">":
+                header_pos = pos
+            else:
+                header_pos = block.find(b"\n>", pos)
+                if header_pos == -1:
+                    pieces.append(block[pos:])
+                    break
+                header_pos += 1
+                pieces.append(block[pos:header_pos])
+            if pieces:
+                yield parse_fasta_record(b"".join(pieces))
+                pieces = []
+            # the next record runs from its '>' to the next header line:
+            next_header = block.find(b"\n>", header_pos)
+            if next_header == -1:
+                pieces.append(block[header_pos:])
+                break
+            pieces.append(block[header_pos:next_header + 1])
+            pos = next_header + 1
+            line_start = True
+        line_start = block.endswith(b"\n")
+    if pieces:
+        yield parse_fasta_record(b"".join(pieces))
+
+    return
+
+#====================================================================#
+
+# define a function to get the name and sequence from the text of one fasta record:
+
+def parse_fasta_record(text):
+
+    header_end = text.find(b"\n")
+    if header_end == -1:
+        header_end = len(text)
+    temp = text[1:header_end].split() # eg. >chr1 some description
+    if not text.startswith(b">") or len(temp) == 0:
+        raise ValueError("a fasta record does not start with a '>name' header line: %s" % text[:50])
+
+    return temp[0].decode(), text[header_end + 1:].translate(None, b" \t\r\n")
+
+#====================================================================#
+
+# define a function to read the sequences from an EMBL file:
+
+def read_embl_records(fileObj):
+    """yields (name, sequence) for each entry in an EMBL file opened in binary mode, using the
+    first word of its ID line as the name
+
+    The sequence lines look like this, with the base counts at their ends:
+         ttcaggatcc aacatgcaga aagaatgtta agtcatcaac tgctgttgaa agactcctcg        60
+    """
+
+    name = None
+    lines = None
+    for line in fileObj:
+        if line.startswith(b"ID   "):
+            name = line[5:].split()[0].rstrip(b";").decode()
+        elif line.startswith(b"SQ"):
+            lines = []
+        elif line.startswith(b"//"):
+            if lines is not None:
+                yield name, b"".join(lines).translate(None, b" \t\r\n0123456789")
+            name = None
+            lines = None
+        elif lines is not None:
+            lines.append(line)
+
+    return
+
+#====================================================================#
+
+# define a function to find the runs of True in a boolean array:
+
+def find_runs(flags):
+    """returns (starts, sizes) of the runs of True in a boolean array, as uint32 arrays
+    >>> [array.tolist() for array in find_runs(np.array([True, True, False, True, False, False, True]))]
+    [[0, 3, 6], [2, 1, 1]]
+    """
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], flags, [False])).view(np.int8)))
+    starts = edges[0::2]
+    ends = edges[1::2]
+
+    return starts.astype(np.uint32), (ends - starts).astype(np.uint32)
+
+#====================================================================#
+
+# define a function to pack one sequence as a .2bit record:
+
+def pack_sequence(seq):
+    """returns the .2bit record (sizes, N blocks, mask blocks and packed DNA) for a sequence given as bytes
+    >>> record = pack_sequence(b'ACGTnnacgT')
+    >>> struct.unpack('<6I', record[:24]), record[-3:]
+    ((10, 1, 4, 2, 1, 4), b'\\x9c\\t\\xc0')
+    """
+
+    # most scaffolds have no Ns or lower case bases, which bytes methods check quickly:
+    n_starts = n_sizes = mask_starts = mask_sizes = np.zeros(0, dtype=np.uint32)
+    if seq.translate(None, b"ACGTacgt"):
+        n_starts, n_sizes = find_runs(BASE_CODES[np.frombuffer(seq, dtype=np.uint8)] == 4)
+    if seq.upper() != seq:
+        mask_starts, mask_sizes = find_runs(np.frombuffer(seq, dtype=np.uint8) >= ord("a")) # lower case letters come after all the upper case ones
+
+    # pack 4 codes to a byte, padding the end with T:
+    codes = np.frombuffer(seq.translate(PACK_CODES) + b"\0" * (-len(seq) % 4), dtype=np.uint8)
+    packed = (codes[0::4] << 6) | (codes[1::4] << 4) | (codes[2::4] << 2) | codes[3::4]
+
+    return b"".join([struct.pack("<II", len(seq), len(n_starts)), n_starts.astype("<u4").tobytes(), n_sizes.astype("<u4").tobytes(),
+                     struct.pack("<I", len(mask_starts)), mask_starts.astype("<u4").tobytes(), mask_sizes.astype("<u4").tobytes(),
+                     struct.pack("<I", 0), packed.tobytes()])
+
+#====================================================================#
+
+# define a function to write a .2bit file:
+
+def write_twobit_file(records, output_file):
+    """write (name, sequence) records to a .2bit file; returns the number of sequences
+
+    The packed records are written to a temporary file as they come, since the index at
+    the start of the file needs their offsets, and then copied in after the index.
+    """
+
+    names = []
+    sizes = []
+    temp_file = "%s.tmp%d" % (output_file, os.getpid())
+    tempfileObj = open(temp_file, "wb")
+    for name, seq in records:
+        record = pack_sequence(seq)
+        tempfileObj.write(record)
+        names.append(name.encode())
+        sizes.append(len(record))
+        if len(names[-1]) > 255:
+            raise ValueError("the sequence name %s is longer than 255 characters" % name)
+    tempfileObj.close()
+
+    # the index has the name and file offset of each record:
+    index_size = sum(1 + len(name) + 4 for name in names)
+    version = 0
+    if 16 + index_size + sum(sizes) >= MAX_VERSION0_SIZE:
+        version = 1
+        index_size += 4 * len(names)
+    offset_format = "<Q" if version == 1 else "<I"
+    header = [struct.pack("<4I", TWOBIT_SIGNATURE, version, len(names), 0)]
+    offset = 16 + index_size
+    for name, size in zip(names, sizes):
+        header.append(struct.pack("B", len(name)) + name + struct.pack(offset_format, offset))
+        offset += size
+
+    outputfileObj = open(output_file, "wb")
+    outputfileObj.write(b"".join(header))
+    tempfileObj = open(temp_file, "rb")
+    shutil.copyfileobj(tempfileObj, outputfileObj, 16 * 1024 * 1024)
+    tempfileObj.close()
+    outputfileObj.close()
+    os.remove(temp_file)
+
+    return len(names)
+
+#====================================================================#
+
+# define a function to work out the reverse complement of some bases:
+
+def reverse_complement(seq):
+    """
+    >>> reverse_complement(b'AACGtn')
+    b'naCGTT'
+    """
+
+    return seq.translate(COMPLEMENT)[::-1]
+
+#====================================================================#
+
+# reads regions of sequences from a memory-mapped .2bit file:
+
+class TwoBitStore:
+    """random access to the sequences in a .2bit file
+
+    A TwoBitStore can be passed to worker processes (eg. with multiprocessing): each
+    one maps the file again, so they all share the same pages of the page cache.
+
+    >>> import tempfile
+    >>> temp_dir = tempfile.TemporaryDirectory()
+    >>> twobit_file = os.path.join(temp_dir.name, 'test.2bit')
+    >>> write_twobit_file([('chr1', b'ACGTNNacgtAC'), ('chr2', b'GGATC')], twobit_file)
+    2
+    >>> store = TwoBitStore(twobit_file)
+    >>> store.names, store.get_length('chr1'), store.fetch('chr1'), store.fetch('chr1', 3, 9)
+    (['chr1', 'chr2'], 12, b'ACGTNNacgtAC', b'TNNacg')
+    >>> store.fetch('chr1', 3, 9, reverse=True), store.fetch('chr1', 3, 9, mask=False), store.fetch_codes('chr2', 1).tolist()
+    (b'cgtNNA', b'TNNACG', [3, 2, 0, 1])
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(store)).fetch_region('chr2:2-4')
+    b'GAT'
+    >>> store.close()
+    >>> temp_dir.cleanup()
+    """
+
+    def __init__(self, twobit_file):
+        self.twobit_file = twobit_file
+        self.open()
+
+    def open(self):
+        self.fileObj = open(self.twobit_file, "rb")
+        self.data = mmap.mmap(self.fileObj.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # the file may have been written on a big-endian machine:
+        signature, version, num_seqs, reserved = struct.unpack("<4I", self.data[:16])
+        self.endian = "<"
+        if signature != TWOBIT_SIGNATURE:
+            signature, version, num_seqs, reserved = struct.unpack(">4I", self.data[:16])
+            self.endian = ">"
+            if signature != TWOBIT_SIGNATURE:
+                raise ValueError("%s is not a .2bit file" % self.twobit_file)
+        if version > 1:
+            raise ValueError("%s is a version %d .2bit file, which we can't read" % (self.twobit_file, version))
+        offset_format = self.endian + ("Q" if version == 1 else "I")
+        offset_size = struct.calcsize(offset_format)
+
+        # read the index of sequence names and record offsets:
+        self.names = []
+        self.offsets = {}
+        pos = 16
+        for _ in range(num_seqs):
+            name_size = self.data[pos]
+            name = self.data[pos + 1:pos + 1 + name_size].decode()
+            self.offsets[name] = struct.unpack(offset_format, self.data[pos + 1 + name_size:pos + 1 + name_size + offset_size])[0]
+            self.names.append(name)
+            pos += 1 + name_size + offset_size
+        self.records = {} # name -> (length, N block starts, N block sizes, mask block starts, mask block sizes, packed DNA), read when first needed
+
+    def __getstate__(self):
+        return {"twobit_file": self.twobit_file}
+
+    def __setstate__(self, state):
+        self.twobit_file = state["twobit_file"]
+        self.open()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.offsets
+
+    def get_record(self, name):
+        """returns (length, N block starts, N block sizes, mask block starts, mask block sizes, packed DNA) for
+        a sequence, with the blocks as array('I')s (which bisect searches quickly) and the packed DNA as a
+        view of the memory-mapped file"""
+        if name in self.records:
+            return self.records[name]
+        if name not in self.offsets:
+            raise KeyError("%s is not a sequence in %s" % (name, self.twobit_file))
+        pos = self.offsets[name]
+        length, num_n_blocks = struct.unpack(self.endian + "II", self.data[pos:pos + 8])
+        n_starts = self.read_uint32s(pos + 8, num_n_blocks)
+        n_sizes = self.read_uint32s(pos + 8 + 4 * num_n_blocks, num_n_blocks)
+        pos += 8 + 8 * num_n_blocks
+        num_mask_blocks = struct.unpack(self.endian + "I", self.data[pos:pos + 4])[0]
+        mask_starts = self.read_uint32s(pos + 4, num_mask_blocks)
+        mask_sizes = self.read_uint32s(pos + 4 + 4 * num_mask_blocks, num_mask_blocks)
+        pos += 4 + 8 * num_mask_blocks + 4 # and the reserved word
+        packed = np.frombuffer(self.data, dtype=np.uint8, count=(length + 3) // 4, offset=pos)
+        record = (length, n_starts, n_sizes, mask_starts, mask_sizes, packed)
+        self.records[name] = record
+        return record
+
+    def read_uint32s(self, pos, count):
+        values = array("I", self.data[pos:pos + 4 * count])
+        if (self.endian == "<") != (sys.byteorder == "little"):
+            values.byteswap()
+        return values
+
+    def get_length(self, name):
+        return self.get_record(name)[0]
+
+    def get_packed(self, name):
+        """the packed DNA of a sequence, as a zero-copy uint8 view of the file (4 bases per byte, N as T)"""
+        return self.get_record(name)[5]
+
+    def fetch_array(self, name, start=0, end=None, mask=True):
+        """returns the bases in sequence[start:end] (0-based, as for a Python slice) as a uint8 array of ASCII codes"""
+        length, n_starts, n_sizes, mask_starts, mask_sizes, packed = self.get_record(name)
+        if end is None or end > length:
+            end = length
+        start = max(start, 0)
+        if start >= end:
+            return np.zeros(0, dtype=np.uint8)
+        bases = UNPACK_WORDS[packed[start >> 2:(end + 3) >> 2]].view(np.uint8)[start & 3:(start & 3) + end - start]
+        apply_blocks(bases, start, end, n_starts, n_sizes, None)
+        if mask:
+            apply_blocks(bases, start, end, mask_starts, mask_sizes, 0x20) # lower case
+        return bases
+
+    def fetch(self, name, start=0, end=None, reverse=False, mask=True):
+        """returns the bases in sequence[start:end] as bytes; the reverse complement if reverse is True,
+        and with soft-masked bases in lower case if mask is True"""
+        seq = self.fetch_array(name, start, end, mask).tobytes()
+        if reverse:
+            return reverse_complement(seq)
+        return seq
+
+    def fetch_region(self, region, reverse=False, mask=True):
+        """returns the bases in a samtools-style region, eg. 'chr1:1,001-2,000'"""
+        name, start, end = parse_region(region)
+        return self.fetch(name, start, end, reverse, mask)
+
+    def fetch_codes(self, name, start=0, end=None, reverse=False):
+        """returns the bases in sequence[start:end] as codes T=0, C=1, A=2, G=3, N=4 (uint8)"""
+        length, n_starts, n_sizes, mask_starts, mask_sizes, packed = self.get_record(name)
+        if end is None or end > length:
+            end = length
+        start = max(start, 0)
+        if start >= end:
+            return np.zeros(0, dtype=np.uint8)
+        codes = np.stack([(packed[start >> 2:(end + 3) >> 2] >> shift) & 3 for shift in (6, 4, 2, 0)], axis=1).reshape(-1)[start & 3:(start & 3) + end - start]
+        apply_blocks(codes, start, end, n_starts, n_sizes, None, 4)
+        if reverse:
+            return COMPLEMENT_CODES[codes[::-1]]
+        return codes
+
+    def close(self):
+        self.records = {}
+        self.data.close()
+        self.fileObj.close()
+
+#====================================================================#
+
+# define a function to write the N blocks or mask blocks that overlap a region into its bases:
+
+def apply_blocks(bases, start, end, block_starts, block_sizes, or_bits, fill=N_BASE):
+    """set bases[i] to fill (or OR it with or_bits, if given) for the positions start + i that fall in a block"""
+
+    # the blocks don't overlap each other, so the ones overlapping the region are a run of them:
+    first = bisect_right(block_starts, start) - 1
+    if first < 0 or block_starts[first] + block_sizes[first] <= start:
+        first += 1
+    last = bisect_left(block_starts, end)
+    if first >= last:
+        return
+    if last - first <= SMALL_BLOCK_COUNT:
+        for i in range(first, last):
+            block_start = max(block_starts[i] - start, 0)
+            block_end = min(block_starts[i] + block_sizes[i] - start, end - start)
+            if or_bits is None:
+                bases[block_start:block_end] = fill
+            else:
+                bases[block_start:block_end] |= or_bits
+        return
+
+    # mark the block edges with +1 and -1, so a running total is 1 inside blocks:
+    starts = np.frombuffer(block_starts, dtype=np.uint32)[first:last].astype(np.int64)
+    ends = starts + np.frombuffer(block_sizes, dtype=np.uint32)[first:last]
+    edges = np.zeros(end - start + 1, dtype=np.int32)
+    np.add.at(edges, np.maximum(starts - start, 0), 1)
+    np.add.at(edges, np.minimum(ends - start, end - start), -1)
+    inside = np.cumsum(edges[:-1]) > 0
+    if or_bits is None:
+        bases[inside] = fill
+    else:
+        bases[inside] |= or_bits
+
+    return
+
+#====================================================================#
+
+# time random region fetches from a .2bit file, and from the fasta file it was made from:
+
+def benchmark_main(argv):
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(prog="%s benchmark" % sys.argv[0], description="time random region fetches from a .2bit file (and from a fasta file, for comparison)")
+    parser.add_argument("twobit_file", help=".2bit file")
+    parser.add_argument("--fasta", help="the fasta file the .2bit file was made from, to compare fetches with (through its .fai index) and check they agree")
+    parser.add_argument("--num-fetches", type=int, default=100000, help="number of regions to fetch (default: 100000)")
+    parser.add_argument("--length", type=int, default=1000, help="length of each region (default: 1000)")
+    args = parser.parse_args(argv)
+    if os.path.exists(args.twobit_file) == False or (args.fasta and os.path.exists(args.fasta) == False):
+        parser.print_usage()
+        sys.exit(1)
+
+    store = TwoBitStore(args.twobit_file)
+    random.seed(1)
+    lengths = [store.get_length(name) for name in store.names]
+    regions = []
+    for _ in range(args.num_fetches):
+        name_num = random.randrange(len(lengths))
+        start = random.randrange(max(1, lengths[name_num] - args.length))
+        regions.append((store.names[name_num], start, start + args.length, random.random() < 0.5))
+
+    start_time = time.perf_counter()
+    seqs = [store.fetch(name, start, end, reverse) for name, start, end, reverse in regions]
+    seconds = time.perf_counter() - start_time
+    print("%d fetches of %d bases from %s: %.1f microseconds each" % (len(regions), args.length, args.twobit_file, 1e6 * seconds / len(regions)))
+    if args.fasta:
+        fasta = IndexedFasta(args.fasta)
+        start_time = time.perf_counter()
+        fasta_seqs = [fasta.fetch(name, start, end) for name, start, end, reverse in regions]
+        fasta_seqs = [reverse_complement(seq) if reverse else seq for seq, (name, start, end, reverse) in zip(fasta_seqs, regions)]
+        seconds = time.perf_counter() - start_time
+        print("the same fetches from %s: %.1f microseconds each" % (args.fasta, 1e6 * seconds / len(regions)))
+        mismatches = sum(1 for seq, fasta_seq in zip(seqs, fasta_seqs) if seq != fasta_seq.translate(AS_N))
+        print("%d of the fetches differ between the two files" % mismatches)
+        print("file sizes: %s %.1f MB, %s %.1f MB" % (args.twobit_file, os.path.getsize(args.twobit_file) / 2**20, args.fasta, os.path.getsize(args.fasta) / 2**20))
+        fasta.close()
+    store.close()
+
+#====================================================================#
+
+def main():
+
+    # 'twobit_store.py benchmark ...' times region fetches:
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark_main(sys.argv[2:])
+        return
+
+    # 'twobit_store.py fetch ...' prints out regions:
+    if len(sys.argv) > 1 and sys.argv[1] == "fetch":
+        parser = argparse.ArgumentParser(prog="%s fetch" % sys.argv[0], description="print out regions of the sequences in a .2bit file, in fasta format")
+        parser.add_argument("twobit_file", help=".2bit file")
+        parser.add_argument("regions", nargs="+", help="regions to print out, eg. chr1 or chr1:1,001-2,000 (counting from 1)")
+        parser.add_argument("--reverse", action="store_true", help="print out the reverse complement of each region")
+        parser.add_argument("--no-mask", action="store_true", help="print out soft-masked bases in upper case")
+        args = parser.parse_args(sys.argv[2:])
+        store = TwoBitStore(args.twobit_file)
+        for region in args.regions:
+            seq = store.fetch_region(region, args.reverse, not args.no_mask).decode()
+            sys.stdout.write(">%s\n" % region)
+            for i in range(0, len(seq), 60):
+                sys.stdout.write(seq[i:i + 60] + "\n")
+        store.close()
+        return
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(description="convert the sequences in a fasta or EMBL file (optionally gzipped) to a .2bit file", epilog="Run '%(prog)s fetch -h' for printing out regions, or '%(prog)s benchmark -h' for timing them.")
+    parser.add_argument("input_file", help="input fasta or EMBL file")
+    parser.add_argument("output_file", help="output .2bit file")
+    args = parser.parse_args()
+    if os.path.exists(args.input_file) == False:
+        parser.print_usage()
+        sys.exit(1)
+
+    # read the sequences one at a time, and write them out packed:
+    fileObj = open(args.input_file, "rb")
+    if fileObj.read(2) == b"\x1f\x8b":
+        fileObj.close()
+        fileObj = gzip.open(args.input_file, "rb")
+    else:
+        fileObj.seek(0)
+    first_line = fileObj.readline()
+    fileObj.seek(0)
+    if first_line.startswith(b">"):
+        records = read_fasta_records(fileObj)
+    elif first_line.startswith(b"ID"):
+        records = read_embl_records(fileObj)
+    else:
+        print("%s does not look like a fasta or EMBL file" % args.input_file)
+        sys.exit(1)
+    num_seqs = write_twobit_file(records, args.output_file)
+    fileObj.close()
+    print("Wrote %d sequences to %s (%.1f MB, from %.1f MB)" % (num_seqs, args.output_file, os.path.getsize(args.output_file) / 2**20, os.path.getsize(args.input_file) / 2**20))
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
@@ -0,0 +1,199 @@
+# Script to build an index of the Compara families file, so that the genes in
+# families for one species can be read in without parsing the whole file
+
+import sys
+import os
+import sqlite3
+
+#====================================================================#
+
+# the index is an SQLite database written next to the families file, eg.
+# complete_families.txt_27mar2017.sqlite, with one row for each species:
+
+INDEX_SUFFIX = ".sqlite"
+
+# change this if the gene name normalisation changes, so old indexes get rebuilt:
+
+INDEX_VERSION = "1"
+
+#====================================================================#
+
+# define a function to normalise a gene name from the families file:
+
+def normalise_family_gene_name(gene, species):
+    """get the gene name from a transcript name in the families file
+    >>> normalise_family_gene_name('SRAE_X000112100.t1:mRNA', 'strongyloides_ratti')
+    'SRAE_X000112100'
+    >>> normalise_family_gene_name('ASIM_0000655901-mRNA-1', 'anisakis_simplex')
+    'ASIM_0000655901'
+    >>> normalise_family_gene_name('HCOI02162100.t1', 'haemonchus_contortus')
+    'HCOI02162100'
+    >>> normalise_family_gene_name('F23B12.1', 'caenorhabditis_elegans')
+    'F23B12.1'
+    """
+
+    # eg. SRAE_X000112100.t1:mRNA/SSTP_0000225500.1:mRNA/SPAL_0001294400.1:mRNA/SVEN_0373900.1/PTRK_0001428200.1:mRNA/RSKR_0000682500.1:mRNA
+    if ':mRNA' in gene:
+        temp2 = gene.split(':mRNA') # eg. SRAE_X000112100.t1:mRNA
+        gene = temp2[0] # eg. SRAE_X000112100.t1
+    if '-mRNA-' in gene: # eg. ASIM_0000655901-mRNA-1
+        temp2 = gene.split('-mRNA-')
+        gene = temp2[0] # eg. ASIM_0000655901
+    if '_' in gene and '.' in gene: # eg. SRAE_X000112100.t1 or MhA1_Contig1285.frz3.fgene2
+        temp2 = gene.split('.')
+        afterdot = temp2[1] # eg. t1 or fgene2
+        if (afterdot.startswith('t') or afterdot.isdigit() == True) and species != 'caenorhabditis_elegans':
+            gene = temp2[0] # eg. SRAE_X000112100
+    if '.t' in gene: # eg. HCOI02162100.t1
+        temp2 = gene.split('.t')
+        afterdot = temp2[1] # eg. 1
+        if afterdot.isdigit() == True:
+            gene = temp2[0] # eg. HCOI02162100
+
+    return gene
+
+#====================================================================#
+
+# define a function to read the genes in each family from the families file:
+
+def read_families_file(families_file):
+    """yield a (species, gene, family) tuple for each gene in the families file, with normalised gene names"""
+
+    fileObj = open(families_file, "r")
+    for line in fileObj:
+        line = line.rstrip()
+        if line.startswith('family'): # eg. family 5168 : SPAL_0001096400.1:mRNA (strongyloides_papillosus) Bm11175 (brugia_malayi) HCOI_1164600.1 (haemonchus_contortus)...
+            temp = line.split()
+            family = temp[1] # eg. 4376
+            temp = line.split(': ')
+            line = temp[1] # SPAL_0000608500.1:mRNA (strongyloides_papillosus) Bm10870f (brugia_malayi) F23B12.1 (caenorhabditis_elegans)...
+            temp = line.split()
+            # the gene names and species names alternate, eg. gene= SPAL_0000608500.1:mRNA species= (strongyloides_papillosus)
+            for gene, species in zip(temp[0::2], temp[1::2]):
+                species = species[1:-1] # remove the parentheses
+                yield species, normalise_family_gene_name(gene, species), family
+    fileObj.close()
+
+#====================================================================#
+
+# define a function to get the file details that tell us if the index is out of date:
+
+def get_families_file_stamp(families_file):
+
+    stat = os.stat(families_file)
+    stamp = "%s %d %d" % (INDEX_VERSION, stat.st_size, stat.st_mtime_ns)
+
+    return stamp
+
+#====================================================================#
+
+# define a function to build the index of a families file:
+
+def build_families_index(families_file, index_file):
+    """parse the families file once, and write an SQLite index with one row per species
+
+    Each species' row holds all of its (normalised) genes and their families, as
+    'gene<tab>family' lines in the order they first appear in the families file, so
+    that loading a species is one lookup. The index is built in a temporary file and
+    then renamed, so that several processes building it at the same time never see
+    a half-written index.
+    """
+
+    genes_of_species = {} # species -> {gene: family}
+    for species, gene, family in read_families_file(families_file):
+        genes = genes_of_species.get(species)
+        if genes is None:
+            genes = genes_of_species[species] = {}
+        if gene not in genes:
+            genes[gene] = family
+
+    stamp = get_families_file_stamp(families_file)
+    temp_file = "%s.%d.tmp" % (index_file, os.getpid())
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    conn = sqlite3.connect(temp_file)
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE species (name TEXT PRIMARY KEY, num_genes INTEGER, genes TEXT)")
+    rows = ((species, len(genes), "".join("%s\t%s\n" % pair for pair in genes.items())) for species, genes in genes_of_species.items())
+    conn.executemany("INSERT INTO species VALUES (?, ?, ?)", rows)
+    conn.execute("INSERT INTO meta VALUES ('stamp', ?)", (stamp,))
+    conn.commit()
+    conn.close()
+    os.replace(temp_file, index_file)
+
+    return
+
+#====================================================================#
+
+# define a function to check if an index is there and up to date:
+
+def families_index_is_current(families_file, index_file):
+
+    if not os.path.exists(index_file):
+        return False
+    try:
+        conn = sqlite3.connect(index_file)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+        conn.close()
+    except sqlite3.DatabaseError:
+        return False
+
+    return row is not None and row[0] == get_families_file_stamp(families_file)
+
+#====================================================================#
+
+# define a function to read in the genes in families for one species, using the index:
+
+def load_genes_in_families(families_file, our_species_name, index_file=None):
+    """return a dictionary from each (normalised) gene of a species to its family
+
+    The index is (re)built if it is missing, or if the families file's size or
+    modification time have changed since it was built. If the index can't be
+    written (eg. the families file is in a read-only directory), the families
+    file is parsed directly instead.
+    """
+
+    if index_file is None:
+        index_file = families_file + INDEX_SUFFIX
+    if not families_index_is_current(families_file, index_file):
+        try:
+            print("Building index",index_file,"of",families_file,"...")
+            build_families_index(families_file, index_file)
+        except (OSError, sqlite3.Error) as error:
+            print("Could not build index",index_file,"(%s), so reading the families file instead" % error)
+            genes = {}
+            for species, gene, family in read_families_file(families_file):
+                if species == our_species_name and gene not in genes:
+                    genes[gene] = family
+            return genes
+
+    conn = sqlite3.connect(index_file)
+    row = conn.execute("SELECT genes FROM species WHERE name = ?", (our_species_name,)).fetchone()
+    conn.close()
+    if row is None:
+        return {}
+    genes = dict(line.split("\t") for line in row[0].splitlines())
+
+    return genes
+
+#====================================================================#
+
+def main():
+
+    # check the command-line arguments:
+    if len(sys.argv) != 2 or os.path.exists(sys.argv[1]) == False:
+        print("Usage: %s families_file" % sys.argv[0])
+        sys.exit(1)
+    families_file = sys.argv[1] # eg. /nfs/helminths02/analysis/50HGP/00ANALYSES/final_families/complete_families.txt_27mar2017
+
+    # build the index, even if there is a current one already:
+    build_families_index(families_file, families_file + INDEX_SUFFIX)
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
@@ -0,0 +1,260 @@
+# Script to check the translations of the CDSs in an EMBL file, and write out
+# error lines like those of the EMBL validator, eg.
+# ERROR: ERROR: Protein coding feature translation contains more than 50% X . [haemonchus_placei_new2.embl,  line: 1102966-1102969 of HPLM_0000313201-mRNA-1]
+# so that they can be given to fix_embl_file_cds_error.py without a round-trip
+# through the validator. The translation follows os/translate_spliced_dna.pl
+# (a codon with any base other than A, C, G or T is an X), and internal stops
+# are counted as in scripts/find_internal_stops.pl (not counting a stop at the end).
+
+import sys
+import os
+import numpy as np
+from embl_features import iter_embl, parse_id_note, EmblFeature, EmblSequence
+
+#====================================================================#
+
+# the NCBI genetic codes, with the amino acids of the codons in the order TTT, TTC, TTA, TTG, TCT, ... GGG:
+
+GENETIC_CODES = {
+    1: "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", # standard
+    2: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSS**VVVVAAAADDEEGGGG", # vertebrate mitochondrial
+    3: "FFLLSSSSYY**CCWWTTTTPPPPHHQQRRRRIIMMTTTTNNKKSSRRVVVVAAAADDEEGGGG", # yeast mitochondrial
+    4: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", # mold, protozoan and coelenterate mitochondrial
+    5: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSSSVVVVAAAADDEEGGGG", # invertebrate mitochondrial
+    6: "FFLLSSSSYYQQCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", # ciliate nuclear
+    9: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG", # echinoderm and flatworm mitochondrial
+    10: "FFLLSSSSYY**CCCWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", # euplotid nuclear
+    11: "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", # bacterial, archaeal and plant plastid
+    12: "FFLLSSSSYY**CC*WLLLSPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", # alternative yeast nuclear
+    13: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSGGVVVVAAAADDEEGGGG", # ascidian mitochondrial
+    14: "FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG", # alternative flatworm mitochondrial
+}
+
+TABLE_NUMBERS = sorted(GENETIC_CODES)
+
+# a (number of genetic codes, 65) array of amino acids (as bytes), where codon 64 is any codon with a base other than A/C/G/T:
+
+CODON_TABLES = np.array([[ord(aa) for aa in GENETIC_CODES[table] + "X"] for table in TABLE_NUMBERS], dtype=np.uint8)
+
+# the base codes in the order of the genetic codes above (T, C, A, G), with 4 for any other base:
+
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate("TCAG"):
+    BASE_CODES[ord(base)] = code
+    BASE_CODES[ord(base.lower())] = code
+
+COMPLEMENT_CODES = np.array([2, 3, 0, 1, 4], dtype=np.uint8) # T<->A, C<->G
+
+X = ord('X')
+STOP = ord('*')
+
+#====================================================================#
+
+# define a function to parse a feature location:
+
+def parse_location(location):
+    """turn a location into a list of (start, end, strand) pieces, in the order they are transcribed
+
+    Returns None for locations we can't use, such as ones in other entries.
+
+    >>> parse_location('complement(join(40602..44150,44239..44536))')
+    [(44239, 44536, -1), (40602, 44150, -1)]
+    >>> parse_location('join(complement(<5..10),complement(1..3))')
+    [(5, 10, -1), (1, 3, -1)]
+    >>> parse_location('join(1..5,AB000001.1:10..20)') is None
+    True
+    """
+
+    pieces, end = parse_location_from(location, 0)
+    if pieces is None or end != len(location):
+        return None
+
+    return pieces
+
+#====================================================================#
+
+# define a function to parse part of a location, starting at position 'start':
+
+def parse_location_from(location, start):
+    """returns (pieces, the position after the part parsed), or (None, start) if it can't be parsed"""
+
+    for operator in ("complement(", "join(", "order("):
+        if location.startswith(operator, start):
+            pos = start + len(operator)
+            pieces = []
+            while True:
+                new_pieces, pos = parse_location_from(location, pos)
+                if new_pieces is None or pos >= len(location):
+                    return None, start
+                pieces.extend(new_pieces)
+                if location[pos] == ')':
+                    break
+                if location[pos] != ',' or operator == "complement(":
+                    return None, start
+                pos += 1
+            if operator == "complement(":
+                pieces = [(piece_start, piece_end, -strand) for (piece_start, piece_end, strand) in reversed(pieces)]
+            return pieces, pos + 1
+
+    # a range such as 40602..44150 or <1..>200, or a single base such as 467:
+    pos = start
+    while pos < len(location) and location[pos] not in ",()":
+        pos += 1
+    text = location[start:pos].replace('<', '').replace('>', '')
+    temp = text.split('..')
+    if len(temp) > 2 or not all(part.isdigit() for part in temp):
+        return None, start
+    return [(int(temp[0]), int(temp[-1]), 1)], pos
+
+#====================================================================#
+
+# define a function to translate a batch of CDSs from one sequence:
+
+def translate_cds_batch(sequence, cds_list):
+    """translate the CDSs of one sequence, all at once
+
+    'cds_list' is a list of (pieces, codon_start, transl_table) tuples. Returns a
+    list of translations (as bytes), one for each CDS. The positions of all the
+    bases of all the CDSs are gathered into one NumPy array, so the translation is
+    a few array operations for the whole sequence, however many CDSs it has.
+
+    >>> translate_cds_batch('ATGCAGTAAccc', [([(1, 9, 1)], 1, 1), ([(1, 9, -1)], 1, 1), ([(1, 10, 1)], 2, 1)])
+    [b'MQ*', b'LLH', b'CSN']
+    >>> translate_cds_batch('ATGNNNTGA', [([(1, 9, 1)], 1, 1), ([(1, 9, 1)], 1, 2)])
+    [b'MX*', b'MXW']
+    """
+
+    codes = BASE_CODES[np.frombuffer(sequence.encode("ascii"), dtype=np.uint8)]
+    table_index = {table: i for i, table in enumerate(TABLE_NUMBERS)}
+
+    # the positions of the bases of each CDS, in order:
+    positions = []
+    minus_strand = []
+    num_codons = []
+    tables = []
+    for pieces, codon_start, transl_table in cds_list:
+        cds_positions = [np.arange(start - 1, end) if strand == 1 else np.arange(end - 1, start - 2, -1) for (start, end, strand) in pieces]
+        cds_strands = [np.full(end - start + 1, strand == -1) for (start, end, strand) in pieces]
+        cds_positions = np.concatenate(cds_positions)[codon_start - 1:]
+        cds_strands = np.concatenate(cds_strands)[codon_start - 1:]
+        length = len(cds_positions) // 3 * 3
+        positions.append(cds_positions[:length])
+        minus_strand.append(cds_strands[:length])
+        num_codons.append(length // 3)
+        tables.append(table_index[transl_table])
+    if not positions:
+        return []
+    positions = np.concatenate(positions)
+    minus_strand = np.concatenate(minus_strand)
+
+    # look up the bases, and complement the ones on the minus strand:
+    bases = codes[np.minimum(positions, len(codes) - 1)]
+    bases[positions >= len(codes)] = 4 # past the end of the sequence
+    bases[minus_strand] = COMPLEMENT_CODES[bases[minus_strand]]
+
+    # then translate the codons:
+    bases = bases.reshape(-1, 3).astype(np.int32)
+    codon_index = bases[:, 0] * 16 + bases[:, 1] * 4 + bases[:, 2]
+    codon_index[(bases == 4).any(axis=1)] = 64
+    codon_tables = np.repeat(np.array(tables, dtype=np.intp), num_codons)
+    amino_acids = CODON_TABLES[codon_tables, codon_index]
+
+    translations = []
+    start = 0
+    for n in num_codons:
+        translations.append(amino_acids[start:start + n].tobytes())
+        start += n
+
+    return translations
+
+#====================================================================#
+
+# define a function to check the translations of the CDSs in an EMBL file:
+
+def validate_embl_cds(input_embl, max_x_fraction=0.5):
+    """yield (first line, last line, CDS name, problem) for each CDS whose translation has too many Xs or internal stops
+
+    The CDSs of each entry are collected as its features are read, and translated
+    all together once its sequence has been read.
+    """
+
+    cds_list = [] # the CDSs of the current entry that can be translated
+    cds_details = [] # (first line, last line, name, problem) for all the CDSs of the current entry, with problem None if it can be translated
+    fileObj = open(input_embl, "r")
+    for item in iter_embl(fileObj):
+        if isinstance(item, EmblFeature):
+            if item.key != 'CDS':
+                continue
+            pieces = parse_location(item.location)
+            name = None
+            for qualifier_name, value, _ in item.qualifier_lines:
+                if qualifier_name == 'note' and parse_id_note(value)[0] == 'cds': # eg. ID:cds:HPLM_0000313201-mRNA-1
+                    name = value[len('ID:cds:'):]
+                    break
+            if name is None:
+                name = item.get('locus_tag', item.get('protein_id', 'CDS'))
+            first_line, last_line = item.line_range()
+            if pieces is None:
+                print("WARNING: can't use the location of %s at line %d: %s" % (name, first_line, item.location))
+                continue
+            codon_start = item.get('codon_start', '1')
+            if codon_start not in ('1', '2', '3'): # eg. a bare /codon_start with no value
+                cds_details.append((first_line, last_line, name, "Protein coding feature has an invalid /codon_start (%s)" % ("no value" if codon_start is None else codon_start)))
+                continue
+            transl_table = item.get('transl_table', '1')
+            if transl_table is None or not transl_table.isdigit() or int(transl_table) not in GENETIC_CODES:
+                print("WARNING: unknown transl_table %s for %s at line %d, using table 1" % (transl_table, name, first_line))
+                transl_table = '1'
+            cds_list.append((pieces, int(codon_start), int(transl_table)))
+            cds_details.append((first_line, last_line, name, None))
+        elif isinstance(item, EmblSequence):
+            translations = iter(translate_cds_batch(item.sequence(), cds_list))
+            for first_line, last_line, name, problem in cds_details:
+                if problem is not None:
+                    yield first_line, last_line, name, problem
+                    continue
+                protein = next(translations)
+                if len(protein) == 0:
+                    yield first_line, last_line, name, "Protein coding feature is too short to translate"
+                    continue
+                if protein.count(b"X") > max_x_fraction * len(protein):
+                    yield first_line, last_line, name, "Protein coding feature translation contains more than %d%% X" % round(100 * max_x_fraction)
+                internal_stops = protein.count(b"*", 0, len(protein) - 1)
+                if internal_stops > 0:
+                    yield first_line, last_line, name, "Protein coding feature translation contains %d internal stop codons" % internal_stops
+            cds_list = []
+            cds_details = []
+        elif any(line.startswith('//') for line in item.lines):
+            cds_list = [] # an entry with no sequence
+            cds_details = []
+    fileObj.close()
+
+#====================================================================#
+
+def main():
+
+    # check the command-line arguments:
+    if len(sys.argv) not in (3, 4) or os.path.exists(sys.argv[1]) == False:
+        print("Usage: %s input_embl output_error_file [max_x_fraction]" % sys.argv[0])
+        sys.exit(1)
+    input_embl = sys.argv[1] # eg. haemonchus_placei_new2.embl
+    output_error_file = sys.argv[2] # eg. haemonchus_placei_new2.errors, to give to fix_embl_file_cds_error.py
+    max_x_fraction = float(sys.argv[3]) if len(sys.argv) == 4 else 0.5
+
+    # check the CDSs, and write out the errors in the same format as the EMBL validator:
+    num_errors = 0
+    outputfileObj = open(output_error_file, "w")
+    for first_line, last_line, name, problem in validate_embl_cds(input_embl, max_x_fraction):
+        outputfileObj.write("ERROR: ERROR: %s . [%s,  line: %d-%d of %s]\n" % (problem, os.path.basename(input_embl), first_line, last_line, name))
+        num_errors += 1
+    outputfileObj.close()
+    print("Found",num_errors,"errors")
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
@@ -0,0 +1,373 @@
+# Streaming parser for EMBL files, shared by the fix_embl scripts
+# It reads an EMBL file one feature at a time, and writes the features back out
+# without re-serializing the lines that were not changed.
+
+#====================================================================#
+
+# the feature table lines look like this, with the key in columns 6-20 and the
+# location or qualifiers from column 22:
+# FT   CDS             complement(join(40602..44150,44239..44536,44646..44849,
+# FT                   46859..46950,47022..47072))
+# FT                   /locus_tag="HPLM_LOCUS3124"
+# FT                   /note="ID:cds:HPLM_0000313201-mRNA-1"
+
+QUALIFIER_COLUMN = 21
+
+# the characters in the sequence lines that aren't bases (spaces, and the base counts at the ends of the lines):
+
+NOT_BASES = str.maketrans("", "", " \t\r\n0123456789")
+
+# how much of the file to scan at once when looking for the ends of entries:
+
+SCAN_BLOCK_SIZE = 16 * 1024 * 1024
+
+#====================================================================#
+
+# a run of lines that are not part of a feature or the sequence, eg. ID, AC, XX, SQ and // lines:
+
+class EmblLines:
+    """lines of an EMBL file outside the feature table and the sequence"""
+
+    __slots__ = ("lines", "first_line")
+
+    def __init__(self, lines, first_line):
+        self.lines = lines
+        self.first_line = first_line # the line number of the first line, counting from 1
+
+    def line_range(self):
+        """the line numbers of the first and last lines"""
+        return self.first_line, self.first_line + len(self.lines) - 1
+
+    def write(self, outputfileObj):
+        outputfileObj.writelines(self.lines)
+
+#====================================================================#
+
+# the sequence lines between an SQ line and the // at the end of an entry:
+
+class EmblSequence:
+    """the sequence lines of an EMBL entry, kept as one string"""
+
+    __slots__ = ("text", "num_lines", "first_line")
+
+    def __init__(self, text, num_lines, first_line):
+        self.text = text
+        self.num_lines = num_lines
+        self.first_line = first_line
+
+    def line_range(self):
+        """the line numbers of the first and last lines"""
+        return self.first_line, self.first_line + self.num_lines - 1
+
+    def sequence(self):
+        """the sequence as one string of bases (lower case, as in the file)
+        >>> EmblSequence('     acgtacgtac gtacg         15\\n', 1, 1).sequence()
+        'acgtacgtacgtacg'
+        """
+        return self.text.translate(NOT_BASES)
+
+    def write(self, outputfileObj):
+        outputfileObj.write(self.text)
+
+#====================================================================#
+
+# one feature from the feature table, with its key, location and qualifiers:
+
+class EmblFeature:
+    """one feature from an EMBL feature table
+
+    The raw lines are kept as they were read; the location and qualifiers are only
+    parsed if they are asked for. Lines can be inserted or dropped before writing
+    the feature back out, and the lines that were not touched are written as they
+    were.
+
+    >>> feature = EmblFeature(['FT   CDS             join(1..10,\\n',
+    ...                        'FT                   20..30)\\n',
+    ...                        'FT                   /note="ID:cds:X-mRNA-1"\\n',
+    ...                        'FT                   /pseudo\\n'], 5)
+    >>> feature.key, feature.location
+    ('CDS', 'join(1..10,20..30)')
+    >>> feature.qualifiers
+    {'note': ['ID:cds:X-mRNA-1'], 'pseudo': [None]}
+    >>> feature.qualifier_lines
+    [('note', 'ID:cds:X-mRNA-1', 2), ('pseudo', None, 3)]
+    >>> feature.get('note')
+    'ID:cds:X-mRNA-1'
+    >>> feature.line_range()
+    (5, 8)
+    """
+
+    __slots__ = ("key", "lines", "first_line", "_location", "_qualifiers", "_inserted", "_dropped")
+
+    def __init__(self, lines, first_line):
+        self.lines = lines
+        self.first_line = first_line
+        self.key = lines[0][5:QUALIFIER_COLUMN].strip() # eg. CDS
+        self._location = None
+        self._qualifiers = None
+        self._inserted = None # line index -> lines to write after that line
+        self._dropped = None # line indices not to write
+
+    def line_range(self):
+        """the line numbers of the first and last lines of the feature"""
+        return self.first_line, self.first_line + len(self.lines) - 1
+
+    @property
+    def location(self):
+        """the location, joined up from all of its lines"""
+        if self._location is None:
+            parts = []
+            for line in self.lines:
+                text = line[QUALIFIER_COLUMN:].strip()
+                if text.startswith('/'):
+                    break
+                parts.append(text)
+            self._location = "".join(parts)
+        return self._location
+
+    @property
+    def qualifier_lines(self):
+        """the qualifiers in file order, as (name, value, line index) tuples; value is None for qualifiers like /pseudo"""
+        if self._qualifiers is None:
+            qualifiers = []
+            name = None
+            for index, line in enumerate(self.lines):
+                text = line[QUALIFIER_COLUMN:].rstrip("\n")
+                if text.startswith('/'):
+                    if name is not None:
+                        qualifiers.append(make_qualifier(name, parts, start))
+                    name, _, value = text[1:].partition('=')
+                    parts = [value] if _ else None
+                    start = index
+                elif name is not None and parts is not None:
+                    parts.append(text)
+            if name is not None:
+                qualifiers.append(make_qualifier(name, parts, start))
+            self._qualifiers = qualifiers
+        return self._qualifiers
+
+    @property
+    def qualifiers(self):
+        """a dictionary from each qualifier name to a list of its values"""
+        qualifiers = {}
+        for name, value, _ in self.qualifier_lines:
+            qualifiers.setdefault(name, []).append(value)
+        return qualifiers
+
+    def get(self, name, default=None):
+        """the value of the first qualifier called 'name'"""
+        for qualifier_name, value, _ in self.qualifier_lines:
+            if qualifier_name == name:
+                return value
+        return default
+
+    def insert_lines_after(self, index, new_lines):
+        """write some new lines (each ending in a newline) after line 'index' of the feature"""
+        if self._inserted is None:
+            self._inserted = {}
+        self._inserted.setdefault(index, []).extend(new_lines)
+
+    def drop_line(self, index):
+        """don't write line 'index' of the feature"""
+        if self._dropped is None:
+            self._dropped = set()
+        self._dropped.add(index)
+
+    def drop_lines_containing(self, text):
+        """don't write any line of the feature that has 'text' in it (eg. on the continuation line of a qualifier)
+
+        >>> feature = EmblFeature(['FT   gene            1..9\\n', 'FT                   /note="ID:gene:G1;\\n',
+        ...                        'FT                   source:X"\\n', 'FT                   /locus_tag="source:X"\\n'], 1)
+        >>> feature.drop_lines_containing('source:X')
+        >>> [index for index in range(4) if feature.is_dropped(index)]
+        [2, 3]
+        """
+        for index, line in enumerate(self.lines):
+            if text in line:
+                self.drop_line(index)
+
+    def is_dropped(self, index):
+        """True if line 'index' of the feature won't be written"""
+        return self._dropped is not None and index in self._dropped
+
+    def write(self, outputfileObj):
+        if self._inserted is None and self._dropped is None:
+            outputfileObj.writelines(self.lines) # nothing changed, so write the lines as they were
+            return
+        inserted = self._inserted or {}
+        dropped = self._dropped or ()
+        for index, line in enumerate(self.lines):
+            if index not in dropped:
+                outputfileObj.write(line)
+            if index in inserted:
+                outputfileObj.writelines(inserted[index])
+
+#====================================================================#
+
+# make a qualifier tuple from the parts of its value:
+
+def make_qualifier(name, parts, line_index):
+    """join up a qualifier's value and take off its quotes
+    >>> make_qualifier('note', ['"odd gene structure probably', 'caused by assembly error"'], 3)
+    ('note', 'odd gene structure probably caused by assembly error', 3)
+    >>> make_qualifier('translation', ['"MKV', 'LLA"'], 4)
+    ('translation', 'MKVLLA', 4)
+    """
+
+    if parts is None:
+        return (name, None, line_index)
+    joiner = "" if name == "translation" else " "
+    value = joiner.join(part.strip() for part in parts)
+    if len(value) >= 2 and value.startswith('"') and value.endswith('"'):
+        value = value[1:-1].replace('""', '"')
+
+    return (name, value, line_index)
+
+#====================================================================#
+
+# define a function to read an EMBL file one feature at a time:
+
+def iter_embl(fileObj):
+    """read an EMBL file, yielding EmblLines, EmblFeature and EmblSequence objects in file order
+
+    Every line comes back in exactly one of them, with any whitespace at the end of
+    the line taken off (as the fix_embl scripts have always written their output).
+
+    >>> import io
+    >>> embl = io.StringIO('ID   X;\\nFT   gene            1..9\\nFT                   /note="ID:gene:G1"\\nSQ   Sequence 9 BP;\\n     acgtacgta    9\\n//\\n')
+    >>> [(type(item).__name__, item.line_range()) for item in iter_embl(embl)]
+    [('EmblLines', (1, 1)), ('EmblFeature', (2, 3)), ('EmblLines', (4, 4)), ('EmblSequence', (5, 5)), ('EmblLines', (6, 6))]
+    """
+
+    lines = [] # the current run of EmblLines lines, or the current feature's lines
+    in_feature = False
+    first_line = 1
+    line_num = 0
+    fileObj = iter(fileObj)
+    for line in fileObj:
+        line_num += 1
+        if line[-2:-1] in " \t\r" or not line.endswith("\n"): # take any whitespace off the end of the line
+            line = line.rstrip() + "\n"
+        if line.startswith('FT'):
+            if line[5:6].strip(): # the start of a new feature
+                if lines:
+                    yield EmblFeature(lines, first_line) if in_feature else EmblLines(lines, first_line)
+                lines = [line]
+                first_line = line_num
+                in_feature = True
+                continue
+            if in_feature:
+                lines.append(line)
+                continue
+        if in_feature:
+            yield EmblFeature(lines, first_line)
+            lines = []
+            first_line = line_num
+            in_feature = False
+        lines.append(line)
+        if line.startswith('SQ'):
+            yield EmblLines(lines, first_line)
+            # read the sequence lines in a tight loop, up to the // line:
+            sequence_lines = []
+            append = sequence_lines.append
+            for line in fileObj:
+                if line.startswith('//'):
+                    break
+                append(line)
+            else:
+                line = None # there is no // line at the end of the file
+            text = "".join(sequence_lines)
+            if " \n" in text or "\t\n" in text or "\r" in text or not text.endswith("\n"):
+                text = "".join(line.rstrip() + "\n" for line in sequence_lines)
+            yield EmblSequence(text, len(sequence_lines), line_num + 1)
+            line_num += len(sequence_lines)
+            if line is not None:
+                line_num += 1
+                line = line.rstrip() + "\n"
+            lines = [line] if line is not None else []
+            first_line = line_num
+    if lines:
+        yield EmblFeature(lines, first_line) if in_feature else EmblLines(lines, first_line)
+
+#====================================================================#
+
+# define a function to get the gene name from a WormBase ParaSite ID note:
+
+def parse_id_note(note):
+    """get the type and the gene name from a /note="ID:..." qualifier value, or (None, None) if it isn't one
+    >>> parse_id_note('ID:gene:NAV_0000008934')
+    ('gene', 'NAV_0000008934')
+    >>> parse_id_note('ID:exon:SMUV_0000587401-mRNA-1.1')
+    ('exon', 'SMUV_0000587401')
+    >>> parse_id_note('odd gene structure probably caused by assembly error')
+    (None, None)
+    """
+
+    if note is None or not note.startswith('ID:'):
+        return None, None
+    temp = note.split(":")
+    if len(temp) < 3:
+        return None, None
+    note_type = temp[1] # gene, transcript, cds or exon
+    temp = temp[2].split("-mRNA-")
+    gene = temp[0] # eg. SMUV_0000587401
+
+    return note_type, gene
+
+#====================================================================#
+
+# define a function to find where each entry of an EMBL file starts:
+
+def find_embl_entry_boundaries(input_embl):
+    """scan an EMBL file for the // lines at the ends of its entries
+
+    Returns a list of (byte offset, number of lines before it) for the start of each
+    entry, followed by the end of the file, so entry k is the lines from
+    boundaries[k] up to boundaries[k+1]. The file is read as bytes in large blocks
+    and searched with bytes.find(), without decoding or splitting it into lines.
+
+    >>> import os, tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix='.embl', delete=False) as fileObj:
+    ...     _ = fileObj.write(b'ID   A;\\nSQ\\n     acgt    4\\n//\\nID   B;\\n//\\n')
+    >>> find_embl_entry_boundaries(fileObj.name)
+    [(0, 0), (29, 4), (40, 6)]
+    >>> os.remove(fileObj.name)
+    """
+
+    boundaries = [(0, 0)]
+    offset = 0 # the offset of the start of 'data' in the file
+    line_num = 0 # the number of lines before 'data'
+    leftover = b""
+    fileObj = open(input_embl, "rb")
+    while True:
+        chunk = fileObj.read(SCAN_BLOCK_SIZE)
+        data = leftover + chunk
+        end = data.rfind(b"\n") + 1 if chunk else len(data) # only look at whole lines, until the end of the file
+        last = 0
+        at_start = end > 0 and data.startswith(b"//") # a // line at the start of the block
+        pos = 0 if at_start else data.find(b"\n//", 0, end) + 1 # the start of the next // line
+        found = at_start or pos > 0
+        while found:
+            entry_end = data.find(b"\n", pos, end) + 1 # the end of the // line
+            if entry_end == 0: # the file ends with a // line with no newline
+                entry_end = end
+                line_num += 1
+            line_num += data.count(b"\n", last, entry_end)
+            last = entry_end
+            boundaries.append((offset + last, line_num))
+            pos = data.find(b"\n//", last - 1, end) + 1
+            found = pos > 0
+        line_num += data.count(b"\n", last, end)
+        if not chunk and last < end and not data.endswith(b"\n"):
+            line_num += 1 # the last line has no newline
+        offset += end
+        leftover = data[end:]
+        if not chunk:
+            break
+    fileObj.close()
+    if boundaries[-1][0] != offset: # the last entry has no // line at the end
+        boundaries.append((offset, line_num))
+
+    return boundaries
+
+#====================================================================#
@@ -0,0 +1,633 @@
+# Script to build an index of the features of an EMBL (or GFF) file by position, so that
+# we can find the features overlapping, nearest to or flanking many regions at once
+# without scanning the file, eg. which CDSs overlap a list of validator errors, or which
+# genes lie within 1 kb of each gene (as for scripts/sanger/get_flanking_regions_of_genes.pl).
+
+import sys
+import os
+import gzip
+import time
+import argparse
+import numpy as np
+from embl_features import iter_embl, parse_id_note, EmblFeature, EmblLines
+from embl_cds_validator import parse_location
+from embl_line_index import get_embl_file_stamp
+
+#====================================================================#
+
+# the index is written next to the EMBL file, eg. haemonchus_placei_new2.embl.gz.intervals.npz:
+
+INDEX_SUFFIX = ".intervals.npz"
+
+INDEX_VERSION = 1
+
+# positions are combined with their contig number into one int64 key, contig * 2**KEY_SHIFT + position,
+# so one searchsorted() call finds positions on many contigs at once:
+
+KEY_SHIFT = 40
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+#====================================================================#
+
+# define a function to open a plain or gzipped text file:
+
+def open_text_file(input_file):
+
+    fileObj = open(input_file, "rb")
+    is_gzip = fileObj.read(2) == GZIP_MAGIC
+    fileObj.close()
+    if is_gzip:
+        return gzip.open(input_file, "rt")
+
+    return open(input_file, "r")
+
+#====================================================================#
+
+# define a function to read the features of an EMBL file:
+
+def read_embl_features(fileObj):
+    """yields ('contig', contig name, length) at the start of each entry and
+    ('feature', key, name, pieces, first line, last line) for each feature, where pieces is
+    a list of (start, end, strand) as from embl_cds_validator.parse_location()
+
+    >>> import io
+    >>> embl = io.StringIO('ID   scaf1; SV 1; linear; genomic DNA; STD; INV; 30 BP.\\nFT   CDS             complement(join(2..5,\\nFT                   9..12))\\nFT                   /note="ID:cds:G1-mRNA-1"\\nSQ   Sequence 30 BP;\\n//\\n')
+    >>> list(read_embl_features(embl))
+    [('contig', 'scaf1', 30), ('feature', 'CDS', 'G1-mRNA-1', [(9, 12, -1), (2, 5, -1)], 2, 4)]
+    """
+
+    for item in iter_embl(fileObj):
+        if isinstance(item, EmblFeature):
+            pieces = parse_location(item.location)
+            if pieces is None:
+                print("WARNING: can't use the location of the %s feature at line %d: %s" % (item.key, item.first_line, item.location))
+                continue
+            name = None
+            for qualifier_name, value, _ in item.qualifier_lines:
+                if qualifier_name == 'note' and parse_id_note(value)[0] is not None: # eg. ID:cds:HPLM_0000313201-mRNA-1
+                    name = value.split(":", 2)[2]
+                    break
+            if name is None:
+                name = item.get('locus_tag') or item.get('gene') or item.get('protein_id') or ''
+            first_line, last_line = item.line_range()
+            yield ('feature', item.key, name, pieces, first_line, last_line)
+        elif isinstance(item, EmblLines):
+            for line in item.lines:
+                # ID   HPLM_contig_1; SV 1; linear; genomic DNA; STD; INV; 2983 BP.
+                if line.startswith('ID   '):
+                    temp = line[5:].split()
+                    length = int(temp[-2]) if len(temp) >= 2 and temp[-1].startswith('BP') and temp[-2].isdigit() else 0
+                    yield ('contig', temp[0].rstrip(';'), length)
+
+    return
+
+#====================================================================#
+
+# define a function to read the features of a GFF file:
+
+def read_gff_features(fileObj):
+    """yields ('contig', ...) and ('feature', ...) tuples as read_embl_features() does, for a GFF file;
+    lines with the same type and ID (eg. the pieces of a CDS) become one feature
+
+    >>> import io
+    >>> gff = io.StringIO('##sequence-region scaf1 1 500\\nscaf1\\tx\\tgene\\t10\\t90\\t.\\t+\\t.\\tID=G1\\nscaf1\\tx\\tCDS\\t10\\t20\\t.\\t+\\t0\\tID=C1;Parent=T1\\nscaf1\\tx\\tCDS\\t50\\t90\\t.\\t+\\t0\\tID=C1;Parent=T1\\n')
+    >>> list(read_gff_features(gff))
+    [('contig', 'scaf1', 500), ('feature', 'gene', 'G1', [(10, 90, 1)], 2, 2), ('feature', 'CDS', 'C1', [(10, 20, 1), (50, 90, 1)], 3, 4)]
+    """
+
+    features = {} # (contig, type, ID) -> [type, name, pieces, first line, last line], in file order
+    contigs = {}
+    line_num = 0
+    for line in fileObj:
+        line_num += 1
+        if line.startswith('##sequence-region'):
+            temp = line.split() # ##sequence-region scaf1 1 500
+            if len(temp) >= 4:
+                contigs[temp[1]] = int(temp[3])
+            continue
+        if line.startswith('##FASTA'):
+            break
+        if line.startswith('#'):
+            continue
+        temp = line.rstrip('\n').split('\t')
+        if len(temp) < 9:
+            continue
+        contig, feature_type, start, end, strand, attributes = temp[0], temp[2], int(temp[3]), int(temp[4]), temp[6], temp[8]
+        name = ''
+        for attribute in attributes.split(';'):
+            key, _, value = attribute.strip().partition('=')
+            if key == 'ID' or (key == 'Name' and name == ''):
+                name = value
+        if contig not in contigs:
+            contigs[contig] = 0
+        strand = -1 if strand == '-' else 1
+        key = (contig, feature_type, name) if name else (contig, feature_type, line_num)
+        if key in features:
+            feature = features[key]
+            feature[3].append((start, end, strand))
+            feature[5] = line_num
+        else:
+            features[key] = [contig, feature_type, name, [(start, end, strand)], line_num, line_num]
+
+    # the features of each contig come after its 'contig' tuple:
+    by_contig = {}
+    for contig, feature_type, name, pieces, first_line, last_line in features.values():
+        if strand_of(pieces) == -1:
+            pieces = pieces[::-1] # in the order they are transcribed, as for EMBL
+        by_contig.setdefault(contig, []).append(('feature', feature_type, name, pieces, first_line, last_line))
+    for contig, length in contigs.items():
+        yield ('contig', contig, length)
+        for feature in by_contig.get(contig, []):
+            yield feature
+
+    return
+
+#====================================================================#
+
+# define a function to get the strand of a feature:
+
+def strand_of(pieces):
+    """1 or -1 if all the pieces are on that strand, or 0 if they're on both"""
+
+    strands = set(piece[2] for piece in pieces)
+
+    return strands.pop() if len(strands) == 1 else 0
+
+#====================================================================#
+
+# define a function to collect the features of a file into arrays:
+
+def build_feature_arrays(records):
+    """returns a dictionary of arrays for a FeatureIntervalIndex, from the tuples of read_embl_features()
+    or read_gff_features(); the features are sorted by contig and start"""
+
+    contig_names = []
+    contig_lengths = []
+    contig_numbers = {}
+    type_numbers = {}
+    contig_ids = []
+    type_ids = []
+    names = []
+    strands = []
+    first_lines = []
+    last_lines = []
+    piece_counts = []
+    piece_starts = []
+    piece_ends = []
+    contig_id = -1
+    for record in records:
+        if record[0] == 'contig':
+            contig, length = record[1], record[2]
+            if contig in contig_numbers: # eg. a GFF contig that's also in a ##sequence-region line
+                contig_id = contig_numbers[contig]
+                contig_lengths[contig_id] = max(contig_lengths[contig_id], length)
+                continue
+            contig_id = len(contig_names)
+            contig_numbers[contig] = contig_id
+            contig_names.append(contig)
+            contig_lengths.append(length)
+            continue
+        _, key, name, pieces, first_line, last_line = record
+        if contig_id < 0:
+            raise ValueError("the feature at line %d comes before any ID line" % first_line)
+        contig_ids.append(contig_id)
+        type_ids.append(type_numbers.setdefault(key, len(type_numbers)))
+        names.append(name)
+        strands.append(strand_of(pieces))
+        first_lines.append(first_line)
+        last_lines.append(last_line)
+        piece_counts.append(len(pieces))
+        for start, end, strand in pieces:
+            piece_starts.append(start)
+            piece_ends.append(end)
+
+    # each feature's span is from its lowest piece start to its highest piece end:
+    piece_counts = np.array(piece_counts, dtype=np.int64)
+    piece_indptr = np.zeros(len(piece_counts) + 1, dtype=np.int64)
+    np.cumsum(piece_counts, out=piece_indptr[1:])
+    piece_starts = np.array(piece_starts, dtype=np.int64)
+    piece_ends = np.array(piece_ends, dtype=np.int64)
+    starts = np.minimum.reduceat(piece_starts, piece_indptr[:-1]) if len(piece_counts) else np.zeros(0, dtype=np.int64)
+    ends = np.maximum.reduceat(piece_ends, piece_indptr[:-1]) if len(piece_counts) else np.zeros(0, dtype=np.int64)
+    contig_ids = np.array(contig_ids, dtype=np.int64)
+
+    # sort the features by contig and start, taking their pieces with them:
+    order = np.lexsort((ends, starts, contig_ids))
+    counts = piece_counts[order]
+    new_indptr = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(counts, out=new_indptr[1:])
+    piece_order = np.arange(new_indptr[-1]) - np.repeat(new_indptr[:-1], counts) + np.repeat(piece_indptr[:-1][order], counts)
+
+    types = sorted(type_numbers, key=type_numbers.get)
+    arrays = {"contig_names": np.array(contig_names, dtype=str), "contig_lengths": np.array(contig_lengths, dtype=np.int64),
+              "types": np.array(types, dtype=str), "contig_ids": contig_ids[order], "starts": starts[order], "ends": ends[order],
+              "strands": np.array(strands, dtype=np.int8)[order], "type_ids": np.array(type_ids, dtype=np.int32)[order],
+              "names": np.array(names, dtype=str)[order], "first_lines": np.array(first_lines, dtype=np.int64)[order],
+              "last_lines": np.array(last_lines, dtype=np.int64)[order], "piece_indptr": new_indptr,
+              "piece_starts": piece_starts[piece_order], "piece_ends": piece_ends[piece_order]}
+
+    return arrays
+
+#====================================================================#
+
+# define a function to find the start positions of each query region's candidate features in one sorted array:
+
+def gather_ranges(lo, hi):
+    """returns (query numbers, positions) for the positions lo[i] <= position < hi[i] of each query i
+    >>> [array.tolist() for array in gather_ranges(np.array([2, 0, 5]), np.array([4, 0, 6]))]
+    [[0, 0, 2], [2, 3, 5]]
+    """
+
+    counts = np.maximum(hi - lo, 0)
+    queries = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.cumsum(counts) - counts
+    positions = np.arange(len(queries)) - np.repeat(offsets, counts) + np.repeat(lo, counts)
+
+    return queries, positions
+
+#====================================================================#
+
+# define a function to sort (query, feature) pairs:
+
+def sort_pairs(queries, features, num_features):
+    """sort (query number, feature number) pairs by query and then feature
+
+    The pairs come in a few runs that are sorted already (one per length class), so they
+    are sorted as one int64 key with a stable sort, which merges the runs it finds.
+
+    >>> [array.tolist() for array in sort_pairs(np.array([0, 1, 0, 1]), np.array([3, 2, 1, 5]), 6)]
+    [[0, 0, 1, 1], [1, 3, 2, 5]]
+    """
+
+    keys = np.sort(queries * num_features + features, kind="stable")
+    queries = keys // num_features
+
+    return queries, keys - queries * num_features
+
+#====================================================================#
+
+# finds the features overlapping, nearest to, or flanking regions of the contigs:
+
+class FeatureIntervalIndex:
+    """the features of an EMBL or GFF file, sorted by position, for batches of region queries
+
+    Positions count from 1 and include both ends, as in EMBL and GFF files. The features
+    are numbered in order of contig and start; their details are in the arrays contig_ids,
+    starts, ends, strands, type_ids (into types), names, first_lines and last_lines, and their
+    pieces are piece_starts and piece_ends[piece_indptr[i]:piece_indptr[i+1]].
+
+    For overlap queries the features are also kept in classes by length (up to 2, 4, 8 ...
+    bases): a feature of at most L bases overlapping [start, end] must start in
+    [start - L + 1, end], so each class is a searchsorted() range with few false hits, and
+    long features (eg. EMBL 'source' features) don't slow down queries elsewhere.
+
+    >>> index = FeatureIntervalIndex(build_feature_arrays([('contig', 'c1', 100), ('feature', 'gene', 'G1', [(10, 40, 1)], 2, 3),
+    ...     ('feature', 'CDS', 'C1', [(12, 20, 1), (30, 38, 1)], 4, 6), ('feature', 'gene', 'G2', [(60, 70, -1)], 7, 8), ('contig', 'c2', 50),
+    ...     ('feature', 'source', 'S', [(1, 50, 1)], 10, 11)]))
+    >>> queries, features = index.overlaps(index.get_contig_ids(['c1', 'c1', 'c2']), [25, 45, 5], [35, 50, 5])
+    >>> queries.tolist(), index.names[features].tolist()
+    ([0, 0, 2], ['G1', 'C1', 'S'])
+    >>> features, distances = index.nearest(index.get_contig_ids(['c1', 'c1']), [45, 1], [50, 2], ['gene'])
+    >>> index.names[features].tolist(), distances.tolist()
+    (['G1', 'G1'], [5, 8])
+    >>> [array.tolist() for array in index.nearest(index.get_contig_ids(['c1']), [45], [50], ['mRNA'])]
+    [[-1], [-1]]
+    >>> queries, features, sides = index.flanking(index.get_contig_ids(['c1']), [45], [50], 15)
+    >>> index.names[features].tolist(), sides.tolist()
+    (['G1', 'C1', 'G2'], [-1, -1, 1])
+    >>> index.names[index.features_at_lines([1, 5, 7, 9])].tolist()
+    ['G1', 'C1', 'G2', 'S']
+    >>> FeatureIntervalIndex(build_feature_arrays([('contig', 'c1', 100)])).features_at_lines([1, 5]).tolist()
+    [-1, -1]
+    >>> [array.tolist() for array in index.flank_windows(np.array([0, 3]), 20)]
+    [[1, 1], [60, 50]]
+    """
+
+    def __init__(self, arrays):
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.contig_numbers = dict((name, i) for i, name in enumerate(self.contig_names.tolist()))
+        self.type_numbers = dict((name, i) for i, name in enumerate(self.types.tolist()))
+        self.start_keys = (self.contig_ids << KEY_SHIFT) + self.starts
+        self.end_keys = (self.contig_ids << KEY_SHIFT) + self.ends
+
+        # the features in order of their end, for finding the nearest one to the left:
+        self.end_order = np.argsort(self.end_keys, kind="stable")
+        self.sorted_end_keys = self.end_keys[self.end_order]
+
+        # the features in classes by length, each class sorted by start:
+        lengths = self.ends - self.starts + 1
+        length_classes = np.ceil(np.log2(np.maximum(lengths, 1))).astype(np.int64)
+        self.class_order = np.lexsort((self.start_keys, length_classes))
+        sorted_classes = length_classes[self.class_order]
+        self.class_start_keys = self.start_keys[self.class_order]
+        self.class_bounds = []
+        for length_class in np.unique(sorted_classes).tolist():
+            first = int(np.searchsorted(sorted_classes, length_class, side="left"))
+            last = int(np.searchsorted(sorted_classes, length_class, side="right"))
+            self.class_bounds.append((first, last, int(lengths[self.class_order[first:last]].max())))
+
+        # the features in file order, for finding the feature at a line:
+        self.line_order = np.argsort(self.first_lines, kind="stable")
+        self.sorted_last_lines = self.last_lines[self.line_order]
+
+    @classmethod
+    def from_file(cls, input_file):
+        """build the index from an EMBL or GFF file (plain or gzipped)"""
+        fileObj = open_text_file(input_file)
+        first_line = fileObj.readline()
+        fileObj.close()
+        fileObj = open_text_file(input_file)
+        if first_line.startswith('ID   '):
+            arrays = build_feature_arrays(read_embl_features(fileObj))
+        else:
+            arrays = build_feature_arrays(read_gff_features(fileObj))
+        fileObj.close()
+        return cls(arrays)
+
+    def save(self, index_file, stamp=""):
+        """write the index to a .npz file, with a stamp of the file it was built from"""
+        arrays = dict((name, getattr(self, name)) for name in ARRAY_NAMES)
+        temp_file = "%s.%d.tmp.npz" % (index_file, os.getpid())
+        np.savez(temp_file, version=np.array(INDEX_VERSION), stamp=np.array(stamp), **arrays)
+        os.replace(temp_file, index_file)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get_contig_ids(self, contigs):
+        """the numbers of some contigs, given by name"""
+        try:
+            return np.array([self.contig_numbers[contig] for contig in contigs], dtype=np.int64)
+        except KeyError as error:
+            raise KeyError("%s is not a contig in the index" % error.args[0]) from None
+
+    def get_type_mask(self, feature_types):
+        """a boolean array over the features, True for those of the given types (all of them if feature_types is None)"""
+        if feature_types is None:
+            return np.ones(len(self.starts), dtype=bool)
+        wanted = np.zeros(len(self.types), dtype=bool)
+        wanted[[self.type_numbers[feature_type] for feature_type in feature_types if feature_type in self.type_numbers]] = True
+        return wanted[self.type_ids]
+
+    def overlaps(self, contig_ids, starts, ends, feature_types=None):
+        """returns (query numbers, feature numbers) for each feature overlapping region i, contig_ids[i]:starts[i]-ends[i],
+        in order of query and then of feature position"""
+        contig_ids = np.asarray(contig_ids, dtype=np.int64)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        query_start_keys = (contig_ids << KEY_SHIFT) + starts
+        query_end_keys = (contig_ids << KEY_SHIFT) + ends
+        all_queries = []
+        all_features = []
+        for first, last, max_length in self.class_bounds:
+            class_keys = self.class_start_keys[first:last]
+            lo = np.searchsorted(class_keys, (contig_ids << KEY_SHIFT) + np.maximum(starts - max_length + 1, 0), side="left")
+            hi = np.searchsorted(class_keys, query_end_keys, side="right")
+            queries, positions = gather_ranges(lo, hi)
+            features = self.class_order[first + positions]
+            keep = self.end_keys[features] >= query_start_keys[queries]
+            all_queries.append(queries[keep])
+            all_features.append(features[keep])
+        if not all_queries:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        queries = np.concatenate(all_queries)
+        features = np.concatenate(all_features)
+        if feature_types is not None:
+            keep = self.get_type_mask(feature_types)[features]
+            queries = queries[keep]
+            features = features[keep]
+        return sort_pairs(queries, features, len(self.starts))
+
+    def nearest(self, contig_ids, starts, ends, feature_types=None):
+        """returns (feature numbers, distances) with the nearest feature to each region (the first one
+        overlapping it, at distance 0, if any do), or -1 if there are no features on its contig"""
+        contig_ids = np.asarray(contig_ids, dtype=np.int64)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        num_queries = len(contig_ids)
+        type_mask = self.get_type_mask(feature_types)
+        if not type_mask.any():
+            return np.full(num_queries, -1, dtype=np.int64), np.full(num_queries, -1, dtype=np.int64)
+        if feature_types is not None and not type_mask.all():
+            subset = FeatureIntervalIndex(self.subset_arrays(np.flatnonzero(type_mask)))
+            features, distances = subset.nearest(contig_ids, starts, ends)
+            return np.where(features >= 0, np.flatnonzero(type_mask)[np.maximum(features, 0)], -1), distances
+        features = np.full(num_queries, -1, dtype=np.int64)
+        distances = np.full(num_queries, np.iinfo(np.int64).max, dtype=np.int64)
+
+        # the feature ending closest before the region, and the one starting closest after it:
+        left = np.searchsorted(self.sorted_end_keys, (contig_ids << KEY_SHIFT) + starts, side="left") - 1
+        has_left = left >= 0
+        has_left[has_left] = self.contig_ids[self.end_order[left[has_left]]] == contig_ids[has_left]
+        left_features = self.end_order[left[has_left]]
+        features[has_left] = left_features
+        distances[has_left] = starts[has_left] - self.ends[left_features]
+        right = np.searchsorted(self.start_keys, (contig_ids << KEY_SHIFT) + ends, side="right")
+        has_right = right < len(self.start_keys)
+        has_right[has_right] = self.contig_ids[right[has_right]] == contig_ids[has_right]
+        right_distances = self.starts[right[has_right]] - ends[has_right]
+        closer = right_distances < distances[has_right]
+        features[np.flatnonzero(has_right)[closer]] = right[has_right][closer]
+        distances[np.flatnonzero(has_right)[closer]] = right_distances[closer]
+
+        # and the first feature overlapping it, if there is one:
+        queries, overlapping = self.overlaps(contig_ids, starts, ends)
+        first = np.ones(len(queries), dtype=bool)
+        first[1:] = queries[1:] != queries[:-1]
+        features[queries[first]] = overlapping[first]
+        distances[queries[first]] = 0
+        distances[features < 0] = -1
+        return features, distances
+
+    def flanking(self, contig_ids, starts, ends, window, feature_types=None):
+        """returns (query numbers, feature numbers, sides) for the features that overlap the 'window' bases to the
+        left (side -1) or right (side 1) of each region, but not the region itself"""
+        contig_ids = np.asarray(contig_ids, dtype=np.int64)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        left_queries, left_features = self.overlaps(contig_ids, starts - window, starts - 1, feature_types)
+        keep_left = self.ends[left_features] < starts[left_queries]
+        right_queries, right_features = self.overlaps(contig_ids, ends + 1, ends + window, feature_types)
+        keep_right = self.starts[right_features] > ends[right_queries]
+        queries = np.concatenate((left_queries[keep_left], right_queries[keep_right]))
+        features = np.concatenate((left_features[keep_left], right_features[keep_right]))
+        queries, features = sort_pairs(queries, features, len(self.starts))
+        return queries, features, np.where(self.ends[features] < starts[queries], -1, 1).astype(np.int8)
+
+    def features_at_lines(self, line_nums):
+        """the feature each line is in, or (for lines between features) the next feature in the file; -1 after the last feature"""
+        line_nums = np.asarray(line_nums, dtype=np.int64)
+        if len(self.line_order) == 0:
+            return np.full(line_nums.shape, -1, dtype=np.int64)
+        positions = np.searchsorted(self.sorted_last_lines, line_nums, side="left")
+        return np.where(positions < len(self.line_order), self.line_order[np.minimum(positions, len(self.line_order) - 1)], -1)
+
+    def flank_windows(self, features, flank):
+        """returns (starts, ends) of each feature with 'flank' bases either side, kept within its contig
+        (if the contig length is known)"""
+        features = np.asarray(features, dtype=np.int64)
+        starts = np.maximum(self.starts[features] - flank, 1)
+        ends = self.ends[features] + flank
+        contig_lengths = self.contig_lengths[self.contig_ids[features]]
+        ends = np.where(contig_lengths > 0, np.minimum(ends, contig_lengths), ends)
+        return starts, ends
+
+    def subset_arrays(self, features):
+        """the arrays for an index of some of the features (given in order)"""
+        arrays = dict((name, getattr(self, name)[features]) for name in FEATURE_ARRAY_NAMES)
+        counts = self.piece_indptr[features + 1] - self.piece_indptr[features]
+        queries, positions = gather_ranges(self.piece_indptr[features], self.piece_indptr[features + 1])
+        arrays["piece_indptr"] = np.concatenate(([0], np.cumsum(counts)))
+        arrays["piece_starts"] = self.piece_starts[positions]
+        arrays["piece_ends"] = self.piece_ends[positions]
+        for name in ("contig_names", "contig_lengths", "types"):
+            arrays[name] = getattr(self, name)
+        return arrays
+
+#====================================================================#
+
+# the arrays with one entry per feature, and all the arrays saved in an index file:
+
+FEATURE_ARRAY_NAMES = ["contig_ids", "starts", "ends", "strands", "type_ids", "names", "first_lines", "last_lines"]
+
+ARRAY_NAMES = FEATURE_ARRAY_NAMES + ["contig_names", "contig_lengths", "types", "piece_indptr", "piece_starts", "piece_ends"]
+
+#====================================================================#
+
+# define a function to read in the interval index of an EMBL or GFF file, building it if need be:
+
+def load_feature_index(input_file):
+    """read in the interval index of a file, (re)building it if it is missing or the file has changed since"""
+
+    index_file = input_file + INDEX_SUFFIX
+    stamp = get_embl_file_stamp(input_file)
+    if os.path.exists(index_file):
+        try:
+            saved = np.load(index_file, allow_pickle=False)
+            if int(saved["version"]) == INDEX_VERSION and str(saved["stamp"]) == stamp:
+                return FeatureIntervalIndex(dict((name, saved[name]) for name in ARRAY_NAMES))
+        except (ValueError, KeyError, OSError):
+            pass
+    print("Building interval index", index_file, "...")
+    index = FeatureIntervalIndex.from_file(input_file)
+    try:
+        index.save(index_file, stamp)
+    except OSError as error:
+        print("Could not write interval index", index_file, "(%s)" % error)
+
+    return index
+
+#====================================================================#
+
+# define a function to read in a file of regions:
+
+def read_regions(regions_file):
+    """returns (contigs, starts, ends) from a file of tab-separated 'contig start end' lines (counting from 1)"""
+
+    contigs = []
+    starts = []
+    ends = []
+    fileObj = open(regions_file, "r")
+    for line in fileObj:
+        temp = line.split()
+        if len(temp) < 3 or line.startswith('#'):
+            continue
+        contigs.append(temp[0])
+        starts.append(int(temp[1]))
+        ends.append(int(temp[2]))
+    fileObj.close()
+
+    return contigs, np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+#====================================================================#
+
+# time batches of random queries:
+
+def benchmark_main(argv):
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(prog="%s benchmark" % sys.argv[0], description="time overlap, nearest and flank queries for random regions")
+    parser.add_argument("input_file", help="EMBL or GFF file (plain or gzipped)")
+    parser.add_argument("--queries", type=int, default=1000000, help="number of random regions (default: 1000000)")
+    parser.add_argument("--length", type=int, default=1000, help="length of each region (default: 1000)")
+    args = parser.parse_args(argv)
+    if os.path.exists(args.input_file) == False:
+        parser.print_usage()
+        sys.exit(1)
+
+    index = load_feature_index(args.input_file)
+    rng = np.random.default_rng(1)
+    features = rng.integers(0, len(index), args.queries)
+    contig_ids = index.contig_ids[features]
+    starts = np.maximum(index.starts[features] + rng.integers(-5000, 5000, args.queries), 1)
+    ends = starts + args.length - 1
+    for label, function in [("overlap", lambda: index.overlaps(contig_ids, starts, ends)),
+                            ("nearest", lambda: index.nearest(contig_ids, starts, ends)),
+                            ("flank (1 kb)", lambda: index.flanking(contig_ids, starts, ends, 1000))]:
+        start_time = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start_time
+        print("%s queries: %.0f per second (%d results)" % (label, args.queries / seconds, len(result[0])))
+
+#====================================================================#
+
+def main():
+
+    # 'embl_interval_index.py benchmark ...' times random queries:
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark_main(sys.argv[2:])
+        return
+
+    # check the command-line arguments:
+    parser = argparse.ArgumentParser(description="find the features of an EMBL or GFF file overlapping, nearest to or flanking some regions, using an interval index (built the first time, as input_file.intervals.npz)", epilog="Run '%(prog)s benchmark -h' for timing random queries.")
+    parser.add_argument("input_file", help="EMBL or GFF file (plain or gzipped)")
+    parser.add_argument("regions_file", help="tab-separated 'contig start end' lines, counting from 1")
+    parser.add_argument("output_file", help="output file of tab-separated lines: the region, then the feature's type, name, start, end and strand")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--nearest", action="store_true", help="write the nearest feature to each region, and its distance")
+    group.add_argument("--flank", type=int, metavar="WINDOW", help="write the features within WINDOW bases either side of each region (not overlapping it), and the side")
+    parser.add_argument("--types", help="comma-separated feature types to look at (default: all), eg. CDS,gene")
+    args = parser.parse_args()
+    if os.path.exists(args.input_file) == False or os.path.exists(args.regions_file) == False or (args.flank is not None and args.flank < 1):
+        parser.print_usage()
+        sys.exit(1)
+    feature_types = args.types.split(',') if args.types else None
+
+    # read in (or build) the index, and the regions:
+    index = load_feature_index(args.input_file)
+    contigs, starts, ends = read_regions(args.regions_file)
+    contig_ids = index.get_contig_ids(contigs)
+
+    # answer all the queries at once:
+    if args.nearest:
+        features, extras = index.nearest(contig_ids, starts, ends, feature_types)
+        queries = np.flatnonzero(features >= 0)
+        features = features[queries]
+        extras = extras[queries]
+    elif args.flank is not None:
+        queries, features, extras = index.flanking(contig_ids, starts, ends, args.flank, feature_types)
+    else:
+        queries, features = index.overlaps(contig_ids, starts, ends, feature_types)
+        extras = None
+
+    # write out a line for each region and feature:
+    strand_names = {1: '+', -1: '-', 0: '.'}
+    outputfileObj = open(args.output_file, "w")
+    for i, (query, feature) in enumerate(zip(queries.tolist(), features.tolist())):
+        fields = [contigs[query], str(starts[query]), str(ends[query]), index.types[index.type_ids[feature]], index.names[feature],
+                  str(index.starts[feature]), str(index.ends[feature]), strand_names[int(index.strands[feature])]]
+        if extras is not None:
+            fields.append(str(extras[i]))
+        outputfileObj.write("\t".join(fields) + "\n")
+    outputfileObj.close()
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
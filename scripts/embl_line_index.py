@@ -0,0 +1,282 @@
+# Script to build a sparse index from line numbers to file offsets for an EMBL
+# file (plain or gzipped), so that we can jump straight to a line, eg. one that a
+# validator error message points at
+#
+# A gzipped file can only be entered at the start of one of its gzip members, so
+# jumping is only fast for files made of many members (eg. BGZF from 'bgzip', or
+# pigz/'cat' output). An ordinary single-member .embl.gz file gets no seek points
+# past the start, and reaching a line means decompressing everything before it
+# (though not splitting it into lines); recompress it with 'bgzip' to fix that.
+
+import sys
+import os
+import json
+import gzip
+import zlib
+from bisect import bisect_right
+from itertools import islice
+from collections import deque
+
+#====================================================================#
+
+# the index is written next to the EMBL file, eg. haemonchus_placei_new2.embl.gz.lineidx.json:
+
+INDEX_SUFFIX = ".lineidx.json"
+
+INDEX_VERSION = 1
+
+# roughly how many (uncompressed) bytes of the file there are between entries of the index:
+
+INDEX_INTERVAL = 64 * 1024
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+#====================================================================#
+
+# a gzip file object that starts reading at an offset in a file:
+
+class SeekedGzipFile(gzip.GzipFile):
+    """read a gzip file from the start of the member at 'offset', closing the file when done"""
+
+    def __init__(self, filename, offset):
+        self.rawfileObj = open(filename, "rb")
+        self.rawfileObj.seek(offset)
+        gzip.GzipFile.__init__(self, fileobj=self.rawfileObj, mode="rb")
+
+    def close(self):
+        gzip.GzipFile.close(self)
+        self.rawfileObj.close()
+
+#====================================================================#
+
+# define a function to decompress a gzip file, keeping track of where each member starts:
+
+def read_gzip_members(fileObj):
+    """yield (data, compressed offset of the member that data is in, uncompressed offset of that member)
+
+    A gzip file can be made of many members (eg. BGZF, or files made with
+    'cat a.gz b.gz' or pigz), and we can start decompressing at the start of any
+    of them, so these are the places we can seek to.
+    """
+
+    coffset = 0 # the number of compressed bytes read so far
+    uoffset = 0 # the number of uncompressed bytes so far
+    decompressor = None
+    while True:
+        cdata = fileObj.read(READ_BLOCK_SIZE)
+        if not cdata:
+            break
+        coffset += len(cdata)
+        while cdata:
+            if decompressor is None: # the start of a new member
+                decompressor = zlib.decompressobj(31)
+                member = (coffset - len(cdata), uoffset)
+            data = decompressor.decompress(cdata)
+            if data:
+                yield data, member[0], member[1]
+                uoffset += len(data)
+            if decompressor.eof:
+                cdata = decompressor.unused_data
+                decompressor = None
+            else:
+                cdata = b""
+
+#====================================================================#
+
+# define a function to get the file details that tell us if the index is out of date:
+
+def get_embl_file_stamp(embl_file):
+
+    stat = os.stat(embl_file)
+    stamp = "%d %d" % (stat.st_size, stat.st_mtime_ns)
+
+    return stamp
+
+#====================================================================#
+
+# define a function to build the line index of an EMBL file:
+
+def build_embl_line_index(embl_file):
+    """read through the EMBL file once, and note the start of a line about every INDEX_INTERVAL bytes
+
+    Each entry of the index is [line number, uncompressed offset, seek offset,
+    bytes to skip]. For a plain file the seek offset is the line's offset and there
+    is nothing to skip; for a gzipped file it is the compressed offset of the gzip
+    member the line is in, and the bytes to skip are from the start of that member
+    to the line. A gzip file made of one big member only has the start of the file
+    to seek to, so there lines are reached by decompressing (but not splitting
+    into lines) the part of the file before them: the index only saves
+    decompression for multi-member (eg. BGZF) files. (Python's zlib can't restart
+    inflating part way through a member, as zran.c does with inflatePrime(), so
+    there are no checkpoints inside members.)
+    """
+
+    fileObj = open(embl_file, "rb")
+    is_gzip = fileObj.read(2) == GZIP_MAGIC
+    fileObj.seek(0)
+    if is_gzip:
+        pieces = read_gzip_members(fileObj)
+    else:
+        pieces = ((data, 0, 0) for data in iter(lambda: fileObj.read(READ_BLOCK_SIZE), b""))
+
+    entries = [[1, 0, 0, 0]]
+    line_num = 1 # the number of the line that the current piece starts in
+    uoffset = 0 # the uncompressed offset of the current piece
+    next_entry = INDEX_INTERVAL
+    for data, member_coffset, member_uoffset in pieces:
+        while uoffset + len(data) > next_entry:
+            # the first line that starts after next_entry:
+            pos = data.find(b"\n", max(next_entry - uoffset, 0)) + 1
+            if pos == 0:
+                break # no more lines start in this piece
+            line_start = uoffset + pos
+            if is_gzip:
+                entries.append([line_num + data.count(b"\n", 0, pos), line_start, member_coffset, line_start - member_uoffset])
+            else:
+                entries.append([line_num + data.count(b"\n", 0, pos), line_start, line_start, 0])
+            next_entry = line_start + INDEX_INTERVAL
+        line_num += data.count(b"\n")
+        uoffset += len(data)
+    fileObj.close()
+
+    index = {"version": INDEX_VERSION, "stamp": get_embl_file_stamp(embl_file), "gzip": is_gzip, "entries": entries}
+
+    return index
+
+#====================================================================#
+
+# define a function to read in the line index of an EMBL file, if it has one that is up to date:
+
+def read_embl_line_index(embl_file):
+    """read in the line index of an EMBL file, or return None if it is missing or the file has changed since"""
+
+    index_file = embl_file + INDEX_SUFFIX
+    if not os.path.exists(index_file):
+        return None
+    with open(index_file, "r") as fileObj:
+        try:
+            index = json.load(fileObj)
+        except ValueError:
+            return None
+    if index.get("version") != INDEX_VERSION or index.get("stamp") != get_embl_file_stamp(embl_file):
+        return None
+    index["line_nums"] = [entry[0] for entry in index["entries"]]
+
+    return index
+
+#====================================================================#
+
+# define a function to read in the line index of an EMBL file, building it if need be:
+
+def load_embl_line_index(embl_file):
+    """read in the line index of an EMBL file, (re)building it if it is missing or the file has changed since"""
+
+    index = read_embl_line_index(embl_file)
+    if index is None:
+        index_file = embl_file + INDEX_SUFFIX
+        print("Building line index",index_file,"...")
+        index = build_embl_line_index(embl_file)
+        try:
+            temp_file = "%s.%d.tmp" % (index_file, os.getpid())
+            with open(temp_file, "w") as outputfileObj:
+                json.dump(index, outputfileObj)
+            os.replace(temp_file, index_file)
+        except OSError as error:
+            print("Could not write line index",index_file,"(%s)" % error)
+        index["line_nums"] = [entry[0] for entry in index["entries"]]
+
+    return index
+
+#====================================================================#
+
+# read the lines of an EMBL file from any line number:
+
+class EmblLineReader:
+    """read an EMBL file (plain or gzipped, for reading bytes) from any line, using its line index
+
+    seek_line() jumps to the indexed line at or before the one we want, and reads
+    on from there. Going forward in a gzipped file, it either decompresses on
+    from where it is or starts again at the gzip member of the indexed line,
+    whichever means less to decompress.
+    """
+
+    def __init__(self, embl_file, index):
+        self.embl_file = embl_file
+        self.index = index
+        self.fileObj = None
+        self.base_uoffset = 0 # the uncompressed offset in the file of the start of fileObj
+        self.line_num = 1 # the number of the next line to be read
+
+    def seek_line(self, line_num):
+        """get ready to read line line_num (counting from 1)"""
+        i = bisect_right(self.index["line_nums"], line_num) - 1
+        (entry_line_num, uoffset, seek_offset, skip) = self.index["entries"][i]
+        going_forward = self.fileObj is not None and self.line_num <= line_num
+        if going_forward and (entry_line_num <= self.line_num or uoffset - (self.base_uoffset + self.fileObj.tell()) < INDEX_INTERVAL):
+            pass # the indexed line isn't far past where we are, so just read on
+        elif not self.index["gzip"]:
+            if self.fileObj is None:
+                self.fileObj = open(self.embl_file, "rb")
+            self.fileObj.seek(uoffset)
+            self.line_num = entry_line_num
+        elif going_forward and uoffset - (self.base_uoffset + self.fileObj.tell()) <= skip:
+            self.fileObj.seek(uoffset - self.base_uoffset) # decompress on from where we are
+            self.line_num = entry_line_num
+        else:
+            if self.fileObj is not None:
+                self.fileObj.close()
+            self.fileObj = SeekedGzipFile(self.embl_file, seek_offset) # start at the gzip member of the indexed line
+            self.base_uoffset = uoffset - skip
+            if skip:
+                self.fileObj.seek(skip)
+            self.line_num = entry_line_num
+        if self.line_num < line_num:
+            deque(islice(self.fileObj, line_num - self.line_num), maxlen=0) # read on to line_num
+            self.line_num = line_num
+
+    def readline(self):
+        if self.fileObj is None:
+            self.seek_line(1)
+        line = self.fileObj.readline()
+        if line:
+            self.line_num += 1
+        return line
+
+    def __iter__(self):
+        if self.fileObj is None:
+            self.seek_line(1)
+        for line in self.fileObj:
+            self.line_num += 1
+            yield line
+
+    def close(self):
+        if self.fileObj is not None:
+            self.fileObj.close()
+            self.fileObj = None
+
+#====================================================================#
+
+def main():
+
+    # check the command-line arguments:
+    if len(sys.argv) != 2 or os.path.exists(sys.argv[1]) == False:
+        print("Usage: %s input_embl" % sys.argv[0])
+        sys.exit(1)
+    input_embl = sys.argv[1] # eg. haemonchus_placei_new2.embl.gz
+
+    # build the index (if it isn't there already or is out of date):
+    index = load_embl_line_index(input_embl)
+    print("The index has",len(index["entries"]),"entries")
+    if index["gzip"] and len(set(entry[2] for entry in index["entries"])) == 1:
+        print("The file is a single gzip member, so lines can only be reached by decompressing from the start; recompress it with bgzip to make jumping to lines fast")
+
+    print("FINISHED\n")
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
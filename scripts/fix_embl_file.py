@@ -3,126 +3,188 @@
 
 import sys
 import os
+import shutil
+from bisect import bisect_left
+from itertools import islice
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from compara_families import load_genes_in_families
+from embl_features import iter_embl, parse_id_note, find_embl_entry_boundaries, EmblFeature, EmblLines
+
+#====================================================================#
+
+# the embl files are read and written as latin-1, which maps each byte to one character and back,
+# so any bytes in the input are written out unchanged:
+
+EMBL_ENCODING = "latin-1"
 
 #====================================================================#
 
 # define a function to read in the genes that are in families, for our species of interest:
 
 def find_genes_in_families(families_file, our_species_name, locus_tag):
-    """read in the genes that are in families, for our species of interest """
+    """read in the genes that are in families, for our species of interest, from the index of the families file """
 
     # define a set to store the genes in families:
     genes_in_families = set()
 
-    # read in the input file of genes in families:
-    fileObj = open(families_file, "r")
-    for line in fileObj:
-        line = line.rstrip()
-        if line.startswith('family'): # eg. family 5168 : SPAL_0001096400.1:mRNA (strongyloides_papillosus) Bm11175 (brugia_malayi) HCOI_1164600.1 (haemonchus_contortus)...
-            temp = line.split()
-            family = temp[1] # eg. 4376
-            temp = line.split(': ')
-            line = temp[1] # SPAL_0000608500.1:mRNA (strongyloides_papillosus) Bm10870f (brugia_malayi) F23B12.1 (caenorhabditis_elegans)...
-            temp = line.split()
-            # make a list of tuples, with gene names and species names
-            # taken from http://stackoverflow.com/questions/2631189/python-every-other-element-idiom
-            # uses the zip function: http://docs.python.org/2/library/functions.html#zip
-            # see also on zip: http://nbviewer.ipython.org/github/pycam/python-intro/blob/release/Introduction_to_python_session_2.ipynb
-            # note the array 'pairs' seems to be empty after we have looked at it once, this must be a feature of 'zip'.
-            set_of_species = set() # define the set of species we have seen
-            family_genes = set() # define the set of genes in the family
-            pairs = zip(temp[0::2], temp[1::2])
-            for pair in pairs:
-                (gene, species) = pair # unpack the tuple, eg. gives gene= SPAL_0000608500.1:mRNA species= (strongyloides_papillosus)
-                species = species[1:-1] # remove the parentheses
-                # get the gene name:
-                # eg. SRAE_X000112100.t1:mRNA/SSTP_0000225500.1:mRNA/SPAL_0001294400.1:mRNA/SVEN_0373900.1/PTRK_0001428200.1:mRNA/RSKR_0000682500.1:mRNA
-                if ':mRNA' in gene:
-                    temp2 = gene.split(':mRNA') # eg. SRAE_X000112100.t1:mRNA
-                    gene = temp2[0] # eg. SRAE_X000112100.t1
-                if '-mRNA-' in gene: # eg. ASIM_0000655901-mRNA-1
-                    temp2 = gene.split('-mRNA-')
-                    gene = temp2[0] # eg. ASIM_0000655901
-                if '_' in gene and '.' in gene: # eg. SRAE_X000112100.t1 or MhA1_Contig1285.frz3.fgene2
-                    temp2 = gene.split('.')
-                    afterdot = temp2[1] # eg. t1 or fgene2
-                    if (afterdot.startswith('t') or afterdot.isdigit() == True) and species != 'caenorhabditis_elegans':
-                        gene = temp2[0] # eg. SRAE_X000112100                 
-                if '.t' in gene: # eg. HCOI02162100.t1
-                    temp2 = gene.split('.t')
-                    afterdot = temp2[1] # eg. 1
-                    if afterdot.isdigit() == True:
-                        gene = temp2[0] # eg. HCOI02162100 
-                if species == our_species_name:
-                    if locus_tag == 'NOO' or locus_tag == 'NLS' or locus_tag == 'NAV':
-                                              gene = get_new_gene_name(gene, locus_tag)
-                    genes_in_families.add(gene)
-    fileObj.close()
+    # read in the genes in families from the index, building it if need be:
+    for gene in load_genes_in_families(families_file, our_species_name):
+        if locus_tag == 'NOO' or locus_tag == 'NLS' or locus_tag == 'NAV':
+            gene = get_new_gene_name(gene, locus_tag)
+        genes_in_families.add(gene)
 
     return genes_in_families
 
 #====================================================================#
 
-# get the gene name from a line of the embl file:
+# read in the input embl file, and write out a new embl file:
 
-def get_gene_name2(line):
-    """ get the name of a gene from line of an embl file
-    >>> get_gene_name2('FT                   /note="ID:gene:NAV_0000008934"')
-    'NAV_0000008934'
-    >>> get_gene_name2('FT                   /note="ID:cds:SMUV_0000034201-mRNA-1"')
-    'SMUV_0000034201'
+def read_input_embl_and_write_output_embl(input_embl, output_embl, dodgy_genes, genes_in_families):
+
+    # open an output file:
+    outputfileObj = open(output_embl, "w", encoding=EMBL_ENCODING, newline="\n")
+
+    # read in the input file:
+    fileObj = open(input_embl, "r", encoding=EMBL_ENCODING, newline="\n")
+    fix_embl_lines(fileObj, outputfileObj, dodgy_genes, genes_in_families)
+    fileObj.close() 
+    outputfileObj.close()
+
+    return
+
+#====================================================================#
+
+# fix some lines of an embl file, and write them out:
+
+def fix_embl_lines(lines, outputfileObj, dodgy_genes, genes_in_families):
+    """fix the lines of one or more whole embl entries, and write them to outputfileObj"""
+
+    # read in the lines, one feature at a time:
+    for item in iter_embl(lines):
+        if isinstance(item, EmblFeature):
+            item.drop_lines_containing('source:WormBase_imported') # don't print these lines to the output
+            for name, value, index in item.qualifier_lines:
+                if name != 'note' or item.is_dropped(index):
+                    continue
+                # FT                   /note="ID:gene:NAV_0000008934"
+                # FT                   /note="ID:cds:SMUV_0000034201-mRNA-1"
+                # FT                   /note="ID:exon:SMUV_0000587401-mRNA-1.1"
+                note_type, gene = parse_id_note(value) # eg. ('gene', 'NAV_0000008934')
+                if (note_type == 'gene' or note_type == 'cds' or note_type == 'exon') and gene in dodgy_genes:
+                    output_lines = ["FT                   /pseudo\n", "FT                   /note=\"odd gene structure probably caused by assembly error\"\n"]
+                    if gene in genes_in_families:
+                        output_lines.append("FT                   /note=\"predicted protein belongs to a gene family in the Compara database of the International Helminth Genomes Consortium\"\n")
+                    item.insert_lines_after(index, output_lines)
+            item.write(outputfileObj) # the lines we haven't changed are written out as they were
+        elif isinstance(item, EmblLines):
+            for line in item.lines:
+                if 'source:WormBase_imported' in line:
+                    pass # don't print this line to the output
+                elif 'AC *' in line: # AC * _ALUE_contig0000001 length=91883
+                    output_line = make_embl_output_line1(line)
+                    output_line = "%s\n" % output_line
+                    outputfileObj.write(output_line)
+                else:
+                    outputfileObj.write(line)
+        else:
+            item.write(outputfileObj) # the sequence
+
+    return
+
+#====================================================================#
+
+# define a function to split the entries of an embl file into runs of about the same size:
+
+def group_embl_entries(boundaries, num_groups):
+    """split the entries into at most num_groups runs of consecutive entries, of about the same number of bytes
+
+    'boundaries' is from find_embl_entry_boundaries(); returns the (byte offset,
+    number of lines) of each run.
+
+    >>> group_embl_entries([(0, 0), (100, 10), (150, 15), (400, 40)], 2)
+    [(0, 15), (150, 25)]
+    >>> group_embl_entries([(0, 0), (100, 10)], 4)
+    [(0, 10)]
     """
 
-    temp = line.split()
-    gene = temp[1] # /note="ID:gene:NAV_0000008934"
-    temp = gene.split("\"")
-    gene = temp[1] # ID:gene:NAV_0000008934 or ID:cds:SMUV_0000034201-mRNA-1
-    temp = gene.split(":")
-    gene = temp[2] # NAV_0000008934 or SMUV_0000034201-mRNA-1
-    temp = gene.split("-mRNA-")
-    gene = temp[0] # NAV_0000008934 or SMUV_0000034201
+    total_size = boundaries[-1][0]
+    offsets = [offset for (offset, line_num) in boundaries]
+    groups = []
+    start = 0
+    for k in range(1, num_groups + 1):
+        target = total_size * k // num_groups
+        end = min(bisect_left(offsets, target, start), len(offsets) - 1) # the first entry start at or after the target
+        if end - 1 > start and target - offsets[end - 1] < offsets[end] - target:
+            end -= 1 # the entry start just before the target is closer to it
+        if k == num_groups:
+            end = len(boundaries) - 1
+        if end > start:
+            groups.append((boundaries[start][0], boundaries[end][1] - boundaries[start][1]))
+            start = end
+
+    return groups
 
-    return gene
+#====================================================================#
+
+# the gene sets used by the worker processes, set once when each worker starts:
+
+worker_gene_sets = {}
+
+def set_worker_gene_sets(dodgy_genes, genes_in_families):
+
+    worker_gene_sets["dodgy_genes"] = dodgy_genes
+    worker_gene_sets["genes_in_families"] = genes_in_families
 
 #====================================================================#
 
-# read in the input embl file, and write out a new embl file:
+# define a function to fix a run of entries of the input embl file, in a worker process:
 
-def read_input_embl_and_write_output_embl(input_embl, output_embl, dodgy_genes, genes_in_families):
+def fix_embl_entries(input_embl, start_offset, num_lines, part_file):
 
-    # open an output file:
-    outputfileObj = open(output_embl,"w")
+    # open the input file at the first entry, and fix num_lines lines from there; the file is
+    # read as latin-1 split only at \n, so each character and line is one byte and one \n of the
+    # file, as in the byte offsets and line counts from find_embl_entry_boundaries():
+    fileObj = open(input_embl, "r", encoding=EMBL_ENCODING, newline="\n")
+    fileObj.seek(start_offset)
+    outputfileObj = open(part_file, "w", encoding=EMBL_ENCODING, newline="\n")
+    fix_embl_lines(islice(fileObj, num_lines), outputfileObj, worker_gene_sets["dodgy_genes"], worker_gene_sets["genes_in_families"])
+    outputfileObj.close()
+    fileObj.close()
 
-    # read in the input file:
-    fileObj = open(input_embl, "r")
-    for line in fileObj:
-        line = line.rstrip()
-        if 'source:WormBase_imported' in line:
-            pass # don't print this line to the output
-        else:
-            if 'AC *' in line: # AC * _ALUE_contig0000001 length=91883
-                output_line = make_embl_output_line1(line)
-                output_line = "%s\n" % output_line
-                outputfileObj.write(output_line)
-            elif '/note="ID:gene:' in line or 'note="ID:cds:' in line or 'note="ID:exon:' in line : # FT                   /note="ID:gene:NAV_0000008934"
-                                                                                                  # FT                   /note="ID:cds:SMUV_0000034201-mRNA-1"
-                                                                                                  # FT                   /note="ID:exon:SMUV_0000587401-mRNA-1.1"
-                gene = get_gene_name2(line) # eg. NAV_0000008934
-                output_line = "%s\n" % line
-                outputfileObj.write(output_line) # write out the current line
-                                if gene in dodgy_genes: 
-                    output_line = "FT                   /pseudo\n"
-                    outputfileObj.write(output_line)
-                    output_line = "FT                   /note=\"odd gene structure probably caused by assembly error\"\n" 
-                    outputfileObj.write(output_line)
-                    if gene in genes_in_families:
-                        output_line = "FT                   /note=\"predicted protein belongs to a gene family in the Compara database of the International Helminth Genomes Consortium\"\n"
-                        outputfileObj.write(output_line)
-            else: 
-                output_line = "%s\n" % line
-                outputfileObj.write(output_line)
-    fileObj.close() 
+    return
+
+#====================================================================#
+
+# read in the input embl file, and write out a new embl file, using several processes:
+
+def read_input_embl_and_write_output_embl_in_parallel(input_embl, output_embl, dodgy_genes, genes_in_families, num_processes):
+    """fix the entries (contigs) of the embl file on a pool of processes, giving the same output as
+    read_input_embl_and_write_output_embl()
+
+    The file is scanned once for the // lines at the ends of the entries, and cut
+    into runs of entries of about the same size (a few per process, so the work
+    evens out). Each worker seeks to the start of its run and writes it to a part
+    file, and the part files are then joined up in order.
+    """
+
+    boundaries = find_embl_entry_boundaries(input_embl)
+    groups = group_embl_entries(boundaries, num_processes * 4)
+    part_files = ["%s.part%d" % (output_embl, i + 1) for i in range(len(groups))]
+
+    pool = ProcessPoolExecutor(max_workers=num_processes, initializer=set_worker_gene_sets, initargs=(dodgy_genes, genes_in_families))
+    futures = [pool.submit(fix_embl_entries, input_embl, start_offset, num_lines, part_file) for ((start_offset, num_lines), part_file) in zip(groups, part_files)]
+    for future in futures:
+        future.result() # raises any error from the worker
+    pool.shutdown()
+
+    # join up the part files, in order:
+    outputfileObj = open(output_embl, "wb")
+    for part_file in part_files:
+        fileObj = open(part_file, "rb")
+        shutil.copyfileobj(fileObj, outputfileObj, 16 * 1024 * 1024)
+        fileObj.close()
+        os.remove(part_file)
     outputfileObj.close()
 
     return
@@ -212,20 +274,6 @@ def read_set_of_dodgy_genes(dodgy_gene_list, locus_tag):
 
 # find the new name for a gene:
 
-def get_new_gene_name(old_gene_name, locus_tag):
-    """find the new name for a gene
-    >>> get_new_gene_name('nAv.1.0.1.g01019', 'NOO')
-    'NOO_0000001019'
-    """
-
-    temp = old_gene_name.split('.g')
-    gene_name = temp[1] # 08934
-    gene_name = trim_off_zeroes(gene_name) # 8934 
-
-    #====================================================================#
-
-# find the new name for a gene:
-
 def get_new_gene_name(old_gene_name, locus_tag):
     """find the new name for a gene
     >>> get_new_gene_name('nAv.1.0.1.g01019', 'NOO')
@@ -247,8 +295,8 @@ def get_new_gene_name(old_gene_name, locus_tag):
 def main():
     
     # check the command-line arguments:
-    if len(sys.argv) != 7 or os.path.exists(sys.argv[1]) == False or os.path.exists(sys.argv[3]) == False or os.path.exists(sys.argv[6]) == False:
-        print("Usage: %s input_embl output_embl dodgy_gene_list locus_tag our_species families_file" % sys.argv[0]) 
+    if len(sys.argv) not in (7, 8) or os.path.exists(sys.argv[1]) == False or os.path.exists(sys.argv[3]) == False or os.path.exists(sys.argv[6]) == False:
+        print("Usage: %s input_embl output_embl dodgy_gene_list locus_tag our_species families_file [num_processes]" % sys.argv[0]) 
         sys.exit(1)
     input_embl = sys.argv[1] # e.g. onchocerca_ochengi.embl
     output_embl = sys.argv[2] # e.g. onchocerca_ochengi_new.embl 
@@ -256,6 +304,7 @@ def main():
     locus_tag = sys.argv[4] # eg. NOO 
     our_species = sys.argv[5] # eg. onchocerca_ochengi
     families_file = sys.argv[6] # /nfs/helminths02/analysis/50HGP/00ANALYSES/final_families/complete_families.txt_27mar2017 
+    num_processes = int(sys.argv[7]) if len(sys.argv) == 8 else 1 # eg. 32
 
     # read in the set of genes/transcripts that look dodgy:
     dodgy_genes = read_set_of_dodgy_genes(dodgy_gene_list, locus_tag)
@@ -264,7 +313,10 @@ def main():
     genes_in_families = find_genes_in_families(families_file, our_species, locus_tag)
 
     # read in the input embl file, and write out a new embl file:
-    read_input_embl_and_write_output_embl(input_embl, output_embl, dodgy_genes, genes_in_families)
+    if num_processes > 1:
+        read_input_embl_and_write_output_embl_in_parallel(input_embl, output_embl, dodgy_genes, genes_in_families, num_processes)
+    else:
+        read_input_embl_and_write_output_embl(input_embl, output_embl, dodgy_genes, genes_in_families)
 
     print("FINISHED\n")
 
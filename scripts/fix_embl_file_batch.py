@@ -0,0 +1,132 @@
+# Script to run fix_embl_file.py on many genomes at once, on a pool of processes
+
+import sys
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fix_embl_file import find_genes_in_families, read_set_of_dodgy_genes, read_input_embl_and_write_output_embl
+
+#====================================================================#
+
+# define a function to read in the manifest of genomes to fix:
+
+def read_manifest(manifest_file):
+    """read the tab-separated manifest, one genome per line:
+    input_embl  output_embl  dodgy_gene_list  locus_tag  our_species"""
+
+    jobs = []
+    fileObj = open(manifest_file, "r")
+    for line in fileObj:
+        line = line.rstrip()
+        if line == "" or line.startswith('#'):
+            continue
+        temp = line.split("\t")
+        if len(temp) != 5:
+            print("ERROR: line of %s does not have 5 tab-separated columns: %s" % (manifest_file, line))
+            sys.exit(1)
+        (input_embl, output_embl, dodgy_gene_list, locus_tag, our_species) = temp
+        for input_file in (input_embl, dodgy_gene_list):
+            if os.path.exists(input_file) == False:
+                print("ERROR: %s in %s does not exist" % (input_file, manifest_file))
+                sys.exit(1)
+        jobs.append((input_embl, output_embl, dodgy_gene_list, locus_tag, our_species))
+    fileObj.close()
+
+    return jobs
+
+#====================================================================#
+
+# define a function to fix one genome, in a worker process:
+
+def fix_one_genome(input_embl, output_embl, dodgy_gene_list, locus_tag, genes_in_families):
+    """returns (status, seconds taken, number of dodgy genes, error message)"""
+
+    start_time = time.time()
+    try:
+        dodgy_genes = read_set_of_dodgy_genes(dodgy_gene_list, locus_tag)
+        read_input_embl_and_write_output_embl(input_embl, output_embl, dodgy_genes, genes_in_families)
+    except Exception as error: # pylint: disable=broad-except
+        return ("FAILED", time.time() - start_time, 0, "%s: %s" % (type(error).__name__, error))
+
+    return ("OK", time.time() - start_time, len(dodgy_genes), "")
+
+#====================================================================#
+
+# define a function to fix all the genomes in the manifest:
+
+def fix_genomes_in_parallel(jobs, families_file, num_processes, report_file):
+    """fix each genome on a process pool, and write a report with one line per genome
+
+    The families file is read once, and each worker is only sent the genes in
+    families of its own species. The biggest EMBL files are started first, so the
+    whole batch takes about as long as the biggest genome.
+    """
+
+    # read in the genes that are in families, once for each species and locus tag:
+    genes_in_families_of = {}
+    for (input_embl, output_embl, dodgy_gene_list, locus_tag, our_species) in jobs:
+        if (our_species, locus_tag) not in genes_in_families_of:
+            genes_in_families_of[(our_species, locus_tag)] = find_genes_in_families(families_file, our_species, locus_tag)
+
+    # start the biggest EMBL files first:
+    job_order = sorted(range(len(jobs)), key=lambda i: os.path.getsize(jobs[i][0]), reverse=True)
+    results = [None] * len(jobs)
+    batch_start_time = time.time()
+    pool = ProcessPoolExecutor(max_workers=num_processes)
+    futures = {}
+    for i in job_order:
+        (input_embl, output_embl, dodgy_gene_list, locus_tag, our_species) = jobs[i]
+        future = pool.submit(fix_one_genome, input_embl, output_embl, dodgy_gene_list, locus_tag, genes_in_families_of[(our_species, locus_tag)])
+        futures[future] = i
+    for future in as_completed(futures):
+        i = futures[future]
+        try:
+            results[i] = future.result()
+        except Exception as error: # pylint: disable=broad-except
+            results[i] = ("FAILED", 0.0, 0, "%s: %s" % (type(error).__name__, error)) # eg. the worker process died
+        (status, seconds, num_dodgy_genes, message) = results[i]
+        print("%s\t%s\t%.1f s\t%s" % (status, jobs[i][0], seconds, message))
+    pool.shutdown()
+    batch_seconds = time.time() - batch_start_time
+
+    # write out the report, in the order of the manifest:
+    outputfileObj = open(report_file, "w")
+    outputfileObj.write("input_embl\toutput_embl\tspecies\tstatus\tseconds\tnum_dodgy_genes\tnum_genes_in_families\tmessage\n")
+    for job, result in zip(jobs, results):
+        (input_embl, output_embl, dodgy_gene_list, locus_tag, our_species) = job
+        (status, seconds, num_dodgy_genes, message) = result
+        outputfileObj.write("%s\t%s\t%s\t%s\t%.1f\t%d\t%d\t%s\n" % (input_embl, output_embl, our_species, status, seconds, num_dodgy_genes, len(genes_in_families_of[(our_species, locus_tag)]), message))
+    outputfileObj.close()
+
+    num_failed = sum(1 for result in results if result[0] != "OK")
+    print("Fixed %d of %d genomes in %.1f s (%d failed), see %s" % (len(results) - num_failed, len(results), batch_seconds, num_failed, report_file))
+
+    return num_failed
+
+#====================================================================#
+
+def main():
+
+    # check the command-line arguments:
+    if len(sys.argv) != 5 or os.path.exists(sys.argv[1]) == False or os.path.exists(sys.argv[2]) == False:
+        print("Usage: %s manifest_file families_file num_processes report_file" % sys.argv[0])
+        sys.exit(1)
+    manifest_file = sys.argv[1] # tab-separated: input_embl output_embl dodgy_gene_list locus_tag our_species
+    families_file = sys.argv[2] # /nfs/helminths02/analysis/50HGP/00ANALYSES/final_families/complete_families.txt_27mar2017
+    num_processes = int(sys.argv[3]) # eg. 8
+    report_file = sys.argv[4] # eg. fix_embl_report.tsv
+
+    jobs = read_manifest(manifest_file)
+
+    num_failed = fix_genomes_in_parallel(jobs, families_file, num_processes, report_file)
+
+    print("FINISHED\n")
+    if num_failed > 0:
+        sys.exit(1)
+
+#====================================================================#
+
+if __name__=="__main__":
+    main()
+
+#====================================================================#
@@ -1,6 +1,9 @@
 import sys
 import os
 from collections import defaultdict
+from compara_families import load_genes_in_families
+from embl_line_index import load_embl_line_index, read_embl_line_index, EmblLineReader
+from embl_features import iter_embl, parse_id_note, EmblFeature, EmblSequence
 
 #====================================================================#
 
@@ -34,154 +37,143 @@ def read_error_file(error_file):
 # define a function to read in the genes that are in families, for our species of interest:
 
 def find_genes_in_families(families_file, our_species_name, locus_tag):
-    """read in the genes that are in families, for our species of interest """
+    """read in the genes that are in families, for our species of interest, from the index of the families file """
 
     # define a set to store the genes in families:
     genes_in_families = set()
 
-    # read in the input file of genes in families:
-    fileObj = open(families_file, "r")
-    for line in fileObj:
-        line = line.rstrip()
-        if line.startswith('family'): # eg. family 5168 : SPAL_0001096400.1:mRNA (strongyloides_papillosus) Bm11175 (brugia_malayi) HCOI_1164600.1 (haemonchus_contortus)...
-            temp = line.split()
-            family = temp[1] # eg. 4376
-            temp = line.split(': ')
-            line = temp[1] # SPAL_0000608500.1:mRNA (strongyloides_papillosus) Bm10870f (brugia_malayi) F23B12.1 (caenorhabditis_elegans)...
-            temp = line.split()
-            # make a list of tuples, with gene names and species names
-            # taken from http://stackoverflow.com/questions/2631189/python-every-other-element-idiom
-            # uses the zip function: http://docs.python.org/2/library/functions.html#zip
-            # see also on zip: http://nbviewer.ipython.org/github/pycam/python-intro/blob/release/Introduction_to_python_session_2.ipynb
-            # note the array 'pairs' seems to be empty after we have looked at it once, this must be a feature of 'zip'.
-            set_of_species = set() # define the set of species we have seen
-            family_genes = set() # define the set of genes in the family
-            pairs = zip(temp[0::2], temp[1::2])
-            for pair in pairs:
-                (gene, species) = pair # unpack the tuple, eg. gives gene= SPAL_0000608500.1:mRNA species= (strongyloides_papillosus)
-                species = species[1:-1] # remove the parentheses
-                # get the gene name:
-                # eg. SRAE_X000112100.t1:mRNA/SSTP_0000225500.1:mRNA/SPAL_0001294400.1:mRNA/SVEN_0373900.1/PTRK_0001428200.1:mRNA/RSKR_0000682500.1:mRNA
-                if ':mRNA' in gene:
-                    temp2 = gene.split(':mRNA') # eg. SRAE_X000112100.t1:mRNA
-                    gene = temp2[0] # eg. SRAE_X000112100.t1
-                if '-mRNA-' in gene: # eg. ASIM_0000655901-mRNA-1
-                    temp2 = gene.split('-mRNA-')
-                    gene = temp2[0] # eg. ASIM_0000655901
-                if '_' in gene and '.' in gene: # eg. SRAE_X000112100.t1 or MhA1_Contig1285.frz3.fgene2
-                    temp2 = gene.split('.')
-                    afterdot = temp2[1] # eg. t1 or fgene2
-                    if (afterdot.startswith('t') or afterdot.isdigit() == True) and species != 'caenorhabditis_elegans':
-                        gene = temp2[0] # eg. SRAE_X000112100                 
-                if '.t' in gene: # eg. HCOI02162100.t1
-                    temp2 = gene.split('.t')
-                    afterdot = temp2[1] # eg. 1
-                    if afterdot.isdigit() == True:
-                        gene = temp2[0] # eg. HCOI02162100 
-                if species == our_species_name:
-                    if locus_tag == 'NOO' or locus_tag == 'NLS' or locus_tag == 'NAV':
-                        gene = get_new_gene_name(gene, locus_tag)
-                    genes_in_families.add(gene)
-    fileObj.close()
+    # read in the genes in families from the index, building it if need be:
+    for gene in load_genes_in_families(families_file, our_species_name):
+        if locus_tag == 'NOO' or locus_tag == 'NLS' or locus_tag == 'NAV':
+            gene = get_new_gene_name(gene, locus_tag)
+        genes_in_families.add(gene)
 
     return genes_in_families
 
 #====================================================================#
 
-# get the gene name from a line of the embl file:
+# read in the input embl file, and write out a new embl file, in one pass:
 
-def get_gene_name2(line):
-    """ get the name of a gene from line of an embl file
-    >>> get_gene_name2('FT                   /note="ID:gene:NAV_0000008934"')
-    'NAV_0000008934'
-    >>> get_gene_name2('FT                   /note="ID:cds:SMUV_0000034201-mRNA-1"')
-    'SMUV_0000034201'
-    """
+def fix_embl_file_in_one_pass(input_embl, output_embl, line_nums_set, genes_in_families, dodgy_genes_set=None):
+    """read the input embl file once, marking genes with dodgy CDSs as /pseudo
 
-    temp = line.split()
-    gene = temp[1] # /note="ID:gene:NAV_0000008934"
-    temp = gene.split("\"")
-    gene = temp[1] # ID:gene:NAV_0000008934 or ID:cds:SMUV_0000034201-mRNA-1
-    temp = gene.split(":")
-    gene = temp[2] # NAV_0000008934 or SMUV_0000034201-mRNA-1
-    temp = gene.split("-mRNA-")
-    gene = temp[0] # NAV_0000008934 or SMUV_0000034201
-
-    return gene
-
-#====================================================================#
+    This does the work of reading the file three times (to find the dodgy genes
+    from the error line numbers, to find the genes already labelled /pseudo, and to
+    write the output), and gives exactly the same output. The features of a gene
+    are held back, from the feature with its '/note="ID:gene:' until the next gene
+    (or the sequence or end of the entry), by which point we know whether its CDS is
+    dodgy and whether it is already /pseudo. This relies on a gene's features
+    (gene, mRNA, CDS, exons) coming together in the file, as they do in
+    WormBase ParaSite embl files; if they don't, an AssertionError is raised
+    rather than writing different output.
 
-# read in the input embl file to find genes that are already labelled dodgy:
+    If the genes with dodgy CDSs have been found already (with
+    find_dodgy_genes_and_cds()), they can be given as dodgy_genes_set, and then
+    the error line numbers are not matched to CDSs here.
+    """
 
-def find_genes_labelled_dodgy_already(input_embl):
+    # open an output file:
+    outputfileObj = open(output_embl,"w")
 
-    # make a set of genes labelled dodgy already:
+    if dodgy_genes_set is None:
+        error_line_nums = sorted(line_nums_set)
+        dodgy_genes_set = set()
+    else:
+        error_line_nums = [] # the dodgy genes are known already
+    next_error = 0 # the first error line that has not been matched to a CDS yet
     genes_labelled_dodgy_already_set = set()
+    written_genes = set() # genes whose features have been written out already
+    block = [] # the features held back, each with the (line index, gene) of its gene/cds/exon notes
+    block_genes = set()
+
+    # write out the features held back:
+    def write_block():
+        for feature, notes in block:
+            for index, gene in notes:
+                if gene in dodgy_genes_set and gene not in genes_labelled_dodgy_already_set:
+                    output_lines = ["FT                   /pseudo\n", "FT                   /note=\"odd gene structure probably caused by assembly error\"\n"]
+                    if gene in genes_in_families:
+                        output_lines.append("FT                   /note=\"predicted protein belongs to a gene family in the Compara database of the International Helminth Genomes Consortium\"\n")
+                    feature.insert_lines_after(index, output_lines)
+            feature.write(outputfileObj)
+        written_genes.update(block_genes)
+        del block[:]
+        block_genes.clear()
 
     # read in the input file:
     is_pseudo = False
     found_a_gene = False
     fileObj = open(input_embl, "r")
-    for line in fileObj:
-        line = line.rstrip()
-        if '/note="ID:gene:' in line: # FT                   /note="ID:gene:NAV_0000008934"
-            gene = get_gene_name2(line) # eg. NAV_0000008934
-            found_a_gene = True
-            is_pseudo = False
-        if found_a_gene == True:
-            if '/pseudo' in line:
-                is_pseudo = True
-            if '/standard_name' in line:
-                if is_pseudo == True:
-                    assert(gene not in genes_labelled_dodgy_already_set)
-                    genes_labelled_dodgy_already_set.add(gene)
-                found_a_gene = False
+    for item in iter_embl(fileObj):
+        if not isinstance(item, EmblFeature):
+            # the sequence and the end of an entry come after all the features:
+            write_block()
+            if isinstance(item, EmblSequence):
+                item.write(outputfileObj)
+                continue
+            for line in item.lines:
+                if 'source:WormBase_imported' in line:
+                    continue # don't print this line to the output
+                if line.startswith('AC'): # AC   HPLM_contig0000001;
+                    outputfileObj.write("AC   XXX;\nXX\n%s\n" % make_embl_output_line1(line))
+                else:
+                    outputfileObj.write(line)
+            continue
+
+        notes = []
+        item.drop_lines_containing('source:WormBase_imported') # don't print these lines to the output
+        for name, value, index in item.qualifier_lines:
+            if name != 'note':
+                note_type = None
+            else:
+                note_type, gene = parse_id_note(value) # eg. ('cds', 'HPLM_0000313201') for ID:cds:HPLM_0000313201-mRNA-1
+
+            # find the genes whose CDSs have errors, that is the first CDS at or after each error line:
+            # FT   CDS             complement(join(40602..44150,44239..44536,44646..44849,
+            # FT                   46859..46950,47022..47072,47138..47194,47316..47395,
+            # FT                   48487..48832,49403..49555,49625..49723,50906..50995,
+            # FT                   52710..52783,55438..55570))
+            # FT                   /locus_tag="HPLM_LOCUS3124"
+            # FT                   /codon_start=1
+            # FT                   /note="ID:cds:HPLM_0000313201-mRNA-1"
+            # FT                   /transl_table=1
+            if note_type == 'cds':
+                line_num = item.first_line + index
+                if next_error < len(error_line_nums) and error_line_nums[next_error] <= line_num:
+                    while next_error < len(error_line_nums) and error_line_nums[next_error] <= line_num:
+                        next_error += 1
+                    assert('-mRNA-' in value)
+                    assert(gene not in dodgy_genes_set)
+                    assert gene not in written_genes, "the CDS of %s comes after the features of another gene" % gene
+                    dodgy_genes_set.add(gene)
+
+            # find the genes that are labelled dodgy already:
+            if note_type == 'gene': # FT                   /note="ID:gene:NAV_0000008934"
+                if not notes:
+                    write_block() # a new gene, so we have everything we need for the features held back
+                labelled_gene = gene
+                found_a_gene = True
                 is_pseudo = False
-    fileObj.close()
-   
-    return genes_labelled_dodgy_already_set
-
-#====================================================================#
-
-# read in the input embl file, and write out a new embl file:
-
-def read_input_embl_and_write_output_embl(input_embl, output_embl, dodgy_genes_set, genes_in_families, genes_labelled_dodgy_already_set):
-
-    # open an output file:
-    outputfileObj = open(output_embl,"w")
-
-    # read in the input file:
-    fileObj = open(input_embl, "r")
-    for line in fileObj:
-        line = line.rstrip()
-        if 'source:WormBase_imported' in line:
-            pass # don't print this line to the output
+            if found_a_gene == True:
+                if name.startswith('pseudo'):
+                    is_pseudo = True
+                if name == 'standard_name':
+                    if is_pseudo == True:
+                        assert(labelled_gene not in genes_labelled_dodgy_already_set)
+                        assert labelled_gene not in written_genes, "the /standard_name of %s comes after the features of another gene" % labelled_gene
+                        genes_labelled_dodgy_already_set.add(labelled_gene)
+                    found_a_gene = False
+                    is_pseudo = False
+
+            if (note_type == 'gene' or note_type == 'cds' or note_type == 'exon') and not item.is_dropped(index):
+                notes.append((index, gene))
+                block_genes.add(gene)
+
+        if block_genes:
+            block.append((item, notes))
         else:
-            if line.startswith('AC'): # AC   HPLM_contig0000001;
-                output_line = "AC   XXX;\n"
-                outputfileObj.write(output_line)
-                output_line = "XX\n"
-                outputfileObj.write(output_line)
-                output_line = make_embl_output_line1(line)
-                output_line = "%s\n" % output_line
-                outputfileObj.write(output_line)
-            elif '/note="ID:gene:' in line or 'note="ID:cds:' in line or 'note="ID:exon:' in line : # FT                   /note="ID:gene:NAV_0000008934"
-                                                                                                    # FT                   /note="ID:cds:SMUV_0000034201-mRNA-1"
-                                                                                                    # FT                   /note="ID:exon:SMUV_0000587401-mRNA-1.1"
-                gene = get_gene_name2(line) # eg. NAV_0000008934
-                output_line = "%s\n" % line
-                outputfileObj.write(output_line) # write out the current line
-                if gene in dodgy_genes_set and gene not in genes_labelled_dodgy_already_set: 
-                    output_line = "FT                   /pseudo\n"
-                    outputfileObj.write(output_line)
-                    output_line = "FT                   /note=\"odd gene structure probably caused by assembly error\"\n" 
-                    outputfileObj.write(output_line)
-                    if gene in genes_in_families:
-                        output_line = "FT                   /note=\"predicted protein belongs to a gene family in the Compara database of the International Helminth Genomes Consortium\"\n"
-                        outputfileObj.write(output_line)
-            else: 
-                output_line = "%s\n" % line
-                outputfileObj.write(output_line)
+            item.write(outputfileObj) # nothing is held back, so write it out straight away
+    write_block()
     fileObj.close() 
     outputfileObj.close()
 
@@ -230,18 +222,29 @@ def trim_off_zeroes(scaffold_name):
 
 # read in the set of genes/CDSs that look dodgy:
 
-def find_dodgy_genes_and_cds(input_embl, locus_tag, line_nums_set):
+def find_dodgy_genes_and_cds(input_embl, locus_tag, line_nums_set, index=None):
+    """find the gene of the first CDS at or after each error line
+
+    Rather than reading every line of the embl file (which can be gzipped), we
+    use its line index to jump to just before each error line, and read on from
+    there to the next CDS; errors that point at the same CDS are only looked up
+    once. The index is built the first time, and after that the work depends on
+    the number of errors rather than the size of the file (for a gzipped file,
+    only if it is made of many gzip members, eg. BGZF; see embl_line_index.py).
+    An index that has been read in already can be given as 'index'.
+    """
 
     dodgy_genes_set = set()
 
-    linecnt = 0 
-    searching_for_cds = False
-    fileObj = open(input_embl, "r")
-    for line in fileObj:
-        linecnt += 1
-        if linecnt in line_nums_set:
-            searching_for_cds = True    
-        line = line.rstrip()
+    if index is None:
+        index = load_embl_line_index(input_embl)
+    reader = EmblLineReader(input_embl, index)
+    linecnt = 0 # the number of the last line read
+    for error_line in sorted(line_nums_set):
+        if error_line <= linecnt:
+            continue # we have read past this line already, looking for the CDS of an earlier error
+        reader.seek_line(error_line)
+        linecnt = error_line - 1
         # FT   CDS             complement(join(40602..44150,44239..44536,44646..44849,
         # FT                   46859..46950,47022..47072,47138..47194,47316..47395,
         # FT                   48487..48832,49403..49555,49625..49723,50906..50995,
@@ -250,9 +253,11 @@ def find_dodgy_genes_and_cds(input_embl, locus_tag, line_nums_set):
         # FT                   /codon_start=1
         # FT                   /note="ID:cds:HPLM_0000313201-mRNA-1"
         # FT                   /transl_table=1
-        if 'ID:cds:' in line:
-            if searching_for_cds == True:
+        for line in reader:
+            linecnt += 1
+            if b'ID:cds:' in line:
                 # FT                   /note="ID:cds:HPLM_0000313201-mRNA-1"
+                line = line.decode("latin-1").rstrip()
                 temp = line.split("\"")
                 cds = temp[1] # ID:cds:HPLM_0000313201-mRNA-1
                 temp = cds.split(":")
@@ -262,7 +267,8 @@ def find_dodgy_genes_and_cds(input_embl, locus_tag, line_nums_set):
                 gene = temp[0] # HPLM_0000313201
                 assert(gene not in dodgy_genes_set)
                 dodgy_genes_set.add(gene)
-                searching_for_cds = False
+                break
+    reader.close()
 
     return dodgy_genes_set 
 
@@ -304,17 +310,20 @@ def main():
     # read in the line numbers of dodgy CDS:
     line_nums_set = read_error_file(error_file)
 
-    # read in the set of genes/CDSs that look dodgy:
-    dodgy_genes_set = find_dodgy_genes_and_cds(input_embl, locus_tag, line_nums_set)
-
     # read in the genes that are in families, for our species of interest:
     genes_in_families = find_genes_in_families(families_file, our_species, locus_tag)
 
-    # read in the input embl file to find genes that are already labelled dodgy:
-    genes_labelled_dodgy_already_set = find_genes_labelled_dodgy_already(input_embl)
-
-    # read in the input embl file, and write out a new embl file:
-    read_input_embl_and_write_output_embl(input_embl, output_embl, dodgy_genes_set, genes_in_families, genes_labelled_dodgy_already_set)
+    # if the input embl file has an up-to-date line index, jump to the error lines with it to find the
+    # genes with dodgy CDSs; if not, building one would mean reading the whole file an extra time, so
+    # they are found while reading it in the one pass below:
+    dodgy_genes_set = None
+    index = read_embl_line_index(input_embl)
+    if index is not None:
+        dodgy_genes_set = find_dodgy_genes_and_cds(input_embl, locus_tag, line_nums_set, index)
+
+    # read in the input embl file once, finding the genes with dodgy CDSs (if we don't know them
+    # already) and the genes already labelled dodgy, and write out a new embl file:
+    fix_embl_file_in_one_pass(input_embl, output_embl, line_nums_set, genes_in_families, dodgy_genes_set)
 
     print("FINISHED\n")
 